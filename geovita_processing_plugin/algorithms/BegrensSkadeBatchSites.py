@@ -0,0 +1,793 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import csv
+import os
+import time
+from pathlib import Path
+from datetime import datetime
+
+from qgis.core import (
+    Qgis,
+    QgsGeometry,
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsProject,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+
+from ..utilities.batchlib import partition_buildings, run_sites, site_id_of, site_jsons, site_tasks, write_site_outputs
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.methodslib import (
+    check_canceled,
+    create_temp_folder_for_version,
+    get_shapefile_as_json_pyqgis,
+    map_porepressure_curve_names,
+    read_features_in_extent,
+    reproject_is_needed,
+    reproject_layers,
+)
+from ..utilities.settlementlib import POREWATER_INFLUENCE_DISTANCE
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class BegrensSkadeBatchSites(GvBaseProcessingAlgorithms):
+    """
+    The BegrensSkadeBatchSites algorithm evaluates many excavation or tunnel sites in one run. The
+    polygons of the source layer are grouped into sites by a site id field. The buildings are read,
+    reprojected once, and assigned to the sites within the search distance through a spatial index.
+    Every site is then evaluated by the REMEDY core of the Excavation or Tunnel algorithm in a pool of
+    worker processes, and the outputs of all sites are merged into one building, wall and corner layer
+    with the fields of the Excavation and Tunnel outputs and the governing site in the field 'site'.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_BATCH_SITES.log",
+            "BATCH_SITES_LOGGER",
+        ).get_logger()
+
+        # Retrieve version number from BaseAlgorithm class "GvBaseProcessingAlgorithms"
+        self.version = self.getVersion()
+        self.logger.info(f"__INIT__ - VERSION: {self.version} ")
+
+        # instanciate variables used in postprocessing to add layers to GUI
+        self.feature_name = None  # Default value
+        self.layers_info = {}
+        self.logger.info("__INIT__ - Finished initialize BegrensSkadeBatchSites ")
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BegrensSkadeBatchSites()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="excavation.png")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "begrensskadebatchsites"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Begrens Skade - Batch sites")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("REMEDY_GIS_RiskTool")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "remedygisrisktool"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "The Begrens Skade - Batch sites algorithm evaluates many excavation or tunnel sites in one run, e.g. all building projects of a city. The polygons of the excavation or tunnel layer are grouped into sites by the site id field. Buildings and depth to bedrock are loaded and prepared once, and every site is evaluated for the buildings within the search distance by the calculation of the Excavation or Tunnel algorithm, vulnerability analysis included.\n"
+            "SITES\nAll polygons with the same site id form one site. The optional depth field gives the excavation or tunnel depth of every site (the largest value of its polygons), sites without a value take the depth given in this dialog. All other parameters are the same for every site.\n"
+            "WORKER PROCESSES\nThe sites are evaluated in parallel in separate Python processes. Set the number of worker processes to 0 to evaluate the sites in QGIS, one after the other.\n"
+            "OUTPUT\nOne building, wall and corner layer for all sites, with the fields of the Excavation and Tunnel outputs. Every building appears once. A building within the search distance of several sites gets the largest value of every result over these sites, and the walls and corners of the site with the largest total settlement. That site is in the field 'site', and the number of sites in 'n_sites'. A CSV file lists the sites with their number of buildings, the number of buildings they govern and their maximum settlement.\n"
+            "The algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_FEATURE_NAME = "OUTPUT_FEATURE_NAME"
+    OUTPUT_CRS = "OUTPUT_CRS"
+    INPUT_BUILDING_POLY = "INPUT_BUILDING_POLY"
+    INPUT_SOURCE_POLY = "INPUT_SOURCE_POLY"
+    SITE_FIELD = ["SITE_FIELD", "Site id field"]
+    DEPTH_FIELD = ["DEPTH_FIELD", "Depth field (excavation or tunnel depth of every site) [m]"]
+    SOURCE_TYPE = ["SOURCE_TYPE", "Type of construction"]
+    enum_source_type = ["Excavation", "Tunnel"]
+    BUILDING_SEARCH_DISTANCE = [
+        "BUILDING_SEARCH_DISTANCE",
+        "Evaluate buildings within this distance of every site [m] (0 = all buildings for every site)",
+    ]
+    N_WORKERS = ["N_WORKERS", "Number of worker processes (0 = evaluate in QGIS)"]
+
+    SHORT_TERM_SETTLEMENT = ["SHORT_TERM_SETTLEMENT", "Short term settlements"]
+    EXCAVATION_DEPTH = ["EXCAVATION_DEPTH", "Depth of excavation [m]"]
+    SETTLEMENT_ENUM = ["SETTLEMENT_ENUM", "Settlement curves (excavation)"]
+    enum_settlment = [
+        r"0,5 % av byggegropdybde",
+        r"1 % av byggegropdybde",
+        r"2 % av byggegropdybde",
+        r"3 % av byggegropdybde",
+    ]
+    TUNNEL_DEPTH = ["TUNNEL_DEPTH", "Depth of tunnel [m]"]
+    TUNNEL_DIAM = ["TUNNEL_DIAM", "Diameter of tunnel [m]"]
+    VOLUME_LOSS = ["VOLUME_LOSS", "Loss of volume [%]"]
+    TROUGH_WIDTH = ["TROUGH_WIDTH", "Width of trough [m]"]
+
+    LONG_TERM_SETTLEMENT = ["LONG_TERM_SETTLEMENT", "Long term settlements"]
+    RASTER_ROCK_SURFACE = [
+        "RASTER_ROCK_SURFACE",
+        "Input raster of depth to bedrock",
+    ]
+    POREWP_REDUCTION_M = [
+        "POREWP_REDUCTION_M",
+        'Porewater pressure reduction at the excavation or tunnel (tunnels: only used if the curve is "Manual") [m]',
+    ]
+    POREPRESSURE_ENUM_CURVES = [
+        "POREPRESSURE_ENUM",
+        "Calculation curves for pore pressure reduction (tunnels)",
+    ]
+    CURVES_enum_porepressure = ["Upper", "Typical", "Lower", "Manual"]
+    TUNNEL_LEAKAGE = [
+        "TUNNEL_LEAKAGE",
+        "Leakage of water into the tunnel [L/min each 100m of tunnelsection]",
+    ]
+    DRY_CRUST_THICKNESS = [
+        "DRY_CRUST_THICKNESS",
+        "Thickness of overburden not affected by porewater drawdown [m]",
+    ]
+    DEPTH_GROUNDWATER = ["DEPTH_GROUNDWATER", "Depht to groundwater table [m]"]
+    SOIL_DENSITY = ["SOIL_DENSITY", "Soil saturation density [kN/m3]"]
+    OCR = ["OCR", "Over consolidation ratio"]
+    JANBU_REF_STRESS = [
+        "JANBU_REF_STRESS",
+        "Janbu reference stress, p`r (kPa)",
+    ]
+    JANBU_CONSTANT = ["JANBU_CONSTANT", "Janbu constant [M0/(m*p`c)]"]
+    JANBU_COMP_MODULUS = ["JANBU_COMP_MODULUS", "Janbu compression modulus"]
+    CONSOLIDATION_TIME = ["CONSOLIDATION_TIME", "Consolidation time [years]"]
+
+    VULNERABILITY_ANALYSIS = [
+        "VULNERABILITY_ANALYSIS",
+        "Building vulnerability analysis",
+    ]
+    FILED_NAME_BUILDING_FOUNDATION = [
+        "FILED_NAME_BUILDING_FOUNDATION",
+        "Building Foundation column",
+    ]
+    FILED_NAME_BUILDING_STRUCTURE = [
+        "FILED_NAME_BUILDING_STRUCTURE",
+        "Building Structure column",
+    ]
+    FILED_NAME_BUILDING_STATUS = [
+        "FILED_NAME_BUILDING_STATUS",
+        "Building Condition column",
+    ]
+
+    OUTPUT_BUILDING = "OUTPUT_BUILDING"
+    OUTPUT_WALL = "OUTPUT_WALL"
+    OUTPUT_CORNER = "OUTPUT_CORNER"
+    OUTPUT_SITES = "OUTPUT_SITES"
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_BUILDING_POLY,
+                self.tr("Input Building polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_SOURCE_POLY,
+                self.tr("Input Excavation or Tunnel polygon(s) of all sites"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.SITE_FIELD[0],
+                self.tr(f"{self.SITE_FIELD[1]}"),
+                parentLayerParameterName=self.INPUT_SOURCE_POLY,
+                allowMultiple=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SOURCE_TYPE[0],
+                self.tr(f"{self.SOURCE_TYPE[1]}"),
+                self.enum_source_type,
+                defaultValue=0,
+                allowMultiple=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.DEPTH_FIELD[0],
+                self.tr(f"{self.DEPTH_FIELD[1]}"),
+                defaultValue=None,
+                parentLayerParameterName=self.INPUT_SOURCE_POLY,
+                type=QgsProcessingParameterField.Numeric,
+                allowMultiple=False,
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SHORT_TERM_SETTLEMENT[0],
+                self.tr(f"{self.SHORT_TERM_SETTLEMENT[1]}"),
+                defaultValue=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.LONG_TERM_SETTLEMENT[0],
+                self.tr(f"{self.LONG_TERM_SETTLEMENT[1]}"),
+                defaultValue=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.RASTER_ROCK_SURFACE[0],
+                self.tr(f"{self.RASTER_ROCK_SURFACE[1]}"),
+                defaultValue=None,
+                optional=True,
+            )
+        )
+        param = QgsProcessingParameterNumber(
+            self.BUILDING_SEARCH_DISTANCE[0],
+            self.tr(f"{self.BUILDING_SEARCH_DISTANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=POREWATER_INFLUENCE_DISTANCE,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.N_WORKERS[0],
+            self.tr(f"{self.N_WORKERS[1]}"),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=max(1, (os.cpu_count() or 2) - 1),
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterEnum(
+            self.SETTLEMENT_ENUM[0],
+            self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
+            self.enum_settlment,
+            defaultValue=1,
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        for constant, default, number_type in [
+            (self.EXCAVATION_DEPTH, 10, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DEPTH, 15, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DIAM, 9.5, QgsProcessingParameterNumber.Double),
+            (self.VOLUME_LOSS, 2, QgsProcessingParameterNumber.Double),
+            (self.TROUGH_WIDTH, 0.5, QgsProcessingParameterNumber.Double),
+            (self.POREWP_REDUCTION_M, 10, QgsProcessingParameterNumber.Double),
+            (self.DRY_CRUST_THICKNESS, 5, QgsProcessingParameterNumber.Double),
+            (self.DEPTH_GROUNDWATER, 3, QgsProcessingParameterNumber.Double),
+            (self.SOIL_DENSITY, 18.5, QgsProcessingParameterNumber.Double),
+            (self.OCR, 1.2, QgsProcessingParameterNumber.Double),
+            (self.JANBU_REF_STRESS, 0, QgsProcessingParameterNumber.Integer),
+            (self.JANBU_CONSTANT, 4, QgsProcessingParameterNumber.Double),
+            (self.JANBU_COMP_MODULUS, 15, QgsProcessingParameterNumber.Double),
+            (self.CONSOLIDATION_TIME, 1000, QgsProcessingParameterNumber.Integer),
+        ]:
+            param = QgsProcessingParameterNumber(
+                constant[0],
+                self.tr(f"{constant[1]}"),
+                number_type,
+                defaultValue=default,
+                minValue=0,
+            )
+            param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.POREPRESSURE_ENUM_CURVES[0],
+            self.tr(f"{self.POREPRESSURE_ENUM_CURVES[1]}"),
+            self.CURVES_enum_porepressure,
+            defaultValue=1,
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.TUNNEL_LEAKAGE[0],
+            self.tr(f"{self.TUNNEL_LEAKAGE[1]}"),
+            defaultValue=10,
+            optional=True,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        # VULNERABILITY_ANALYSIS Advanced features
+        param = QgsProcessingParameterBoolean(
+            self.VULNERABILITY_ANALYSIS[0],
+            self.tr(f"{self.VULNERABILITY_ANALYSIS[1]}"),
+            defaultValue=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        for constant in [
+            self.FILED_NAME_BUILDING_FOUNDATION,
+            self.FILED_NAME_BUILDING_STRUCTURE,
+            self.FILED_NAME_BUILDING_STATUS,
+        ]:
+            param = QgsProcessingParameterField(
+                constant[0],
+                self.tr(f"{constant[1]}"),
+                defaultValue=None,
+                parentLayerParameterName=self.INPUT_BUILDING_POLY,
+                allowMultiple=False,
+                optional=True,
+            )
+            param.setFlags(
+                QgsProcessingParameterDefinition.FlagAdvanced
+                | QgsProcessingParameterDefinition.FlagOptional
+            )
+            self.addParameter(param)
+
+        # DEFINE OUTPUTS
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.OUTPUT_FEATURE_NAME,
+                self.tr(
+                    "Naming Conventions for Analysis and Features (Output feature name appended to file-names)"
+                )
+            ),
+            createOutput=True
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                self.OUTPUT_CRS,
+                self.tr("Output CRS"),
+                defaultValue=QgsProject.instance().crs(),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output Folder"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_BUILDING,
+                self.tr("Output Buildings Shapefile (all sites)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_WALL,
+                self.tr("Output Walls Shapefile (all sites)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_CORNER,
+                self.tr("Output Corners Shapefile (all sites)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_SITES,
+                self.tr("Site summary (CSV)"),
+            )
+        )
+
+    def read_sites(self, source_layer, site_field, depth_field=None):
+        """
+        Groups the polygons of the source layer into sites.
+
+        Args:
+            source_layer (QgsVectorLayer): The excavation or tunnel polygons of all sites.
+            site_field (str): The field with the site id.
+            depth_field (str, optional): The field with the depth of the sites.
+
+        Returns:
+            tuple: (geometries, depths) Site id -> QgsGeometry of all its polygons, and site id -> the
+            largest depth of its polygons, for the sites with a depth.
+        """
+        parts = {}
+        depths = {}
+        for feature in source_layer.getFeatures():
+            geometry = feature.geometry()
+            if geometry is None or geometry.isEmpty():
+                continue
+            site_id = site_id_of(feature[site_field])
+            if site_id is None:
+                self.logger.warning(f"PROCESS - Skipping feature {feature.id()} without a site id")
+                continue
+            parts.setdefault(site_id, []).append(geometry)
+            if depth_field:
+                depth = feature[depth_field]
+                if depth is not None and str(depth).strip() not in ("", "NULL"):
+                    depths[site_id] = max(float(depth), depths.get(site_id, 0.0))
+        geometries = {site_id: QgsGeometry.collectGeometry(geometries) for site_id, geometries in parts.items()}
+        return geometries, depths
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        self.logger.info("PROCESS - Starting the processing")
+        feedback.pushInfo(f"PROCESS - Version: {self.version}")
+
+        bShortterm = self.parameterAsBoolean(parameters, self.SHORT_TERM_SETTLEMENT[0], context)
+        bLongterm = self.parameterAsBoolean(parameters, self.LONG_TERM_SETTLEMENT[0], context)
+        if not bShortterm and not bLongterm:
+            error_msg = "Please choose Short term or Long term settlements, or both"
+            self.logger.error(error_msg)
+            feedback.reportError(error_msg)
+            return {}
+
+        source_building_poly = self.parameterAsVectorLayer(parameters, self.INPUT_BUILDING_POLY, context)
+        source_poly = self.parameterAsVectorLayer(parameters, self.INPUT_SOURCE_POLY, context)
+        source_type = self.enum_source_type[self.parameterAsEnum(parameters, self.SOURCE_TYPE[0], context)]
+        site_field = self.parameterAsString(parameters, self.SITE_FIELD[0], context)
+        depth_field = self.parameterAsString(parameters, self.DEPTH_FIELD[0], context) or None
+        source_raster_rock_surface = self.parameterAsRasterLayer(parameters, self.RASTER_ROCK_SURFACE[0], context)
+        if bLongterm and source_raster_rock_surface is None:
+            feedback.reportError("PROCESS - No raster chosen! Chose a raster to perform long-term analysis")
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.RASTER_ROCK_SURFACE[0]))
+        building_search_distance = self.parameterAsDouble(parameters, self.BUILDING_SEARCH_DISTANCE[0], context)
+        n_workers = self.parameterAsInt(parameters, self.N_WORKERS[0], context)
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        output_folder_path = Path(output_folder)
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.feature_name = self.parameterAsString(parameters, self.OUTPUT_FEATURE_NAME, context)
+        output_proj = self.parameterAsCrs(parameters, self.OUTPUT_CRS, context)
+        self.logger.info(f"PROCESS - Output folder: {output_folder}, feature name: {self.feature_name}, output CRS: {output_proj.authid()}")
+
+        ################# PARAMETERS OF THE SITES #################
+        # The arguments of the core, as the Excavation and Tunnel algorithms pass them
+        common = {
+            "output_proj": output_proj.postgisSrid(),
+            "bShortterm": bShortterm,
+            "bLongterm": bLongterm,
+            "dtb_raster": None,
+            "dry_crust_thk": None,
+            "dep_groundwater": None,
+            "density_sat": None,
+            "OCR": None,
+            "janbu_ref_stress": None,
+            "janbu_const": None,
+            "janbu_m": None,
+            "consolidation_time": None,
+        }
+        if bLongterm:
+            common.update(
+                dry_crust_thk=self.parameterAsDouble(parameters, self.DRY_CRUST_THICKNESS[0], context),
+                dep_groundwater=self.parameterAsDouble(parameters, self.DEPTH_GROUNDWATER[0], context),
+                density_sat=self.parameterAsDouble(parameters, self.SOIL_DENSITY[0], context),
+                OCR=self.parameterAsDouble(parameters, self.OCR[0], context),
+                janbu_ref_stress=self.parameterAsInt(parameters, self.JANBU_REF_STRESS[0], context),
+                janbu_const=self.parameterAsInt(parameters, self.JANBU_CONSTANT[0], context),
+                janbu_m=self.parameterAsInt(parameters, self.JANBU_COMP_MODULUS[0], context),
+                consolidation_time=self.parameterAsInt(parameters, self.CONSOLIDATION_TIME[0], context),
+            )
+        bVulnerability = self.parameterAsBoolean(parameters, self.VULNERABILITY_ANALYSIS[0], context)
+        vulnerability_fields = [
+            (self.parameterAsString(parameters, constant[0], context).strip() or None) if bVulnerability else None
+            for constant in (
+                self.FILED_NAME_BUILDING_FOUNDATION,
+                self.FILED_NAME_BUILDING_STRUCTURE,
+                self.FILED_NAME_BUILDING_STATUS,
+            )
+        ]
+        common.update(
+            bVulnerability=bVulnerability,
+            fieldNameFoundation=vulnerability_fields[0],
+            fieldNameStructure=vulnerability_fields[1],
+            fieldNameStatus=vulnerability_fields[2],
+        )
+        if source_type == "Excavation":
+            depth_argument = "excavation_depth"
+            common.update(
+                excavation_depth=self.parameterAsDouble(parameters, self.EXCAVATION_DEPTH[0], context) if bShortterm else None,
+                short_term_curve=self.enum_settlment[self.parameterAsEnum(parameters, self.SETTLEMENT_ENUM[0], context)]
+                if bShortterm else None,
+                porewp_red_m=self.parameterAsInt(parameters, self.POREWP_REDUCTION_M[0], context) if bLongterm else None,
+            )
+        else:
+            depth_argument = "tunnel_depth"
+            common.update(
+                tunnel_depth=self.parameterAsDouble(parameters, self.TUNNEL_DEPTH[0], context) if bShortterm else None,
+                tunnel_diameter=self.parameterAsDouble(parameters, self.TUNNEL_DIAM[0], context) if bShortterm else None,
+                volume_loss=self.parameterAsDouble(parameters, self.VOLUME_LOSS[0], context) if bShortterm else None,
+                trough_width=self.parameterAsDouble(parameters, self.TROUGH_WIDTH[0], context) if bShortterm else None,
+                tunnel_leakage=None,
+                porewp_calc_type=None,
+                porewp_red_at_site_m=0,
+            )
+            if bLongterm:
+                common.update(
+                    tunnel_leakage=self.parameterAsDouble(parameters, self.TUNNEL_LEAKAGE[0], context),
+                    porewp_calc_type=map_porepressure_curve_names(
+                        self.CURVES_enum_porepressure[self.parameterAsEnum(parameters, self.POREPRESSURE_ENUM_CURVES[0], context)]
+                    ),
+                    porewp_red_at_site_m=self.parameterAsInt(parameters, self.POREWP_REDUCTION_M[0], context),
+                )
+
+        ################# PREPARE THE INPUTS ONCE #################
+        temp_files = [self.run_temp_folder]
+        if reproject_is_needed(source_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_poly.name()}")
+            source_poly, _ = reproject_layers(output_proj, source_poly, context=context, logger=self.logger)
+        site_geometries, site_depths = self.read_sites(source_poly, site_field, depth_field)
+        if not site_geometries:
+            feedback.reportError(f"PROCESS - No sites found in the field '{site_field}' of {source_poly.name()}")
+            return {}
+        site_inputs = site_jsons(get_shapefile_as_json_pyqgis(source_poly, self.logger), site_field)
+        core_kwargs = {site_id: dict(common) for site_id in site_geometries}
+        if bShortterm:
+            for site_id, depth in site_depths.items():
+                core_kwargs[site_id][depth_argument] = depth
+        feedback.pushInfo(f"PROCESS - {len(site_geometries)} {source_type.lower()} sites read, {len(site_depths)} with their own depth")
+        self.logger.info(f"PROCESS - {len(site_geometries)} sites: {list(site_geometries)}")
+        check_canceled(feedback, temp_files, self.logger)
+
+        if building_search_distance > 0:
+            # Only the buildings near any of the sites are read, through the spatial index of the source
+            search_extent = QgsRectangle()
+            for geometry in site_geometries.values():
+                search_extent.combineExtentWith(geometry.boundingBox())
+            search_extent.grow(building_search_distance)
+            temp_files.append(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context) / "buildings_in_extent_temp.shp")
+            source_building_poly = read_features_in_extent(
+                source_building_poly,
+                search_extent,
+                output_proj,
+                temp_files[-1],
+                context=context,
+                logger=self.logger,
+                feedback=feedback,
+            )
+        if reproject_is_needed(source_building_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_building_poly.name()}")
+            source_building_poly, _ = reproject_layers(output_proj, source_building_poly, context=context, logger=self.logger)
+        if bLongterm:
+            if reproject_is_needed(source_raster_rock_surface, output_proj):
+                feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}")
+                _, source_raster_rock_surface = reproject_layers(
+                    output_proj, raster_layer=source_raster_rock_surface, context=context, logger=self.logger
+                )
+            dtb_path = source_raster_rock_surface.source().split("|")[0]
+            for kwargs in core_kwargs.values():
+                kwargs["dtb_raster"] = dtb_path
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(10)
+
+        if source_building_poly.featureCount() == 0:
+            feedback.reportError("PROCESS - No building polygons found")
+            return {}
+        partition = partition_buildings(source_building_poly, site_geometries, building_search_distance)
+        for site_id in site_geometries:
+            if not len(partition[site_id]):
+                feedback.pushInfo(f"PROCESS - No buildings within {building_search_distance} m of site {site_id}")
+        # The buildings of every site are written once, for the core of the site to read
+        tasks = site_tasks(
+            source_building_poly,
+            site_inputs,
+            partition,
+            source_type,
+            core_kwargs,
+            create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context) / "sites",
+        )
+        if not tasks:
+            feedback.reportError("PROCESS - No buildings within the search distance of any site")
+            return {}
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(30)
+
+        ################# EVALUATE ALL SITES #################
+        start_time = time.perf_counter()
+        site_results = run_sites(
+            tasks,
+            n_workers=n_workers,
+            progress=self.progressCallback(feedback, 30, 60, temp_files, self.logger, total=len(tasks), unit="sites"),
+            logger=self.logger,
+        )
+        elapsed = time.perf_counter() - start_time
+        n_evaluated = sum(len(fids) for fids, _, _ in site_results.values())
+        feedback.pushInfo(f"PROCESS - Evaluated {len(site_results)} sites with {n_evaluated} buildings in {elapsed:.1f} s")
+        self.logger.info(f"PROCESS - Evaluated {len(site_results)} sites with {n_evaluated} buildings in {elapsed:.1f} s")
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(90)
+
+        ################# WRITE THE RESULTS #################
+        output_building, output_wall, output_corner, summary = write_site_outputs(
+            site_results,
+            output_folder_path / f"{self.feature_name}-SITES-BUILDING.shp",
+            output_folder_path / f"{self.feature_name}-SITES-WALL.shp",
+            output_folder_path / f"{self.feature_name}-SITES-CORNER.shp",
+        )
+        self.layers_info = {
+            "SITES-CORNER": {"shape_path": output_corner, "style_name": "CORNERS-SETTLMENT_mm.qml"},
+            "SITES-WALL": {"shape_path": output_wall, "style_name": "WALL-ANGLE.qml"},
+            "SITES-BUILDING-ANGLE": {"shape_path": output_building, "style_name": "BUILDING-TOTAL-ANGLE_max_angle.qml"},
+            "SITES-BUILDING": {"shape_path": output_building, "style_name": "BUILDING-TOTAL-SETTLMENT_sv_tot.qml"},
+        }
+        if bVulnerability:
+            self.layers_info.update(
+                {
+                    "SITES-BUILDING-RISK-ANGLE": {
+                        "shape_path": output_building,
+                        "style_name": "BUILDING-TOTAL-RISK-ANGLE_risk_angle.qml",
+                    },
+                    "SITES-BUILDING-RISK-SETTLMENT": {
+                        "shape_path": output_building,
+                        "style_name": "BUILDING-TOTAL-RISK-SELLMENT_risk_tots.qml",
+                    },
+                }
+            )
+
+        sites_path = output_folder_path / f"{self.feature_name}-SITES.csv"
+        with open(sites_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["site", depth_argument, "n_buildings", "n_governing", "max_sv_tot"])
+            for site_id, site_summary in summary.items():
+                max_sv_tot = site_summary["max_sv_tot"]
+                writer.writerow(
+                    [site_id, core_kwargs[site_id][depth_argument], site_summary["n_buildings"],
+                     site_summary["n_governing"], max_sv_tot]
+                )
+                feedback.pushInfo(
+                    f"PROCESS - Site {site_id}: {site_summary['n_buildings']} buildings, governing "
+                    f"{site_summary['n_governing']}, max settlement "
+                    + ("-" if max_sv_tot is None else f"{max_sv_tot * 1000:.1f} mm")
+                )
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        return {
+            self.OUTPUT_BUILDING: output_building,
+            self.OUTPUT_WALL: output_wall,
+            self.OUTPUT_CORNER: output_corner,
+            self.OUTPUT_SITES: str(sites_path),
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        This method is called after processAlgorithm finishes.
+        Here, we manually load the output shapefiles, apply QML styles,
+        and place them under a custom group in the layer tree.
+        """
+        self.removeRunTempFolder(context)
+        project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
+        root = project.layerTreeRoot()
+
+        # Create (or find) a group at the top level named by 'self.feature_name'.
+        group_name = self.feature_name
+        group = root.findGroup(group_name)
+        if not group:
+            group = root.insertGroup(0, group_name)
+
+        for layer_label, layer_info in self.layers_info.items():
+            shape_path = layer_info["shape_path"]
+            style_name = layer_info["style_name"]
+
+            # Generate a unique layer name with timestamp
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            final_layer_name = f"{layer_label}_{timestamp}"
+
+            layer = QgsVectorLayer(shape_path, final_layer_name, "ogr")
+            if not layer.isValid():
+                feedback.reportError(f"Could not load layer from file: {shape_path}")
+                continue
+
+            # Load the QML style if there is one for this output
+            if style_name is not None:
+                style_path = self.STYLES_DIR / style_name
+                if style_path.is_file():
+                    layer.loadNamedStyle(str(style_path))
+                    layer.triggerRepaint()
+                else:
+                    feedback.reportError(f"Style file not found: {style_path}")
+
+            # Add the layer to the project (layer registry) *without* adding to the root TOC
+            project.addMapLayer(layer, False)
+            group.insertLayer(-1, layer)
+            node = group.findLayer(layer.id())
+            if node:
+                node.setItemVisibilityChecked(True)
+
+            feedback.pushInfo(f"Loaded and styled layer '{final_layer_name}' in group '{group_name}'.")
+
+        feedback.pushInfo("postProcessAlgorithm complete.")
+        return {}
@@ -0,0 +1,791 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import time
+from pathlib import Path
+from datetime import datetime
+
+from qgis.core import (
+    Qgis,
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsProject,
+    QgsRasterLayer,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+
+import numpy as np
+
+from ..utilities.gridlib import Grid, read_grid, superposed_cells, write_grid
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.methodslib import (
+    check_canceled,
+    create_temp_folder_for_version,
+    reproject_is_needed,
+    reproject_layers,
+    warp_raster_to_grid,
+)
+from ..utilities.settlementlib import (
+    LOOKUP_TOLERANCE,
+    POREWATER_INFLUENCE_DISTANCE,
+    short_term_curve_parameters,
+)
+from ..utilities.sitelib import (
+    MANUAL_POREPRESSURE_CURVE,
+    POREPRESSURE_CURVES,
+    check_porepressure_curve,
+    evaluate_sources,
+    geometry_segments,
+    prepare_site,
+    tunnel_corridors,
+    write_building_results,
+    write_corner_results,
+    write_wall_results,
+)
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class BegrensSkadeCombinedImpact(GvBaseProcessingAlgorithms):
+    """
+    The BegrensSkadeCombinedImpact algorithm evaluates the combined settlements of several
+    excavations and tunnels (e.g. a tunnel and two station pits) on the same buildings. Every
+    polygon of the excavation and tunnel layers is a source. Buildings and depth to bedrock are
+    loaded once, the short term settlements and the porewater pressure reductions of all sources
+    are added up at every corner in one vectorized pass, and the long term settlement, wall angles
+    and categories follow from the totals. Optionally the same superposition is evaluated on a grid.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_COMBINED_IMPACT.log",
+            "COMBINED_IMPACT_LOGGER",
+        ).get_logger()
+
+        # Retrieve version number from BaseAlgorithm class "GvBaseProcessingAlgorithms"
+        self.version = self.getVersion()
+        self.logger.info(f"__INIT__ - VERSION: {self.version} ")
+
+        # instanciate variables used in postprocessing to add layers to GUI
+        self.feature_name = None  # Default value
+        self.layers_info = {}
+        self.logger.info("__INIT__ - Finished initialize BegrensSkadeCombinedImpact ")
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BegrensSkadeCombinedImpact()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="excavation.png")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "begrensskadecombinedimpact"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Begrens Skade - Combined impact")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("REMEDY_GIS_RiskTool")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "remedygisrisktool"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "The Begrens Skade - Combined impact algorithm evaluates the settlements of several excavations and tunnels together, e.g. a tunnel and two station pits under the same block. Every polygon of the excavation and tunnel layers is a source. Buildings and depth to bedrock are loaded once for all sources.\n"
+            "SUPERPOSITION\nThe short term settlements of the sources are added at every building corner. The horizontal displacements point towards their source and are added as vectors. The porewater pressure reductions of the sources are added, and the long term settlement is computed from the total reduction. Wall angles and the settlement and angle categories follow from the total settlement.\n"
+            "SOURCES\nThe optional depth fields give the depth of every excavation or tunnel polygon, polygons without a value take the depth given in this dialog. All other parameters are the same for the sources of one layer.\n"
+            "OUTPUT\nA building layer with the maximum total settlement and angular distortion and their categories, a wall layer with the angular distortion, and a corner layer with the distance to the nearest source, the short term, long term and total settlement and the short term settlement of every source (sv_s01, sv_s02, ...). With a grid size above 0, a raster with the short term, long term and total settlement covers the sources and the clip distance around them.\n"
+            "The settlements are evaluated with the vectorized settlement engine of the plugin. For tunnels, the porewater pressure reduction at the tunnel is given directly (as with the Manual curve of the Tunnel algorithm).\n"
+            "The algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_FEATURE_NAME = "OUTPUT_FEATURE_NAME"
+    OUTPUT_CRS = "OUTPUT_CRS"
+    INPUT_BUILDING_POLY = "INPUT_BUILDING_POLY"
+    INPUT_EXCAVATION_POLY = "INPUT_EXCAVATION_POLY"
+    INPUT_TUNNEL_POLY = "INPUT_TUNNEL_POLY"
+    EXCAVATION_DEPTH_FIELD = ["EXCAVATION_DEPTH_FIELD", "Depth field of the excavations [m]"]
+    TUNNEL_DEPTH_FIELD = ["TUNNEL_DEPTH_FIELD", "Depth field of the tunnels [m]"]
+
+    SHORT_TERM_SETTLEMENT = ["SHORT_TERM_SETTLEMENT", "Short term settlements"]
+    EXCAVATION_DEPTH = ["EXCAVATION_DEPTH", "Depth of excavation [m]"]
+    SETTLEMENT_ENUM = ["SETTLEMENT_ENUM", "Settlement curves (excavation)"]
+    enum_settlment = [
+        r"0,5 % av byggegropdybde",
+        r"1 % av byggegropdybde",
+        r"2 % av byggegropdybde",
+        r"3 % av byggegropdybde",
+    ]
+    TUNNEL_DEPTH = ["TUNNEL_DEPTH", "Depth of tunnel [m]"]
+    TUNNEL_DIAM = ["TUNNEL_DIAM", "Diameter of tunnel [m]"]
+    VOLUME_LOSS = ["VOLUME_LOSS", "Loss of volume [%]"]
+    TROUGH_WIDTH = ["TROUGH_WIDTH", "Width of trough [m]"]
+
+    LONG_TERM_SETTLEMENT = ["LONG_TERM_SETTLEMENT", "Long term settlements"]
+    RASTER_ROCK_SURFACE = [
+        "RASTER_ROCK_SURFACE",
+        "Input raster of depth to bedrock",
+    ]
+    EXCAVATION_POREWP_REDUCTION = [
+        "EXCAVATION_POREWP_REDUCTION",
+        "Porewater pressure reduction at the excavations [m]",
+    ]
+    TUNNEL_POREWP_REDUCTION = [
+        "TUNNEL_POREWP_REDUCTION",
+        "Porewater pressure reduction at the tunnels [m]",
+    ]
+    POREPRESSURE_ENUM_CURVES = [
+        "POREPRESSURE_ENUM",
+        "Calculation curve for pore pressure reduction of the tunnels (only Manual, the reduction at the tunnels)",
+    ]
+    DRY_CRUST_THICKNESS = [
+        "DRY_CRUST_THICKNESS",
+        "Thickness of overburden not affected by porewater drawdown [m]",
+    ]
+    DEPTH_GROUNDWATER = ["DEPTH_GROUNDWATER", "Depht to groundwater table [m]"]
+    SOIL_DENSITY = ["SOIL_DENSITY", "Soil saturation density [kN/m3]"]
+    OCR = ["OCR", "Over consolidation ratio"]
+    JANBU_REF_STRESS = [
+        "JANBU_REF_STRESS",
+        "Janbu reference stress, p`r (kPa)",
+    ]
+    JANBU_CONSTANT = ["JANBU_CONSTANT", "Janbu constant [M0/(m*p`c)]"]
+    JANBU_COMP_MODULUS = ["JANBU_COMP_MODULUS", "Janbu compression modulus"]
+    CONSOLIDATION_TIME = ["CONSOLIDATION_TIME", "Consolidation time [years]"]
+    LOOKUP_TOLERANCE = [
+        "LOOKUP_TOLERANCE",
+        "Error bound of the long term lookup table [mm] (0 = exact evaluation)",
+    ]
+
+    GRID_RESOLUTION = ["GRID_RESOLUTION", "Grid size of the combined impact map [m] (0 = no impact map)"]
+    CLIPPING_RANGE = ["CLIPPING_RANGE", "Clip distance of the impact map around the sources [m]"]
+
+    # Shapefiles hold at most 255 fields, one corner field is written for every source
+    MAX_SOURCE_COLUMNS = 99
+
+    OUTPUT_BUILDING = "OUTPUT_BUILDING"
+    OUTPUT_WALL = "OUTPUT_WALL"
+    OUTPUT_CORNER = "OUTPUT_CORNER"
+    OUTPUT_RASTER = "OUTPUT_RASTER"
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_BUILDING_POLY,
+                self.tr("Input Building polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_EXCAVATION_POLY,
+                self.tr("Input Excavation polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_TUNNEL_POLY,
+                self.tr("Input Tunnel polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True,
+            )
+        )
+        for constant, parent in [
+            (self.EXCAVATION_DEPTH_FIELD, self.INPUT_EXCAVATION_POLY),
+            (self.TUNNEL_DEPTH_FIELD, self.INPUT_TUNNEL_POLY),
+        ]:
+            self.addParameter(
+                QgsProcessingParameterField(
+                    constant[0],
+                    self.tr(f"{constant[1]}"),
+                    defaultValue=None,
+                    parentLayerParameterName=parent,
+                    type=QgsProcessingParameterField.Numeric,
+                    allowMultiple=False,
+                    optional=True,
+                )
+            )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SHORT_TERM_SETTLEMENT[0],
+                self.tr(f"{self.SHORT_TERM_SETTLEMENT[1]}"),
+                defaultValue=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.LONG_TERM_SETTLEMENT[0],
+                self.tr(f"{self.LONG_TERM_SETTLEMENT[1]}"),
+                defaultValue=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.RASTER_ROCK_SURFACE[0],
+                self.tr(f"{self.RASTER_ROCK_SURFACE[1]}"),
+                defaultValue=None,
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SETTLEMENT_ENUM[0],
+                self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
+                self.enum_settlment,
+                defaultValue=1,
+                allowMultiple=False,
+            )
+        )
+        for constant, default, number_type in [
+            (self.EXCAVATION_DEPTH, 10, QgsProcessingParameterNumber.Double),
+            (self.EXCAVATION_POREWP_REDUCTION, 10, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DEPTH, 15, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DIAM, 9.5, QgsProcessingParameterNumber.Double),
+            (self.VOLUME_LOSS, 2, QgsProcessingParameterNumber.Double),
+            (self.TROUGH_WIDTH, 0.5, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_POREWP_REDUCTION, 10, QgsProcessingParameterNumber.Double),
+        ]:
+            self.addParameter(
+                QgsProcessingParameterNumber(
+                    constant[0],
+                    self.tr(f"{constant[1]}"),
+                    number_type,
+                    defaultValue=default,
+                    minValue=0,
+                )
+            )
+        param = QgsProcessingParameterEnum(
+            self.POREPRESSURE_ENUM_CURVES[0],
+            self.tr(f"{self.POREPRESSURE_ENUM_CURVES[1]}"),
+            POREPRESSURE_CURVES,
+            defaultValue=POREPRESSURE_CURVES.index(MANUAL_POREPRESSURE_CURVE),
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        for constant, default, number_type in [
+            (self.DRY_CRUST_THICKNESS, 5, QgsProcessingParameterNumber.Double),
+            (self.DEPTH_GROUNDWATER, 3, QgsProcessingParameterNumber.Double),
+            (self.SOIL_DENSITY, 18.5, QgsProcessingParameterNumber.Double),
+            (self.OCR, 1.2, QgsProcessingParameterNumber.Double),
+            (self.JANBU_REF_STRESS, 0, QgsProcessingParameterNumber.Integer),
+            (self.JANBU_CONSTANT, 4, QgsProcessingParameterNumber.Double),
+            (self.JANBU_COMP_MODULUS, 15, QgsProcessingParameterNumber.Double),
+            (self.CONSOLIDATION_TIME, 1000, QgsProcessingParameterNumber.Integer),
+        ]:
+            param = QgsProcessingParameterNumber(
+                constant[0],
+                self.tr(f"{constant[1]}"),
+                number_type,
+                defaultValue=default,
+                minValue=0,
+            )
+            param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.LOOKUP_TOLERANCE[0],
+            self.tr(f"{self.LOOKUP_TOLERANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=LOOKUP_TOLERANCE * 1000,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.GRID_RESOLUTION[0],
+                self.tr(f"{self.GRID_RESOLUTION[1]}"),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0,
+            )
+        )
+        param = QgsProcessingParameterNumber(
+            self.CLIPPING_RANGE[0],
+            self.tr(f"{self.CLIPPING_RANGE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=POREWATER_INFLUENCE_DISTANCE,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # DEFINE OUTPUTS
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.OUTPUT_FEATURE_NAME,
+                self.tr(
+                    "Naming Conventions for Analysis and Features (Output feature name appended to file-names)"
+                )
+            ),
+            createOutput=True
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                self.OUTPUT_CRS,
+                self.tr("Output CRS"),
+                defaultValue=QgsProject.instance().crs(),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output Folder"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_BUILDING,
+                self.tr("Output Buildings Shapefile (combined settlements)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_WALL,
+                self.tr("Output Walls Shapefile (combined settlements)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_CORNER,
+                self.tr("Output Corners Shapefile (combined settlements)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_RASTER,
+                self.tr("Output Raster combined impact map"),
+            )
+        )
+
+    def read_sources(self, layer, source_type, depth_field, parameters):
+        """
+        Returns every polygon of an excavation or tunnel layer as a source of sitelib.source_contributions().
+
+        Args:
+            layer (QgsVectorLayer): The excavation or tunnel polygons, or None.
+            source_type (str): "Excavation" or "Tunnel".
+            depth_field (str, optional): The field with the depth of every polygon.
+            parameters (dict): The arguments of the short term curve and 'porewp_red_m' of the layer.
+
+        Returns:
+            list: The sources, with the polygon geometry as 'geometry' and a 'name'.
+        """
+        if layer is None:
+            return []
+        depth_argument = "excavation_depth" if source_type == "Excavation" else "tunnel_depth"
+        sources = []
+        for feature in layer.getFeatures():
+            geometry = feature.geometry()
+            if geometry is None or geometry.isEmpty():
+                continue
+            source = dict(parameters, type=source_type, name=f"{source_type} {feature.id()}", geometry=geometry)
+            source["segments"] = geometry_segments([geometry])
+            if source_type == "Tunnel":
+                source["corridors"] = tunnel_corridors([geometry])
+            if depth_field:
+                depth = feature[depth_field]
+                if depth is not None and str(depth).strip() not in ("", "NULL"):
+                    source[depth_argument] = float(depth)
+            sources.append(source)
+        return sources
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        self.logger.info("PROCESS - Starting the processing")
+        feedback.pushInfo(f"PROCESS - Version: {self.version}")
+
+        bShortterm = self.parameterAsBoolean(parameters, self.SHORT_TERM_SETTLEMENT[0], context)
+        bLongterm = self.parameterAsBoolean(parameters, self.LONG_TERM_SETTLEMENT[0], context)
+        if not bShortterm and not bLongterm:
+            error_msg = "Please choose Short term or Long term settlements, or both"
+            self.logger.error(error_msg)
+            feedback.reportError(error_msg)
+            return {}
+
+        source_building_poly = self.parameterAsVectorLayer(parameters, self.INPUT_BUILDING_POLY, context)
+        source_excavation_poly = self.parameterAsVectorLayer(parameters, self.INPUT_EXCAVATION_POLY, context)
+        source_tunnel_poly = self.parameterAsVectorLayer(parameters, self.INPUT_TUNNEL_POLY, context)
+        if source_excavation_poly is None and source_tunnel_poly is None:
+            raise QgsProcessingException("Please choose an excavation layer, a tunnel layer, or both")
+        porepressure_curve = POREPRESSURE_CURVES[
+            self.parameterAsEnum(parameters, self.POREPRESSURE_ENUM_CURVES[0], context)
+        ]
+        if bLongterm and source_tunnel_poly is not None:
+            try:
+                check_porepressure_curve(porepressure_curve)
+            except ValueError as e:
+                self.logger.error(f"PROCESS - {e}")
+                feedback.reportError(f"PROCESS - {e}")
+                return {}
+        source_raster_rock_surface = self.parameterAsRasterLayer(parameters, self.RASTER_ROCK_SURFACE[0], context)
+        if bLongterm and source_raster_rock_surface is None:
+            feedback.reportError("PROCESS - No raster chosen! Chose a raster to perform long-term analysis")
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.RASTER_ROCK_SURFACE[0]))
+        grid_resolution = self.parameterAsDouble(parameters, self.GRID_RESOLUTION[0], context)
+        clipping_range = self.parameterAsDouble(parameters, self.CLIPPING_RANGE[0], context)
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        output_folder_path = Path(output_folder)
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.feature_name = self.parameterAsString(parameters, self.OUTPUT_FEATURE_NAME, context)
+        output_proj = self.parameterAsCrs(parameters, self.OUTPUT_CRS, context)
+        self.logger.info(f"PROCESS - Output folder: {output_folder}, feature name: {self.feature_name}, output CRS: {output_proj.authid()}")
+
+        ################# PREPARE THE INPUTS ONCE #################
+        temp_files = [self.run_temp_folder]
+        if reproject_is_needed(source_building_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_building_poly.name()}")
+            source_building_poly, _ = reproject_layers(output_proj, source_building_poly, context=context, logger=self.logger)
+        if source_excavation_poly is not None and reproject_is_needed(source_excavation_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_excavation_poly.name()}")
+            source_excavation_poly, _ = reproject_layers(output_proj, source_excavation_poly, context=context, logger=self.logger)
+        if source_tunnel_poly is not None and reproject_is_needed(source_tunnel_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_tunnel_poly.name()}")
+            source_tunnel_poly, _ = reproject_layers(output_proj, source_tunnel_poly, context=context, logger=self.logger)
+        dtb_path = None
+        if bLongterm:
+            if reproject_is_needed(source_raster_rock_surface, output_proj):
+                feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}")
+                _, source_raster_rock_surface = reproject_layers(
+                    output_proj, raster_layer=source_raster_rock_surface, context=context, logger=self.logger
+                )
+            dtb_path = source_raster_rock_surface.source().split("|")[0]
+        check_canceled(feedback, temp_files, self.logger)
+
+        ratio, extent = short_term_curve_parameters(
+            self.enum_settlment[self.parameterAsEnum(parameters, self.SETTLEMENT_ENUM[0], context)]
+        )
+        sources = self.read_sources(
+            source_excavation_poly,
+            "Excavation",
+            self.parameterAsString(parameters, self.EXCAVATION_DEPTH_FIELD[0], context) or None,
+            {
+                "excavation_depth": self.parameterAsDouble(parameters, self.EXCAVATION_DEPTH[0], context),
+                "ratio": ratio,
+                "extent": extent,
+                "porewp_red_m": self.parameterAsDouble(parameters, self.EXCAVATION_POREWP_REDUCTION[0], context),
+            },
+        )
+        sources += self.read_sources(
+            source_tunnel_poly,
+            "Tunnel",
+            self.parameterAsString(parameters, self.TUNNEL_DEPTH_FIELD[0], context) or None,
+            {
+                "tunnel_depth": self.parameterAsDouble(parameters, self.TUNNEL_DEPTH[0], context),
+                "tunnel_diameter": self.parameterAsDouble(parameters, self.TUNNEL_DIAM[0], context),
+                "volume_loss": self.parameterAsDouble(parameters, self.VOLUME_LOSS[0], context),
+                "trough_width": self.parameterAsDouble(parameters, self.TROUGH_WIDTH[0], context),
+                "porewp_red_m": self.parameterAsDouble(parameters, self.TUNNEL_POREWP_REDUCTION[0], context),
+                "porepressure_curve": porepressure_curve,
+            },
+        )
+        if not sources:
+            feedback.reportError("PROCESS - No excavation or tunnel polygons found")
+            return {}
+        if len(sources) > self.MAX_SOURCE_COLUMNS:
+            raise QgsProcessingException(
+                f"{len(sources)} sources do not fit in the corner shapefile (max {self.MAX_SOURCE_COLUMNS})"
+            )
+        for number, source in enumerate(sources, start=1):
+            self.logger.info(f"PROCESS - Source s{number:02d}: {source['name']}")
+        feedback.pushInfo(f"PROCESS - {len(sources)} sources: {', '.join(source['name'] for source in sources)}")
+        feedback.setProgress(10)
+
+        site = prepare_site(source_building_poly, dtb_path=dtb_path)
+        feedback.pushInfo(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        self.logger.info(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        if site.n_buildings == 0:
+            feedback.reportError("PROCESS - No building polygons found")
+            return {}
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(20)
+
+        ################# EVALUATE ALL SOURCES TOGETHER #################
+        soil = {
+            "dry_crust_thk": self.parameterAsDouble(parameters, self.DRY_CRUST_THICKNESS[0], context),
+            "dep_groundwater": self.parameterAsDouble(parameters, self.DEPTH_GROUNDWATER[0], context),
+            "density_sat": self.parameterAsDouble(parameters, self.SOIL_DENSITY[0], context),
+            "ocr": self.parameterAsDouble(parameters, self.OCR[0], context),
+            "janbu_ref_stress": self.parameterAsDouble(parameters, self.JANBU_REF_STRESS[0], context),
+            "janbu_const": self.parameterAsDouble(parameters, self.JANBU_CONSTANT[0], context),
+            "janbu_m": self.parameterAsDouble(parameters, self.JANBU_COMP_MODULUS[0], context),
+            "consolidation_time": self.parameterAsDouble(parameters, self.CONSOLIDATION_TIME[0], context),
+        }
+        start_time = time.perf_counter()
+        results = evaluate_sources(
+            site,
+            sources,
+            short_term=bShortterm,
+            long_term=bLongterm,
+            lookup_tolerance=self.parameterAsDouble(parameters, self.LOOKUP_TOLERANCE[0], context) / 1000 or None,
+            progress=self.progressCallback(feedback, 20, 40, temp_files, self.logger, total=site.n_corners, unit="corners"),
+            **soil,
+        )
+        elapsed = time.perf_counter() - start_time
+        feedback.pushInfo(f"PROCESS - Evaluated {len(sources)} sources on {site.n_corners} corners in {elapsed:.1f} s")
+        self.logger.info(f"PROCESS - Evaluated {len(sources)} sources on {site.n_corners} corners in {elapsed:.1f} s")
+        feedback.setProgress(60)
+
+        ################# WRITE THE RESULTS #################
+        output_building = write_building_results(
+            site,
+            output_folder_path / f"{self.feature_name}-COMBINED-BUILDING.shp",
+            [
+                ("max_sv_tot", QVariant.Double, results["max_sv_tot"][0]),
+                ("max_angle", QVariant.Double, results["max_angle"][0]),
+                ("sv_class", QVariant.Int, results["sv_class"][0]),
+                ("angle_cls", QVariant.Int, results["angle_class"][0]),
+            ],
+        )
+        output_wall = write_wall_results(
+            site,
+            output_folder_path / f"{self.feature_name}-COMBINED-WALL.shp",
+            [("slope_ang", QVariant.Double, results["slope_ang"][0])],
+        )
+        dtb = site.dtb if site.dtb is not None else np.full(site.n_corners, np.nan)
+        output_corner = write_corner_results(
+            site,
+            output_folder_path / f"{self.feature_name}-COMBINED-CORNER.shp",
+            [
+                ("near_dist", QVariant.Double, site.near_dist),
+                ("dtb", QVariant.Double, dtb),
+                ("sv_short", QVariant.Double, results["sv_short"][0]),
+                ("sh_short", QVariant.Double, results["sh_short"][0]),
+                ("porewp_red", QVariant.Double, results["porewp_red"][0]),
+                ("sv_long", QVariant.Double, results["sv_long"][0]),
+                ("sv_tot", QVariant.Double, results["sv_tot"][0]),
+            ]
+            + [(f"sv_s{number:02d}", QVariant.Double, values) for number, values in enumerate(results["sv_sources"], start=1)],
+        )
+        self.layers_info = {
+            "COMBINED-CORNER": {"shape_path": output_corner, "style_name": "CORNERS-SETTLMENT_mm.qml"},
+            "COMBINED-WALL": {"shape_path": output_wall, "style_name": "WALL-ANGLE.qml"},
+            "COMBINED-BUILDING": {"shape_path": output_building, "style_name": "BUILDING-TOTAL-SETTLMENT_sv_tot.qml"},
+        }
+        categories = np.bincount(results["sv_class"][0], minlength=5)
+        feedback.pushInfo(
+            f"PROCESS - Max combined settlement {np.nanmax(results['max_sv_tot'][0]) * 1000:.1f} mm, "
+            f"buildings per settlement category {categories[1:5].tolist()}"
+        )
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(70)
+
+        ################# COMBINED IMPACT MAP #################
+        output_raster = None
+        if grid_resolution > 0:
+            output_raster = self.write_impact_map(
+                feedback, context, sources, dtb_path, grid_resolution, clipping_range, output_proj,
+                output_folder_path, bShortterm, bLongterm, soil, temp_files,
+            )
+            self.layers_info["COMBINED-IMPACT-MAP"] = {"shape_path": output_raster, "style_name": "IMPACT-MAP.qml", "band": 3}
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        return {
+            self.OUTPUT_BUILDING: output_building,
+            self.OUTPUT_WALL: output_wall,
+            self.OUTPUT_CORNER: output_corner,
+            self.OUTPUT_RASTER: output_raster,
+        }
+
+    def write_impact_map(self, feedback, context, sources, dtb_path, resolution, clipping_range, output_crs,
+                         output_folder_path, short_term, long_term, soil, temp_files):
+        """
+        Evaluates the combined settlements of all sources on a grid covering the sources and the clip
+        distance around them, and writes the short term, long term and total settlement as three bands.
+
+        Args:
+            sources (list): The excavations and tunnels, see read_sources().
+            dtb_path (str): The depth to bedrock raster, in the output CRS (None without long term).
+            resolution (float): The grid size [m].
+            clipping_range (float): The distance around the sources [m].
+            soil (dict): The long term parameters, see settlementlib.long_term_settlement().
+            temp_files (list): Temporary files of the run, removed when the run is canceled.
+
+        Returns:
+            str: The path to the written raster.
+        """
+        extent = QgsRectangle()
+        for source in sources:
+            extent.combineExtentWith(source["geometry"].boundingBox())
+        extent.grow(clipping_range)
+        if long_term:
+            dtb_grid_path = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context) / "combined_dtb_temp-raster.tif"
+            temp_files.append(dtb_grid_path)
+            grid = read_grid(warp_raster_to_grid(dtb_path, extent, resolution, dtb_grid_path, self.logger, feedback))
+        else:
+            x0 = np.floor(extent.xMinimum() / resolution) * resolution
+            y0 = np.ceil(extent.yMaximum() / resolution) * resolution
+            n_cols = int(np.ceil(extent.xMaximum() / resolution) - np.floor(extent.xMinimum() / resolution))
+            n_rows = int(np.ceil(extent.yMaximum() / resolution) - np.floor(extent.yMinimum() / resolution))
+            grid = Grid(np.zeros((n_rows, n_cols)), (x0, resolution, 0.0, y0, 0.0, -resolution), output_crs.toWkt())
+        feedback.pushInfo(f"PROCESS - Combined impact map on {grid.shape[1]} x {grid.shape[0]} cells of {resolution} m")
+
+        bands = superposed_cells(
+            grid, sources, short_term, long_term, soil,
+            progress=self.progressCallback(feedback, 70, 30, temp_files, self.logger, total=grid.values.size, unit="cells"),
+        )
+        output_path = write_grid(
+            Path(output_folder_path) / f"{self.feature_name}-COMBINED-IMPACT-MAP.tif",
+            [bands["sv_short"], bands["sv_long"], bands["sv_tot"]],
+            grid.geotransform,
+            grid.projection,
+            descriptions=["Short term settlement [m]", "Long term settlement [m]", "Total settlement [m]"],
+        )
+        self.logger.info(f"PROCESS - Combined impact map written to {output_path}")
+        return output_path
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        This method is called after processAlgorithm finishes.
+        Here, we manually load the output shapefiles and the impact map, apply QML styles,
+        and place them under a custom group in the layer tree.
+        """
+        self.removeRunTempFolder(context)
+        project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
+        root = project.layerTreeRoot()
+
+        # Create (or find) a group at the top level named by 'self.feature_name'.
+        group_name = self.feature_name
+        group = root.findGroup(group_name)
+        if not group:
+            group = root.insertGroup(0, group_name)
+
+        for layer_label, layer_info in self.layers_info.items():
+            path = layer_info["shape_path"]
+            style_name = layer_info["style_name"]
+
+            # Generate a unique layer name with timestamp
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            final_layer_name = f"{layer_label}_{timestamp}"
+
+            if str(path).endswith(".tif"):
+                layer = QgsRasterLayer(str(path), final_layer_name, "gdal")
+            else:
+                layer = QgsVectorLayer(str(path), final_layer_name, "ogr")
+            if not layer.isValid():
+                feedback.reportError(f"Could not load layer from file: {path}")
+                continue
+
+            style_path = self.STYLES_DIR / style_name
+            if style_path.is_file():
+                layer.loadNamedStyle(str(style_path))
+                band = layer_info.get("band")
+                if band is not None:
+                    # The style is applied to the total settlement band
+                    renderer = layer.renderer()
+                    if hasattr(renderer, "setInputBand"):
+                        renderer.setInputBand(band)
+                    elif hasattr(renderer, "setBand"):
+                        renderer.setBand(band)
+                layer.triggerRepaint()
+            else:
+                feedback.reportError(f"Style file not found: {style_path}")
+
+            # Add the layer to the project (layer registry) *without* adding to the root TOC
+            project.addMapLayer(layer, False)
+            group.insertLayer(-1, layer)
+            node = group.findLayer(layer.id())
+            if node:
+                node.setItemVisibilityChecked(True)
+
+            feedback.pushInfo(f"Loaded and styled layer '{final_layer_name}' in group '{group_name}'.")
+
+        feedback.pushInfo("postProcessAlgorithm complete.")
+        return {}
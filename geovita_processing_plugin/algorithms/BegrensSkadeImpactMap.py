@@ -35,6 +35,7 @@ from qgis.core import (
     Qgis,
     QgsProject,
     QgsProcessing,
+    QgsProcessingException,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterFolderDestination,
     QgsProcessingParameterString,
@@ -44,24 +45,65 @@ from qgis.core import (
     QgsProcessingParameterEnum,
     QgsProcessingParameterDefinition,
     QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterMatrix,
     QgsMessageLog,
     QgsProcessingOutputFile,
-    QgsRasterLayer
+    QgsProcessingUtils,
+    QgsRasterLayer,
+    QgsRectangle,
 )
 
 import traceback
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
+from osgeo import gdal
+
 from .base_algorithm import GvBaseProcessingAlgorithms
 from ..utilities.gui import GuiUtils
 from ..utilities.logger import CustomLogger
+from ..utilities.gridlib import (
+    adaptive_cells,
+    cached_distance_field,
+    distance_field,
+    expand_cells,
+    influence_zone,
+    long_term_percentile_cells,
+    long_term_table_cells,
+    long_term_time_cells,
+    read_grid,
+    write_grid,
+    zone_windows,
+)
 from ..utilities.methodslib import (
+    check_canceled,
+    create_temp_folder_for_version,
     get_shapefile_as_json_pyqgis,
+    is_gdal_raster,
+    move_file_components,
+    prepare_dtb_window,
     process_raster_for_impactmap,
     reproject_is_needed,
     reproject_layers,
 )
+from ..utilities.settlementlib import (
+    LOOKUP_MIN_POINTS,
+    LOOKUP_TOLERANCE,
+    parse_consolidation_times,
+    short_term_curve_parameters,
+    short_term_excavation,
+    time_label,
+)
+from ..utilities.sitelib import polygon_segments
+from ..utilities.uncertainty import (
+    DEFAULT_DISTRIBUTION_TABLE,
+    DISTRIBUTION_TABLE_HEADERS,
+    PERCENTILES,
+    UNCERTAIN_PARAMETERS,
+    draw_samples,
+    parse_distribution_table,
+)
 
 from ..REMEDY_GIS_RiskTool.BegrensSkade import mainBegrensSkade_ImpactMap
 
@@ -117,7 +159,6 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         # instanciate variables used in postprocessing to add layers to GUI
         self.feature_name = None  # Default value
         self.layers_info = {}
-        self.styles_dir_path = Path()
         self.logger.info("__INIT__ - Finished initialize BegrensSkadeImpactMap ")
 
     def name(self):
@@ -159,7 +200,7 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         Returns a localised short help string for the algorithm.
         """
         return self.tr(
-            "The BegrensSkade ImpactMap alorithm calculates both short-term and long-term settlements that occur due to the establishment of a construction pit. The difference is that ImpactMap calculates terrain settlements, meaning the settlement is calculated for each cell in a grid that covers the same area as the rock model instead of only at the corner points of the building polygons. ImpactMap only provides total settlements as output.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+            "The BegrensSkade ImpactMap alorithm calculates both short-term and long-term settlements that occur due to the establishment of a construction pit. The difference is that ImpactMap calculates terrain settlements, meaning the settlement is calculated for each cell in a grid that covers the same area as the rock model instead of only at the corner points of the building polygons. ImpactMap only provides total settlements as output.\nUNCERTAINTY\nSample the long term soil parameters from the distribution table, and write the P10, P50 and P90 total settlement in a second raster.\nCONSOLIDATION TIMES\nAdditional consolidation times (e.g. '1, 10, 100') give a raster with one band of total settlement per time.\nDISTANCE FIELD\nCache the distance from every cell to the excavation for later runs on the same grid.\nPREVIEW\nCompute the total settlement on a grid 8 times coarser than the output grid first, and add it as a temporary layer.\nINFLUENCE ZONE\nOnly compute the cells within the clip distance of the excavation, and write all other cells as nodata.\nLOOKUP TABLE\nError bound of the tabulated long term settlement used for large grids (0 = exact evaluation).\nADAPTIVE REFINEMENT\nEvaluate the impact map on a grid refined where the settlement varies by more than the tolerance (0 = every cell).\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
         )
 
     def tr(self, string):
@@ -179,14 +220,31 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
     # used when calling the algorithm from another algorithm, or when
     # calling from the QGIS console.
     INPUT_EXCAVATION_POLY = "INPUT_EXCAVATION_POLY"
+    # The input layer of the polygons the settlements are computed around
+    SOURCE_POLY = INPUT_EXCAVATION_POLY
+    # True if the total settlement raster is computed by the vectorized engine instead of the REMEDY core
+    VECTORIZED_ENGINE = False
+    # Name of the impact map raster, after the output feature name
+    IMPACT_MAP_NAME = "IMPACT-MAP"
     OUTPUT_FOLDER = "OUTPUT_FOLDER"
     OUTPUT_FEATURE_NAME = "OUTPUT_FEATURE_NAME"
 
     OUTPUT_CRS = "OUTPUT_CRS"
     # return shapefiles from mainBegrensSkade_ImpactMap()
     OUTPUT_RASTER = "OUTPUT_RASTER"
+    OUTPUT_PERCENTILE_RASTER = "OUTPUT_PERCENTILE_RASTER"
+    OUTPUT_TIME_RASTER = "OUTPUT_TIME_RASTER"
+    OUTPUT_PREVIEW_RASTER = "OUTPUT_PREVIEW_RASTER"
 
     OUTPUT_RESOLUTION = ["OUTPUT_RESOLUTION", "Output grid size [meters]"]  # in meters
+    PREVIEW = ["PREVIEW", "Preview on a coarse grid"]
+    enum_preview = [
+        "No preview",
+        "Preview only",
+        "Preview, then full resolution",
+    ]
+    # The preview grid size is this factor times the output grid size
+    preview_factor = 8
     SHORT_TERM_SETTLEMENT = ["SHORT_TERM_SETTLEMENT", "Short term settlements"]
     EXCAVATION_DEPTH = ["EXCAVATION_DEPTH", "Depth of excavation [m]"]
     SETTLEMENT_ENUM = ["SETTLEMENT_ENUM", "Settlement curves"]
@@ -201,6 +259,10 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         "CLIPPING_RANGE",
         "Clip distance in case of high resolution (buffer distance in [meters])",
     ]
+    INFLUENCE_ZONE = [
+        "INFLUENCE_ZONE",
+        "Only compute cells within the clip distance of the excavation (nodata elsewhere)",
+    ]
 
     POREWP_REDUCTION_M = ["POREWP_REDUCTION_M", "Porewater pressure reduction [m]"]
     DRY_CRUST_THICKNESS = [
@@ -214,6 +276,29 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
     JANBU_CONSTANT = ["JANBU_CONSTANT", "Janbu constant [M0/(m*p`c)]"]
     JANBU_COMP_MODULUS = ["JANBU_COMP_MODULUS", "Janbu compression modulus"]
     CONSOLIDATION_TIME = ["CONSOLIDATION_TIME", "Consolidation time [years]"]
+    CONSOLIDATION_TIMES = [
+        "CONSOLIDATION_TIMES",
+        "Additional consolidation times, comma separated [years]",
+    ]
+    LOOKUP_TOLERANCE = [
+        "LOOKUP_TOLERANCE",
+        "Error bound of the long term lookup table [mm] (0 = exact evaluation)",
+    ]
+    ADAPTIVE_TOLERANCE = [
+        "ADAPTIVE_TOLERANCE",
+        "Adaptive refinement tolerance [mm] (0 = every cell)",
+    ]
+
+    USE_CACHE = ["USE_CACHE", "Reuse cached results of identical runs"]
+    REUSE_DISTANCE_FIELD = [
+        "REUSE_DISTANCE_FIELD",
+        "Distance transform of the excavation, cached for later runs on the same grid",
+    ]
+
+    UNCERTAINTY = ["UNCERTAINTY", "Percentile bands (P10/P50/P90) from sampled soil parameters"]
+    N_SAMPLES = ["N_SAMPLES", "Number of samples"]
+    RANDOM_SEED = ["RANDOM_SEED", "Random seed (repeatable samples)"]
+    DISTRIBUTION_TABLE = ["DISTRIBUTION_TABLE", "Distributions of the uncertain soil parameters"]
 
     def initAlgorithm(self, config):
         """
@@ -223,13 +308,7 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
 
         # We add the input vector features source. It must have polygon
         # geometry.
-        self.addParameter(
-            QgsProcessingParameterFeatureSource(
-                self.INPUT_EXCAVATION_POLY,
-                self.tr("Input Excavation polygon(s)"),
-                [QgsProcessing.TypeVectorPolygon],
-            )
-        )
+        self.add_source_parameter()
         # We add the input raster features source. It must contain depth to bedrock values
         param = QgsProcessingParameterRasterLayer(
             self.RASTER_ROCK_SURFACE[0],
@@ -261,6 +340,14 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             minValue=0,
         )
         self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.PREVIEW[0],
+            self.tr(f"{self.PREVIEW[1]}"),
+            self.enum_preview,
+            defaultValue=0,
+            allowMultiple=False,
+        )
+        self.addParameter(param)
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT_FOLDER,
@@ -275,22 +362,7 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             defaultValue=False,
         )
         self.addParameter(param)
-        param = QgsProcessingParameterNumber(
-            self.EXCAVATION_DEPTH[0],
-            self.tr(f"{self.EXCAVATION_DEPTH[1]}"),
-            QgsProcessingParameterNumber.Double,
-            defaultValue=0,
-            minValue=0,
-        )
-        self.addParameter(param)
-        param = QgsProcessingParameterEnum(
-            self.SETTLEMENT_ENUM[0],
-            self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
-            self.enum_settlment,
-            defaultValue=1,
-            allowMultiple=False,
-        )
-        self.addParameter(param)
+        self.add_short_term_parameters()
 
         # DEFINING ADVANCED PARAMETERS
         param = QgsProcessingParameterNumber(
@@ -301,6 +373,13 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         )
         param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.INFLUENCE_ZONE[0],
+            self.tr(f"{self.INFLUENCE_ZONE[1]}"),
+            defaultValue=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
         
         param = QgsProcessingParameterNumber(
             self.POREWP_REDUCTION_M[0],
@@ -376,7 +455,89 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         )
         param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
-        
+        param = QgsProcessingParameterString(
+            self.CONSOLIDATION_TIMES[0],
+            self.tr(f"{self.CONSOLIDATION_TIMES[1]}"),
+            defaultValue="",
+            optional=True,
+        )
+        param.setFlags(
+            QgsProcessingParameterDefinition.FlagAdvanced
+            | QgsProcessingParameterDefinition.FlagOptional
+        )
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.LOOKUP_TOLERANCE[0],
+            self.tr(f"{self.LOOKUP_TOLERANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=LOOKUP_TOLERANCE * 1000,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.ADAPTIVE_TOLERANCE[0],
+            self.tr(f"{self.ADAPTIVE_TOLERANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=0,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterBoolean(
+            self.USE_CACHE[0],
+            self.tr(f"{self.USE_CACHE[1]}"),
+            defaultValue=True,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.REUSE_DISTANCE_FIELD[0],
+            self.tr(f"{self.REUSE_DISTANCE_FIELD[1]}"),
+            defaultValue=True,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # UNCERTAINTY Advanced features
+        param = QgsProcessingParameterBoolean(
+            self.UNCERTAINTY[0],
+            self.tr(f"{self.UNCERTAINTY[1]}"),
+            defaultValue=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.N_SAMPLES[0],
+            self.tr(f"{self.N_SAMPLES[1]}"),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=500,
+            minValue=1,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterMatrix(
+            self.DISTRIBUTION_TABLE[0],
+            self.tr(f"{self.DISTRIBUTION_TABLE[1]}"),
+            numberRows=len(UNCERTAIN_PARAMETERS),
+            hasFixedNumberRows=False,
+            headers=DISTRIBUTION_TABLE_HEADERS,
+            defaultValue=DEFAULT_DISTRIBUTION_TABLE,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.RANDOM_SEED[0],
+            self.tr(f"{self.RANDOM_SEED[1]}"),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=None,
+            optional=True,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced | QgsProcessingParameterDefinition.FlagOptional)
+        self.addParameter(param)
+
         # We add the output definition
         self.addOutput(
             QgsProcessingOutputFile(
@@ -384,6 +545,80 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
                 self.tr("Output Raster impact map"),
             )
         )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_PERCENTILE_RASTER,
+                self.tr("Output Raster percentile bands (P10/P50/P90)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_TIME_RASTER,
+                self.tr("Output Raster consolidation times (one band per time)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_PREVIEW_RASTER,
+                self.tr("Output Raster preview (temporary)"),
+            )
+        )
+
+    def add_source_parameter(self):
+        """Adds the input layer of the excavation (or tunnel) polygons, named SOURCE_POLY."""
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.SOURCE_POLY,
+                self.tr("Input Excavation polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+
+    def add_short_term_parameters(self):
+        """Adds the parameters of the short term settlement curve."""
+        param = QgsProcessingParameterNumber(
+            self.EXCAVATION_DEPTH[0],
+            self.tr(f"{self.EXCAVATION_DEPTH[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=0,
+            minValue=0,
+        )
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.SETTLEMENT_ENUM[0],
+            self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
+            self.enum_settlment,
+            defaultValue=1,
+            allowMultiple=False,
+        )
+        self.addParameter(param)
+
+    def short_term_input(self, parameters, context):
+        """
+        Returns the parameters of the short term settlement curve, as passed to short_term_settlement().
+
+        Returns:
+            tuple: (excavation depth, curve name)
+        """
+        excavation_depth = self.parameterAsDouble(parameters, self.EXCAVATION_DEPTH[0], context)
+        short_term_curve = self.enum_settlment[self.parameterAsEnum(parameters, self.SETTLEMENT_ENUM[0], context)]
+        return excavation_depth, short_term_curve
+
+    def short_term_settlement(self, grid, cell_index, source_poly, near_dist, short_term):
+        """
+        Short term settlement of cells at a distance from the excavation.
+
+        Args:
+            grid (Grid): The impact map grid.
+            cell_index (np.ndarray): Flat indices of the cells in the grid.
+            source_poly (QgsVectorLayer): The excavation polygons, in the CRS of the grid.
+            near_dist (np.ndarray): Distance from the cells to the excavation.
+            short_term (tuple): The parameters of the curve, see short_term_input().
+        """
+        excavation_depth, short_term_curve = short_term
+        ratio, extent = short_term_curve_parameters(short_term_curve)
+        sv_short, _ = short_term_excavation(near_dist, excavation_depth, ratio, extent)
+        return sv_short
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -433,6 +668,14 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         consolidation_time = self.parameterAsInt(
             parameters, self.CONSOLIDATION_TIME[0], context
         )
+        try:
+            consolidation_times = parse_consolidation_times(
+                self.parameterAsString(parameters, self.CONSOLIDATION_TIMES[0], context)
+            )
+        except ValueError as e:
+            feedback.reportError(f"PROCESS - {e}")
+            return {}
+        self.logger.info(f"PROCESS - Additional consolidation times: {consolidation_times}")
 
         source_raster_rock_surface = self.parameterAsRasterLayer(
             parameters, self.RASTER_ROCK_SURFACE[0], context
@@ -447,27 +690,33 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         output_folder_path.mkdir(parents=True, exist_ok=True)
         self.logger.info(f"PROCESS - Output folder: {str(output_folder_path)}")
         feedback.setProgress(20)
+
+        preview_mode = self.parameterAsEnum(parameters, self.PREVIEW[0], context)
+        self.logger.info(f"PROCESS - Preview: {self.enum_preview[preview_mode]}")
+
+        #################  RESULT CACHE #################
+        # Previews are temporary and not cached. The full resolution result is the same with or
+        # without a preview, so the preview mode is not part of the key.
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE[0], context) and preview_mode != 1
+        if use_cache:
+            cache_key = self.getCacheKey(parameters, context, exclude=[self.PREVIEW[0]])
+            self.logger.info(f"PROCESS - Result cache key: {cache_key}")
+            cached_outputs = self.restoreCachedOutputs(cache_key, output_folder_path, self.logger)
+            if cached_outputs is not None:
+                feedback.pushInfo("PROCESS - Identical run found in the result cache. Reusing the cached outputs.")
+                self.define_layers_info(
+                    cached_outputs[self.OUTPUT_RASTER],
+                    cached_outputs.get(self.OUTPUT_PERCENTILE_RASTER),
+                    cached_outputs.get(self.OUTPUT_TIME_RASTER),
+                    len(consolidation_times),
+                )
+                feedback.setProgress(100)
+                return cached_outputs
+        # Temporary files and folder of the run, removed when the run is canceled
+        temp_files = [self.run_temp_folder]
+        check_canceled(feedback, temp_files, self.logger)
         ############### HANDELING OF INPUT RASTER ################
         if source_raster_rock_surface is not None:
-            ############### RASTER REPROJECT ################
-            if reproject_is_needed(source_raster_rock_surface, output_proj):
-                feedback.pushInfo(
-                    f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}, ORIGINAL CRS: {source_raster_rock_surface.crs().postgisSrid()}"
-                )
-                try:
-                    _, source_raster_rock_surface = reproject_layers(
-                        output_proj,
-                        vector_layer=None,
-                        raster_layer=source_raster_rock_surface,
-                        context=context,
-                        logger=self.logger,
-                    )
-                except Exception as e:
-                    feedback.reportError(
-                        f"Error during reprojection of RASTER LAYER: {e}"
-                    )
-                    return {}
-
             # Get the file path of the raster layer
             path_source_raster_rock_surface = (
                 source_raster_rock_surface.source().split("|")[0]
@@ -475,22 +724,18 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             self.logger.info(
                 f"PROCESS - Rock raster DTM File path: {path_source_raster_rock_surface}"
             )
-            # Check if the file extension is .tif
-            if path_source_raster_rock_surface.endswith(
-                ".tif"
-            ) or path_source_raster_rock_surface.endswith(".tiff"):
-                feedback.pushInfo("The raster layer is a TIFF file.")
-                # Continue processing...
-            else:
+            # Any GDAL raster (GeoTIFF, VRT mosaic, GeoPackage), the clip to the analysis window only reads that window
+            if not is_gdal_raster(path_source_raster_rock_surface):
                 feedback.reportError(
-                    "The raster layer is not a TIFF file. Convert it to TIF/TIFF!"
+                    f"The raster layer can not be read by GDAL: {path_source_raster_rock_surface}"
                 )
                 return {}
 
+        check_canceled(feedback, temp_files, self.logger)
         #################  CHECK INPUT PROJECTIONS OF VECTOR LAYERS #################
         # Retrive the parameter as vector layer
         source_excavation_poly = self.parameterAsVectorLayer(
-            parameters, self.INPUT_EXCAVATION_POLY, context
+            parameters, self.SOURCE_POLY, context
         )
         # Check if each layer matches the output CRS --> If False is returned, reproject the layers.
         if reproject_is_needed(source_excavation_poly, output_proj):
@@ -514,11 +759,79 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             f"PROCESS - Path to source excavation: {path_source_excavation_poly}"
         )
 
-        source_excavation_poly_as_json = get_shapefile_as_json_pyqgis(
-            source_excavation_poly, self.logger
+        ############### DTB WINDOW ################
+        # The window around the excavation is clipped and warped to the output CRS once, the preview
+        # and the full resolution grid are both resampled from it
+        window_extent = QgsRectangle(source_excavation_poly.extent())
+        window_extent.grow(clipping_range)
+        try:
+            dtb_window_path = prepare_dtb_window(
+                source_raster_rock_surface, window_extent, output_proj, output_proj, context=context, logger=self.logger
+            )
+        except QgsProcessingException as e:
+            check_canceled(feedback, temp_files, self.logger)
+            feedback.reportError(f"PROCESS - Error during preparation of the raster layer: {e}")
+            return {}
+        temp_files.append(dtb_window_path)
+        source_raster_rock_surface = QgsRasterLayer(str(dtb_window_path), "dtb_window_temp-raster")
+
+        short_term = None
+        if bShortterm:
+            self.logger.info("PROCESS - ######## SHORTTERM ########")
+            self.logger.info("PROCESS - Defining short term input")
+            short_term = self.short_term_input(parameters, context)
+
+        fixed = {
+            "dry_crust_thk": dry_crust_thk,
+            "dep_groundwater": dep_groundwater,
+            "density_sat": density_sat,
+            "ocr": ocr_value,
+            "janbu_ref_stress": janbu_ref_stress,
+            "janbu_const": janbu_const,
+            "janbu_m": janbu_m,
+        }
+        bInfluenceZone = self.parameterAsBoolean(parameters, self.INFLUENCE_ZONE[0], context)
+
+        lookup_tolerance = self.parameterAsDouble(parameters, self.LOOKUP_TOLERANCE[0], context) / 1000
+        adaptive_tolerance = self.parameterAsDouble(parameters, self.ADAPTIVE_TOLERANCE[0], context) / 1000
+        impact_map_args = dict(
+            source_excavation_poly=source_excavation_poly,
+            source_raster_rock_surface=source_raster_rock_surface,
+            clipping_range=clipping_range,
+            output_srid=output_srid,
+            porewp_red_m=porewp_red_m,
+            fixed=dict(fixed, consolidation_time=consolidation_time),
+            short_term=short_term,
+            lookup_tolerance=lookup_tolerance,
+            adaptive_tolerance=adaptive_tolerance,
+            temp_files=temp_files,
         )
-        # source_excavation_poly_as_json = Utils.getShapefileAsJson(path_source_excavation_poly, logger)
-        self.logger.info(f"PROCESS - JSON structure: {source_excavation_poly_as_json}")
+
+        #################### PREVIEW ###############################
+        check_canceled(feedback, temp_files, self.logger)
+        preview_raster_path = None
+        if preview_mode != 0:
+            try:
+                preview_raster_path = self.write_preview(
+                    feedback,
+                    context,
+                    preview_resolution=output_resolution * self.preview_factor,
+                    output_crs=output_proj,
+                    impact_map_args=impact_map_args,
+                    influence_zone_only=bInfluenceZone,
+                )
+            except (IOError, ValueError) as e:
+                feedback.reportError(f"PROCESS - Preview failed: {e}")
+                return {}
+            if preview_raster_path is None:
+                return {}
+            if preview_mode == 1:
+                self.define_layers_info(None, preview_raster_path=preview_raster_path)
+                feedback.setProgress(100)
+                feedback.pushInfo("PROCESS - Finished preview!")
+                return {self.OUTPUT_PREVIEW_RASTER: preview_raster_path}
+            temp_files.append(preview_raster_path)
+            feedback.pushInfo("PROCESS - Continuing with the full resolution...")
 
         feedback.pushInfo("PROCESS - Running process_raster_for_impactmap...")
         path_processed_raster = process_raster_for_impactmap(
@@ -530,23 +843,127 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             output_crs=output_proj,
             context=context,
             logger=self.logger,
+            read_overviews=False,
         )
+        temp_files.append(path_processed_raster)
+        check_canceled(feedback, temp_files, self.logger)
         feedback.pushInfo("PROCESS - Done running process_raster_for_impactmap...")
         feedback.setProgress(30)
-        if bShortterm:
-            self.logger.info("PROCESS - ######## SHORTTERM ########")
-            self.logger.info("PROCESS - Defining short term input")
-            excavation_depth = self.parameterAsDouble(
-                parameters, self.EXCAVATION_DEPTH[0], context
+        #################### CELLS OF THE VECTORIZED ENGINE ###############################
+        bUncertainty = self.parameterAsBoolean(parameters, self.UNCERTAINTY[0], context)
+        cells = None
+        if (
+            self.needs_cells(path_processed_raster, bInfluenceZone, lookup_tolerance, adaptive_tolerance)
+            or bUncertainty
+            or consolidation_times
+        ):
+            # The grid, the distance field and the short term settlements are shared by all outputs
+            cells = self.prepare_cells(
+                feedback,
+                source_excavation_poly,
+                path_processed_raster,
+                short_term=short_term,
+                clipping_range=clipping_range
+                if self.parameterAsBoolean(parameters, self.REUSE_DISTANCE_FIELD[0], context)
+                else None,
+                influence_range=clipping_range if bInfluenceZone else None,
+                progress=self.progressCallback(feedback, 30, 0, temp_files, self.logger),
             )
-            short_term_curve_index = self.parameterAsEnum(
-                parameters, self.SETTLEMENT_ENUM[0], context
+
+        feedback.setProgress(50)
+        check_canceled(feedback, temp_files, self.logger)
+        try:
+            output_raster_path = self.compute_impact_map(
+                feedback,
+                context,
+                cells,
+                dict(impact_map_args, path_processed_raster=path_processed_raster, output_folder_path=output_folder_path),
+                influence_zone_only=bInfluenceZone,
             )
-            short_term_curve = self.enum_settlment[short_term_curve_index]
+        except (IOError, ValueError) as e:
+            feedback.reportError(f"PROCESS - Influence zone failed: {e}")
+            return {}
+        if output_raster_path is None:
+            return {}
 
-        else:
-            excavation_depth = None
-            short_term_curve = None
+        #################### UNCERTAINTY AND TIME BANDS ###############################
+        # The core calculation can not be interrupted, a run canceled meanwhile stops before the bands are computed
+        check_canceled(feedback, temp_files, self.logger)
+        feedback.setProgress(70)
+        outputs = {self.OUTPUT_RASTER: output_raster_path}
+        if bUncertainty:
+            try:
+                outputs[self.OUTPUT_PERCENTILE_RASTER] = self.write_percentile_bands(
+                    parameters,
+                    context,
+                    feedback,
+                    cells=cells,
+                    output_path=output_folder_path / f"{self.feature_name}-IMPACT-MAP-PERCENTILES.tif",
+                    porewp_red_m=porewp_red_m,
+                    fixed=dict(fixed, consolidation_time=consolidation_time),
+                    lookup_tolerance=lookup_tolerance,
+                    adaptive_tolerance=adaptive_tolerance,
+                    temp_files=temp_files,
+                )
+            except ValueError as e:
+                feedback.reportError(f"PROCESS - Invalid uncertainty input: {e}")
+                return {}
+        if consolidation_times:
+            outputs[self.OUTPUT_TIME_RASTER] = self.write_time_bands(
+                feedback,
+                cells=cells,
+                output_path=output_folder_path / f"{self.feature_name}-IMPACT-MAP-TIMES.tif",
+                porewp_red_m=porewp_red_m,
+                fixed=fixed,
+                consolidation_times=consolidation_times,
+                lookup_tolerance=lookup_tolerance,
+                adaptive_tolerance=adaptive_tolerance,
+                temp_files=temp_files,
+            )
+
+        #################### HANDLE THE RESULT ###############################
+        feedback.setProgress(90)
+        self.logger.info(f"PROCESS - OUTPUT RASTER: {output_raster_path}")
+        feedback.pushInfo("PROCESS - Finished with processing!")
+
+        if use_cache:
+            self.storeCachedOutputs(cache_key, outputs, self.logger)
+        if preview_raster_path is not None:
+            outputs[self.OUTPUT_PREVIEW_RASTER] = preview_raster_path
+
+        self.define_layers_info(
+            output_raster_path,
+            outputs.get(self.OUTPUT_PERCENTILE_RASTER),
+            outputs.get(self.OUTPUT_TIME_RASTER),
+            len(consolidation_times),
+            preview_raster_path,
+        )
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        # Return the results of the algorithm.
+        return outputs
+
+    def write_impact_map(self, feedback, source_excavation_poly, source_raster_rock_surface, path_processed_raster,
+                         output_folder_path, clipping_range, output_srid, porewp_red_m, fixed, short_term, temp_files):
+        """
+        Computes the total settlement raster of the impact map with the REMEDY core.
+
+        Args:
+            source_excavation_poly (QgsVectorLayer): The excavation, in the output CRS.
+            source_raster_rock_surface (QgsRasterLayer): The depth to bedrock input.
+            path_processed_raster (Path): The depth to bedrock, clipped and resampled to the impact map grid.
+            fixed (dict): The soil parameters and the consolidation time.
+            short_term (tuple or None): See short_term_input().
+
+        Returns:
+            str: The path of the raster, or None if the calculation failed.
+        """
+        source_excavation_poly_as_json = get_shapefile_as_json_pyqgis(
+            source_excavation_poly, self.logger
+        )
+        self.logger.info(f"PROCESS - JSON structure: {source_excavation_poly_as_json}")
+        excavation_depth, short_term_curve = short_term if short_term is not None else (None, None)
 
         #################  LOG PROJECTIONS #################
         feedback.pushInfo(
@@ -565,78 +982,551 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         feedback.pushInfo(f"PROCESS - PARAM CALCULATION_RANGE: {clipping_range}")
         feedback.pushInfo(f"PROCESS - PARAM output_proj: {output_srid}")
         feedback.pushInfo(f"PROCESS - PARAM dtb_raster: {str(path_processed_raster)}")
-        feedback.pushInfo(f"PROCESS - PARAM dry_crust_thk: {dry_crust_thk}")
-        feedback.pushInfo(f"PROCESS - PARAM dep_groundwater: {dep_groundwater}")
-        feedback.pushInfo(f"PROCESS - PARAM density_sat: {density_sat}")
-        feedback.pushInfo(f"PROCESS - PARAM OCR: {ocr_value}")
+        feedback.pushInfo(f"PROCESS - PARAM dry_crust_thk: {fixed['dry_crust_thk']}")
+        feedback.pushInfo(f"PROCESS - PARAM dep_groundwater: {fixed['dep_groundwater']}")
+        feedback.pushInfo(f"PROCESS - PARAM density_sat: {fixed['density_sat']}")
+        feedback.pushInfo(f"PROCESS - PARAM OCR: {fixed['ocr']}")
         feedback.pushInfo(f"PROCESS - PARAM porewp_red_m: {porewp_red_m}")
-        feedback.pushInfo(f"PROCESS - PARAM janbu_ref_stress: {janbu_ref_stress}")
-        feedback.pushInfo(f"PROCESS - PARAM janbu_const: {janbu_const}")
-        feedback.pushInfo(f"PROCESS - PARAM janbu_m: {janbu_m}")
-        feedback.pushInfo(f"PROCESS - PARAM consolidation_time: {consolidation_time}")
-        feedback.pushInfo(f"PROCESS - PARAM bShortterm: {bShortterm}")
+        feedback.pushInfo(f"PROCESS - PARAM janbu_ref_stress: {fixed['janbu_ref_stress']}")
+        feedback.pushInfo(f"PROCESS - PARAM janbu_const: {fixed['janbu_const']}")
+        feedback.pushInfo(f"PROCESS - PARAM janbu_m: {fixed['janbu_m']}")
+        feedback.pushInfo(f"PROCESS - PARAM consolidation_time: {fixed['consolidation_time']}")
+        feedback.pushInfo(f"PROCESS - PARAM bShortterm: {short_term is not None}")
         feedback.pushInfo(f"PROCESS - PARAM excavation_depth: {excavation_depth}")
         feedback.pushInfo(f"PROCESS - PARAM short_term_curve: {short_term_curve}")
         feedback.pushInfo("PROCESS - Running mainBegrensSkade_ImpactMap...")
         self.logger.info("PROCESS - Running mainBegrensSkade_ImpactMap...")
-        feedback.setProgress(50)
+        dataset = gdal.Open(str(path_processed_raster))
+        n_cells = dataset.RasterXSize * dataset.RasterYSize if dataset is not None else None
+        dataset = None
         try:
-            output_raster_path = mainBegrensSkade_ImpactMap(
-                logger=self.logger,
-                excavationJson=source_excavation_poly_as_json,
-                output_ws=str(output_folder_path),
-                output_name=self.feature_name,
-                CALCULATION_RANGE=clipping_range,  # '380' hardcoded constant used in the underlying submodule's method.
-                output_proj=output_srid,
-                dtb_raster=str(path_processed_raster),
-                dry_crust_thk=dry_crust_thk,
-                dep_groundwater=dep_groundwater,
-                density_sat=density_sat,
-                OCR=ocr_value,
-                porewp_red_m=porewp_red_m,
-                janbu_ref_stress=janbu_ref_stress,
-                janbu_const=janbu_const,
-                janbu_m=janbu_m,
-                consolidation_time=consolidation_time,
-                bShortterm=bShortterm,
-                excavation_depth=excavation_depth,
-                short_term_curve=short_term_curve,
+            output_raster_path = self.runCore(
+                mainBegrensSkade_ImpactMap,
+                dict(
+                    logger=self.logger,
+                    excavationJson=source_excavation_poly_as_json,
+                    output_ws=str(output_folder_path),
+                    output_name=self.feature_name,
+                    CALCULATION_RANGE=clipping_range,  # '380' hardcoded constant used in the underlying submodule's method.
+                    output_proj=output_srid,
+                    dtb_raster=str(path_processed_raster),
+                    dry_crust_thk=fixed["dry_crust_thk"],
+                    dep_groundwater=fixed["dep_groundwater"],
+                    density_sat=fixed["density_sat"],
+                    OCR=fixed["ocr"],
+                    porewp_red_m=porewp_red_m,
+                    janbu_ref_stress=fixed["janbu_ref_stress"],
+                    janbu_const=fixed["janbu_const"],
+                    janbu_m=fixed["janbu_m"],
+                    consolidation_time=fixed["consolidation_time"],
+                    bShortterm=short_term is not None,
+                    excavation_depth=excavation_depth,
+                    short_term_curve=short_term_curve,
+                ),
+                feedback,
+                50,
+                20,
+                temp_files,
+                total=n_cells,
+                unit="cells",
             )
             feedback.pushInfo("PROCESS - Finished with mainBegrensSkade_ImpactMap...")
             self.logger.info("PROCESS - Finished with mainBegrensSkade_ImpactMap...")
+        except QgsProcessingException:
+            # Canceled from the progress callback of a core that reports its progress
+            raise
         except Exception as e:
             error_msg = f"Unexpected error: {e}\nTraceback:\n{traceback.format_exc()}"
             QgsMessageLog.logMessage(error_msg, level=Qgis.Critical)
             feedback.reportError(error_msg)
-            return {}
+            return None
+        return output_raster_path
 
-        #################### HANDLE THE RESULT ###############################
-        feedback.setProgress(80)
-        self.logger.info(f"PROCESS - OUTPUT RASTER: {output_raster_path}")
-        feedback.pushInfo("PROCESS - Finished with processing!")
+    def needs_cells(self, dtb_raster_path, influence_zone_only, lookup_tolerance, adaptive_tolerance=0):
+        """
+        Returns True if the impact map of a grid is computed from its cells, see prepare_cells():
+        with VECTORIZED_ENGINE, on the influence zone, adaptively or from a lookup table. A lookup
+        table needs LOOKUP_MIN_POINTS cells, smaller grids are computed by the REMEDY core directly.
+        """
+        if self.VECTORIZED_ENGINE or influence_zone_only or adaptive_tolerance:
+            return True
+        if not lookup_tolerance:
+            return False
+        dataset = gdal.Open(str(dtb_raster_path))
+        n_cells = dataset.RasterXSize * dataset.RasterYSize if dataset is not None else 0
+        dataset = None
+        return n_cells >= LOOKUP_MIN_POINTS
+
+    def compute_impact_map(self, feedback, context, cells, impact_map_args, influence_zone_only=False):
+        """
+        Computes the total settlement raster of a grid, on the whole grid or on the windows of the
+        influence zone. The preview and the full resolution run both go through here, so they only
+        differ by their grid.
+
+        With a lookup table that meets its error bound (see lookup_table()), the cells are
+        interpolated from the table by the vectorized engine. With an adaptive tolerance, the
+        vectorized engine evaluates the cells on a quadtree, see evaluate_cells(). Otherwise the
+        REMEDY core evaluates every cell, unless the algorithm has VECTORIZED_ENGINE.
+
+        Args:
+            cells (tuple or None): The grid and cell values, see prepare_cells(). Needed when
+                needs_cells() is True, otherwise None.
+            impact_map_args (dict): The keyword arguments of write_impact_map(), and the
+                lookup_tolerance and adaptive_tolerance.
+            influence_zone_only (bool): Only compute the cells of the influence zone.
+
+        Returns:
+            str: The path of the raster, or None if the calculation failed.
+
+        Raises:
+            IOError, ValueError: See write_zone_impact_map().
+        """
+        impact_map_args = dict(impact_map_args)
+        lookup_tolerance = impact_map_args.pop("lookup_tolerance")
+        adaptive_tolerance = impact_map_args.pop("adaptive_tolerance")
+        table = None
+        if cells is not None and lookup_tolerance:
+            soil = {name: value for name, value in impact_map_args["fixed"].items() if name != "consolidation_time"}
+            table = self.lookup_table(feedback, cells, impact_map_args["porewp_red_m"], soil, lookup_tolerance)
+        if self.VECTORIZED_ENGINE or table is not None or adaptive_tolerance:
+            return self.write_engine_impact_map(
+                feedback,
+                cells,
+                table,
+                adaptive_tolerance,
+                **{name: impact_map_args[name] for name in ("output_folder_path", "porewp_red_m", "fixed", "temp_files")},
+            )
+        if lookup_tolerance:
+            feedback.pushInfo("PROCESS - No lookup table for this grid, every cell is computed by the REMEDY core")
+        if influence_zone_only:
+            return self.write_zone_impact_map(feedback, context, cells, impact_map_args)
+        return self.write_impact_map(feedback, **impact_map_args)
+
+    def write_engine_impact_map(self, feedback, cells, table, adaptive_tolerance, output_folder_path, porewp_red_m,
+                                fixed, temp_files):
+        """
+        Computes the total settlement raster of the impact map with the vectorized settlement engine.
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells().
+            table (LongTermTable or None): The long term lookup table, see lookup_table(). None
+                evaluates the cells exactly.
+            adaptive_tolerance (float): Tolerance of the adaptive refinement [m], 0 to evaluate every cell.
+            porewp_red_m (float): Porewater pressure reduction at the source.
+            fixed (dict): The soil parameters and the consolidation time.
+
+        Returns:
+            str: The path of the raster.
+        """
+        feedback.pushInfo(f"PROCESS - PARAM porewp_red_m: {porewp_red_m}")
+        feedback.pushInfo(f"PROCESS - PARAM long term: {fixed}")
+        feedback.pushInfo("PROCESS - Running the vectorized impact map...")
+        self.logger.info("PROCESS - Running the vectorized impact map...")
+        fixed = dict(fixed)
+        consolidation_time = fixed.pop("consolidation_time")
+        grid, index = cells[:2]
+        settlements = self.evaluate_cells(
+            feedback,
+            cells,
+            lambda dtb, near_dist, sv_short: long_term_time_cells(
+                dtb, near_dist, sv_short, porewp_red_m, fixed, [consolidation_time],
+                # With adaptive refinement the chunks are not the whole grid, the callback only checks for cancellation
+                progress=self.progressCallback(
+                    feedback, 50, 0 if adaptive_tolerance else 20, temp_files, self.logger,
+                    total=None if adaptive_tolerance else len(cells[2]), unit="cells",
+                ),
+                table=table,
+            ),
+            adaptive_tolerance,
+        )
+        output_raster_path = write_grid(
+            Path(output_folder_path) / f"{self.feature_name}-{self.IMPACT_MAP_NAME}.tif",
+            [settlements[0]],
+            grid.geotransform,
+            grid.projection,
+            descriptions=["Total settlement [m]"],
+            sparse=index is not None,
+        )
+        feedback.pushInfo("PROCESS - Finished with the vectorized impact map...")
+        self.logger.info("PROCESS - Finished with the vectorized impact map...")
+        return output_raster_path
+
+    def write_zone_impact_map(self, feedback, context, cells, impact_map_args):
+        """
+        Computes the impact map of the influence zone only. The REMEDY core takes a rectangular
+        depth to bedrock raster, so it runs on the windows of the grid that cover the zone (see
+        gridlib.zone_windows()), each cut from the processed raster without resampling. The windows
+        are put together on the full grid, and the cells outside of the zone are written as nodata.
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells() with an influence range.
+            impact_map_args (dict): The keyword arguments of write_impact_map() for the full grid.
+
+        Returns:
+            str: The path of the raster, or None if the calculation failed.
+
+        Raises:
+            IOError: If a window can not be written or read.
+            ValueError: If the core returns a raster of another size than its window.
+        """
+        grid, index = cells[:2]
+        windows = zone_windows(index, grid.shape)
+        n_window_cells = sum(n_rows * n_cols for _, _, n_rows, n_cols in windows)
+        feedback.pushInfo(
+            f"PROCESS - Influence zone: {len(index)} cells in {len(windows)} windows of {n_window_cells} cells, "
+            f"the full grid has {grid.values.size} cells"
+        )
+        temp_files = impact_map_args["temp_files"]
+        temp_folder = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context)
+        settlements = np.full(grid.shape, np.nan)
+        output_name = f"{self.feature_name}-IMPACT-MAP.tif"
+        for number, (r0, c0, n_rows, n_cols) in enumerate(windows):
+            check_canceled(feedback, temp_files, self.logger)
+            window_folder = temp_folder / f"zone_{Path(impact_map_args['path_processed_raster']).stem}_{number}"
+            window_folder.mkdir(parents=True, exist_ok=True)
+            window_raster = window_folder / "zone_temp-raster.tif"
+            temp_files.append(window_raster)
+            if gdal.Translate(str(window_raster), str(impact_map_args["path_processed_raster"]),
+                              srcWin=[c0, r0, n_cols, n_rows]) is None:
+                raise IOError(f"Could not write the window {number} of the influence zone: {window_raster}")
+            window_output = self.write_impact_map(
+                feedback, **dict(impact_map_args, path_processed_raster=window_raster, output_folder_path=window_folder)
+            )
+            if window_output is None:
+                return None
+            temp_files.append(window_output)
+            output_name = Path(window_output).name
+            values = read_grid(window_output).values
+            if values.shape != (n_rows, n_cols):
+                raise ValueError(f"The impact map of window {number} has {values.shape} cells, expected {(n_rows, n_cols)}")
+            settlements[r0:r0 + n_rows, c0:c0 + n_cols] = values
+        # The windows are rectangles, cells outside of the zone get nodata
+        settlements = expand_cells(settlements.ravel()[index], index, grid.shape)
+        return write_grid(
+            Path(impact_map_args["output_folder_path"]) / output_name,
+            [settlements],
+            grid.geotransform,
+            grid.projection,
+            sparse=True,
+        )
 
+    def prepare_cells(self, feedback, source_excavation_poly, dtb_raster_path, short_term, clipping_range=None,
+                      influence_range=None, progress=None):
+        """
+        Reads the impact map grid and computes what every cell needs besides the long term
+        parameters: the depth to bedrock, the distance to the excavation and the short term settlement.
+        With an influence range, only the cells within that distance of the excavation are kept.
+
+        Args:
+            source_excavation_poly (QgsVectorLayer): The excavation, in the CRS of the grid.
+            dtb_raster_path (Path): The depth to bedrock, clipped and resampled to the impact map grid.
+            short_term (tuple or None): (excavation depth, curve name), or None without short term settlements.
+            clipping_range (int, optional): The clipping range of the grid. If given, the distances are
+                a distance transform stored in (or loaded from) the distance cache, otherwise they are
+                computed exactly.
+            influence_range (float, optional): Keep only the cells within this distance of the excavation.
+            progress (callable, optional): Progress callback of the distance computation.
+
+        Returns:
+            tuple: (Grid, index, dtb, near_dist, sv_short), the values of the kept cells row by row,
+                and their flat indices in the grid (None if all cells are kept).
+        """
+        grid = read_grid(dtb_raster_path)
+        segments = polygon_segments(source_excavation_poly)
+        if clipping_range is None:
+            near_dist = distance_field(grid, segments, progress=progress).ravel()
+        else:
+            geometries_wkb = [feature.geometry().asWkb() for feature in source_excavation_poly.getFeatures()]
+            distance, cached = cached_distance_field(
+                grid, geometries_wkb, segments, clipping_range, self.logger, progress=progress
+            )
+            near_dist = distance.ravel()
+            message = "Loaded the cached" if cached else "Computed and cached the"
+            feedback.pushInfo(f"PROCESS - {message} distance field of {grid.shape[0]} x {grid.shape[1]} cells")
+            self.logger.info(f"PROCESS - {message} distance field of {grid.shape[0]} x {grid.shape[1]} cells")
+        dtb = grid.values.ravel()
+        index = None
+        if influence_range is not None:
+            index = influence_zone(near_dist, influence_range)
+            dtb, near_dist = dtb[index], np.asarray(near_dist[index], dtype=float)
+            message = f"PROCESS - Influence zone: {len(index)} of {grid.values.size} cells are computed"
+            feedback.pushInfo(message)
+            self.logger.info(message)
+        sv_short = np.zeros(near_dist.shape)
+        if short_term is not None:
+            cell_index = index if index is not None else np.arange(grid.values.size)
+            sv_short = self.short_term_settlement(grid, cell_index, source_excavation_poly, near_dist, short_term)
+        return grid, index, dtb, near_dist, sv_short
+
+    def lookup_table(self, feedback, cells, porewp_red_m, soil, lookup_tolerance):
+        """
+        Builds the long term lookup table of the impact map cells, or returns None to evaluate the
+        cells exactly (no tolerance, too few cells, or the tolerance is not reached).
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells().
+            porewp_red_m (float): Porewater pressure reduction at the excavation.
+            soil (dict): The soil parameters, see settlementlib.LongTermTable.
+            lookup_tolerance (float): The error bound [m], 0 for no table.
+        """
+        if not lookup_tolerance:
+            return None
+        _, _, dtb, near_dist, _ = cells
+        table, max_error = long_term_table_cells(dtb, near_dist, porewp_red_m, soil, lookup_tolerance)
+        if table is None:
+            self.logger.info("PROCESS - Long term settlements are evaluated exactly")
+            return None
+        message = (
+            f"PROCESS - Long term lookup table of {table.shape[0]} x {table.shape[1]} nodes, "
+            f"checked error {max_error * 1000:.3f} mm"
+        )
+        feedback.pushInfo(message)
+        self.logger.info(message)
+        return table
+
+    def evaluate_cells(self, feedback, cells, evaluate, adaptive_tolerance=0):
+        """
+        Evaluates bands of values for the impact map cells, at every cell or adaptively.
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells().
+            evaluate (callable): Called with (dtb, near_dist, sv_short) of some cells, returns the
+                values (n_bands, n_cells) of these cells.
+            adaptive_tolerance (float): The tolerance of the adaptive refinement [m], see
+                gridlib.adaptive_cells(). 0 evaluates every cell.
+
+        Returns:
+            np.ndarray: (n_bands, rows, cols), NaN at cells without value.
+        """
+        grid, index, dtb, near_dist, sv_short = cells
+        if not adaptive_tolerance:
+            return expand_cells(evaluate(dtb, near_dist, sv_short), index, grid.shape)
+        # The quadtree runs on the full grid, cells outside of the influence zone have no data
+        dtb, near_dist, sv_short = [expand_cells(values, index, grid.shape).ravel() for values in cells[2:]]
+        values, n_evaluated = adaptive_cells(
+            lambda cell_index: evaluate(dtb[cell_index], near_dist[cell_index], sv_short[cell_index]),
+            grid.shape,
+            adaptive_tolerance,
+            valid=~np.isnan(dtb),
+        )
+        message = f"PROCESS - Adaptive refinement: {n_evaluated} of {grid.values.size} cells evaluated"
+        feedback.pushInfo(message)
+        self.logger.info(message)
+        return values.reshape((-1,) + grid.shape)
+
+    def write_percentile_bands(self, parameters, context, feedback, cells, output_path, porewp_red_m, fixed,
+                               lookup_tolerance=0, adaptive_tolerance=0, temp_files=()):
+        """
+        Samples the uncertain soil parameters and writes the P10/P50/P90 total settlement of every
+        cell of the impact map grid to a three band raster.
+
+        The distance field and the depth to bedrock are computed once, and reused for every sample.
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells().
+            porewp_red_m (float): Porewater pressure reduction at the excavation.
+            fixed (dict): The deterministic long term parameters, see settlementlib.long_term_settlement().
+            lookup_tolerance (float): Error bound of the long term lookup table [m], 0 to evaluate exactly.
+            adaptive_tolerance (float): Tolerance of the adaptive refinement [m], 0 to evaluate every cell.
+            temp_files (list): Temporary files of the run, removed when the run is canceled.
+
+        Returns:
+            str: The path to the written raster.
+        """
+        n_samples = self.parameterAsInt(parameters, self.N_SAMPLES[0], context)
+        seed = None
+        if parameters.get(self.RANDOM_SEED[0]) is not None:
+            seed = self.parameterAsInt(parameters, self.RANDOM_SEED[0], context)
+        distributions = parse_distribution_table(
+            self.parameterAsMatrix(parameters, self.DISTRIBUTION_TABLE[0], context),
+            list(UNCERTAIN_PARAMETERS),
+        )
+        drawn = draw_samples(distributions, n_samples, seed)
+        samples = {UNCERTAIN_PARAMETERS[name]: values for name, values in drawn.items()}
+        fixed = {name: value for name, value in fixed.items() if name not in samples}
+        for name, distribution in distributions.items():
+            feedback.pushInfo(f"PROCESS - UNCERTAINTY {name}: {distribution}")
+        self.logger.info(f"PROCESS - UNCERTAINTY: {n_samples} samples of {distributions}")
+
+        grid, index = cells[:2]
+        soil = {name: value for name, value in fixed.items() if name != "consolidation_time"}
+        soil.update(samples)
+        table = self.lookup_table(feedback, cells, porewp_red_m, soil, lookup_tolerance)
+        percentiles = self.evaluate_cells(
+            feedback,
+            cells,
+            lambda dtb, near_dist, sv_short: long_term_percentile_cells(
+                dtb, near_dist, sv_short, porewp_red_m, samples, fixed, PERCENTILES,
+                # With adaptive refinement the chunks are not the whole grid, the callback only checks for cancellation
+                progress=self.progressCallback(
+                    feedback, 70, 0 if adaptive_tolerance else 10, temp_files, self.logger,
+                    total=None if adaptive_tolerance else len(cells[2]), unit="cells",
+                ),
+                table=table,
+            ),
+            adaptive_tolerance,
+        )
+        output_path = write_grid(
+            output_path,
+            list(percentiles),
+            grid.geotransform,
+            grid.projection,
+            descriptions=[f"P{p} total settlement [m]" for p in PERCENTILES],
+            sparse=index is not None,
+        )
+        feedback.pushInfo(f"PROCESS - Percentile bands written to {output_path}")
+        return output_path
+
+    def write_time_bands(self, feedback, cells, output_path, porewp_red_m, fixed, consolidation_times,
+                         lookup_tolerance=0, adaptive_tolerance=0, temp_files=()):
+        """
+        Writes the total settlement of every cell of the impact map grid at every consolidation
+        time, one band per time in increasing order.
+
+        Args:
+            cells (tuple): The grid and cell values, see prepare_cells().
+            porewp_red_m (float): Porewater pressure reduction at the excavation.
+            fixed (dict): The long term parameters, see settlementlib.final_long_term_settlement().
+            consolidation_times (list): Consolidation times [years].
+            lookup_tolerance (float): Error bound of the long term lookup table [m], 0 to evaluate exactly.
+            adaptive_tolerance (float): Tolerance of the adaptive refinement [m], 0 to evaluate every cell.
+            temp_files (list): Temporary files of the run, removed when the run is canceled.
+
+        Returns:
+            str: The path to the written raster.
+        """
+        self.logger.info(f"PROCESS - CONSOLIDATION TIMES: {consolidation_times}")
+        grid, index = cells[:2]
+        table = self.lookup_table(feedback, cells, porewp_red_m, fixed, lookup_tolerance)
+        settlements = self.evaluate_cells(
+            feedback,
+            cells,
+            lambda dtb, near_dist, sv_short: long_term_time_cells(
+                dtb, near_dist, sv_short, porewp_red_m, fixed, consolidation_times,
+                progress=self.progressCallback(
+                    feedback, 80, 0 if adaptive_tolerance else 10, temp_files, self.logger,
+                    total=None if adaptive_tolerance else len(cells[2]), unit="cells",
+                ),
+                table=table,
+            ),
+            adaptive_tolerance,
+        )
+        output_path = write_grid(
+            output_path,
+            list(settlements),
+            grid.geotransform,
+            grid.projection,
+            descriptions=[f"Total settlement after {time_label(time)} years [m]" for time in consolidation_times],
+            sparse=index is not None,
+        )
+        feedback.pushInfo(f"PROCESS - Consolidation time bands written to {output_path}")
+        return output_path
+
+    def write_preview(self, feedback, context, preview_resolution, output_crs, impact_map_args, influence_zone_only=False):
+        """
+        Computes the total settlement on a coarse grid with the same core as the full resolution
+        run, and writes it to the Processing temporary folder.
+
+        The preview grid is resampled from the depth to bedrock window of the run, so the window is
+        clipped and warped once for the preview and the full resolution.
+
+        Args:
+            preview_resolution (float): The grid size of the preview [m].
+            impact_map_args (dict): The keyword arguments of write_impact_map() shared with the full
+                resolution run, without the grid and the output folder.
+            influence_zone_only (bool): Only compute the cells within the clipping range of the excavation.
+
+        Returns:
+            str: The path to the written raster, or None if the calculation failed.
+        """
+        feedback.pushInfo(f"PROCESS - Preview on a {preview_resolution} m grid...")
+        temp_folder = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context)
+        temp_files = impact_map_args["temp_files"]
+        preview_dtb_path = process_raster_for_impactmap(
+            source_excavation_poly=impact_map_args["source_excavation_poly"],
+            dtb_raster_layer=impact_map_args["source_raster_rock_surface"],
+            clipping_range=impact_map_args["clipping_range"],
+            output_resolution=preview_resolution,
+            output_folder=temp_folder,
+            output_crs=output_crs,
+            context=context,
+            logger=self.logger,
+            file_prefix="preview_",
+            read_overviews=False,
+        )
+        temp_files.append(preview_dtb_path)
+        cells = None
+        if self.needs_cells(
+            preview_dtb_path, influence_zone_only, impact_map_args["lookup_tolerance"], impact_map_args["adaptive_tolerance"]
+        ):
+            cells = self.prepare_cells(
+                feedback,
+                impact_map_args["source_excavation_poly"],
+                preview_dtb_path,
+                impact_map_args["short_term"],
+                influence_range=impact_map_args["clipping_range"] if influence_zone_only else None,
+                progress=self.progressCallback(feedback, 20, 0, temp_files, self.logger),
+            )
+        output_path = self.compute_impact_map(
+            feedback,
+            context,
+            cells,
+            dict(impact_map_args, path_processed_raster=preview_dtb_path, output_folder_path=temp_folder),
+            influence_zone_only=influence_zone_only,
+        )
+        if output_path is None:
+            return None
+        # The temporary folder of the run is removed at its end, the preview layer outlives the run
+        preview_path = Path(QgsProcessingUtils.generateTempFilename(f"{self.feature_name}-IMPACT-MAP-PREVIEW.tif"))
+        move_file_components(Path(output_path), preview_path)
+        feedback.pushInfo(f"PROCESS - Preview written to {preview_path}")
+        self.logger.info(f"PROCESS - Preview written to {preview_path}")
+        return str(preview_path)
+
+    def define_layers_info(self, output_raster_path, percentile_raster_path=None, time_raster_path=None, n_times=0,
+                           preview_raster_path=None):
+        """
+        Defines which output layers postProcessAlgorithm adds to the project, and their styles.
+        """
         # Path to the "styles" directory
-        self.styles_dir_path = Path(__file__).resolve().parent.parent / "styles"
-        self.logger.info(f"RESULTS - Styles directory path: {self.styles_dir_path}")
+        self.logger.info(f"RESULTS - Styles directory path: {self.STYLES_DIR}")
 
-        self.layers_info = {
-            "IMPACT-MAP": {
+        self.layers_info = {}
+        if preview_raster_path is not None:
+            self.layers_info["IMPACT-MAP-PREVIEW"] = {
+                "shape_path": preview_raster_path,
+                "style_name": "IMPACT-MAP.qml",
+            }
+        if output_raster_path is not None:
+            self.layers_info["IMPACT-MAP"] = {
                 "shape_path": output_raster_path,
                 "style_name": "IMPACT-MAP.qml",
             }
-        }
-
-        feedback.setProgress(100)
-        feedback.pushInfo("PROCESS - Finished processing!")
-        # Return the results of the algorithm.
-        return {self.OUTPUT_RASTER: output_raster_path}
+        if percentile_raster_path is not None:
+            # The style is applied to the P90 band
+            self.layers_info["IMPACT-MAP-P90"] = {
+                "shape_path": percentile_raster_path,
+                "style_name": "IMPACT-MAP.qml",
+                "band": PERCENTILES.index(90) + 1,
+            }
+        if time_raster_path is not None and n_times:
+            # The style is applied to the band of the longest time
+            self.layers_info["IMPACT-MAP-TIMES"] = {
+                "shape_path": time_raster_path,
+                "style_name": "IMPACT-MAP.qml",
+                "band": n_times,
+            }
 
     def postProcessAlgorithm(self, context, feedback):
         """
         After processAlgorithm finishes, load the produced raster (output_raster_path),
         apply a QML style, and place it into a custom group in the TOC.
         """
+        self.removeRunTempFolder(context)
         project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
         root = project.layerTreeRoot()
 
         # 1) Define or find the group at the top level
@@ -650,7 +1540,7 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
         for layer_label, layer_info in self.layers_info.items():
             raster_path = layer_info["shape_path"]
             style_name = layer_info["style_name"]
-            style_path = self.styles_dir_path / style_name
+            style_path = self.STYLES_DIR / style_name
 
             # Build a unique name with timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M")
@@ -666,12 +1556,19 @@ class BegrensSkadeImpactMap(GvBaseProcessingAlgorithms):
             # Attempt to load a QML style (if it references valid raster symbology)
             if style_path.is_file():
                 raster_layer.loadNamedStyle(str(style_path))
+                band = layer_info.get("band")
+                if band is not None:
+                    renderer = raster_layer.renderer()
+                    if hasattr(renderer, "setInputBand"):
+                        renderer.setInputBand(band)
+                    elif hasattr(renderer, "setBand"):
+                        renderer.setBand(band)
                 raster_layer.triggerRepaint()
             else:
                 feedback.reportError(f"Style file not found: {style_path}")
 
             # Add the layer to the project, but do *not* place it in the root
-            QgsProject.instance().addMapLayer(raster_layer, False)
+            project.addMapLayer(raster_layer, False)
 
             # Insert it in our custom group
             group.insertLayer(0, raster_layer)
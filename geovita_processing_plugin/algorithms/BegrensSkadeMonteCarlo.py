@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import csv
+import time
+from pathlib import Path
+from datetime import datetime
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMatrix,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsProject,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+
+import numpy as np
+
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.methodslib import (
+    check_canceled,
+    reproject_is_needed,
+    reproject_layers,
+)
+from ..utilities.settlementlib import (
+    ANGLE_LIMITS,
+    LOOKUP_TOLERANCE,
+    SETTLEMENT_LIMITS,
+    classify_settlement,
+    short_term_curve_parameters,
+)
+from ..utilities.sitelib import (
+    MANUAL_POREPRESSURE_CURVE,
+    POREPRESSURE_CURVES,
+    check_porepressure_curve,
+    evaluate_excavation,
+    evaluate_tunnel,
+    monte_carlo_buildings,
+    prepare_site,
+    write_building_results,
+)
+from ..utilities.uncertainty import (
+    DEFAULT_DISTRIBUTION_TABLE,
+    DISTRIBUTION_TABLE_HEADERS,
+    DISTRIBUTIONS,
+    PERCENTILES,
+    UNCERTAIN_PARAMETERS,
+    draw_samples,
+    exceedance_probability,
+    parse_distribution_table,
+    sample_percentiles,
+)
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class BegrensSkadeMonteCarlo(GvBaseProcessingAlgorithms):
+    """
+    The BegrensSkadeMonteCarlo algorithm propagates the uncertainty of the soil parameters to the
+    building risk. The uncertain parameters (OCR, Janbu modulus and constant, dry crust thickness and
+    soil density) are given by distributions, N samples are drawn, and the settlements of all
+    buildings are evaluated for all samples as batched array computations (samples x corners).
+
+    Every building gets the percentiles of its maximum total settlement and angular distortion, and
+    the probability of exceeding every settlement and angle category limit.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_MONTE_CARLO.log",
+            "MONTE_CARLO_LOGGER",
+        ).get_logger()
+
+        # Retrieve version number from BaseAlgorithm class "GvBaseProcessingAlgorithms"
+        self.version = self.getVersion()
+        self.logger.info(f"__INIT__ - VERSION: {self.version} ")
+
+        # instanciate variables used in postprocessing to add layers to GUI
+        self.feature_name = None  # Default value
+        self.layers_info = {}
+        self.logger.info("__INIT__ - Finished initialize BegrensSkadeMonteCarlo ")
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BegrensSkadeMonteCarlo()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="excavation.png")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "begrensskademontecarlo"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Begrens Skade - Uncertainty (Monte Carlo)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("REMEDY_GIS_RiskTool")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "remedygisrisktool"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        distributions = ", ".join(f"{name} ({meaning})" for name, meaning in DISTRIBUTIONS.items())
+        return self.tr(
+            "The Begrens Skade - Uncertainty (Monte Carlo) algorithm evaluates the long term settlements of all buildings for N samples of the uncertain soil parameters, next to an excavation or above a tunnel. All samples are evaluated as batched array computations, not as N separate runs.\n"
+            f"DISTRIBUTIONS\nOne row per uncertain parameter: {', '.join(UNCERTAIN_PARAMETERS)}. Parameters without a row keep the value given in this dialog. Distributions: {distributions}. Normal samples are truncated at zero.\n"
+            "OUTPUT\nA building layer with the percentiles of the maximum total settlement (sv_p10, sv_p50, sv_p90) and angular distortion (ang_p10, ang_p50, ang_p90), the mean settlement (sv_mean), and the probability of exceeding the limits of settlement category 2, 3 and 4 (p_sv_c2, p_sv_c3, p_sv_c4) and angle category 2, 3 and 4 (p_ang_c2, p_ang_c3, p_ang_c4). A CSV file lists the drawn samples.\n"
+            "The settlements are evaluated with the vectorized settlement engine of the plugin. For tunnels, the porewater pressure reduction at the tunnel is given directly (as with the Manual curve of the Tunnel algorithm).\n"
+            "LOOKUP TABLE\nFor large sites (from 250 000 building corners), the long term settlement is tabulated over depth to bedrock and porewater pressure reduction and interpolated for every corner. The table is refined until its error, checked against the exact evaluation, is below the given bound. Set the bound to 0 to always evaluate exactly.\n"
+            "The algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_FEATURE_NAME = "OUTPUT_FEATURE_NAME"
+    OUTPUT_CRS = "OUTPUT_CRS"
+    INPUT_BUILDING_POLY = "INPUT_BUILDING_POLY"
+    INPUT_SOURCE_POLY = "INPUT_SOURCE_POLY"
+    SOURCE_TYPE = ["SOURCE_TYPE", "Type of construction"]
+    enum_source_type = ["Excavation", "Tunnel"]
+    RASTER_ROCK_SURFACE = [
+        "RASTER_ROCK_SURFACE",
+        "Input raster of depth to bedrock",
+    ]
+
+    N_SAMPLES = ["N_SAMPLES", "Number of samples"]
+    RANDOM_SEED = ["RANDOM_SEED", "Random seed (repeatable samples)"]
+    LOOKUP_TOLERANCE = [
+        "LOOKUP_TOLERANCE",
+        "Error bound of the long term lookup table [mm] (0 = exact evaluation)",
+    ]
+    DISTRIBUTION_TABLE = ["DISTRIBUTION_TABLE", "Distributions of the uncertain soil parameters"]
+
+    SHORT_TERM_SETTLEMENT = ["SHORT_TERM_SETTLEMENT", "Include short term settlements"]
+    EXCAVATION_DEPTH = ["EXCAVATION_DEPTH", "Depth of excavation [m]"]
+    SETTLEMENT_ENUM = ["SETTLEMENT_ENUM", "Settlement curves (excavation)"]
+    enum_settlment = [
+        r"0,5 % av byggegropdybde",
+        r"1 % av byggegropdybde",
+        r"2 % av byggegropdybde",
+        r"3 % av byggegropdybde",
+    ]
+    TUNNEL_DEPTH = ["TUNNEL_DEPTH", "Depth of tunnel [m]"]
+    TUNNEL_DIAM = ["TUNNEL_DIAM", "Diameter of tunnel [m]"]
+    VOLUME_LOSS = ["VOLUME_LOSS", "Loss of volume [%]"]
+    TROUGH_WIDTH = ["TROUGH_WIDTH", "Width of trough [m]"]
+
+    POREWP_REDUCTION_M = [
+        "POREWP_REDUCTION_M",
+        "Porewater pressure reduction at the excavation or tunnel [m]",
+    ]
+    POREPRESSURE_ENUM_CURVES = [
+        "POREPRESSURE_ENUM",
+        "Calculation curve for pore pressure reduction of the tunnel (only Manual, the reduction at the tunnel)",
+    ]
+    DRY_CRUST_THICKNESS = [
+        "DRY_CRUST_THICKNESS",
+        "Thickness of overburden not affected by porewater drawdown [m]",
+    ]
+    DEPTH_GROUNDWATER = ["DEPTH_GROUNDWATER", "Depht to groundwater table [m]"]
+    SOIL_DENSITY = ["SOIL_DENSITY", "Soil saturation density [kN/m3]"]
+    OCR = ["OCR", "Over consolidation ratio"]
+    JANBU_REF_STRESS = [
+        "JANBU_REF_STRESS",
+        "Janbu reference stress, p`r (kPa)",
+    ]
+    JANBU_CONSTANT = ["JANBU_CONSTANT", "Janbu constant [M0/(m*p`c)]"]
+    JANBU_COMP_MODULUS = ["JANBU_COMP_MODULUS", "Janbu compression modulus"]
+    CONSOLIDATION_TIME = ["CONSOLIDATION_TIME", "Consolidation time [years]"]
+
+    OUTPUT_BUILDING = "OUTPUT_BUILDING"
+    OUTPUT_SAMPLES = "OUTPUT_SAMPLES"
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_BUILDING_POLY,
+                self.tr("Input Building polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_SOURCE_POLY,
+                self.tr("Input Excavation or Tunnel polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SOURCE_TYPE[0],
+                self.tr(f"{self.SOURCE_TYPE[1]}"),
+                self.enum_source_type,
+                defaultValue=0,
+                allowMultiple=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.RASTER_ROCK_SURFACE[0],
+                self.tr(f"{self.RASTER_ROCK_SURFACE[1]}"),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.N_SAMPLES[0],
+                self.tr(f"{self.N_SAMPLES[1]}"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1000,
+                minValue=1,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterMatrix(
+                self.DISTRIBUTION_TABLE[0],
+                self.tr(f"{self.DISTRIBUTION_TABLE[1]}"),
+                numberRows=len(UNCERTAIN_PARAMETERS),
+                hasFixedNumberRows=False,
+                headers=DISTRIBUTION_TABLE_HEADERS,
+                defaultValue=DEFAULT_DISTRIBUTION_TABLE,
+            )
+        )
+        param = QgsProcessingParameterNumber(
+            self.RANDOM_SEED[0],
+            self.tr(f"{self.RANDOM_SEED[1]}"),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=None,
+            optional=True,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced | QgsProcessingParameterDefinition.FlagOptional)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.LOOKUP_TOLERANCE[0],
+            self.tr(f"{self.LOOKUP_TOLERANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=LOOKUP_TOLERANCE * 1000,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # Short term settlements are deterministic, and added to every sample
+        param = QgsProcessingParameterBoolean(
+            self.SHORT_TERM_SETTLEMENT[0],
+            self.tr(f"{self.SHORT_TERM_SETTLEMENT[1]}"),
+            defaultValue=True,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.SETTLEMENT_ENUM[0],
+            self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
+            self.enum_settlment,
+            defaultValue=1,
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # Deterministic values, also used for uncertain parameters without a distribution
+        for constant, default, number_type in [
+            (self.EXCAVATION_DEPTH, 10, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DEPTH, 15, QgsProcessingParameterNumber.Double),
+            (self.TUNNEL_DIAM, 9.5, QgsProcessingParameterNumber.Double),
+            (self.VOLUME_LOSS, 2, QgsProcessingParameterNumber.Double),
+            (self.TROUGH_WIDTH, 0.5, QgsProcessingParameterNumber.Double),
+            (self.POREWP_REDUCTION_M, 10, QgsProcessingParameterNumber.Double),
+            (self.DRY_CRUST_THICKNESS, 5, QgsProcessingParameterNumber.Double),
+            (self.DEPTH_GROUNDWATER, 3, QgsProcessingParameterNumber.Double),
+            (self.SOIL_DENSITY, 18.5, QgsProcessingParameterNumber.Double),
+            (self.OCR, 1.2, QgsProcessingParameterNumber.Double),
+            (self.JANBU_REF_STRESS, 0, QgsProcessingParameterNumber.Integer),
+            (self.JANBU_CONSTANT, 4, QgsProcessingParameterNumber.Double),
+            (self.JANBU_COMP_MODULUS, 15, QgsProcessingParameterNumber.Double),
+            (self.CONSOLIDATION_TIME, 1000, QgsProcessingParameterNumber.Integer),
+        ]:
+            param = QgsProcessingParameterNumber(
+                constant[0],
+                self.tr(f"{constant[1]}"),
+                number_type,
+                defaultValue=default,
+                minValue=0,
+            )
+            param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.POREPRESSURE_ENUM_CURVES[0],
+            self.tr(f"{self.POREPRESSURE_ENUM_CURVES[1]}"),
+            POREPRESSURE_CURVES,
+            defaultValue=POREPRESSURE_CURVES.index(MANUAL_POREPRESSURE_CURVE),
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # DEFINE OUTPUTS
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.OUTPUT_FEATURE_NAME,
+                self.tr(
+                    "Naming Conventions for Analysis and Features (Output feature name appended to file-names)"
+                )
+            ),
+            createOutput=True
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                self.OUTPUT_CRS,
+                self.tr("Output CRS"),
+                defaultValue=QgsProject.instance().crs(),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output Folder"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_BUILDING,
+                self.tr("Output Buildings Shapefile (percentiles and exceedance probabilities)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_SAMPLES,
+                self.tr("Drawn samples (CSV)"),
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        self.logger.info("PROCESS - Starting the processing")
+        feedback.pushInfo(f"PROCESS - Version: {self.version}")
+
+        source_building_poly = self.parameterAsVectorLayer(parameters, self.INPUT_BUILDING_POLY, context)
+        source_poly = self.parameterAsVectorLayer(parameters, self.INPUT_SOURCE_POLY, context)
+        source_type = self.enum_source_type[self.parameterAsEnum(parameters, self.SOURCE_TYPE[0], context)]
+        porepressure_curve = POREPRESSURE_CURVES[
+            self.parameterAsEnum(parameters, self.POREPRESSURE_ENUM_CURVES[0], context)
+        ]
+        if source_type == "Tunnel":
+            try:
+                check_porepressure_curve(porepressure_curve)
+            except ValueError as e:
+                self.logger.error(f"PROCESS - {e}")
+                feedback.reportError(f"PROCESS - {e}")
+                return {}
+        source_raster_rock_surface = self.parameterAsRasterLayer(parameters, self.RASTER_ROCK_SURFACE[0], context)
+        if source_raster_rock_surface is None:
+            feedback.reportError("PROCESS - No raster chosen! Chose a raster to perform long-term analysis")
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.RASTER_ROCK_SURFACE[0]))
+
+        n_samples = self.parameterAsInt(parameters, self.N_SAMPLES[0], context)
+        seed = None
+        if parameters.get(self.RANDOM_SEED[0]) is not None:
+            seed = self.parameterAsInt(parameters, self.RANDOM_SEED[0], context)
+        bShortterm = self.parameterAsBoolean(parameters, self.SHORT_TERM_SETTLEMENT[0], context)
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        output_folder_path = Path(output_folder)
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.feature_name = self.parameterAsString(parameters, self.OUTPUT_FEATURE_NAME, context)
+        output_proj = self.parameterAsCrs(parameters, self.OUTPUT_CRS, context)
+        self.logger.info(f"PROCESS - Output folder: {output_folder}, feature name: {self.feature_name}, output CRS: {output_proj.authid()}")
+
+        ################# DRAW THE SAMPLES #################
+        try:
+            distributions = parse_distribution_table(
+                self.parameterAsMatrix(parameters, self.DISTRIBUTION_TABLE[0], context),
+                list(UNCERTAIN_PARAMETERS),
+            )
+        except ValueError as e:
+            raise QgsProcessingException(f"Invalid distribution table: {e}")
+        for name, distribution in distributions.items():
+            feedback.pushInfo(f"PROCESS - {name}: {distribution}")
+            self.logger.info(f"PROCESS - {name}: {distribution}")
+        drawn = draw_samples(distributions, n_samples, seed)
+        samples = {UNCERTAIN_PARAMETERS[name]: values for name, values in drawn.items()}
+
+        fixed = {
+            "short_term": bShortterm,
+            "long_term": True,
+            "porewp_red_m": self.parameterAsDouble(parameters, self.POREWP_REDUCTION_M[0], context),
+            "dep_groundwater": self.parameterAsDouble(parameters, self.DEPTH_GROUNDWATER[0], context),
+            "janbu_ref_stress": self.parameterAsDouble(parameters, self.JANBU_REF_STRESS[0], context),
+            "consolidation_time": self.parameterAsDouble(parameters, self.CONSOLIDATION_TIME[0], context),
+            "lookup_tolerance": self.parameterAsDouble(parameters, self.LOOKUP_TOLERANCE[0], context) / 1000 or None,
+        }
+        for name, argument in UNCERTAIN_PARAMETERS.items():
+            if argument not in samples:
+                fixed[argument] = self.parameterAsDouble(parameters, name, context)
+        if source_type == "Excavation":
+            evaluate = evaluate_excavation
+            ratio, extent = short_term_curve_parameters(
+                self.enum_settlment[self.parameterAsEnum(parameters, self.SETTLEMENT_ENUM[0], context)]
+            )
+            fixed.update(
+                excavation_depth=self.parameterAsDouble(parameters, self.EXCAVATION_DEPTH[0], context),
+                ratio=ratio,
+                extent=extent,
+            )
+        else:
+            evaluate = evaluate_tunnel
+            fixed.update(
+                tunnel_depth=self.parameterAsDouble(parameters, self.TUNNEL_DEPTH[0], context),
+                tunnel_diameter=self.parameterAsDouble(parameters, self.TUNNEL_DIAM[0], context),
+                volume_loss=self.parameterAsDouble(parameters, self.VOLUME_LOSS[0], context),
+                trough_width=self.parameterAsDouble(parameters, self.TROUGH_WIDTH[0], context),
+                porepressure_curve=porepressure_curve,
+            )
+        feedback.setProgress(5)
+
+        ################# PREPARE THE INPUTS ONCE #################
+        if reproject_is_needed(source_building_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_building_poly.name()}")
+            source_building_poly, _ = reproject_layers(output_proj, source_building_poly, context=context, logger=self.logger)
+        if reproject_is_needed(source_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_poly.name()}")
+            source_poly, _ = reproject_layers(output_proj, source_poly, context=context, logger=self.logger)
+        if reproject_is_needed(source_raster_rock_surface, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}")
+            _, source_raster_rock_surface = reproject_layers(
+                output_proj, raster_layer=source_raster_rock_surface, context=context, logger=self.logger
+            )
+        dtb_path = source_raster_rock_surface.source().split("|")[0]
+        check_canceled(feedback, [self.run_temp_folder], self.logger)
+
+        site = prepare_site(source_building_poly, source_poly, dtb_path, tunnel=evaluate is evaluate_tunnel)
+        feedback.pushInfo(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        self.logger.info(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        if site.n_buildings == 0:
+            feedback.reportError("PROCESS - No building polygons found")
+            return {}
+        feedback.setProgress(15)
+
+        ################# EVALUATE ALL SAMPLES #################
+        start_time = time.perf_counter()
+        max_sv_tot, max_angle = monte_carlo_buildings(
+            site, evaluate, samples, fixed, n_samples,
+            progress=self.progressCallback(feedback, 15, 75, logger=self.logger, total=n_samples, unit="samples"),
+        )
+        elapsed = time.perf_counter() - start_time
+        feedback.pushInfo(f"PROCESS - Evaluated {n_samples} samples in {elapsed:.1f} s")
+        self.logger.info(f"PROCESS - Evaluated {n_samples} samples x {site.n_corners} corners in {elapsed:.1f} s")
+
+        ################# WRITE THE RESULTS #################
+        sv_percentiles = sample_percentiles(max_sv_tot)
+        angle_percentiles = sample_percentiles(max_angle)
+        sv_exceedance = exceedance_probability(max_sv_tot, SETTLEMENT_LIMITS)
+        angle_exceedance = exceedance_probability(max_angle, ANGLE_LIMITS)
+        valid = np.count_nonzero(~np.isnan(max_sv_tot), axis=0)
+        sv_mean = np.where(valid > 0, np.nansum(max_sv_tot, axis=0) / np.maximum(valid, 1), np.nan)
+        columns = [("sv_mean", QVariant.Double, sv_mean)]
+        columns += [(f"sv_p{p}", QVariant.Double, sv_percentiles[i]) for i, p in enumerate(PERCENTILES)]
+        columns += [(f"ang_p{p}", QVariant.Double, angle_percentiles[i]) for i, p in enumerate(PERCENTILES)]
+        # Exceeding the k-th limit means category k + 2 or higher
+        columns += [(f"p_sv_c{i + 2}", QVariant.Double, sv_exceedance[i]) for i in range(len(SETTLEMENT_LIMITS))]
+        columns += [(f"p_ang_c{i + 2}", QVariant.Double, angle_exceedance[i]) for i in range(len(ANGLE_LIMITS))]
+        output_building = write_building_results(
+            site, output_folder_path / f"{self.feature_name}-MC-BUILDING.shp", columns
+        )
+        self.layers_info = {"MC-BUILDING": {"shape_path": output_building, "style_name": None}}
+
+        samples_path = output_folder_path / f"{self.feature_name}-MC-SAMPLES.csv"
+        with open(samples_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["sample"] + list(drawn) + ["n_cat1", "n_cat2", "n_cat3", "n_cat4"])
+            for index in range(n_samples):
+                categories = np.bincount(classify_settlement(max_sv_tot[index]), minlength=5)
+                writer.writerow(
+                    [index + 1]
+                    + [float(values[index]) for values in drawn.values()]
+                    + [int(count) for count in categories[1:5]]
+                )
+
+        for i, limit in enumerate(SETTLEMENT_LIMITS):
+            likely = int(np.count_nonzero(sv_exceedance[i] > 0.5))
+            feedback.pushInfo(f"PROCESS - Buildings with settlement > {limit * 1000:.0f} mm in more than half of the samples: {likely}")
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        return {
+            self.OUTPUT_BUILDING: output_building,
+            self.OUTPUT_SAMPLES: str(samples_path),
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        This method is called after processAlgorithm finishes.
+        Here, we manually load the output shapefile and place it under a custom group in the layer tree.
+        """
+        self.removeRunTempFolder(context)
+        project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
+        root = project.layerTreeRoot()
+
+        # Create (or find) a group at the top level named by 'self.feature_name'.
+        group_name = self.feature_name
+        group = root.findGroup(group_name)
+        if not group:
+            group = root.insertGroup(0, group_name)
+
+        for layer_label, layer_info in self.layers_info.items():
+            shape_path = layer_info["shape_path"]
+
+            # Generate a unique layer name with timestamp
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            final_layer_name = f"{layer_label}_{timestamp}"
+
+            layer = QgsVectorLayer(shape_path, final_layer_name, "ogr")
+            if not layer.isValid():
+                feedback.reportError(f"Could not load layer from file: {shape_path}")
+                continue
+
+            # Add the layer to the project (layer registry) *without* adding to the root TOC
+            project.addMapLayer(layer, False)
+            group.insertLayer(-1, layer)
+            node = group.findLayer(layer.id())
+            if node:
+                node.setItemVisibilityChecked(True)
+
+            feedback.pushInfo(f"Loaded layer '{final_layer_name}' in group '{group_name}'.")
+
+        feedback.pushInfo("postProcessAlgorithm complete.")
+        return {}
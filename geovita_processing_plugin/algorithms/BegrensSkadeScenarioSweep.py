@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import csv
+from pathlib import Path
+from datetime import datetime
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsProcessingParameterVectorLayer,
+    QgsProject,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+
+import numpy as np
+
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.methodslib import (
+    check_canceled,
+    reproject_is_needed,
+    reproject_layers,
+)
+from ..utilities.settlementlib import LOOKUP_TOLERANCE, short_term_curve_parameters
+from ..utilities.sitelib import evaluate_excavation, prepare_site, write_building_results
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class BegrensSkadeScenarioSweep(GvBaseProcessingAlgorithms):
+    """
+    The BegrensSkadeScenarioSweep algorithm evaluates many parameter sets (scenarios) for one
+    excavation. Buildings, excavation and depth to bedrock are loaded, reprojected and broken down
+    in corners and walls once. Every scenario of the parameter table is then evaluated on the
+    prepared arrays with the vectorized settlement engine, instead of a full Excavation run per
+    scenario.
+
+    The parameter table (a table layer or a CSV file) has one row per scenario. Its columns are
+    named as the parameters of this algorithm (e.g. EXCAVATION_DEPTH, SETTLEMENT_ENUM, OCR); missing
+    columns and empty cells take the value of the algorithm parameter. An optional SCENARIO column
+    names the scenarios.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_SCENARIO_SWEEP.log",
+            "SCENARIO_SWEEP_LOGGER",
+        ).get_logger()
+
+        # Retrieve version number from BaseAlgorithm class "GvBaseProcessingAlgorithms"
+        self.version = self.getVersion()
+        self.logger.info(f"__INIT__ - VERSION: {self.version} ")
+
+        # instanciate variables used in postprocessing to add layers to GUI
+        self.feature_name = None  # Default value
+        self.layers_info = {}
+        self.logger.info("__INIT__ - Finished initialize BegrensSkadeScenarioSweep ")
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BegrensSkadeScenarioSweep()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="excavation.png")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "begrensskadescenariosweep"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Begrens Skade - Scenario sweep")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("REMEDY_GIS_RiskTool")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "remedygisrisktool"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "The Begrens Skade - Scenario sweep algorithm compares many parameter sets for one excavation. Buildings, excavation and depth to bedrock are loaded and prepared once, and every scenario is evaluated on the prepared data.\nSCENARIO TABLE\nA table layer or CSV file with one row per scenario. Columns are named as the parameters of this algorithm: SETTLEMENT_ENUM (index 0-3, curve name or percent 0.5/1/2/3), EXCAVATION_DEPTH, POREWP_REDUCTION_M, DRY_CRUST_THICKNESS, DEPTH_GROUNDWATER, SOIL_DENSITY, OCR, JANBU_REF_STRESS, JANBU_CONSTANT, JANBU_COMP_MODULUS and CONSOLIDATION_TIME. Missing columns and empty cells take the value given in this dialog. An optional SCENARIO column names the scenarios.\nOUTPUT\nEither one building layer with the columns sNN_sv (max total settlement), sNN_svc (settlement category), sNN_ang (max angular distortion) and sNN_angc (angle category) for every scenario NN, or one building layer per scenario. A CSV file lists the scenarios, their parameters and the number of buildings in each settlement category.\nThe scenarios are evaluated with the vectorized settlement engine of the plugin. Use the Excavation algorithm for the reference REMEDY results of a single scenario.\nLOOKUP TABLE\nFor large sites (from 250 000 building corners), the long term settlement is tabulated over depth to bedrock and porewater pressure reduction and interpolated for every corner. The table is refined until its error, checked against the exact evaluation, is below the given bound. Set the bound to 0 to always evaluate exactly.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_FEATURE_NAME = "OUTPUT_FEATURE_NAME"
+    OUTPUT_CRS = "OUTPUT_CRS"
+    INPUT_BUILDING_POLY = "INPUT_BUILDING_POLY"
+    INPUT_EXCAVATION_POLY = "INPUT_EXCAVATION_POLY"
+    SCENARIO_TABLE = ["SCENARIO_TABLE", "Scenario table (table layer or CSV file)"]
+
+    SHORT_TERM_SETTLEMENT = ["SHORT_TERM_SETTLEMENT", "Short term settlements"]
+    EXCAVATION_DEPTH = ["EXCAVATION_DEPTH", "Depth of excavation [m]"]
+    SETTLEMENT_ENUM = ["SETTLEMENT_ENUM", "Settlement curves"]
+    enum_settlment = [
+        r"0,5 % av byggegropdybde",
+        r"1 % av byggegropdybde",
+        r"2 % av byggegropdybde",
+        r"3 % av byggegropdybde",
+    ]
+
+    LONG_TERM_SETTLEMENT = ["LONG_TERM_SETTLEMENT", "Long term settlements"]
+    RASTER_ROCK_SURFACE = [
+        "RASTER_ROCK_SURFACE",
+        "Input raster of depth to bedrock",
+    ]
+    POREWP_REDUCTION_M = [
+        "POREWP_REDUCTION_M",
+        "Porewater pressure reduction [m]",
+    ]
+    DRY_CRUST_THICKNESS = [
+        "DRY_CRUST_THICKNESS",
+        "Thickness of overburden not affected by porewater drawdown [m]",
+    ]
+    DEPTH_GROUNDWATER = ["DEPTH_GROUNDWATER", "Depht to groundwater table [m]"]
+    SOIL_DENSITY = ["SOIL_DENSITY", "Soil saturation density [kN/m3]"]
+    OCR = ["OCR", "Over consolidation ratio"]
+    JANBU_REF_STRESS = [
+        "JANBU_REF_STRESS",
+        "Janbu reference stress, p`r (kPa)",
+    ]
+    JANBU_CONSTANT = ["JANBU_CONSTANT", "Janbu constant [M0/(m*p`c)]"]
+    JANBU_COMP_MODULUS = ["JANBU_COMP_MODULUS", "Janbu compression modulus"]
+    CONSOLIDATION_TIME = ["CONSOLIDATION_TIME", "Consolidation time [years]"]
+    LOOKUP_TOLERANCE = [
+        "LOOKUP_TOLERANCE",
+        "Error bound of the long term lookup table [mm] (0 = exact evaluation)",
+    ]
+
+    OUTPUT_MODE = ["OUTPUT_MODE", "Output"]
+    enum_output_mode = [
+        "One building layer with columns for every scenario",
+        "One building layer per scenario",
+    ]
+
+    # Scenario parameters that can be given in the scenario table, with their default value
+    SCENARIO_PARAMETERS = [
+        EXCAVATION_DEPTH[0],
+        SETTLEMENT_ENUM[0],
+        POREWP_REDUCTION_M[0],
+        DRY_CRUST_THICKNESS[0],
+        DEPTH_GROUNDWATER[0],
+        SOIL_DENSITY[0],
+        OCR[0],
+        JANBU_REF_STRESS[0],
+        JANBU_CONSTANT[0],
+        JANBU_COMP_MODULUS[0],
+        CONSOLIDATION_TIME[0],
+    ]
+    SCENARIO_NAME_COLUMN = "SCENARIO"
+
+    # Shapefiles hold at most 255 fields, four are written for every scenario
+    MAX_COLUMN_SCENARIOS = 60
+
+    OUTPUT_BUILDING = "OUTPUT_BUILDING"
+    OUTPUT_LAYERS = "OUTPUT_LAYERS"
+    OUTPUT_SCENARIOS = "OUTPUT_SCENARIOS"
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_BUILDING_POLY,
+                self.tr("Input Building polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_EXCAVATION_POLY,
+                self.tr("Input Excavation polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.SCENARIO_TABLE[0],
+                self.tr(f"{self.SCENARIO_TABLE[1]}"),
+                [QgsProcessing.TypeVector],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SHORT_TERM_SETTLEMENT[0],
+                self.tr(f"{self.SHORT_TERM_SETTLEMENT[1]}"),
+                defaultValue=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.LONG_TERM_SETTLEMENT[0],
+                self.tr(f"{self.LONG_TERM_SETTLEMENT[1]}"),
+                defaultValue=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.RASTER_ROCK_SURFACE[0],
+                self.tr(f"{self.RASTER_ROCK_SURFACE[1]}"),
+                defaultValue=None,
+                optional=True,
+            )
+        )
+
+        # Default values of the scenario parameters
+        param = QgsProcessingParameterNumber(
+            self.EXCAVATION_DEPTH[0],
+            self.tr(f"{self.EXCAVATION_DEPTH[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=10,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.SETTLEMENT_ENUM[0],
+            self.tr(f"{self.SETTLEMENT_ENUM[1]}"),
+            self.enum_settlment,
+            defaultValue=1,
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        for constant, default, number_type in [
+            (self.POREWP_REDUCTION_M, 10, QgsProcessingParameterNumber.Integer),
+            (self.DRY_CRUST_THICKNESS, 5, QgsProcessingParameterNumber.Double),
+            (self.DEPTH_GROUNDWATER, 3, QgsProcessingParameterNumber.Double),
+            (self.SOIL_DENSITY, 18.5, QgsProcessingParameterNumber.Double),
+            (self.OCR, 1.2, QgsProcessingParameterNumber.Double),
+            (self.JANBU_REF_STRESS, 0, QgsProcessingParameterNumber.Integer),
+            (self.JANBU_CONSTANT, 4, QgsProcessingParameterNumber.Integer),
+            (self.JANBU_COMP_MODULUS, 15, QgsProcessingParameterNumber.Integer),
+            (self.CONSOLIDATION_TIME, 1000, QgsProcessingParameterNumber.Integer),
+        ]:
+            param = QgsProcessingParameterNumber(
+                constant[0],
+                self.tr(f"{constant[1]}"),
+                number_type,
+                defaultValue=default,
+                minValue=0,
+            )
+            param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.LOOKUP_TOLERANCE[0],
+            self.tr(f"{self.LOOKUP_TOLERANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=LOOKUP_TOLERANCE * 1000,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        # DEFINE OUTPUTS
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.OUTPUT_MODE[0],
+                self.tr(f"{self.OUTPUT_MODE[1]}"),
+                self.enum_output_mode,
+                defaultValue=0,
+                allowMultiple=False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.OUTPUT_FEATURE_NAME,
+                self.tr(
+                    "Naming Conventions for Analysis and Features (Output feature name appended to file-names)"
+                )
+            ),
+            createOutput=True
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                self.OUTPUT_CRS,
+                self.tr("Output CRS"),
+                defaultValue=QgsProject.instance().crs(),
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output Folder"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_BUILDING,
+                self.tr("Output Buildings Shapefile (columns for every scenario)"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputMultipleLayers(
+                self.OUTPUT_LAYERS,
+                self.tr("Output Buildings Shapefiles"),
+            )
+        )
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.OUTPUT_SCENARIOS,
+                self.tr("Scenario summary (CSV)"),
+            )
+        )
+
+    def parse_curve(self, value):
+        """
+        Returns the short term curve name of a curve name, an enum index (0-3) or a percentage (0.5, 1, 2, 3).
+        Indices and percentages agree for 1, 2 and 3, so both can be used in the same table.
+        """
+        text = str(value).strip()
+        if text in self.enum_settlment:
+            return text
+        indices = {0.0: 0, 0.5: 0, 1.0: 1, 2.0: 2, 3.0: 3}
+        try:
+            number = float(text.replace(",", ".").replace("%", ""))
+        except ValueError:
+            number = None
+        if number not in indices:
+            raise QgsProcessingException(f"Unknown settlement curve in the scenario table: {value}")
+        return self.enum_settlment[indices[number]]
+
+    def read_scenarios(self, table_layer, defaults):
+        """
+        Reads the scenario table.
+
+        Args:
+            table_layer (QgsVectorLayer): The scenario table.
+            defaults (dict): Parameter name -> value given in the dialog.
+
+        Returns:
+            list: (scenario name, dict of parameter name -> value) for every row.
+        """
+        columns = {field.name().upper(): field.name() for field in table_layer.fields()}
+        unknown = [name for name in columns if name not in self.SCENARIO_PARAMETERS and name != self.SCENARIO_NAME_COLUMN]
+        if unknown:
+            self.logger.warning(f"PROCESS - Ignoring unknown columns in the scenario table: {unknown}")
+
+        scenarios = []
+        for row, feature in enumerate(table_layer.getFeatures(), start=1):
+            values = dict(defaults)
+            for name in self.SCENARIO_PARAMETERS:
+                if name not in columns:
+                    continue
+                value = feature[columns[name]]
+                if value is None or str(value).strip() in ("", "NULL"):
+                    continue
+                if name == self.SETTLEMENT_ENUM[0]:
+                    values[name] = self.parse_curve(value)
+                else:
+                    try:
+                        values[name] = float(str(value).replace(",", "."))
+                    except ValueError:
+                        raise QgsProcessingException(f"Invalid value for {name} in row {row} of the scenario table: {value}")
+            scenario_name = str(feature[columns[self.SCENARIO_NAME_COLUMN]]) if self.SCENARIO_NAME_COLUMN in columns else f"Scenario {row}"
+            scenarios.append((scenario_name, values))
+        return scenarios
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        self.logger.info("PROCESS - Starting the processing")
+        feedback.pushInfo(f"PROCESS - Version: {self.version}")
+
+        bShortterm = self.parameterAsBoolean(parameters, self.SHORT_TERM_SETTLEMENT[0], context)
+        bLongterm = self.parameterAsBoolean(parameters, self.LONG_TERM_SETTLEMENT[0], context)
+        if not bShortterm and not bLongterm:
+            error_msg = "Please choose Short term or Long term settlements, or both"
+            self.logger.error(error_msg)
+            feedback.reportError(error_msg)
+            return {}
+
+        source_building_poly = self.parameterAsVectorLayer(parameters, self.INPUT_BUILDING_POLY, context)
+        source_excavation_poly = self.parameterAsVectorLayer(parameters, self.INPUT_EXCAVATION_POLY, context)
+        scenario_table = self.parameterAsVectorLayer(parameters, self.SCENARIO_TABLE[0], context)
+        source_raster_rock_surface = self.parameterAsRasterLayer(parameters, self.RASTER_ROCK_SURFACE[0], context)
+        if bLongterm and source_raster_rock_surface is None:
+            feedback.reportError("PROCESS - No raster chosen! Chose a raster to perform long-term analysis")
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.RASTER_ROCK_SURFACE[0]))
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        output_folder_path = Path(output_folder)
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.feature_name = self.parameterAsString(parameters, self.OUTPUT_FEATURE_NAME, context)
+        output_proj = self.parameterAsCrs(parameters, self.OUTPUT_CRS, context)
+        output_mode = self.parameterAsEnum(parameters, self.OUTPUT_MODE[0], context)
+        self.logger.info(f"PROCESS - Output folder: {output_folder}, feature name: {self.feature_name}, output CRS: {output_proj.authid()}")
+
+        ################# READ THE SCENARIOS #################
+        defaults = {
+            self.EXCAVATION_DEPTH[0]: self.parameterAsDouble(parameters, self.EXCAVATION_DEPTH[0], context),
+            self.SETTLEMENT_ENUM[0]: self.enum_settlment[self.parameterAsEnum(parameters, self.SETTLEMENT_ENUM[0], context)],
+        }
+        for name in self.SCENARIO_PARAMETERS[2:]:
+            defaults[name] = self.parameterAsDouble(parameters, name, context)
+        scenarios = self.read_scenarios(scenario_table, defaults)
+        if not scenarios:
+            feedback.reportError("PROCESS - The scenario table is empty")
+            return {}
+        if output_mode == 0 and len(scenarios) > self.MAX_COLUMN_SCENARIOS:
+            raise QgsProcessingException(
+                f"{len(scenarios)} scenarios do not fit in one shapefile (max {self.MAX_COLUMN_SCENARIOS}). "
+                "Choose one building layer per scenario."
+            )
+        feedback.pushInfo(f"PROCESS - {len(scenarios)} scenarios read from the scenario table")
+        feedback.setProgress(10)
+
+        ################# PREPARE THE INPUTS ONCE #################
+        if reproject_is_needed(source_building_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_building_poly.name()}")
+            source_building_poly, _ = reproject_layers(output_proj, source_building_poly, context=context, logger=self.logger)
+        if reproject_is_needed(source_excavation_poly, output_proj):
+            feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_excavation_poly.name()}")
+            source_excavation_poly, _ = reproject_layers(output_proj, source_excavation_poly, context=context, logger=self.logger)
+        dtb_path = None
+        if bLongterm:
+            if reproject_is_needed(source_raster_rock_surface, output_proj):
+                feedback.pushInfo(f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}")
+                _, source_raster_rock_surface = reproject_layers(
+                    output_proj, raster_layer=source_raster_rock_surface, context=context, logger=self.logger
+                )
+            dtb_path = source_raster_rock_surface.source().split("|")[0]
+        check_canceled(feedback, [self.run_temp_folder], self.logger)
+        feedback.setProgress(20)
+
+        site = prepare_site(source_building_poly, source_excavation_poly, dtb_path)
+        feedback.pushInfo(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        self.logger.info(f"PROCESS - Prepared {site.n_buildings} buildings with {site.n_corners} corners")
+        if site.n_buildings == 0:
+            feedback.reportError("PROCESS - No building polygons found")
+            return {}
+        feedback.setProgress(40)
+
+        ################# EVALUATE ALL SCENARIOS #################
+        values = {name: [scenario[1][name] for scenario in scenarios] for name in self.SCENARIO_PARAMETERS}
+        ratio, extent = short_term_curve_parameters(values[self.SETTLEMENT_ENUM[0]])
+        results = evaluate_excavation(
+            site,
+            short_term=bShortterm,
+            long_term=bLongterm,
+            excavation_depth=values[self.EXCAVATION_DEPTH[0]],
+            ratio=ratio,
+            extent=extent,
+            porewp_red_m=values[self.POREWP_REDUCTION_M[0]],
+            dry_crust_thk=values[self.DRY_CRUST_THICKNESS[0]],
+            dep_groundwater=values[self.DEPTH_GROUNDWATER[0]],
+            density_sat=values[self.SOIL_DENSITY[0]],
+            ocr=values[self.OCR[0]],
+            janbu_ref_stress=values[self.JANBU_REF_STRESS[0]],
+            janbu_const=values[self.JANBU_CONSTANT[0]],
+            janbu_m=values[self.JANBU_COMP_MODULUS[0]],
+            consolidation_time=values[self.CONSOLIDATION_TIME[0]],
+            lookup_tolerance=self.parameterAsDouble(parameters, self.LOOKUP_TOLERANCE[0], context) / 1000 or None,
+            progress=self.progressCallback(feedback, 40, 40, logger=self.logger, total=site.n_corners, unit="corners"),
+        )
+        feedback.setProgress(80)
+
+        ################# WRITE THE RESULTS #################
+        output_building = None
+        output_layers = []
+        self.layers_info = {}
+        width = max(2, len(str(len(scenarios))))
+        if output_mode == 0:
+            columns = []
+            for index in range(len(scenarios)):
+                prefix = f"s{index + 1:0{width}d}"
+                columns += [
+                    (f"{prefix}_sv", QVariant.Double, results["max_sv_tot"][index]),
+                    (f"{prefix}_svc", QVariant.Int, results["sv_class"][index]),
+                    (f"{prefix}_ang", QVariant.Double, results["max_angle"][index]),
+                    (f"{prefix}_angc", QVariant.Int, results["angle_class"][index]),
+                ]
+            output_building = write_building_results(
+                site, output_folder_path / f"{self.feature_name}-SCENARIOS-BUILDING.shp", columns
+            )
+            output_layers.append(output_building)
+            self.layers_info["SCENARIOS-BUILDING"] = {"shape_path": output_building, "style_name": None}
+        else:
+            for index, (scenario_name, _) in enumerate(scenarios):
+                prefix = f"s{index + 1:0{width}d}"
+                path = write_building_results(
+                    site,
+                    output_folder_path / f"{self.feature_name}-{prefix}-BUILDING.shp",
+                    [
+                        ("max_sv_tot", QVariant.Double, results["max_sv_tot"][index]),
+                        ("sv_class", QVariant.Int, results["sv_class"][index]),
+                        ("max_angle", QVariant.Double, results["max_angle"][index]),
+                        ("angle_cls", QVariant.Int, results["angle_class"][index]),
+                    ],
+                )
+                output_layers.append(path)
+                self.layers_info[f"{prefix}-{scenario_name}"] = {
+                    "shape_path": path,
+                    "style_name": "BUILDING-TOTAL-SETTLMENT_sv_tot.qml",
+                }
+
+        scenarios_path = output_folder_path / f"{self.feature_name}-SCENARIOS.csv"
+        with open(scenarios_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["prefix", self.SCENARIO_NAME_COLUMN] + self.SCENARIO_PARAMETERS
+                            + ["max_sv_tot", "n_cat1", "n_cat2", "n_cat3", "n_cat4"])
+            for index, (scenario_name, scenario_values) in enumerate(scenarios):
+                categories = np.bincount(results["sv_class"][index], minlength=5)
+                writer.writerow(
+                    [f"s{index + 1:0{width}d}", scenario_name]
+                    + [scenario_values[name] for name in self.SCENARIO_PARAMETERS]
+                    + [float(np.nanmax(results["max_sv_tot"][index]))]
+                    + [int(count) for count in categories[1:5]]
+                )
+                feedback.pushInfo(
+                    f"PROCESS - {scenario_name}: max settlement {np.nanmax(results['max_sv_tot'][index]) * 1000:.1f} mm, "
+                    f"buildings per settlement category {categories[1:5].tolist()}"
+                )
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        return {
+            self.OUTPUT_BUILDING: output_building,
+            self.OUTPUT_LAYERS: output_layers,
+            self.OUTPUT_SCENARIOS: str(scenarios_path),
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        This method is called after processAlgorithm finishes.
+        Here, we manually load the output shapefiles, apply QML styles,
+        and place them under a custom group in the layer tree.
+        """
+        self.removeRunTempFolder(context)
+        project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
+        root = project.layerTreeRoot()
+
+        # Create (or find) a group at the top level named by 'self.feature_name'.
+        group_name = self.feature_name
+        group = root.findGroup(group_name)
+        if not group:
+            group = root.insertGroup(0, group_name)
+
+        for layer_label, layer_info in self.layers_info.items():
+            shape_path = layer_info["shape_path"]
+            style_name = layer_info["style_name"]
+
+            # Generate a unique layer name with timestamp
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+            final_layer_name = f"{layer_label}_{timestamp}"
+
+            layer = QgsVectorLayer(shape_path, final_layer_name, "ogr")
+            if not layer.isValid():
+                feedback.reportError(f"Could not load layer from file: {shape_path}")
+                continue
+
+            # Load the QML style if there is one for this output
+            if style_name is not None:
+                style_path = self.STYLES_DIR / style_name
+                if style_path.is_file():
+                    layer.loadNamedStyle(str(style_path))
+                    layer.triggerRepaint()
+                else:
+                    feedback.reportError(f"Style file not found: {style_path}")
+
+            # Add the layer to the project (layer registry) *without* adding to the root TOC
+            project.addMapLayer(layer, False)
+            group.insertLayer(-1, layer)
+            node = group.findLayer(layer.id())
+            if node:
+                node.setItemVisibilityChecked(True)
+
+            feedback.pushInfo(f"Loaded and styled layer '{final_layer_name}' in group '{group_name}'.")
+
+        feedback.pushInfo("postProcessAlgorithm complete.")
+        return {}
@@ -34,8 +34,10 @@ from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (
     Qgis,
     QgsProject,
+    QgsRectangle,
     QgsMessageLog,
     QgsProcessing,
+    QgsProcessingException,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterBoolean,
     QgsProcessingParameterDefinition,
@@ -52,7 +54,9 @@ from qgis.core import (
 
 from .base_algorithm import GvBaseProcessingAlgorithms
 
+import time
 import traceback
+from functools import partial
 from pathlib import Path
 from datetime import datetime
 
@@ -61,11 +65,16 @@ from ..REMEDY_GIS_RiskTool.BegrensSkade import mainBegrensSkade_Tunnel
 from ..utilities.gui import GuiUtils
 from ..utilities.logger import CustomLogger
 from ..utilities.methodslib import (
+    check_canceled,
+    create_temp_folder_for_version,
+    ensure_spatial_index,
     get_shapefile_as_json_pyqgis,
     map_porepressure_curve_names,
-    reproject_is_needed,
-    reproject_layers,
+    prepare_dtb_window,
+    prepare_vector_layer,
+    read_features_in_extent,
 )
+from ..utilities.scheduler import run_branches
 
 
 class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
@@ -118,7 +127,6 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         # instanciate variables used in postprocessing to add layers to GUI
         self.feature_name = None  # Default value
         self.layers_info = {}
-        self.styles_dir_path = Path()
         self.logger.info("__INIT__ - Finished initialize BegrensSkadeTunnel ")
 
     def name(self):
@@ -160,7 +168,7 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         Returns a localised short help string for the algorithm.
         """
         return self.tr(
-            "The BegrensSkade Tunnel alorithm provides a comprehensive analysis of building settlements and risks associated with subsidence and inclination due to tunnel excavation. Key features include:\nSHORT TERM AND LONG TERM\n1. Calculation of total settlements at all corners or breakpoints of a building.\n2. Determination of wall inclinations, classified based on the slope between two corner points of each wall.\n3. Assessment of the building's risk of settlement damage with respect to total settlements, classified based on the highest risk category of the corner with the greatest settlement.\n4. Assessment of the building's risk of settlement damage with respect to inclination, classified based on the highest risk category of wall inclination.\nVULNERABILITY\n5. Classification of a building's risk of damage due to total settlements, considering the vulnerability and the highest risk category of the corner with the greatest settlement.\n6. Classification of a building's risk of damage due to inclination, considering both the vulnerability and the highest risk category of wall inclination.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+            "The BegrensSkade Tunnel alorithm provides a comprehensive analysis of building settlements and risks associated with subsidence and inclination due to tunnel excavation. Key features include:\nSHORT TERM AND LONG TERM\n1. Calculation of total settlements at all corners or breakpoints of a building.\n2. Determination of wall inclinations, classified based on the slope between two corner points of each wall.\n3. Assessment of the building's risk of settlement damage with respect to total settlements, classified based on the highest risk category of the corner with the greatest settlement.\n4. Assessment of the building's risk of settlement damage with respect to inclination, classified based on the highest risk category of wall inclination.\nVULNERABILITY\n5. Classification of a building's risk of damage due to total settlements, considering the vulnerability and the highest risk category of the corner with the greatest settlement.\n6. Classification of a building's risk of damage due to inclination, considering both the vulnerability and the highest risk category of wall inclination.\nINCREMENTAL MODE\nReuse the results of the previous run with the same parameters, and only recompute changed, added or deleted buildings.\nBUILDING SEARCH DISTANCE\nOnly read the buildings within this distance of the tunnel layer (0 = all buildings). The porewater drawdown reaches 380 m, so shorter distances can drop affected buildings.\nSPATIAL INDEXES\nBuild missing spatial indexes of the building and tunnel layers before the buildings are read.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
         )
 
     def tr(self, string):
@@ -238,6 +246,14 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         "Building Condition column",
     ]
 
+    USE_CACHE = ["USE_CACHE", "Reuse cached results of identical runs"]
+    INCREMENTAL = ["INCREMENTAL", "Incremental mode (only recompute changed buildings)"]
+    BUILDING_SEARCH_DISTANCE = [
+        "BUILDING_SEARCH_DISTANCE",
+        "Only read buildings within this distance of the tunnel [m] (0 = all buildings)",
+    ]
+    BUILD_SPATIAL_INDEX = ["BUILD_SPATIAL_INDEX", "Build missing spatial indexes of the input layers"]
+
     # return shapefiles from mainBegrensSkade_Excavation()
     OUTPUT_BUILDING = "OUTPUT_BUILDING"
     OUTPUT_WALL = "OUTPUT_WALL"
@@ -477,6 +493,38 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         )
         self.addParameter(param)
 
+        param = QgsProcessingParameterBoolean(
+            self.USE_CACHE[0],
+            self.tr(f"{self.USE_CACHE[1]}"),
+            defaultValue=True,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        param = QgsProcessingParameterBoolean(
+            self.INCREMENTAL[0],
+            self.tr(f"{self.INCREMENTAL[1]}"),
+            defaultValue=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.BUILDING_SEARCH_DISTANCE[0],
+            self.tr(f"{self.BUILDING_SEARCH_DISTANCE[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=0,
+            minValue=0,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.BUILD_SPATIAL_INDEX[0],
+            self.tr(f"{self.BUILD_SPATIAL_INDEX[1]}"),
+            defaultValue=True,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
         # DEFINE OUTPUTS
         self.addParameter(
             QgsProcessingParameterString(
@@ -583,40 +631,121 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         output_srid = output_proj.postgisSrid()
         self.logger.info(f"PROCESS - Output CRS(SRID): {output_srid}")
 
-        #################  CHECK INPUT PROJECTIONS OF VECTOR LAYERS #################
-
-        # Check if each layer matches the output CRS --> If False is returned, reproject the layers.
-        if reproject_is_needed(source_building_poly, output_proj):
-            feedback.pushInfo(
-                f"PROCESS - Reprojection needed for layer: {source_building_poly.name()}, ORIGINAL CRS: {source_building_poly.crs().postgisSrid()}"
-            )
-            try:
-                source_building_poly, _ = reproject_layers(
-                    output_proj,
-                    vector_layer=source_building_poly,
-                    raster_layer=None,
-                    context=context,
-                    logger=self.logger,
+        #################  RESULT CACHE #################
+        use_cache = self.parameterAsBoolean(parameters, self.USE_CACHE[0], context)
+        if use_cache:
+            cache_key = self.getCacheKey(parameters, context)
+            self.logger.info(f"PROCESS - Result cache key: {cache_key}")
+            cached_outputs = self.restoreCachedOutputs(cache_key, output_folder_path, self.logger)
+            if cached_outputs is not None:
+                feedback.pushInfo("PROCESS - Identical run found in the result cache. Reusing the cached outputs.")
+                self.define_layers_info(
+                    [cached_outputs[self.OUTPUT_BUILDING], cached_outputs[self.OUTPUT_WALL], cached_outputs[self.OUTPUT_CORNER]],
+                    bVulnerability,
                 )
-            except Exception as e:
-                feedback.reportError(f"Error during reprojection of BUILDINGS: {e}")
-                return {}
-        if reproject_is_needed(source_tunnel_poly, output_proj):
+                feedback.setProgress(100)
+                return cached_outputs
+
+        #################  BOUNDED READ OF BUILDINGS #################
+        # Temporary files and folder of the run, removed when the run is canceled
+        temp_files = [self.run_temp_folder]
+        check_canceled(feedback, temp_files, self.logger)
+        building_search_distance = self.parameterAsDouble(
+            parameters, self.BUILDING_SEARCH_DISTANCE[0], context
+        )
+        if self.parameterAsBoolean(parameters, self.BUILD_SPATIAL_INDEX[0], context):
+            # Buildings that can not be indexed in place are read from an indexed GeoPackage copy,
+            # the tunnel is read in full and is only indexed in place
+            source_building_poly, status = ensure_spatial_index(
+                source_building_poly, convert=building_search_distance > 0, logger=self.logger
+            )
+            feedback.pushInfo(f"PROCESS - Spatial index of the building layer: {status}")
+            _, status = ensure_spatial_index(source_tunnel_poly, convert=False, logger=self.logger)
+            feedback.pushInfo(f"PROCESS - Spatial index of the tunnel layer: {status}")
+        check_canceled(feedback, temp_files, self.logger)
+        if building_search_distance > 0:
+            # Only the buildings near the tunnel are read, through the spatial index of the source
+            search_extent = QgsRectangle(source_tunnel_poly.extent())
+            search_extent.grow(building_search_distance)
+            temp_files.append(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context) / "buildings_in_extent_temp.shp")
+            source_building_poly = read_features_in_extent(
+                source_building_poly,
+                search_extent,
+                source_tunnel_poly.crs(),
+                temp_files[-1],
+                context=context,
+                logger=self.logger,
+                feedback=feedback,
+            )
             feedback.pushInfo(
-                f"PROCESS - Reprojection needed for layer: {source_tunnel_poly.name()}, ORIGINAL CRS: {source_tunnel_poly.crs().postgisSrid()}"
+                f"PROCESS - {source_building_poly.featureCount()} buildings within {building_search_distance} m of the tunnel"
             )
-            try:
-                source_tunnel_poly, _ = reproject_layers(
-                    output_proj,
-                    vector_layer=source_tunnel_poly,
-                    raster_layer=None,
-                    context=context,
-                    logger=self.logger,
-                )
-            except Exception as e:
-                feedback.reportError(f"Error during reprojection of EXCAVATION: {e}")
+            if source_building_poly.featureCount() == 0:
+                feedback.reportError("PROCESS - No buildings within the search distance of the tunnel")
                 return {}
 
+        #################  PREPARATION OF THE INPUTS #################
+        source_raster_rock_surface = self.parameterAsRasterLayer(
+            parameters, self.RASTER_ROCK_SURFACE[0], context
+        )
+        self.logger.info(f"PROCESS - Rock raster DTM: {source_raster_rock_surface}")
+        if bLongterm and source_raster_rock_surface is None:
+            feedback.reportError("PROCESS - Something is wrong with the raster.")
+            return {}
+
+        def prepare_tunnel(context):
+            tunnel_poly = prepare_vector_layer(source_tunnel_poly, output_proj, context, self.logger)
+            return tunnel_poly, get_shapefile_as_json_pyqgis(tunnel_poly, self.logger)
+
+        # The branches are independent, they run concurrently and are joined before the calculation
+        branches = {
+            "BUILDINGS": partial(prepare_vector_layer, source_building_poly, output_proj, logger=self.logger),
+            "TUNNEL": prepare_tunnel,
+        }
+        if bLongterm:
+            # The DTB window covers all buildings read, also in incremental mode
+            branches["RASTER LAYER"] = partial(
+                prepare_dtb_window,
+                source_raster_rock_surface,
+                source_building_poly.extent(),
+                source_building_poly.crs(),
+                output_proj,
+                logger=self.logger,
+            )
+        try:
+            prepared = run_branches(branches, context, feedback, self.logger)
+        except QgsProcessingException as e:
+            check_canceled(feedback, temp_files, self.logger)
+            feedback.reportError(f"PROCESS - Error during preparation of the inputs: {e}")
+            return {}
+        if bLongterm:
+            temp_files.append(prepared["RASTER LAYER"])
+        # Reprojected layers are written to the temporary folder
+        temp_files += [Path(layer.source().split("|")[0]) for layer in (prepared["BUILDINGS"], prepared["TUNNEL"][0])
+                       if layer.source() not in (source_building_poly.source(), source_tunnel_poly.source())]
+        check_canceled(feedback, temp_files, self.logger)
+        source_building_poly = prepared["BUILDINGS"]
+        source_tunnel_poly, source_tunnel_poly_as_json = prepared["TUNNEL"]
+
+        #################  INCREMENTAL MODE #################
+        incremental = self.parameterAsBoolean(parameters, self.INCREMENTAL[0], context)
+        full_building_poly = source_building_poly
+        skip_calculation = False
+        if incremental:
+            incremental_state, incremental_plan, source_building_poly = self.prepareIncrementalRun(
+                parameters,
+                context,
+                self.INPUT_BUILDING_POLY,
+                full_building_poly,
+                [self.OUTPUT_BUILDING, self.OUTPUT_WALL, self.OUTPUT_CORNER],
+                feedback,
+                self.logger,
+            )
+            if source_building_poly is None:
+                # Only deleted buildings, the previous results are filtered without a new calculation
+                source_building_poly = full_building_poly
+                skip_calculation = True
+
         path_source_building_poly = source_building_poly.source().split("|")[0]
         self.logger.info(
             f"PROCESS - Path to source buildings: {path_source_building_poly}"
@@ -627,10 +756,6 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
             f"PROCESS - Path to source excavation: {path_source_tunnel_poly}"
         )
 
-        source_tunnel_poly_as_json = get_shapefile_as_json_pyqgis(
-            source_tunnel_poly, self.logger
-        )
-        # source_excavation_poly_as_json = Utils.getShapefileAsJson(path_source_excavation_poly, logger)
         self.logger.info(f"PROCESS - JSON structure: {source_tunnel_poly_as_json}")
 
         feedback.setProgress(30)
@@ -651,56 +776,14 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
             volume_loss = None
             trough_width = None
 
-        source_raster_rock_surface = self.parameterAsRasterLayer(
-            parameters, self.RASTER_ROCK_SURFACE[0], context
-        )
-        self.logger.info(f"PROCESS - Rock raster DTM: {source_raster_rock_surface}")
         if bLongterm:
             self.logger.info("PROCESS - ######## LONGTERM ########")
             self.logger.info("PROCESS - Defining long term input")
 
-            ############### HANDELING OF INPUT RASTER ################
-            if source_raster_rock_surface is not None:
-                ############### RASTER REPROJECT ################
-                if reproject_is_needed(source_raster_rock_surface, output_proj):
-                    feedback.pushInfo(
-                        f"PROCESS - Reprojection needed for layer: {source_raster_rock_surface.name()}, ORIGINAL CRS: {source_raster_rock_surface.crs().postgisSrid()}"
-                    )
-                    try:
-                        _, source_raster_rock_surface = reproject_layers(
-                            output_proj,
-                            vector_layer=None,
-                            raster_layer=source_raster_rock_surface,
-                            context=context,
-                            logger=self.logger,
-                        )
-                    except Exception as e:
-                        feedback.reportError(
-                            f"Error during reprojection of RASTER LAYER: {e}"
-                        )
-                        return {}
-
-                # Get the file path of the raster layer
-                path_source_raster_rock_surface = (
-                    source_raster_rock_surface.source().split("|")[0]
-                )
-                self.logger.info(
-                    f"PROCESS - Rock raster DTM File path: {path_source_raster_rock_surface}"
-                )
-                # Check if the file extension is .tif
-                if path_source_raster_rock_surface.endswith(
-                    ".tif"
-                ) or path_source_raster_rock_surface.endswith(".tiff"):
-                    feedback.pushInfo("The raster layer is a TIFF file.")
-                    # Continue processing...
-                else:
-                    feedback.reportError(
-                        "The raster layer is not a TIFF file. Convert it to TIF/TIFF!"
-                    )
-                    return {}
-            else:
-                feedback.reportError("PROCESS - Something is wrong with the raster.")
-                return {}
+            # Any GDAL raster (GeoTIFF, VRT mosaic, GeoPackage), only the window under the buildings is read
+            path_source_raster_rock_surface = prepared["RASTER LAYER"]
+            self.logger.info(f"PROCESS - Rock raster DTM window: {path_source_raster_rock_surface}")
+            feedback.pushInfo(f"PROCESS - Rock raster DTM window: {path_source_raster_rock_surface}")
 
             porepressure_index = self.parameterAsEnum(
                 parameters, self.POREPRESSURE_ENUM_CURVES[0], context
@@ -833,54 +916,109 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         feedback.pushInfo(f"PROCESS - Param: fieldNameStructure = {structure_field}")
         feedback.pushInfo(f"PROCESS - Param: fieldNameStatus = {status_field}")
         feedback.setProgress(50)
-        try:
-            output_shapefiles = mainBegrensSkade_Tunnel(
-                logger=self.logger,
-                buildingsFN=str(path_source_building_poly),
-                tunnelJson=source_tunnel_poly_as_json,
-                output_ws=output_folder,
-                feature_name=self.feature_name,
-                output_proj=output_srid,
-                bShortterm=bShortterm,
-                tunnel_depth=tunnel_depth,
-                tunnel_diameter=tunnel_diameter,
-                volume_loss=volume_loss,
-                trough_width=trough_width,
-                bLongterm=bLongterm,
-                tunnel_leakage=tunnel_leakage,
-                porewp_calc_type=porewp_calc_type,
-                porewp_red_at_site_m=porewp_red_at_site_m,
-                dtb_raster=str(path_source_raster_rock_surface),
-                dry_crust_thk=dry_crust_thk,
-                dep_groundwater=dep_groundwater,
-                density_sat=density_sat,
-                OCR=ocr_value,
-                janbu_ref_stress=janbu_ref_stress,
-                janbu_const=janbu_const,
-                janbu_m=janbu_m,
-                consolidation_time=consolidation_time,
-                bVulnerability=bVulnerability,
-                fieldNameFoundation=foundation_field,
-                fieldNameStructure=structure_field,
-                fieldNameStatus=status_field,
-            )
-            feedback.pushInfo("PROCESS - Finished with mainBegrensSkade_Excavation...")
-            self.logger.info("PROCESS - Finished with mainBegrensSkade_Excavation...")
-        except Exception as e:
-            error_msg = f"Unexpected error: {e}\nTraceback:\n{traceback.format_exc()}"
-            QgsMessageLog.logMessage(error_msg, level=Qgis.Critical)
-            feedback.reportError(error_msg)
-            return {}
+        check_canceled(feedback, temp_files, self.logger)
+        core_kwargs = dict(
+            logger=self.logger,
+            buildingsFN=str(path_source_building_poly),
+            tunnelJson=source_tunnel_poly_as_json,
+            output_ws=output_folder,
+            feature_name=self.feature_name,
+            output_proj=output_srid,
+            bShortterm=bShortterm,
+            tunnel_depth=tunnel_depth,
+            tunnel_diameter=tunnel_diameter,
+            volume_loss=volume_loss,
+            trough_width=trough_width,
+            bLongterm=bLongterm,
+            tunnel_leakage=tunnel_leakage,
+            porewp_calc_type=porewp_calc_type,
+            porewp_red_at_site_m=porewp_red_at_site_m,
+            dtb_raster=str(path_source_raster_rock_surface),
+            dry_crust_thk=dry_crust_thk,
+            dep_groundwater=dep_groundwater,
+            density_sat=density_sat,
+            OCR=ocr_value,
+            janbu_ref_stress=janbu_ref_stress,
+            janbu_const=janbu_const,
+            janbu_m=janbu_m,
+            consolidation_time=consolidation_time,
+            bVulnerability=bVulnerability,
+            fieldNameFoundation=foundation_field,
+            fieldNameStructure=structure_field,
+            fieldNameStatus=status_field,
+        )
+        if skip_calculation:
+            output_shapefiles = None
+        else:
+            n_buildings = source_building_poly.featureCount()
+            start_time = time.perf_counter()
+            try:
+                output_shapefiles = self.runCore(
+                    mainBegrensSkade_Tunnel, core_kwargs, feedback, 50, 40, temp_files, total=n_buildings, unit="buildings"
+                )
+                elapsed = time.perf_counter() - start_time
+                feedback.pushInfo(
+                    f"PROCESS - Calculated {n_buildings} buildings in {elapsed:.1f} s ({n_buildings / max(elapsed, 1e-9):.1f} buildings/s)"
+                )
+                feedback.pushInfo("PROCESS - Finished with mainBegrensSkade_Excavation...")
+                self.logger.info("PROCESS - Finished with mainBegrensSkade_Excavation...")
+            except QgsProcessingException:
+                # Canceled from the progress callback of a core that reports its progress
+                raise
+            except Exception as e:
+                error_msg = f"Unexpected error: {e}\nTraceback:\n{traceback.format_exc()}"
+                QgsMessageLog.logMessage(error_msg, level=Qgis.Critical)
+                feedback.reportError(error_msg)
+                return {}
 
         #################### HANDLE THE RESULT ###############################
+        # The core calculation can not be interrupted, a run canceled meanwhile stops before the outputs are completed and cached
+        check_canceled(feedback, temp_files, self.logger)
+        if incremental:
+            merged_outputs = self.finishIncrementalRun(
+                incremental_state,
+                incremental_plan,
+                full_building_poly,
+                output_folder,
+                None if output_shapefiles is None else dict(
+                    zip([self.OUTPUT_BUILDING, self.OUTPUT_WALL, self.OUTPUT_CORNER], output_shapefiles)
+                ),
+                self.logger,
+            )
+            output_shapefiles = [merged_outputs[self.OUTPUT_BUILDING], merged_outputs[self.OUTPUT_WALL], merged_outputs[self.OUTPUT_CORNER]]
         self.logger.info(f"PROCESS - OUTPUT BUILDINGS: {output_shapefiles[0]}")
         self.logger.info(f"PROCESS - OUTPUT WALL: {output_shapefiles[1]}")
         self.logger.info(f"PROCESS - OUTPUT CORNER: {output_shapefiles[2]}")
         feedback.pushInfo("PROCESS - Finished with processing!")
 
+        if use_cache:
+            self.storeCachedOutputs(
+                cache_key,
+                {
+                    self.OUTPUT_BUILDING: output_shapefiles[0],
+                    self.OUTPUT_WALL: output_shapefiles[1],
+                    self.OUTPUT_CORNER: output_shapefiles[2],
+                },
+                self.logger,
+            )
+
+        self.define_layers_info(output_shapefiles, bVulnerability)
+
+        feedback.setProgress(100)
+        feedback.pushInfo("PROCESS - Finished processing!")
+        # Return the results of the algorithm.
+        return {
+            self.OUTPUT_BUILDING: output_shapefiles[0],
+            self.OUTPUT_WALL: output_shapefiles[1],
+            self.OUTPUT_CORNER: output_shapefiles[2],
+        }
+
+    def define_layers_info(self, output_shapefiles, bVulnerability):
+        """
+        Defines which output layers postProcessAlgorithm adds to the project, and their styles.
+        """
         # Path to the "styles" directory
-        self.styles_dir_path = Path(__file__).resolve().parent.parent / "styles"
-        self.logger.info(f"RESULTS - Styles directory path: {self.styles_dir_path}")
+        self.logger.info(f"RESULTS - Styles directory path: {self.STYLES_DIR}")
 
         self.layers_info = {
             "TUNNEL_CORNERS-SETTLEMENT": {
@@ -913,15 +1051,6 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
                     }
                 }
             )
-
-        feedback.setProgress(100)
-        feedback.pushInfo("PROCESS - Finished processing!")
-        # Return the results of the algorithm.
-        return {
-            self.OUTPUT_BUILDING: output_shapefiles[0],
-            self.OUTPUT_WALL: output_shapefiles[1],
-            self.OUTPUT_CORNER: output_shapefiles[2],
-        }
     
     
     def postProcessAlgorithm(self, context, feedback):
@@ -930,7 +1059,11 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
         Here, we manually load the output shapefiles, apply QML styles,
         and place them under a custom group in the layer tree.
         """
+        self.removeRunTempFolder(context)
         project = context.project()
+        if project is None:
+            # Runs without a project (e.g. from a standalone script) only write the output files
+            return {}
         root = project.layerTreeRoot()
 
         # Create (or find) a group at the top level named by 'self.feature_name'.
@@ -955,7 +1088,7 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
                 continue
 
             # Load the QML style if it exists
-            style_path = self.styles_dir_path / style_name  # e.g. /path/to/styles/BUILDING-TOTAL-SETTLMENT_sv_tot.qml
+            style_path = self.STYLES_DIR / style_name  # e.g. /path/to/styles/BUILDING-TOTAL-SETTLMENT_sv_tot.qml
             if style_path.is_file():
                 layer.loadNamedStyle(str(style_path))
                 layer.triggerRepaint()
@@ -963,7 +1096,7 @@ class BegrensSkadeTunnel(GvBaseProcessingAlgorithms):
                 feedback.reportError(f"Style file not found: {style_path}")
 
             # Add the layer to the project (layer registry) *without* adding to the root TOC
-            QgsProject.instance().addMapLayer(layer, False)
+            project.addMapLayer(layer, False)
 
             # Place the layer under the group at the bottom
             group.insertLayer(-1, layer)
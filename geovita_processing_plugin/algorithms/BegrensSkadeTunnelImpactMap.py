@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterNumber,
+)
+
+from pathlib import Path
+
+from .BegrensSkadeImpactMap import BegrensSkadeImpactMap
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.settlementlib import short_term_tunnel
+from ..utilities.sitelib import (
+    MANUAL_POREPRESSURE_CURVE,
+    POREPRESSURE_CURVES,
+    check_porepressure_curve,
+    tunnel_axis_distance,
+    tunnel_corridors,
+)
+
+
+class BegrensSkadeTunnelImpactMap(BegrensSkadeImpactMap):
+    """
+    The `BegrensSkadeTunnelImpactMap` algorithm calculates the terrain settlements around a planned tunnel
+    for every cell of a grid along the tunnel corridor, the tunnel counterpart of `BegrensSkadeImpactMap`.
+
+    The short term settlement is the Gaussian settlement trough of the tunnel (volume loss and trough
+    width) around the tunnel axis, the long term settlement follows from the porewater pressure drawdown around the tunnel.
+    Both are computed with the vectorized settlement engine of the plugin: the distance from every
+    cell to the tunnel polygon is a (cached) distance field, and the cells are evaluated in chunks.
+
+    The depth to bedrock preparation, the preview, the influence zone, the lookup table, the result
+    cache and the percentile and consolidation time bands are shared with `BegrensSkadeImpactMap`.
+
+    Parameters:
+    - INPUT_TUNNEL_POLY: Polygon layer depicting the planned tunnel path.
+    - RASTER_ROCK_SURFACE: Raster layer indicating depth to bedrock.
+    - TUNNEL_DEPTH, TUNNEL_DIAM, VOLUME_LOSS, TROUGH_WIDTH: The short term settlement trough.
+    - The output and geotechnical parameters of `BegrensSkadeImpactMap`.
+
+    Outputs:
+    - OUTPUT_RASTER: A raster layer of the total settlement of every cell.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path, "BegrensSkadeII_QGIS_TUNNEL_IMPACTMAP.log", "TUNNEL_IMPACTMAP_LOGGER"
+        ).get_logger()
+        self.logger.info(f"__INIT__ - VERSION: {self.version} ")
+        self.logger.info("__INIT__ - Finished initialize BegrensSkadeTunnelImpactMap ")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "begrensskadetunnelimpactmap"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Begrens Skade - Tunnel ImpactMap")
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "The BegrensSkade Tunnel ImpactMap algorithm calculates both short-term and long-term terrain settlements caused by a tunnel, for each cell in a grid that covers the tunnel corridor (the tunnel polygon buffered by the clip distance). Like ImpactMap, it only provides total settlements as output.\nSHORT TERM\nThe short term settlement is the Gaussian settlement trough above the tunnel, given by the tunnel depth and diameter, the volume loss and the trough width parameter, at the distance from every cell to the tunnel axis. Every tunnel polygon is taken as a corridor of constant width around its own axis.\nLONG TERM\nThe long term settlement follows from the porewater pressure reduction at the tunnel, decreasing with the distance from the tunnel, and the depth to bedrock of every cell.\nVECTORIZED ENGINE\nAll cells are evaluated in chunks with the vectorized settlement engine of the plugin. The distance from every cell to the tunnel is computed once as a distance transform and cached on disk, so later runs on the same tunnel and grid load it. The preview, influence zone, lookup table, adaptive refinement, uncertainty and consolidation time options work as in ImpactMap.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BegrensSkadeTunnelImpactMap()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="impactmap.png")
+
+    INPUT_TUNNEL_POLY = "INPUT_TUNNEL_POLY"
+    SOURCE_POLY = INPUT_TUNNEL_POLY
+    VECTORIZED_ENGINE = True
+    IMPACT_MAP_NAME = "TUNNEL-IMPACT-MAP"
+
+    TUNNEL_DEPTH = ["TUNNEL_DEPTH", "Depth of tunnel [m]"]
+    TUNNEL_DIAM = ["TUNNEL_DIAM", "Diameter of tunnel [m]"]
+    VOLUME_LOSS = ["VOLUME_LOSS", "Loss of volume [%]"]
+    TROUGH_WIDTH = ["TROUGH_WIDTH", "Width of trough [m]"]
+    POREPRESSURE_ENUM_CURVES = [
+        "POREPRESSURE_ENUM",
+        "Calculation curve for pore pressure reduction (only Manual, the reduction at the tunnel)",
+    ]
+
+    def initAlgorithm(self, config):
+        """
+        The parameters of ImpactMap, with the tunnel as source and the pore pressure curve of the tunnel.
+        """
+        super().initAlgorithm(config)
+        param = QgsProcessingParameterEnum(
+            self.POREPRESSURE_ENUM_CURVES[0],
+            self.tr(f"{self.POREPRESSURE_ENUM_CURVES[1]}"),
+            POREPRESSURE_CURVES,
+            defaultValue=POREPRESSURE_CURVES.index(MANUAL_POREPRESSURE_CURVE),
+            allowMultiple=False,
+        )
+        param.setFlags(QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+    def add_source_parameter(self):
+        """Adds the input layer of the tunnel polygons."""
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.SOURCE_POLY,
+                self.tr("Input Tunnel polygon(s)"),
+                [QgsProcessing.TypeVectorPolygon],
+            )
+        )
+
+    def add_short_term_parameters(self):
+        """Adds the parameters of the settlement trough above the tunnel."""
+        param = QgsProcessingParameterNumber(
+            self.TUNNEL_DEPTH[0],
+            self.tr(f"{self.TUNNEL_DEPTH[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=15,
+            minValue=0,
+        )
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.TUNNEL_DIAM[0],
+            self.tr(f"{self.TUNNEL_DIAM[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=9.5,
+            minValue=0,
+        )
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.VOLUME_LOSS[0],
+            self.tr(f"{self.VOLUME_LOSS[1]}"),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=2,
+            minValue=0,
+        )
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.TROUGH_WIDTH[0],
+            self.tr(f"{self.TROUGH_WIDTH[1]}"),
+            QgsProcessingParameterNumber.Double,
+            defaultValue=0.5,
+            minValue=0,
+        )
+        self.addParameter(param)
+
+    def short_term_input(self, parameters, context):
+        """
+        Returns the parameters of the settlement trough, as passed to short_term_settlement().
+
+        Returns:
+            tuple: (tunnel depth, tunnel diameter, volume loss, trough width)
+        """
+        tunnel_depth = self.parameterAsDouble(parameters, self.TUNNEL_DEPTH[0], context)
+        tunnel_diameter = self.parameterAsDouble(parameters, self.TUNNEL_DIAM[0], context)
+        volume_loss = self.parameterAsInt(parameters, self.VOLUME_LOSS[0], context)
+        trough_width = self.parameterAsDouble(parameters, self.TROUGH_WIDTH[0], context)
+        return tunnel_depth, tunnel_diameter, volume_loss, trough_width
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Checks the pore pressure curve, and computes the impact map as ImpactMap does.
+        """
+        curve = POREPRESSURE_CURVES[self.parameterAsEnum(parameters, self.POREPRESSURE_ENUM_CURVES[0], context)]
+        try:
+            check_porepressure_curve(curve)
+        except ValueError as e:
+            self.logger.error(f"PROCESS - {e}")
+            feedback.reportError(f"PROCESS - {e}")
+            return {}
+        return super().processAlgorithm(parameters, context, feedback)
+
+    def short_term_settlement(self, grid, cell_index, source_poly, near_dist, short_term):
+        """
+        Short term settlement trough of cells at a distance from the tunnel axis, see
+        settlementlib.short_term_tunnel() and sitelib.tunnel_axis_distance().
+
+        Args:
+            short_term (tuple): The parameters of the trough, see short_term_input().
+            Other arguments: See BegrensSkadeImpactMap.short_term_settlement().
+        """
+        corridors = tunnel_corridors(feature.geometry() for feature in source_poly.getFeatures())
+        axis_dist = tunnel_axis_distance(near_dist, corridors, grid.cell_centers_at(cell_index))
+        sv_short, _ = short_term_tunnel(axis_dist, *short_term)
+        return sv_short
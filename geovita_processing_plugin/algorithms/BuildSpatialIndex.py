@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+from pathlib import Path
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingOutputNumber,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterMultipleLayers,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+
+from ..utilities.gui import GuiUtils
+from ..utilities.logger import CustomLogger
+from ..utilities.methodslib import ensure_spatial_index
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class BuildSpatialIndex(GvBaseProcessingAlgorithms):
+    """
+    The BuildSpatialIndex algorithm builds missing spatial indexes of building, excavation and tunnel layers.
+
+    The Excavation and Tunnel algorithms only read the buildings near the site, which is fast only if the
+    building layer has a spatial index. Shapefiles get a .qix file next to the source. Layers that can not be
+    indexed in place are converted to a GeoPackage with an R-tree index, kept in the spatial index cache.
+
+    Parameters:
+    - INPUT_LAYERS: The vector layers to index.
+    - CONVERT: Convert layers that can not be indexed in place to an indexed GeoPackage.
+
+    Outputs:
+    - OUTPUT_LAYERS: The indexed layers, the GeoPackage copy for converted layers.
+    - INDEXED_LAYERS: Number of layers that got a new spatial index.
+    - CONVERTED_LAYERS: Number of layers converted to an indexed GeoPackage.
+    """
+
+    INPUT_LAYERS = ["INPUT_LAYERS", "Building, excavation or tunnel layers"]
+    CONVERT = ["CONVERT", "Convert layers that can not be indexed in place to GeoPackage"]
+
+    OUTPUT_LAYERS = "OUTPUT_LAYERS"
+    INDEXED_LAYERS = "INDEXED_LAYERS"
+    CONVERTED_LAYERS = "CONVERTED_LAYERS"
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_SPATIAL_INDEX.log",
+            "SPATIAL_INDEX_LOGGER",
+        ).get_logger()
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return BuildSpatialIndex()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="geovita.ico")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "buildspatialindex"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Build spatial indexes")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("Utilities")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "utilities"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "Builds missing spatial indexes of building, excavation and tunnel layers, so the Excavation and Tunnel algorithms only read the buildings near the site.\nShapefiles get a .qix file next to the source. GeoPackage and FlatGeobuf layers normally have an index already and are left as they are.\nLayers that can not be indexed in place (e.g. GeoJSON, or shapefiles in a read only folder) are converted to a GeoPackage with an R-tree index. The GeoPackage is kept in the spatial index cache under the users Downloads folder in 'REMEDY/cache' and reused by the Excavation and Tunnel algorithms while the source is unchanged.\nThe Excavation and Tunnel algorithms run the same check on their inputs unless it is turned off in their advanced parameters.\nThe algorithm creates a log directory under the users Downloads folder called 'REMEDY'."
+        )
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUT_LAYERS[0],
+                self.tr(f"{self.INPUT_LAYERS[1]}"),
+                QgsProcessing.TypeVectorAnyGeometry,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.CONVERT[0],
+                self.tr(f"{self.CONVERT[1]}"),
+                defaultValue=True,
+            )
+        )
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUT_LAYERS, self.tr("Indexed layers")))
+        self.addOutput(QgsProcessingOutputNumber(self.INDEXED_LAYERS, self.tr("Layers indexed in place")))
+        self.addOutput(QgsProcessingOutputNumber(self.CONVERTED_LAYERS, self.tr("Layers converted to GeoPackage")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        layers = self.parameterAsLayerList(parameters, self.INPUT_LAYERS[0], context)
+        convert = self.parameterAsBoolean(parameters, self.CONVERT[0], context)
+        output_layers = []
+        indexed_layers = 0
+        converted_layers = 0
+        for i, layer in enumerate(layers):
+            if feedback.isCanceled():
+                break
+            indexed_layer, status = ensure_spatial_index(layer, convert=convert, logger=self.logger)
+            if status == "created":
+                indexed_layers += 1
+            elif status == "converted":
+                converted_layers += 1
+            elif status == "unsupported":
+                feedback.reportError(f"PROCESS - {layer.name()} can not be indexed: {layer.source()}")
+            feedback.pushInfo(f"PROCESS - Spatial index of {layer.name()}: {status}")
+            output_layers.append(indexed_layer.source())
+            feedback.setProgress(100 * (i + 1) / len(layers))
+        return {
+            self.OUTPUT_LAYERS: output_layers,
+            self.INDEXED_LAYERS: indexed_layers,
+            self.CONVERTED_LAYERS: converted_layers,
+        }
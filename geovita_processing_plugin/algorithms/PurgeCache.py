@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin
+                                 A QGIS plugin
+ This plugin adds different geovita processing plugins
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2024-01-17
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024-01-17"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from pathlib import Path
+
+from qgis.core import (
+    QgsProcessingOutputNumber,
+    QgsProcessingParameterEnum,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+
+from ..utilities.cache import (
+    get_distance_cache,
+    get_overview_cache,
+    get_reprojection_cache,
+    get_result_cache,
+    get_spatial_index_cache,
+)
+from ..utilities.gui import GuiUtils
+from ..utilities.incremental import get_incremental_cache
+from ..utilities.logger import CustomLogger
+from .base_algorithm import GvBaseProcessingAlgorithms
+
+
+class PurgeCache(GvBaseProcessingAlgorithms):
+    """
+    The PurgeCache algorithm removes cached data written by the REMEDY algorithms.
+
+    The caches are bounded in size and evict the least recently used entries automatically.
+    This algorithm empties them manually, e.g. to free disk space or to force a recomputation.
+
+    Parameters:
+    - CACHES: Which caches to empty.
+
+    Outputs:
+    - REMOVED_ENTRIES: Number of removed cache entries.
+    - FREED_BYTES: Number of bytes freed on disk.
+    """
+
+    CACHES = ["CACHES", "Caches to purge"]
+    enum_caches = ["Results", "Reprojections", "Incremental runs", "Distance fields", "Raster overviews", "Spatial indexes"]
+
+    REMOVED_ENTRIES = "REMOVED_ENTRIES"
+    FREED_BYTES = "FREED_BYTES"
+
+    def __init__(self):
+        super().__init__()
+
+        # Initialize the logger in the users download folder
+        home_dir = Path.home()
+        log_dir_path = home_dir / "Downloads" / "REMEDY" / "log"
+        self.logger = CustomLogger(
+            log_dir_path,
+            "BegrensSkadeII_QGIS_CACHE.log",
+            "CACHE_LOGGER",
+        ).get_logger()
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return PurgeCache()
+
+    def icon(self):
+        """
+        Should return a QIcon which is used for your provider inside
+        the Processing toolbox.
+        """
+        return GuiUtils.get_icon(icon="geovita.ico")
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "purgecache"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Purge cached results")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr("Utilities")
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "utilities"
+
+    def shortHelpString(self):
+        """
+        Returns a localised short help string for the algorithm.
+        """
+        return self.tr(
+            "Removes cached data written by the REMEDY algorithms.\nResults: outputs of earlier Excavation, Tunnel and Impact Map runs, reused when a run with identical inputs and parameters is repeated.\nReprojections: building, excavation, tunnel and DTB layers reprojected to the output CRS, reused until the source file changes.\nIncremental runs: per-building results of the last incremental Excavation and Tunnel run for each parameter set.\nDistance fields: distance from every impact map cell to the excavation, reused by Impact Map runs with the same excavation, grid and clipping range.\nRaster overviews: reduced resolution copies of high resolution DTB rasters, read when the impact map grid is coarser than the DTB.\nSpatial indexes: indexed GeoPackage copies of building layers that could not be indexed in place. Shapefile .qix files are stored next to the source and are not removed.\nThe caches are stored under the users Downloads folder in 'REMEDY/cache'. They are bounded in size and the least recently used entries are removed automatically, so purging is only needed to free disk space or force a recomputation."
+        )
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.CACHES[0],
+                self.tr(f"{self.CACHES[1]}"),
+                self.enum_caches,
+                defaultValue=list(range(len(self.enum_caches))),
+                allowMultiple=True,
+            )
+        )
+        self.addOutput(QgsProcessingOutputNumber(self.REMOVED_ENTRIES, self.tr("Removed cache entries")))
+        self.addOutput(QgsProcessingOutputNumber(self.FREED_BYTES, self.tr("Freed bytes")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        selected = self.parameterAsEnums(parameters, self.CACHES[0], context)
+        caches = {
+            "Results": get_result_cache,
+            "Reprojections": get_reprojection_cache,
+            "Incremental runs": get_incremental_cache,
+            "Distance fields": get_distance_cache,
+            "Raster overviews": get_overview_cache,
+            "Spatial indexes": get_spatial_index_cache,
+        }
+        removed_entries = 0
+        freed_bytes = 0
+        for index in selected:
+            cache_name = self.enum_caches[index]
+            count, size = caches[cache_name](self.logger).purge()
+            feedback.pushInfo(f"PROCESS - Purged {cache_name} cache: {count} entries, {size / 1024 ** 2:.1f} MB")
+            removed_entries += count
+            freed_bytes += size
+        return {self.REMOVED_ENTRIES: removed_entries, self.FREED_BYTES: freed_bytes}
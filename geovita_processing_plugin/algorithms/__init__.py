@@ -1,6 +1,13 @@
 """
 Geovita algorithms
 """
+from .BegrensSkadeBatchSites import BegrensSkadeBatchSites
+from .BegrensSkadeCombinedImpact import BegrensSkadeCombinedImpact
 from .BegrensSkadeExcavation import BegrensSkadeExcavation
 from .BegrensSkadeImpactMap import BegrensSkadeImpactMap
-from .BegrensSkadeTunnel import BegrensSkadeTunnel
\ No newline at end of file
+from .BegrensSkadeMonteCarlo import BegrensSkadeMonteCarlo
+from .BegrensSkadeScenarioSweep import BegrensSkadeScenarioSweep
+from .BegrensSkadeTunnel import BegrensSkadeTunnel
+from .BegrensSkadeTunnelImpactMap import BegrensSkadeTunnelImpactMap
+from .BuildSpatialIndex import BuildSpatialIndex
+from .PurgeCache import PurgeCache
@@ -30,14 +30,271 @@ __copyright__ = '(C) 2024 by DPE'
 
 __revision__ = '$Format:%H$'
 
-from qgis.core import (QgsProcessingAlgorithm)
+from qgis.core import (Qgis,
+                       QgsProcessingAlgorithm,
+                       QgsVectorLayer)
+
+from pathlib import Path
+import logging
+import shutil
+import threading
 
 from geovita_processing_plugin import __version__  # Import version from package's __init__.py
+from ..utilities.cache import (
+    fingerprint_parameters,
+    fingerprint_raster_layer,
+    fingerprint_vector_layer,
+    get_result_cache,
+)
+from ..utilities.incremental import (
+    IncrementalState,
+    building_fingerprints,
+    merge_outputs,
+    plan_incremental,
+    write_building_subset,
+)
+from ..utilities.logger import RunLogger
+from ..utilities.methodslib import (
+    create_run_temp_folder,
+    create_temp_folder_for_version,
+    get_file_components,
+    remove_run_temp_folder,
+)
+from ..utilities.progress import CoreHeartbeat, ProgressReporter, accepts_progress
 
 
 class GvBaseProcessingAlgorithms(QgsProcessingAlgorithm):
     """
     Base class for Geovita algorithms.
     """
+    # Parameters that do not change the computed result, and are left out of the result cache key
+    CACHE_EXCLUDED_PARAMETERS = ["OUTPUT_FOLDER", "USE_CACHE", "INCREMENTAL", "BUILD_SPATIAL_INDEX"]
+    # QML styles of the output layers
+    STYLES_DIR = Path(__file__).resolve().parent.parent / "styles"
+    # Attributes that only describe one run, and are not carried over to copies of the algorithm
+    RUN_STATE = ("feature_name", "layers_info", "run_temp_folder")
+
     def getVersion(self):
-        return __version__
\ No newline at end of file
+        return __version__
+
+    def flags(self):
+        """
+        The algorithms run in background threads and in parallel in batch processing (no FlagNoThreading).
+
+        QGIS runs every execution on its own instance (createInstance()), the run state is reset in
+        prepareAlgorithm(), temporary files go to a folder of their own per run and the layers are only
+        added to the project in postProcessAlgorithm(), on the main thread.
+        """
+        return super().flags() | QgsProcessingAlgorithm.FlagSupportsBatch | QgsProcessingAlgorithm.FlagCanCancel
+
+    def resetRunState(self):
+        """Clears the run state, set by processAlgorithm() and read by postProcessAlgorithm()."""
+        self.feature_name = None
+        self.layers_info = {}
+        self.run_temp_folder = None
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """
+        Starts a run: resets the run state, creates the temporary folder of the run, and tags the log lines
+        of the run with its number, as runs of the same algorithm in parallel share its log file.
+        """
+        self.resetRunState()
+        self.run_temp_folder = create_run_temp_folder(Qgis.QGIS_VERSION_INT, context)
+        if hasattr(self, "logger"):
+            self.logger = RunLogger(getattr(self.logger, "logger", self.logger))
+            self.logger.info(f"PREPARE - Run of {self.name()} in thread {threading.get_ident()}")
+            self.logger.info(f"PREPARE - Temporary folder: {self.run_temp_folder}")
+        return True
+
+    def removeRunTempFolder(self, context):
+        """
+        Removes the temporary folder of the run, called from postProcessAlgorithm(). A canceled run
+        removes it with its temporary files, see check_canceled().
+        """
+        if self.run_temp_folder is not None:
+            remove_run_temp_folder(self.run_temp_folder, context, getattr(self, "logger", None))
+            self.run_temp_folder = None
+
+    def __getstate__(self):
+        """
+        State of copies of the algorithm: its configuration without the run state, and the logger by name.
+        """
+        state = {name: value for name, value in self.__dict__.items() if name not in self.RUN_STATE and name != "logger"}
+        if "logger" in self.__dict__:
+            state["logger"] = getattr(self.logger, "logger", self.logger).name
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        if "logger" in state:
+            state["logger"] = logging.getLogger(state["logger"])
+        self.__dict__.update(state)
+        self.resetRunState()
+
+    def getCacheKey(self, parameters, context, exclude=()):
+        """
+        Returns a key identifying the outputs of a run.
+
+        The key is a hash of the algorithm name, the plugin version and every parameter value.
+        Input layers are represented by their fingerprint (source, feature count, extent, CRS and
+        modification time or content hash), so editing an input invalidates the cached result.
+        Parameters in 'exclude' are left out of the key.
+        """
+        values = {}
+        for definition in self.parameterDefinitions():
+            name = definition.name()
+            if name in self.CACHE_EXCLUDED_PARAMETERS or name in exclude or definition.isDestination():
+                continue
+            param_type = definition.type()
+            if param_type in ("source", "vector"):
+                values[name] = fingerprint_vector_layer(self.parameterAsVectorLayer(parameters, name, context))
+            elif param_type == "raster":
+                values[name] = fingerprint_raster_layer(self.parameterAsRasterLayer(parameters, name, context))
+            elif param_type == "crs":
+                crs = self.parameterAsCrs(parameters, name, context)
+                values[name] = crs.authid() or crs.toWkt()
+            else:
+                values[name] = definition.valueAsPythonString(
+                    parameters.get(name, definition.defaultValue()), context
+                )
+        return fingerprint_parameters(self.name(), self.getVersion(), values)
+
+    def progressCallback(self, feedback, start, span, temp_files=(), logger=None, total=None, unit="items"):
+        """
+        Returns a progress callback for the chunked loops of the vectorized engine and the REMEDY core.
+
+        The callback maps the fraction of the loop to start..start + span percent of the run (span 0
+        leaves the progress bar as it is), and is a cancellation checkpoint: a canceled run stops
+        after the current chunk. With the number of items of the loop it also reports the throughput
+        and the estimated time left, see progress.ProgressReporter.
+
+        Args:
+            feedback (QgsProcessingFeedback): The feedback of the run.
+            start (float): Progress at the start of the loop [%].
+            span (float): Progress of the whole loop [%].
+            temp_files (list): Temporary files of the run, removed when it is canceled.
+            total (int, optional): Number of items (buildings, corners, cells, ...) of the loop.
+            unit (str): Name of the items.
+        """
+        return ProgressReporter(feedback, start, span, total, unit, temp_files, logger)
+
+    def runCore(self, function, core_kwargs, feedback, start, span, temp_files=(), total=None, unit="items"):
+        """
+        Calls a REMEDY core function, with the progress of the call mapped to start..start + span percent.
+
+        A core whose signature takes a 'progress' argument gets a progress callback and reports its
+        progress per building batch or raster tile. Other cores run under a CoreHeartbeat, which
+        estimates the progress from the elapsed time and the throughput of the core in previous runs.
+
+        Args:
+            function (callable): The REMEDY core, e.g. mainBegrensSkade_Excavation.
+            core_kwargs (dict): Keyword arguments of the core.
+            total (int, optional): Number of items (buildings, cells) of the call.
+            unit (str): Name of the items.
+
+        Returns:
+            The return value of the core.
+        """
+        if accepts_progress(function):
+            return function(
+                **core_kwargs,
+                progress=self.progressCallback(feedback, start, span, temp_files, self.logger, total, unit),
+            )
+        with CoreHeartbeat(feedback, start, span, total, unit, function.__name__, logger=self.logger):
+            return function(**core_kwargs)
+
+    def restoreCachedOutputs(self, cache_key, output_folder, logger=None):
+        """
+        Copies the cached outputs of an identical run into 'output_folder'.
+
+        Returns:
+            dict or None: Output name -> file path, or None if the run is not cached.
+        """
+        cached_files = get_result_cache(logger).get(cache_key)
+        if cached_files is None:
+            return None
+        outputs = {}
+        try:
+            for output_name, cached_path in cached_files.items():
+                for component in get_file_components(cached_path):
+                    shutil.copy2(str(component), str(Path(output_folder) / component.name))
+                outputs[output_name] = str(Path(output_folder) / cached_path.name)
+        except OSError as e:
+            # The entry may have been evicted by a concurrent run, fall back to computing
+            if logger:
+                logger.warning(f"Could not restore cached outputs: {e}")
+            return None
+        return outputs
+
+    def storeCachedOutputs(self, cache_key, outputs, logger=None):
+        """
+        Stores the outputs of a run in the result cache. A failure to cache never fails the run.
+
+        Args:
+            cache_key (str): Key from getCacheKey().
+            outputs (dict): Output name -> file path.
+        """
+        try:
+            get_result_cache(logger).put(cache_key, outputs)
+        except OSError as e:
+            if logger:
+                logger.warning(f"Could not store outputs in the result cache: {e}")
+
+    def prepareIncrementalRun(self, parameters, context, building_parameter, building_layer, output_names, feedback, logger=None):
+        """
+        Loads the previous run with the same parameters (except the buildings) and selects the buildings to recompute.
+
+        Returns:
+            tuple: (state, plan, building_layer) The plan is None if there is no previous run, in which case
+            all buildings are computed. The returned building layer holds the buildings to send to the calculation.
+        """
+        state = IncrementalState(
+            self.getCacheKey(parameters, context, exclude=[building_parameter]), output_names, logger
+        )
+        state.current = building_fingerprints(building_layer)
+        if not state.load():
+            feedback.pushInfo("PROCESS - Incremental mode: No previous run with these parameters, computing all buildings.")
+            return state, None, building_layer
+
+        plan = plan_incremental(state.fingerprints, state.current)
+        feedback.pushInfo(
+            f"PROCESS - Incremental mode: {len(plan.changed)} changed, {len(plan.added)} added and {len(plan.deleted)} deleted buildings. "
+            f"Recomputing {len(plan.recompute)} of {len(state.current)} buildings (including touching neighbours)."
+        )
+        if logger:
+            logger.info(f"PROCESS - Incremental plan: {plan}")
+        if not plan.recompute:
+            return state, plan, None
+
+        temp_folder = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context)
+        subset_path = write_building_subset(building_layer, plan.recompute, temp_folder / f"incremental_{building_layer.name()}.shp")
+        subset_layer = QgsVectorLayer(subset_path, f"incremental_{building_layer.name()}", "ogr")
+        return state, plan, subset_layer
+
+    def finishIncrementalRun(self, state, plan, building_layer, output_folder, outputs, logger=None):
+        """
+        Merges the recomputed outputs into the previous outputs, and stores the result as the new state.
+
+        Args:
+            state (IncrementalState): From prepareIncrementalRun().
+            plan (IncrementalPlan): From prepareIncrementalRun(), None if all buildings were computed.
+            building_layer (QgsVectorLayer): The complete building layer.
+            output_folder (str): The output folder.
+            outputs (dict): Output name -> path of the calculated output, or None if nothing was recomputed.
+
+        Returns:
+            dict: Output name -> path of the complete output.
+        """
+        if plan is not None:
+            merged = {}
+            for name in state.output_names:
+                previous_path = state.previous_output(name)
+                new_path = outputs[name] if outputs is not None else None
+                output_path = new_path or str(Path(output_folder) / Path(previous_path).name)
+                merge_outputs(previous_path, state.kept_fids(name, plan.dropped), new_path, output_path)
+                merged[name] = output_path
+            outputs = merged
+        state.save(building_layer, state.current, outputs)
+        if logger:
+            logger.info(f"PROCESS - Stored incremental state {state.key}")
+        return outputs
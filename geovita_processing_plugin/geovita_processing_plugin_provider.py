@@ -33,9 +33,16 @@ __revision__ = '$Format:%H$'
 from qgis.core import QgsProcessingProvider
 
 from geovita_processing_plugin.algorithms import (
+    BegrensSkadeBatchSites,
+    BegrensSkadeCombinedImpact,
     BegrensSkadeExcavation,
     BegrensSkadeImpactMap,
-    BegrensSkadeTunnel
+    BegrensSkadeMonteCarlo,
+    BegrensSkadeScenarioSweep,
+    BegrensSkadeTunnel,
+    BegrensSkadeTunnelImpactMap,
+    BuildSpatialIndex,
+    PurgeCache,
 )
 
 from geovita_processing_plugin.utilities.gui import GuiUtils
@@ -60,7 +67,18 @@ class GeovitaProcessingPluginProvider(QgsProcessingProvider):
         """
         Loads all algorithms belonging to this provider.
         """
-        for alg in [BegrensSkadeExcavation, BegrensSkadeImpactMap, BegrensSkadeTunnel]:
+        for alg in [
+            BegrensSkadeExcavation,
+            BegrensSkadeImpactMap,
+            BegrensSkadeTunnel,
+            BegrensSkadeTunnelImpactMap,
+            BegrensSkadeScenarioSweep,
+            BegrensSkadeMonteCarlo,
+            BegrensSkadeBatchSites,
+            BegrensSkadeCombinedImpact,
+            BuildSpatialIndex,
+            PurgeCache,
+        ]:
             self.addAlgorithm(alg())
         # add additional algorithms here
         # self.addAlgorithm(MyOtherAlgorithm())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+from qgis import processing
+
+from qgis.testing import unittest
+from qgis.core import (
+    QgsApplication,
+    QgsProcessingFeedback,
+    QgsVectorLayer,
+    QgsCoordinateReferenceSystem,
+    QgsRasterLayer,
+    QgsProcessingContext,
+)
+
+import logging
+from pathlib import Path
+
+from geovita_processing_plugin.geovita_processing_plugin_provider import (
+    GeovitaProcessingPluginProvider,
+)
+
+# Set up logging at the beginning of your test file
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class TestBegrensSkadeTunnelImpactMap(unittest.TestCase):
+    def setUp(self):
+        if not QgsApplication.processingRegistry().providers():
+            self.provider = GeovitaProcessingPluginProvider()
+            QgsApplication.processingRegistry().addProvider(self.provider)
+
+        # Use pathlib to get the base directory (where this test file resides)
+        base_dir = Path(__file__).parent
+        # Define the path to the data directory relative to this file
+        self.data_dir = base_dir / "data"
+
+        self.output_data_dir = self.data_dir / "output"
+        # Make sure the output directory exists
+        self.output_data_dir.mkdir(parents=True, exist_ok=True)
+
+        # Construct paths to your test datasets within the data directory
+        self.tunnel_layer_path = self.data_dir / "tunnel.shp"
+        self.raster_rock_surface_path = self.data_dir / "DTB-dummy-25833-clip.tif"
+
+        self.tunnel_layer = QgsVectorLayer(
+            str(self.tunnel_layer_path), "test_tunnel", "ogr"
+        )
+        self.raster_rock_surface_layer = QgsRasterLayer(
+            str(self.raster_rock_surface_path), "test_DTB-dummy-25833-clip"
+        )
+
+        # Ensure layers are valid
+        self.assertTrue(self.tunnel_layer.isValid(), "Tunnel layer failed to load.")
+        self.assertTrue(
+            self.raster_rock_surface_layer.isValid(),
+            "Raster rock surface layer failed to load.",
+        )
+
+        # Output CRS
+        self.out_crs = QgsCoordinateReferenceSystem("EPSG:5110")
+        self.assertTrue(self.out_crs.isValid(), "OUTPUT CRS is invalid!")
+
+        # # Set parameters
+        self.params = {
+            "INPUT_TUNNEL_POLY": self.tunnel_layer,
+            "RASTER_ROCK_SURFACE": self.raster_rock_surface_layer,
+            "OUTPUT_FOLDER": str(self.output_data_dir),
+            "OUTPUT_FEATURE_NAME": "test_output-tunnel-impactmap",
+            "OUTPUT_CRS": self.out_crs,
+            "OUTPUT_RESOLUTION": 10,
+            "SHORT_TERM_SETTLEMENT": True,
+            "TUNNEL_DEPTH": 10.0,
+            "TUNNEL_DIAM": 9.5,
+            "VOLUME_LOSS": 2,
+            "TROUGH_WIDTH": 0.5,
+            "CLIPPING_RANGE": 150,
+            "POREWP_REDUCTION_M": 6,
+            "DRY_CRUST_THICKNESS": 5.0,
+            "DEPTH_GROUNDWATER": 3,
+            "SOIL_DENSITY": 18.5,
+            "OCR": 1.2,
+            "JANBU_REF_STRESS": 50,
+            "JANBU_CONSTANT": 4,
+            "JANBU_COMP_MODULUS": 15,
+            "CONSOLIDATION_TIME": 10,
+            "USE_CACHE": False,
+        }
+
+    def run_algorithm(self, params):
+        results = processing.run(
+            "geovita:begrensskadetunnelimpactmap",
+            params,
+            feedback=QgsProcessingFeedback(),
+            context=QgsProcessingContext(),
+        )
+        self.assertTrue(Path(results["OUTPUT_RASTER"]).exists())
+        output_raster = QgsRasterLayer(results["OUTPUT_RASTER"], "Output Raster")
+        self.assertTrue(output_raster.isValid(), "Output raster layer is not valid.")
+        return output_raster
+
+    def test_algorithm_execution_all(self):
+        """Test executing the BegrensSkadeTunnelImpactMap algorithm with a basic set of parameters."""
+        self.run_algorithm(self.params)
+
+    def test_short_term_trough(self):
+        """The settlement trough is added to the long term settlement of the cells above the tunnel."""
+        params_long = self.params.copy()
+        params_long["SHORT_TERM_SETTLEMENT"] = False
+        params_long["OUTPUT_FEATURE_NAME"] = "test_output-tunnel-impactmap-long"
+        output_all = self.run_algorithm(self.params)
+        output_long = self.run_algorithm(params_long)
+
+        # A point on the tunnel, in the output CRS
+        tunnel_output = processing.run(
+            "native:reprojectlayer",
+            {"INPUT": self.tunnel_layer, "TARGET_CRS": self.out_crs, "OUTPUT": "memory:"},
+        )["OUTPUT"]
+        point = next(tunnel_output.getFeatures()).geometry().pointOnSurface().asPoint()
+        value_all, ok_all = output_all.dataProvider().sample(point, 1)
+        value_long, ok_long = output_long.dataProvider().sample(point, 1)
+        self.assertTrue(ok_all and ok_long, "Failed to sample the rasters on the tunnel")
+        self.assertGreater(value_all, value_long)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import math
+
+import numpy as np
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.batchlib import merge_site_values, site_jsons
+from geovita_processing_plugin.utilities.sitelib import PreparedSite
+
+
+def square_buildings(origins, size=10.0):
+    """A prepared site of square buildings with their lower left corner at 'origins'."""
+    site = PreparedSite()
+    site.corner_xy = np.vstack([np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]]) for x, y in origins])
+    n = len(origins)
+    site.building_ids = np.arange(n)
+    site.corner_building = np.repeat(np.arange(n), 4)
+    site.corner_offsets = np.arange(n) * 4
+    site.wall_offsets = np.arange(n) * 4
+    corners = np.arange(4 * n).reshape(n, 4)
+    site.wall_start = corners.ravel()
+    site.wall_end = np.roll(corners, -1, axis=1).ravel()
+    site.wall_length = np.linalg.norm(site.corner_xy[site.wall_end] - site.corner_xy[site.wall_start], axis=1)
+    return site
+
+
+class TestBatchLib(unittest.TestCase):
+    def test_site_jsons(self):
+        """The polygons are split by site id, polygons without a site id are left out."""
+        def polygon(site):
+            return {"attributes": {"site": site}, "geometry": {"rings": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}}
+
+        sites = site_jsons({"features": [polygon("A"), polygon(" B "), polygon("A"), polygon(None), polygon("")]}, "site")
+        self.assertEqual(sorted(sites), ["A", "B"])
+        self.assertEqual(len(sites["A"]["features"]), 2)
+        self.assertEqual(len(sites["B"]["features"]), 1)
+
+    def test_merge_site_values(self):
+        """A building of several sites gets the largest value of every attribute, and the governing site."""
+        merged = merge_site_values({
+            7: [
+                ("A", {"max_sv_tot": 0.02, "max_angle": 0.003, "risk_tots": 2}),
+                ("B", {"max_sv_tot": 0.05, "max_angle": 0.001, "risk_tots": None}),
+            ],
+            8: [("A", {"max_sv_tot": math.nan, "max_angle": 0.002, "risk_tots": 1})],
+        })
+        self.assertEqual(merged[7], ("B", {"max_sv_tot": 0.05, "max_angle": 0.003, "risk_tots": 2}))
+        self.assertEqual(merged[8][0], "A")
+        self.assertTrue(math.isnan(merged[8][1]["max_sv_tot"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.testing import unittest
+
+import multiprocessing
+import os
+import shutil
+import time
+from pathlib import Path
+
+from osgeo import gdal
+from qgis.core import Qgis, QgsProcessingContext, QgsRasterLayer, QgsVectorLayer
+
+from geovita_processing_plugin.utilities.cache import (
+    DiskCache,
+    fingerprint_raster_layer,
+    overview_cache_key,
+    reprojection_cache_key,
+)
+from geovita_processing_plugin.utilities.methodslib import (
+    copy_file_components,
+    create_run_temp_folder,
+    create_temp_folder_for_version,
+    ensure_spatial_index,
+    get_file_components,
+    remove_run_temp_folder,
+    remove_temp_files,
+)
+
+
+def put_entries(root, keys, path):
+    """Puts entries into a cache, in a process of its own."""
+    cache = DiskCache(root, max_size=1024 ** 3)
+    for key in keys:
+        cache.put(key, {"buildings": path})
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        base_dir = Path(__file__).parent
+        self.data_dir = base_dir / "data"
+        self.output_data_dir = self.data_dir / "output" / "cache"
+        shutil.rmtree(self.output_data_dir, ignore_errors=True)
+        self.output_data_dir.mkdir(parents=True, exist_ok=True)
+        self.building_layer_path = self.data_dir / "bygninger.shp"
+
+    def test_put_get_purge(self):
+        """Cached shapefiles are restored with all components and removed by purge."""
+        cache = DiskCache(self.output_data_dir / "results", max_size=1024 ** 3)
+        self.assertIsNone(cache.get("missing"))
+
+        cache.put("key", {"buildings": self.building_layer_path})
+        files = cache.get("key")
+        self.assertIsNotNone(files)
+        self.assertTrue(files["buildings"].is_file())
+        self.assertTrue(files["buildings"].with_suffix(".dbf").is_file())
+        self.assertGreater(cache.size(), 0)
+
+        count, size = cache.purge()
+        self.assertEqual(count, 1)
+        self.assertGreater(size, 0)
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.size(), 0)
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted when the cache grows beyond its size."""
+        entry_size = sum(path.stat().st_size for path in get_file_components(self.building_layer_path))
+        cache = DiskCache(self.output_data_dir / "lru", max_size=int(entry_size * 2.5))
+        cache.put("first", {"buildings": self.building_layer_path})
+        time.sleep(0.01)
+        cache.put("second", {"buildings": self.building_layer_path})
+        time.sleep(0.01)
+        # Touch the first entry so the second becomes the least recently used
+        self.assertIsNotNone(cache.get("first"))
+        time.sleep(0.01)
+        cache.put("third", {"buildings": self.building_layer_path})
+
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("third"))
+
+    def test_concurrent_processes(self):
+        """Processes sharing a cache keep all their entries in the index."""
+        root = self.output_data_dir / "shared"
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=put_entries, args=(root, [f"{number}-{key}" for key in range(5)], self.building_layer_path))
+            for number in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        cache = DiskCache(root, max_size=1024 ** 3)
+        for number in range(4):
+            for key in range(5):
+                self.assertIsNotNone(cache.get(f"{number}-{key}"))
+        self.assertEqual(list(root.glob("index.json.*.tmp")), [])
+
+    def test_vrt_fingerprint(self):
+        """Editing a source tile of a VRT changes the fingerprint and the overview key of the VRT."""
+        tile_path = self.output_data_dir / "tile.tif"
+        shutil.copy2(self.data_dir / "DTB-dummy-25833-clip.tif", tile_path)
+        vrt_path = self.output_data_dir / "mosaic.vrt"
+        gdal.BuildVRT(str(vrt_path), [str(tile_path)]).FlushCache()
+        layer = QgsRasterLayer(str(vrt_path), "mosaic")
+        fingerprint = fingerprint_raster_layer(layer)
+        overview_key = overview_cache_key(vrt_path)
+        self.assertIn(tile_path.name, [Path(file_name).name for file_name, _, _ in fingerprint["files"]])
+
+        stat = tile_path.stat()
+        os.utime(tile_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(fingerprint_raster_layer(layer), fingerprint)
+        self.assertNotEqual(overview_cache_key(vrt_path), overview_key)
+
+    def test_copy_file_components(self):
+        """Restoring a cached file renames every component, including double extensions."""
+        raster_path = self.data_dir / "DTB-dummy-25833-clip.tif"
+        destination = self.output_data_dir / "reprojected_DTB.tif"
+        copy_file_components(raster_path, destination)
+        self.assertTrue(destination.is_file())
+        self.assertTrue((self.output_data_dir / "reprojected_DTB.tif.aux.xml").is_file())
+
+        destination = self.output_data_dir / "reprojected_buildings.shp"
+        copy_file_components(self.building_layer_path, destination)
+        for extension in [".shp", ".shx", ".dbf", ".prj"]:
+            self.assertTrue(destination.with_suffix(extension).is_file(), extension)
+
+    def test_run_temp_folder(self):
+        """A run gets one temporary folder, a child run its own, and the folders are removed with their files."""
+        context = QgsProcessingContext()
+        parent = create_run_temp_folder(Qgis.QGIS_VERSION_INT, context)
+        self.assertEqual(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context), parent)
+        self.assertEqual(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context), parent)
+
+        child = create_run_temp_folder(Qgis.QGIS_VERSION_INT, context)
+        self.assertNotEqual(child, parent)
+        self.assertEqual(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context), child)
+        (child / "temp.txt").write_text("temporary")
+        remove_run_temp_folder(child, context)
+        self.assertFalse(child.exists())
+        self.assertEqual(create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context), parent)
+
+        # A canceled run removes its folder with its temporary files, later calls get a new folder
+        (parent / "temp.txt").write_text("temporary")
+        remove_temp_files([parent])
+        self.assertFalse(parent.exists())
+        other = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context)
+        self.assertNotIn(other, (parent, child))
+        remove_run_temp_folder(parent, context)
+        shutil.rmtree(other)
+
+    def test_ensure_spatial_index(self):
+        """A shapefile without .qix is indexed once, and the new index does not change its cache keys."""
+        building_path = self.output_data_dir / "bygninger.shp"
+        copy_file_components(self.building_layer_path, building_path)
+        layer = QgsVectorLayer(str(building_path), "bygninger", "ogr")
+        key = reprojection_cache_key(layer, layer.crs())
+
+        indexed_layer, status = ensure_spatial_index(layer)
+        self.assertEqual(status, "created")
+        # The index is built through a layer of the calling thread, on the same source
+        self.assertEqual(indexed_layer.source(), layer.source())
+        self.assertTrue(building_path.with_suffix(".qix").is_file())
+
+        layer = QgsVectorLayer(str(building_path), "bygninger", "ogr")
+        self.assertEqual(ensure_spatial_index(layer)[1], "present")
+        self.assertEqual(reprojection_cache_key(layer, layer.crs()), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.testing import unittest
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRasterLayer,
+    QgsVectorLayer,
+)
+
+import logging
+import shutil
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal
+
+from geovita_processing_plugin.geovita_processing_plugin_provider import (
+    GeovitaProcessingPluginProvider,
+)
+from geovita_processing_plugin.utilities.comparison import (
+    ENGINE_ABS_TOL,
+    ENGINE_FIELDS,
+    ENGINE_REL_TOL,
+    DifferentialHarness,
+    cached_runner,
+    compare_arrays,
+    compare_raster_outputs,
+    compare_vector_outputs,
+    create_synthetic_site,
+    incremental_runner,
+    move_buildings,
+    processing_runner,
+    zone_mask,
+)
+
+# Set up logging at the beginning of your test file
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class TestDifferentialHarness(unittest.TestCase):
+    def setUp(self):
+        if not QgsApplication.processingRegistry().providers():
+            self.provider = GeovitaProcessingPluginProvider()
+            QgsApplication.processingRegistry().addProvider(self.provider)
+
+        # Use pathlib to get the base directory (where this test file resides)
+        base_dir = Path(__file__).parent
+        # Define the path to the data directory relative to this file
+        self.data_dir = base_dir / "data"
+
+        self.output_data_dir = self.data_dir / "output" / "differential"
+        # Make sure the output directory exists
+        self.output_data_dir.mkdir(parents=True, exist_ok=True)
+
+        self.building_layer_path = self.data_dir / "bygninger.shp"
+        self.excavation_layer_path = self.data_dir / "byggegrop.shp"
+        self.raster_rock_surface_path = self.data_dir / "DTB-dummy-25833-clip.tif"
+
+        # Output CRS
+        self.out_crs = QgsCoordinateReferenceSystem("EPSG:5110")
+        self.assertTrue(self.out_crs.isValid(), "OUTPUT CRS is invalid!")
+
+        self.excavation_params = {
+            "INPUT_BUILDING_POLY": QgsVectorLayer(str(self.building_layer_path), "test_bygninger", "ogr"),
+            "INPUT_EXCAVATION_POLY": QgsVectorLayer(str(self.excavation_layer_path), "test_byggegrop", "ogr"),
+            "OUTPUT_CRS": self.out_crs,
+            "SHORT_TERM_SETTLEMENT": True,
+            "EXCAVATION_DEPTH": 10.0,
+            "SETTLEMENT_ENUM": 1,  # index
+            "LONG_TERM_SETTLEMENT": True,
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(self.raster_rock_surface_path), "test_DTB-dummy-25833-clip"),
+            "POREWP_REDUCTION_M": 10,
+            "DRY_CRUST_THICKNESS": 5.0,
+            "DEPTH_GROUNDWATER": 3,
+            "SOIL_DENSITY": 18.5,
+            "OCR": 1.2,
+            "JANBU_REF_STRESS": 50,
+            "JANBU_CONSTANT": 4,
+            "JANBU_COMP_MODULUS": 15,
+            "CONSOLIDATION_TIME": 10,
+            "VULNERABILITY_ANALYSIS": False,
+            "OUTPUT_FEATURE_NAME": "test_output-differential",
+        }
+
+    def synthetic_params(self, algorithm, seed=1):
+        """
+        Parameters of 'algorithm' ("excavation", "tunnel" or "impactmap") on a generated site.
+        The tunnel is a long and narrow source polygon.
+        """
+        site = create_synthetic_site(
+            self.output_data_dir / f"site_{algorithm}",
+            self.out_crs,
+            n_buildings=20,
+            seed=seed,
+            excavation_size=(300.0, 10.0) if algorithm == "tunnel" else (60.0, 30.0),
+        )
+        params = {
+            "INPUT_BUILDING_POLY": QgsVectorLayer(str(site["buildings"]), "synthetic_buildings", "ogr"),
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(site["dtb"]), "synthetic_dtb"),
+            "OUTPUT_CRS": self.out_crs,
+            "SHORT_TERM_SETTLEMENT": True,
+            "LONG_TERM_SETTLEMENT": True,
+            "DRY_CRUST_THICKNESS": 5.0,
+            "DEPTH_GROUNDWATER": 3,
+            "SOIL_DENSITY": 18.5,
+            "OCR": 1.2,
+            "JANBU_REF_STRESS": 50,
+            "JANBU_CONSTANT": 4,
+            "JANBU_COMP_MODULUS": 15,
+            "CONSOLIDATION_TIME": 10,
+            "VULNERABILITY_ANALYSIS": False,
+            "OUTPUT_FEATURE_NAME": f"test_output-differential-{algorithm}",
+        }
+        source = QgsVectorLayer(str(site["excavation"]), "synthetic_source", "ogr")
+        if algorithm == "tunnel":
+            params.update({
+                "INPUT_TUNNEL_POLY": source,
+                "TUNNEL_DEPTH": 15.0,
+                "TUNNEL_DIAM": 9.5,
+                "VOLUME_LOSS": 2,
+                "TROUGH_WIDTH": 0.5,
+                "POREPRESSURE_ENUM": 3,  # Manual
+                "POREWP_REDUCTION": 10,
+            })
+        else:
+            params.update({
+                "INPUT_EXCAVATION_POLY": source,
+                "EXCAVATION_DEPTH": 10.0,
+                "SETTLEMENT_ENUM": 1,  # index
+                "POREWP_REDUCTION_M": 10,
+            })
+        if algorithm == "impactmap":
+            del params["INPUT_BUILDING_POLY"]
+            params.update({"OUTPUT_RESOLUTION": 10, "CLIPPING_RANGE": 150})
+        return site, params
+
+    def run_harness(self, harness, params):
+        results = harness.run({"generated": params})
+        logger.info(harness.summary(results))
+        self.assertTrue(harness.all_passed(results), harness.summary(results))
+        self.assertTrue(results["generated"], "No outputs were compared")
+        return results
+
+    def test_compare_arrays(self):
+        """The largest deviation and its location are reported, NaN only in one array fails."""
+        reference = np.array([1.0, 2.0, 3.0, np.nan])
+        candidate = np.array([1.0, 2.5, 3.0, np.nan])
+        deviation = compare_arrays("values", reference, candidate, abs_tol=1e-6, rel_tol=0.0,
+                                   locations=["a", "b", "c", "d"])
+        self.assertEqual(deviation.n_failed, 1)
+        self.assertAlmostEqual(deviation.max_abs, 0.5)
+        self.assertEqual(deviation.location, "b")
+
+        candidate[3] = 1.0
+        deviation = compare_arrays("values", reference, candidate, abs_tol=1.0, rel_tol=0.0)
+        self.assertEqual(deviation.n_failed, 1, "NaN in only one array should fail")
+
+    def test_vector_comparison_identical(self):
+        """A vector file compared with itself has no deviations."""
+        report = compare_vector_outputs(self.building_layer_path, self.building_layer_path)
+        self.assertTrue(report.passed, report.summary())
+        self.assertTrue(all(dev.max_abs == 0 for dev in report.deviations.values()))
+
+    def test_raster_comparison_detects_deviation(self):
+        """A changed raster cell is reported as the largest deviation at the right row/column."""
+        modified_path = self.output_data_dir / "DTB-modified.tif"
+        shutil.copy(self.raster_rock_surface_path, modified_path)
+        dataset = gdal.Open(str(modified_path), gdal.GA_Update)
+        band = dataset.GetRasterBand(1)
+        array = band.ReadAsArray()
+        row, col = array.shape[0] // 2, array.shape[1] // 2
+        array[row, col] = array[row, col] + 1.0
+        band.WriteArray(array)
+        dataset = None
+
+        report = compare_raster_outputs(self.raster_rock_surface_path, self.raster_rock_surface_path)
+        self.assertTrue(report.passed, report.summary())
+
+        report = compare_raster_outputs(self.raster_rock_surface_path, modified_path)
+        self.assertFalse(report.passed)
+        deviation = report.deviations["band_1"]
+        self.assertEqual(deviation.n_failed, 1)
+        self.assertAlmostEqual(deviation.max_abs, 1.0, places=3)
+        self.assertEqual(tuple(int(i) for i in deviation.location), (row, col))
+
+    def test_raster_comparison_candidate_zone(self):
+        """Nodata outside of the candidate zone is left out, nodata inside it is reported."""
+        reference_ds = gdal.Open(str(self.raster_rock_surface_path))
+        x0, dx, _, y0, _, dy = reference_ds.GetGeoTransform()
+        n_cols, n_rows = reference_ds.RasterXSize, reference_ds.RasterYSize
+        center = QgsGeometry.fromPointXY(QgsPointXY(x0 + n_cols / 2 * dx, y0 + n_rows / 2 * dy))
+        zone = center.buffer(min(n_cols * abs(dx), n_rows * abs(dy)) / 4, 16)
+
+        zone_path = self.output_data_dir / "DTB-zone.tif"
+        empty_path = self.output_data_dir / "DTB-empty.tif"
+        for path in (zone_path, empty_path):
+            shutil.copy(self.raster_rock_surface_path, path)
+        for path, keep in ((zone_path, zone_mask(zone, reference_ds)), (empty_path, False)):
+            dataset = gdal.Open(str(path), gdal.GA_Update)
+            band = dataset.GetRasterBand(1)
+            nodata = band.GetNoDataValue() if band.GetNoDataValue() is not None else -9999.0
+            band.SetNoDataValue(nodata)
+            band.WriteArray(np.where(keep, band.ReadAsArray(), nodata))
+            dataset = None
+
+        report = compare_raster_outputs(self.raster_rock_surface_path, zone_path, candidate_zone=zone)
+        self.assertTrue(report.passed, report.summary())
+        report = compare_raster_outputs(self.raster_rock_surface_path, empty_path, candidate_zone=zone)
+        self.assertFalse(report.passed)
+        self.assertTrue(report.errors)
+
+    def test_synthetic_site(self):
+        """The generated inputs are valid and deterministic for a given seed."""
+        site_a = create_synthetic_site(self.output_data_dir / "site_a", self.out_crs, n_buildings=15, seed=3)
+        site_b = create_synthetic_site(self.output_data_dir / "site_b", self.out_crs, n_buildings=15, seed=3)
+        buildings = QgsVectorLayer(str(site_a["buildings"]), "synthetic", "ogr")
+        self.assertTrue(buildings.isValid())
+        self.assertEqual(buildings.featureCount(), 15)
+        self.assertTrue(QgsRasterLayer(str(site_a["dtb"]), "synthetic_dtb").isValid())
+
+        self.assertTrue(compare_vector_outputs(site_a["buildings"], site_b["buildings"]).passed)
+        self.assertTrue(compare_raster_outputs(site_a["dtb"], site_b["dtb"]).passed)
+
+    def test_excavation_reference_is_reproducible(self):
+        """
+        The reference engine reproduces its own outputs on fixture and generated inputs.
+        This is the baseline every accelerated engine is compared against.
+        """
+        site = create_synthetic_site(self.output_data_dir / "site", self.out_crs, n_buildings=20, seed=1)
+        generated_params = dict(self.excavation_params)
+        generated_params.update({
+            "INPUT_BUILDING_POLY": QgsVectorLayer(str(site["buildings"]), "synthetic_buildings", "ogr"),
+            "INPUT_EXCAVATION_POLY": QgsVectorLayer(str(site["excavation"]), "synthetic_excavation", "ogr"),
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(site["dtb"]), "synthetic_dtb"),
+            "OUTPUT_FEATURE_NAME": "test_output-differential-synthetic",
+        })
+
+        harness = DifferentialHarness(
+            processing_runner("geovita:begrensskadeexcavation", self.output_data_dir / "reference"),
+            processing_runner("geovita:begrensskadeexcavation", self.output_data_dir / "candidate"),
+            logger=logger,
+        )
+        results = harness.run({"fixture": self.excavation_params, "generated": generated_params})
+        logger.info(harness.summary(results))
+        self.assertTrue(harness.all_passed(results), harness.summary(results))
+        self.assertEqual(len(results["fixture"]), 3, "Expected building, wall and corner outputs")
+
+    def test_default_reads_all_buildings(self):
+        """
+        With the default building search distance, the outputs equal the baseline that reads every
+        building (distance 0), also for buildings beyond the porewater influence distance.
+        """
+        site = create_synthetic_site(
+            self.output_data_dir / "site_far", self.out_crs, n_buildings=20, seed=4, max_distance=500.0
+        )
+        params = dict(self.excavation_params)
+        params.update({
+            "INPUT_BUILDING_POLY": QgsVectorLayer(str(site["buildings"]), "synthetic_buildings", "ogr"),
+            "INPUT_EXCAVATION_POLY": QgsVectorLayer(str(site["excavation"]), "synthetic_excavation", "ogr"),
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(site["dtb"]), "synthetic_dtb"),
+            "OUTPUT_FEATURE_NAME": "test_output-differential-far",
+        })
+        harness = DifferentialHarness(
+            processing_runner(
+                "geovita:begrensskadeexcavation", self.output_data_dir / "far_baseline", {"BUILDING_SEARCH_DISTANCE": 0}
+            ),
+            processing_runner("geovita:begrensskadeexcavation", self.output_data_dir / "far_default"),
+            logger=logger,
+        )
+        self.run_harness(harness, params)
+        outputs = processing_runner("geovita:begrensskadeexcavation", self.output_data_dir / "far_default")(params)
+        self.assertEqual(
+            QgsVectorLayer(str(outputs["OUTPUT_BUILDING"]), "buildings", "ogr").featureCount(),
+            params["INPUT_BUILDING_POLY"].featureCount(),
+            "Every building should be in the default outputs",
+        )
+
+    def check_cached_run(self, algorithm_id, algorithm):
+        """The outputs restored from the result cache equal a plain run."""
+        _, params = self.synthetic_params(algorithm)
+        harness = DifferentialHarness(
+            processing_runner(algorithm_id, self.output_data_dir / f"{algorithm}_reference"),
+            cached_runner(algorithm_id, self.output_data_dir / f"{algorithm}_cached"),
+            logger=logger,
+        )
+        self.run_harness(harness, params)
+
+    def check_incremental_run(self, algorithm_id, algorithm):
+        """
+        An incremental run, after a run where some buildings were at other locations, equals a
+        plain run on the current buildings.
+        """
+        site, params = self.synthetic_params(algorithm)
+        previous_buildings = move_buildings(
+            site["buildings"], self.output_data_dir / f"{algorithm}_previous_buildings.shp", [1, 5, 9]
+        )
+        harness = DifferentialHarness(
+            processing_runner(algorithm_id, self.output_data_dir / f"{algorithm}_reference"),
+            incremental_runner(
+                algorithm_id,
+                self.output_data_dir / f"{algorithm}_incremental",
+                QgsVectorLayer(str(previous_buildings), "previous_buildings", "ogr"),
+            ),
+            logger=logger,
+            match_by_location=True,
+        )
+        self.run_harness(harness, params)
+
+    def check_vectorized_engine(self, algorithm_id, algorithm, parameter_names):
+        """The vectorized engine (CombinedImpact) reproduces REMEDY within ENGINE_ABS_TOL/ENGINE_REL_TOL."""
+        _, params = self.synthetic_params(algorithm)
+        harness = DifferentialHarness(
+            processing_runner(algorithm_id, self.output_data_dir / f"{algorithm}_reference"),
+            processing_runner(
+                "geovita:begrensskadecombinedimpact",
+                self.output_data_dir / f"{algorithm}_vectorized",
+                {"LOOKUP_TOLERANCE": 0},
+                parameter_names=parameter_names,
+            ),
+            abs_tol=ENGINE_ABS_TOL,
+            rel_tol=ENGINE_REL_TOL,
+            fields=ENGINE_FIELDS,
+            logger=logger,
+            match_by_location=True,
+        )
+        self.run_harness(harness, params)
+
+    def test_excavation_cached_run(self):
+        self.check_cached_run("geovita:begrensskadeexcavation", "excavation")
+
+    def test_excavation_incremental_run(self):
+        self.check_incremental_run("geovita:begrensskadeexcavation", "excavation")
+
+    def test_excavation_vectorized_engine(self):
+        self.check_vectorized_engine(
+            "geovita:begrensskadeexcavation", "excavation", {"POREWP_REDUCTION_M": "EXCAVATION_POREWP_REDUCTION"}
+        )
+
+    def test_tunnel_cached_run(self):
+        self.check_cached_run("geovita:begrensskadetunnel", "tunnel")
+
+    def test_tunnel_incremental_run(self):
+        self.check_incremental_run("geovita:begrensskadetunnel", "tunnel")
+
+    def test_tunnel_vectorized_engine(self):
+        self.check_vectorized_engine(
+            "geovita:begrensskadetunnel", "tunnel", {"POREWP_REDUCTION": "TUNNEL_POREWP_REDUCTION"}
+        )
+
+    def test_impactmap_cached_run(self):
+        self.check_cached_run("geovita:begrensskadeimpactmap", "impactmap")
+
+    def test_impactmap_vectorized_engine(self):
+        """
+        The consolidation time band of the vectorized engine reproduces the REMEDY impact map at
+        CONSOLIDATION_TIME. ImpactMap has no incremental mode.
+        """
+        _, params = self.synthetic_params("impactmap")
+        harness = DifferentialHarness(
+            processing_runner(
+                "geovita:begrensskadeimpactmap", self.output_data_dir / "impactmap_reference", {"LOOKUP_TOLERANCE": 0}
+            ),
+            processing_runner(
+                "geovita:begrensskadeimpactmap",
+                self.output_data_dir / "impactmap_vectorized",
+                {"CONSOLIDATION_TIMES": str(params["CONSOLIDATION_TIME"]), "LOOKUP_TOLERANCE": 0},
+                output_names={"OUTPUT_TIME_RASTER": "OUTPUT_RASTER"},
+            ),
+            abs_tol=ENGINE_ABS_TOL,
+            rel_tol=ENGINE_REL_TOL,
+            logger=logger,
+        )
+        self.run_harness(harness, params)
+
+    def test_impactmap_adaptive(self):
+        """
+        The impact map refined adaptively by the vectorized engine reproduces the REMEDY impact map
+        at every cell, within the engine tolerance plus the refinement tolerance.
+        """
+        _, params = self.synthetic_params("impactmap")
+        adaptive_tolerance = 0.1
+        harness = DifferentialHarness(
+            processing_runner(
+                "geovita:begrensskadeimpactmap", self.output_data_dir / "impactmap_reference", {"LOOKUP_TOLERANCE": 0}
+            ),
+            processing_runner(
+                "geovita:begrensskadeimpactmap",
+                self.output_data_dir / "impactmap_adaptive",
+                {"LOOKUP_TOLERANCE": 0, "ADAPTIVE_TOLERANCE": adaptive_tolerance},
+            ),
+            abs_tol=ENGINE_ABS_TOL + adaptive_tolerance / 1000,
+            rel_tol=ENGINE_REL_TOL,
+            logger=logger,
+        )
+        self.run_harness(harness, params)
+
+    def test_impactmap_influence_zone(self):
+        """
+        The impact map of the influence zone, computed by REMEDY on windows of the grid, equals the
+        unclipped impact map within the zone, and is nodata in the corners of the grid.
+        """
+        site = create_synthetic_site(
+            self.output_data_dir / "site_zone", self.out_crs, n_buildings=1, seed=1, excavation_size=(300.0, 10.0)
+        )
+        _, params = self.synthetic_params("impactmap")
+        params.update({
+            "INPUT_EXCAVATION_POLY": QgsVectorLayer(str(site["excavation"]), "synthetic_excavation", "ogr"),
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(site["dtb"]), "synthetic_dtb"),
+            "OUTPUT_RESOLUTION": 2,
+            "OUTPUT_FEATURE_NAME": "test_output-differential-zone",
+        })
+        zone_runner = processing_runner(
+            "geovita:begrensskadeimpactmap", self.output_data_dir / "impactmap_zone", {"INFLUENCE_ZONE": True}
+        )
+
+        def influence_zone(parameters):
+            # The buffered excavation, less a cell diagonal for the approximate distances far from it
+            excavation = parameters["INPUT_EXCAVATION_POLY"]
+            geometry = QgsGeometry.unaryUnion([feature.geometry() for feature in excavation.getFeatures()])
+            cell_diagonal = parameters["OUTPUT_RESOLUTION"] * 2 ** 0.5
+            return geometry.buffer(parameters["CLIPPING_RANGE"] - cell_diagonal, 16)
+
+        harness = DifferentialHarness(
+            processing_runner("geovita:begrensskadeimpactmap", self.output_data_dir / "impactmap_unclipped"),
+            zone_runner,
+            logger=logger,
+            candidate_zone=influence_zone,
+        )
+        self.run_harness(harness, params)
+        dataset = gdal.Open(str(zone_runner(params)["OUTPUT_RASTER"]))
+        band = dataset.GetRasterBand(1)
+        values = band.ReadAsArray()
+        nodata = band.GetNoDataValue()
+        self.assertEqual(values[0, 0], nodata, "The corner of the grid is outside of the influence zone")
+        self.assertNotEqual(values[values.shape[0] // 2, values.shape[1] // 2], nodata)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.testing import unittest
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsRasterLayer,
+    QgsVectorLayer,
+)
+
+import logging
+from pathlib import Path
+
+from geovita_processing_plugin.geovita_processing_plugin_provider import (
+    GeovitaProcessingPluginProvider,
+)
+from geovita_processing_plugin.utilities.comparison import (
+    ENGINE_ABS_TOL,
+    ENGINE_REL_TOL,
+    DifferentialHarness,
+    create_synthetic_site,
+    processing_runner,
+)
+from geovita_processing_plugin.utilities.settlementlib import (
+    CONSOLIDATION_COEFFICIENT,
+    HORIZONTAL_DISPLACEMENT_RATIO,
+    N_SUBLAYERS,
+    POREWATER_INFLUENCE_DISTANCE,
+    SHORT_TERM_CURVES,
+)
+
+# Set up logging at the beginning of your test file
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class TestEngineParity(unittest.TestCase):
+    """
+    Checks each constant of the vectorized settlement engine (settlementlib) against REMEDY, by running
+    REMEDY (Excavation/Tunnel) and the vectorized engine (CombinedImpact) with parameters where only
+    that constant matters, and comparing the corner attribute it controls within ENGINE_ABS_TOL and
+    ENGINE_REL_TOL.
+    """
+
+    def setUp(self):
+        if not QgsApplication.processingRegistry().providers():
+            self.provider = GeovitaProcessingPluginProvider()
+            QgsApplication.processingRegistry().addProvider(self.provider)
+
+        # Use pathlib to get the base directory (where this test file resides)
+        base_dir = Path(__file__).parent
+        self.output_data_dir = base_dir / "data" / "output" / "engine_parity"
+        # Make sure the output directory exists
+        self.output_data_dir.mkdir(parents=True, exist_ok=True)
+
+        # Output CRS
+        self.out_crs = QgsCoordinateReferenceSystem("EPSG:5110")
+        self.assertTrue(self.out_crs.isValid(), "OUTPUT CRS is invalid!")
+
+    def site_params(self, label, tunnel=False, max_distance=200.0):
+        site = create_synthetic_site(
+            self.output_data_dir / f"site_{label}",
+            self.out_crs,
+            n_buildings=30,
+            seed=2,
+            excavation_size=(300.0, 10.0) if tunnel else (60.0, 30.0),
+            max_distance=max_distance,
+        )
+        params = {
+            "INPUT_BUILDING_POLY": QgsVectorLayer(str(site["buildings"]), "synthetic_buildings", "ogr"),
+            "RASTER_ROCK_SURFACE": QgsRasterLayer(str(site["dtb"]), "synthetic_dtb"),
+            "OUTPUT_CRS": self.out_crs,
+            "SHORT_TERM_SETTLEMENT": True,
+            "LONG_TERM_SETTLEMENT": True,
+            "DRY_CRUST_THICKNESS": 5.0,
+            "DEPTH_GROUNDWATER": 3,
+            "SOIL_DENSITY": 18.5,
+            "OCR": 1.2,
+            "JANBU_REF_STRESS": 50,
+            "JANBU_CONSTANT": 4,
+            "JANBU_COMP_MODULUS": 15,
+            "CONSOLIDATION_TIME": 10,
+            "VULNERABILITY_ANALYSIS": False,
+            "BUILDING_SEARCH_DISTANCE": 0,
+            "OUTPUT_FEATURE_NAME": f"test_output-parity-{label}",
+        }
+        source = QgsVectorLayer(str(site["excavation"]), "synthetic_source", "ogr")
+        if tunnel:
+            params.update({
+                "INPUT_TUNNEL_POLY": source,
+                "TUNNEL_DEPTH": 15.0,
+                "TUNNEL_DIAM": 9.5,
+                "VOLUME_LOSS": 2,
+                "TROUGH_WIDTH": 0.5,
+                "POREPRESSURE_ENUM": 3,  # Manual
+                "POREWP_REDUCTION": 10,
+            })
+        else:
+            params.update({
+                "INPUT_EXCAVATION_POLY": source,
+                "EXCAVATION_DEPTH": 10.0,
+                "SETTLEMENT_ENUM": 1,  # index
+                "POREWP_REDUCTION_M": 10,
+            })
+        return params
+
+    def check_parity(self, label, cases, fields, tunnel=False):
+        """Runs REMEDY and the vectorized engine on every case and compares 'fields' of the corners."""
+        algorithm = "tunnel" if tunnel else "excavation"
+        harness = DifferentialHarness(
+            processing_runner(f"geovita:begrensskade{algorithm}", self.output_data_dir / f"{label}_remedy"),
+            processing_runner(
+                "geovita:begrensskadecombinedimpact",
+                self.output_data_dir / f"{label}_vectorized",
+                {"LOOKUP_TOLERANCE": 0},
+                parameter_names={
+                    "POREWP_REDUCTION_M": "EXCAVATION_POREWP_REDUCTION",
+                    "POREWP_REDUCTION": "TUNNEL_POREWP_REDUCTION",
+                },
+                output_names={"OUTPUT_CORNER": "OUTPUT_CORNER"},
+            ),
+            abs_tol=ENGINE_ABS_TOL,
+            rel_tol=ENGINE_REL_TOL,
+            fields={"OUTPUT_CORNER": fields},
+            logger=logger,
+            match_by_location=True,
+        )
+        results = harness.run(cases)
+        logger.info(harness.summary(results))
+        self.assertTrue(harness.all_passed(results), harness.summary(results))
+
+    def test_short_term_curves(self):
+        """SHORT_TERM_CURVES: the settlement at the wall and the extent of every curve."""
+        params = dict(self.site_params("curves"), LONG_TERM_SETTLEMENT=False)
+        cases = {
+            name: dict(params, SETTLEMENT_ENUM=index, OUTPUT_FEATURE_NAME=f"test_output-parity-curve{index}")
+            for index, name in enumerate(SHORT_TERM_CURVES)
+        }
+        self.check_parity("curves", cases, ["sv_short"])
+
+    def test_horizontal_displacement_ratio(self):
+        """HORIZONTAL_DISPLACEMENT_RATIO: the horizontal displacement behind the wall."""
+        self.assertGreater(HORIZONTAL_DISPLACEMENT_RATIO, 0)
+        params = dict(self.site_params("horizontal"), LONG_TERM_SETTLEMENT=False)
+        self.check_parity("horizontal", {"horizontal": params}, ["sh_short"])
+
+    def test_porewater_influence_distance(self):
+        """
+        POREWATER_INFLUENCE_DISTANCE and the linear drawdown: buildings are placed up to 1.3 times the
+        distance, so corners both inside and beyond it are compared.
+        """
+        params = self.site_params("influence", max_distance=1.3 * POREWATER_INFLUENCE_DISTANCE)
+        params.update({"SHORT_TERM_SETTLEMENT": False, "CONSOLIDATION_TIME": 1e4})
+        self.check_parity("influence", {"influence": params}, ["sv_long"])
+
+    def test_sublayer_integration(self):
+        """N_SUBLAYERS: the fully consolidated long term settlement only depends on the integration."""
+        self.assertGreater(N_SUBLAYERS, 0)
+        params = self.site_params("sublayers")
+        params.update({"SHORT_TERM_SETTLEMENT": False, "CONSOLIDATION_TIME": 1e4})
+        self.check_parity("sublayers", {"sublayers": params}, ["sv_long"])
+
+    def test_consolidation_coefficient(self):
+        """CONSOLIDATION_COEFFICIENT: the degree of consolidation at partial consolidation."""
+        self.assertGreater(CONSOLIDATION_COEFFICIENT, 0)
+        params = dict(self.site_params("consolidation"), SHORT_TERM_SETTLEMENT=False)
+        cases = {
+            f"{time} years": dict(params, CONSOLIDATION_TIME=time,
+                                  OUTPUT_FEATURE_NAME=f"test_output-parity-consolidation{time}")
+            for time in (1, 10)
+        }
+        self.check_parity("consolidation", cases, ["sv_long"])
+
+    def test_tunnel_trough(self):
+        """The tunnel settlement trough, measured from the tunnel axis."""
+        params = dict(self.site_params("tunnel", tunnel=True), LONG_TERM_SETTLEMENT=False)
+        self.check_parity("tunnel", {"tunnel": params}, ["sv_short", "sh_short"], tunnel=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import numpy as np
+from osgeo import ogr
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.gridlib import (
+    EXACT_DISTANCE_CELLS,
+    Grid,
+    adaptive_cells,
+    distance_field,
+    distance_transform,
+    expand_cells,
+    influence_zone,
+    zone_windows,
+)
+
+
+class TestGridLib(unittest.TestCase):
+    def test_distance_transform(self):
+        """The distance transform is exact near the excavation and within half a cell diagonal elsewhere."""
+        cell_size = 2.0
+        grid = Grid(np.zeros((150, 200)), (0.0, cell_size, 0.0, 300.0, 0.0, -cell_size), "")
+        ring = np.array([[95.3, 140.2], [180.1, 140.2], [180.1, 161.7], [95.3, 161.7], [95.3, 140.2]])
+        segments = np.hstack([ring[:-1], ring[1:]])
+        wkt = "POLYGON((" + ", ".join(f"{x} {y}" for x, y in ring) + "))"
+        wkb = ogr.CreateGeometryFromWkt(wkt).ExportToWkb()
+
+        exact = distance_field(grid, segments)
+        distance = distance_transform(grid, [wkb], segments)
+        near = exact <= EXACT_DISTANCE_CELLS * cell_size - cell_size
+        np.testing.assert_allclose(distance[near], exact[near])
+        self.assertLessEqual(np.abs(distance - exact).max(), cell_size * np.sqrt(2) / 2 + 1e-6)
+
+    def test_influence_zone(self):
+        """Only cells within the clipping range are kept, and expand back to their place in the grid."""
+        distance = np.array([[0.0, 5.0, 12.0], [3.0, 10.0, 20.0]])
+        index = influence_zone(distance, 10.0)
+        np.testing.assert_array_equal(index, [0, 1, 3, 4])
+        values = np.vstack([distance.ravel()[index], 2 * distance.ravel()[index]])
+        expanded = expand_cells(values, index, distance.shape)
+        self.assertEqual(expanded.shape, (2, 2, 3))
+        np.testing.assert_array_equal(expanded[0], np.where(distance <= 10.0, distance, np.nan))
+        np.testing.assert_array_equal(expand_cells(distance.ravel(), None, distance.shape), distance)
+
+    def test_zone_windows(self):
+        """The windows cover every cell of the zone, and leave out the tiles without cells of the zone."""
+        distance = np.hypot(*np.meshgrid(np.arange(40.0), np.arange(30.0)))
+        index = influence_zone(distance, 12.0)
+        windows = zone_windows(index, distance.shape, tile_size=8)
+        covered = np.zeros(distance.shape, dtype=bool)
+        for r0, c0, n_rows, n_cols in windows:
+            covered[r0:r0 + n_rows, c0:c0 + n_cols] = True
+        self.assertTrue(covered.ravel()[index].all())
+        self.assertEqual(len(windows), 4)
+        self.assertLess(covered.sum(), distance.size / 4)
+        self.assertEqual(zone_windows(np.array([], dtype=int), distance.shape), [])
+
+    def test_distance_field_progress(self):
+        """Progress is reported per chunk of rows, and an exception of the callback stops the computation."""
+        grid = Grid(np.zeros((10, 20)), (0.0, 1.0, 0.0, 10.0, 0.0, -1.0), "")
+        segments = np.array([[5.0, 5.0, 15.0, 5.0]])
+        fractions = []
+        distance_field(grid, segments, rows_per_chunk=4, progress=fractions.append)
+        self.assertEqual(fractions, [0.4, 0.8, 1.0])
+
+        def cancel(fraction):
+            fractions.append(fraction)
+            raise RuntimeError("canceled")
+
+        fractions.clear()
+        with self.assertRaises(RuntimeError):
+            distance_field(grid, segments, rows_per_chunk=4, progress=cancel)
+        self.assertEqual(fractions, [0.4])
+
+    def test_adaptive_cells(self):
+        """Adaptive refinement stays within the tolerance with a fraction of the evaluations."""
+        shape = (300, 410)
+        rows, cols = np.indices(shape)
+        distance = np.hypot(rows - 100.3, cols - 150.7) * 2.0
+        exact = np.where(distance < 60.0, 0.1 * (1 - distance / 60.0) ** 2, 0.0) + 0.002 * np.sin(rows / 40.0)
+        exact[5:8, 9:12] = np.nan
+        exact = exact.ravel()
+        values, n_evaluated = adaptive_cells(lambda cells: exact[cells], shape, 1e-3, valid=~np.isnan(exact))
+        self.assertEqual(values.shape, (1, exact.size))
+        np.testing.assert_array_equal(np.isnan(values[0]), np.isnan(exact))
+        self.assertLessEqual(np.nanmax(np.abs(values[0] - exact)), 1e-3)
+        self.assertLess(n_evaluated, exact.size / 10)
+        # Without tolerance every cell is evaluated
+        values, n_evaluated = adaptive_cells(lambda cells: exact[cells], shape, 0.0)
+        self.assertEqual(n_evaluated, exact.size)
+        np.testing.assert_array_equal(values[0], exact)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.testing import unittest
+from qgis.core import (
+    QgsFeature,
+    QgsGeometry,
+    QgsVectorLayer,
+)
+
+from geovita_processing_plugin.utilities.incremental import (
+    building_fingerprints,
+    plan_incremental,
+)
+
+
+def _building_layer(squares):
+    """Creates a memory layer with one square building per (x, y) lower left corner."""
+    layer = QgsVectorLayer("Polygon?crs=EPSG:5110", "buildings", "memory")
+    features = []
+    for x, y in squares:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(f"POLYGON(({x} {y}, {x + 10} {y}, {x + 10} {y + 10}, {x} {y + 10}, {x} {y}))"))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+class TestIncrementalPlan(unittest.TestCase):
+    def test_unchanged(self):
+        """Nothing is recomputed when the buildings are unchanged."""
+        fingerprints = building_fingerprints(_building_layer([(0, 0), (100, 0)]))
+        plan = plan_incremental(fingerprints, fingerprints)
+        self.assertTrue(plan.is_unchanged)
+        self.assertEqual(plan.recompute, [])
+        self.assertEqual(plan.dropped, set())
+
+    def test_changed_building_and_touching_neighbour(self):
+        """A moved building is recomputed with the building it touches, a distant building is kept."""
+        previous = building_fingerprints(_building_layer([(0, 0), (10, 0), (100, 0)]))
+        current = building_fingerprints(_building_layer([(0, 0), (10, 0), (100, 0)]))
+        # Move the first building (the first feature id of a memory layer is 1)
+        moved = building_fingerprints(_building_layer([(-1, 0)]))
+        current["1"] = moved["1"]
+
+        plan = plan_incremental(previous, current)
+        self.assertEqual(plan.changed, ["1"])
+        self.assertEqual(sorted(plan.recompute), ["1", "2"])
+        self.assertEqual(plan.dropped, {"1", "2"})
+
+    def test_added_and_deleted(self):
+        """Added buildings are recomputed, results of deleted buildings are dropped."""
+        previous = building_fingerprints(_building_layer([(0, 0), (100, 0)]))
+        current = {"1": previous["1"]}
+        current["3"] = building_fingerprints(_building_layer([(200, 0)]))["1"]
+
+        plan = plan_incremental(previous, current)
+        self.assertEqual(plan.added, ["3"])
+        self.assertEqual(plan.deleted, ["2"])
+        self.assertEqual(plan.recompute, ["3"])
+        self.assertEqual(plan.dropped, {"2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.logger import CustomLogger, RunLogger
+
+
+class TestLogger(unittest.TestCase):
+    def test_parallel_setup_and_run_tags(self):
+        """Instances created from several threads share one handler, and every run tags its lines."""
+        log_dir = Path(tempfile.mkdtemp())
+        loggers = []
+        threads = [
+            threading.Thread(target=lambda: loggers.append(CustomLogger(log_dir, "test.log", "TEST_PARALLEL_LOGGER").get_logger()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger = logging.getLogger("TEST_PARALLEL_LOGGER")
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertTrue(all(item is logger for item in loggers))
+
+        first, second = RunLogger(logger), RunLogger(logger)
+        self.assertNotEqual(first.extra["run"], second.extra["run"])
+        first.info("started")
+        second.info("started")
+        logger.handlers[0].flush()
+        lines = (log_dir / "test.log").read_text().splitlines()
+        self.assertTrue(lines[0].endswith(f"[run {first.extra['run']}] started "))
+        self.assertTrue(lines[1].endswith(f"[run {second.extra['run']}] started "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.core import QgsProcessingException
+from qgis.testing import unittest
+
+import tempfile
+from pathlib import Path
+
+from geovita_processing_plugin.utilities.progress import (
+    CoreHeartbeat,
+    ProgressReporter,
+    RateHistory,
+    accepts_progress,
+)
+
+
+class Feedback:
+    """Records the progress, progress texts and messages of a run."""
+
+    def __init__(self):
+        self.progress = []
+        self.texts = []
+        self.messages = []
+        self.canceled = False
+
+    def isCanceled(self):
+        return self.canceled
+
+    def setProgress(self, progress):
+        self.progress.append(progress)
+
+    def setProgressText(self, text):
+        self.texts.append(text)
+
+    def pushInfo(self, message):
+        self.messages.append(message)
+
+
+class TestProgress(unittest.TestCase):
+    def test_throughput_and_eta(self):
+        """The fraction is mapped into the progress range, with throughput and time left of the computed items."""
+        feedback = Feedback()
+        now = [0.0]
+        reporter = ProgressReporter(feedback, 50, 40, total=1000, unit="buildings", report_interval=10.0,
+                                    clock=lambda: now[0])
+        now[0] = 4.0
+        reporter(0.25)
+        self.assertEqual(feedback.progress, [60.0])
+        self.assertEqual(feedback.texts[-1], "250 of 1000 buildings, 62 buildings/s, ETA 0:00:12")
+        self.assertEqual(feedback.messages, [])
+        now[0] = 12.0
+        reporter(0.5)
+        self.assertEqual(feedback.messages, ["PROCESS - 500 of 1000 buildings, 42 buildings/s, ETA 0:00:12"])
+        now[0] = 13.0
+        reporter(1.0)
+        self.assertEqual(feedback.progress[-1], 90.0)
+        self.assertEqual(feedback.messages[-1], "PROCESS - 1000 of 1000 buildings, 77 buildings/s")
+
+    def test_cancel_and_core_signature(self):
+        """Every call is a cancellation checkpoint, and only cores with a progress argument get the callback."""
+        feedback = Feedback()
+        reporter = ProgressReporter(feedback, 0, 100)
+        reporter(0.5)
+        self.assertEqual((feedback.progress, feedback.texts), ([50.0], []))
+        feedback.canceled = True
+        with self.assertRaises(QgsProcessingException):
+            reporter(0.6)
+        self.assertTrue(accepts_progress(lambda buildingsFN, progress=None: None))
+        self.assertTrue(accepts_progress(lambda **kwargs: None))
+        self.assertFalse(accepts_progress(lambda buildingsFN, output_ws: None))
+
+    def test_core_heartbeat(self):
+        """The progress of a core without progress argument is estimated from the throughput of previous runs."""
+        with tempfile.TemporaryDirectory() as folder:
+            history = RateHistory(Path(folder) / "core-rates.json")
+            now = [0.0]
+            feedback = Feedback()
+            with CoreHeartbeat(feedback, 50, 40, 200, "buildings", "core", history, interval=3600,
+                               clock=lambda: now[0]) as heartbeat:
+                now[0] = 5.0
+                heartbeat.tick()
+                self.assertEqual(feedback.texts[-1], "Running core, 0:00:05 elapsed")
+                self.assertEqual(feedback.progress, [])
+                now[0] = 20.0
+            self.assertEqual(feedback.progress[-1], 90.0)
+            self.assertAlmostEqual(history.rate("core"), 10.0)
+
+            feedback = Feedback()
+            now[0] = 0.0
+            with CoreHeartbeat(feedback, 50, 40, 200, "buildings", "core", history, interval=3600,
+                               clock=lambda: now[0]) as heartbeat:
+                now[0] = 5.0
+                heartbeat.tick()
+                self.assertEqual(feedback.progress, [60.0])
+                self.assertEqual(feedback.texts[-1],
+                                 "About 50 of 200 buildings (estimated from previous runs), ETA 0:00:15")
+                now[0] = 40.0
+                heartbeat.tick()
+                self.assertAlmostEqual(feedback.progress[-1], 50 + 40 * 0.99)
+                now[0] = 25.0
+            # Average of the throughput of both runs (8 and 10 buildings/s)
+            self.assertAlmostEqual(history.rate("core"), 9.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import threading
+import time
+
+from qgis.core import QgsProcessingException, QgsProcessingFeedback
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.scheduler import run_branches
+
+
+class TestScheduler(unittest.TestCase):
+    def test_branches_run_concurrently(self):
+        """All branches run at the same time and their results are returned by name."""
+        barrier = threading.Barrier(3, timeout=10)
+
+        def branch(value, context=None):
+            self.assertIsNotNone(context)
+            barrier.wait()
+            return value
+
+        results = run_branches({name: lambda context, name=name: branch(name, context) for name in "abc"})
+        self.assertEqual(results, {"a": "a", "b": "b", "c": "c"})
+
+    def test_failed_branch(self):
+        """The error of a failed branch is raised with the branch name after the other branches finished."""
+        finished = []
+
+        def slow(context=None):
+            time.sleep(0.3)
+            finished.append("slow")
+
+        def failing(context=None):
+            raise ValueError("no raster")
+
+        with self.assertRaisesRegex(QgsProcessingException, "RASTER LAYER: no raster"):
+            run_branches({"BUILDINGS": slow, "RASTER LAYER": failing})
+        self.assertEqual(finished, ["slow"])
+
+    def test_canceled(self):
+        """Canceling the feedback stops the wait for the branches."""
+        feedback = QgsProcessingFeedback()
+        feedback.cancel()
+        with self.assertRaises(QgsProcessingException):
+            run_branches({"BUILDINGS": lambda context: time.sleep(0.2)}, feedback=feedback)
+
+
+if __name__ == "__main__":
+    unittest.main()
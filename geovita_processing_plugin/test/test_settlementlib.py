@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import numpy as np
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.settlementlib import (
+    LOOKUP_MIN_POINTS,
+    LOOKUP_TOLERANCE,
+    LongTermTable,
+    building_maximum,
+    classify_settlement,
+    long_term_lookup_table,
+    long_term_settlement,
+    long_term_settlement_times,
+    parse_consolidation_times,
+    short_term_curve_parameters,
+    short_term_excavation,
+)
+
+
+class TestSettlementLib(unittest.TestCase):
+    def test_short_term_excavation(self):
+        """The 1 % curve gives 1 % of the depth at the wall and fades out at 2 x depth."""
+        ratio, extent = short_term_curve_parameters(r"1 % av byggegropdybde")
+        sv, sh = short_term_excavation(np.array([0.0, 10.0, 20.0, 30.0]), 10.0, ratio, extent)
+        np.testing.assert_allclose(sv, [0.1, 0.05, 0.0, 0.0])
+        np.testing.assert_allclose(sh, sv)
+
+    def test_scenarios_broadcast(self):
+        """Scenarios along the first axis give the same result as one scenario at a time."""
+        near_dist = np.array([0.0, 5.0, 12.0])
+        depths = np.array([6.0, 10.0])
+        ratio, extent = short_term_curve_parameters([r"0,5 % av byggegropdybde", r"2 % av byggegropdybde"])
+        sv, _ = short_term_excavation(near_dist, depths[:, None], ratio[:, None], extent[:, None])
+        for i in range(2):
+            expected, _ = short_term_excavation(near_dist, depths[i], ratio[i], extent[i])
+            np.testing.assert_allclose(sv[i], expected)
+
+    def test_long_term_settlement(self):
+        """Long term settlement is zero without drawdown, grows with the drawdown and is NaN without bedrock depth."""
+        dtb = np.array([20.0, 20.0, 20.0, np.nan])
+        porewp_red = np.array([0.0, 5.0, 10.0, 10.0])
+        sv = long_term_settlement(dtb, porewp_red, 3.0, 3.0, 19.0, 1.2, 0.0, 4.0, 15.0, 1000.0)
+        self.assertAlmostEqual(sv[0], 0.0)
+        self.assertGreater(sv[1], 0.0)
+        self.assertGreater(sv[2], sv[1])
+        self.assertTrue(np.isnan(sv[3]))
+
+    def test_long_term_settlement_times(self):
+        """Several times in one evaluation give the same settlements as one time at a time."""
+        dtb = np.array([8.0, 20.0, 40.0, np.nan])
+        porewp_red = np.array([5.0, 10.0, 10.0, 10.0])
+        times = parse_consolidation_times("100; 1, 10 1")
+        self.assertEqual(times, [1.0, 10.0, 100.0])
+        sv = long_term_settlement_times(dtb, porewp_red, 3.0, 3.0, 19.0, 1.2, 0.0, 4.0, 15.0, times)
+        self.assertEqual(sv.shape, (4, 3))
+        for i, time in enumerate(times):
+            expected = long_term_settlement(dtb, porewp_red, 3.0, 3.0, 19.0, 1.2, 0.0, 4.0, 15.0, time)
+            np.testing.assert_allclose(sv[:, i], expected)
+        self.assertTrue(np.all(np.diff(sv[:3], axis=1) >= 0))
+        with self.assertRaises(ValueError):
+            parse_consolidation_times("1, -10")
+
+    def test_long_term_lookup_table(self):
+        """The lookup table reproduces the exact long term settlement within its checked error bound."""
+        soil = {"dry_crust_thk": 3.0, "dep_groundwater": 3.0, "density_sat": 19.0, "ocr": 1.2,
+                "janbu_ref_stress": 0.0, "janbu_const": 4.0, "janbu_m": 15.0}
+        rng = np.random.default_rng(0)
+        dtb = rng.uniform(0.0, 40.0, 2 * LOOKUP_MIN_POINTS)
+        dtb[::100] = np.nan
+        porewp_red = rng.uniform(0.0, 10.0, 2 * LOOKUP_MIN_POINTS)
+        table, max_error = long_term_lookup_table(dtb, porewp_red, soil)
+        self.assertIsNotNone(table)
+        self.assertLessEqual(max_error, LOOKUP_TOLERANCE)
+        sv = table(dtb[:5000], porewp_red[:5000], 100.0)
+        expected = long_term_settlement(dtb[:5000], porewp_red[:5000], consolidation_time=100.0, **soil)
+        np.testing.assert_allclose(sv, expected, atol=LOOKUP_TOLERANCE)
+        # Too few points are evaluated exactly
+        self.assertEqual(long_term_lookup_table(dtb[:1000], porewp_red[:1000], soil), (None, None))
+
+    def test_long_term_table_parameter_sets(self):
+        """A table of several parameter sets matches the exact settlement of every set at the nodes."""
+        soil = {"dry_crust_thk": 3.0, "dep_groundwater": 3.0, "density_sat": 19.0, "ocr": np.array([1.1, 1.5]),
+                "janbu_ref_stress": 0.0, "janbu_const": 4.0, "janbu_m": np.array([10.0, 20.0])}
+        table = LongTermTable(20.0, 10.0, soil, 21, 11)
+        dtb = np.array([5.0, 12.0, 20.0])
+        porewp_red = np.array([[1.0, 5.0, 10.0], [2.0, 4.0, 6.0]])
+        sv = table(dtb, porewp_red, 1000.0)
+        columns = {name: np.reshape(value, (-1, 1)) if np.ndim(value) else value for name, value in soil.items()}
+        expected = long_term_settlement(dtb, porewp_red, consolidation_time=1000.0, **columns)
+        np.testing.assert_allclose(sv, expected)
+
+    def test_classify_and_building_maximum(self):
+        """Categories follow the style limits, maxima are taken per building."""
+        np.testing.assert_array_equal(classify_settlement([0.005, 0.02, 0.06, 0.1, np.nan]), [1, 2, 3, 4, 0])
+        np.testing.assert_allclose(building_maximum(np.array([1.0, 3.0, 2.0, 5.0, 4.0]), np.array([0, 2])), [3.0, 5.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import numpy as np
+from qgis.testing import unittest
+
+from geovita_processing_plugin.test.test_batchlib import square_buildings
+from geovita_processing_plugin.utilities.gridlib import Grid, superposed_cells
+from geovita_processing_plugin.utilities.settlementlib import short_term_curve_parameters, short_term_tunnel
+from geovita_processing_plugin.utilities.sitelib import (
+    corridor_half_width,
+    distance_to_polygons,
+    evaluate_excavation,
+    evaluate_sources,
+    source_contributions,
+    tunnel_axis_distance,
+)
+
+SOIL = dict(dry_crust_thk=5.0, dep_groundwater=3.0, density_sat=18.5, ocr=1.2, janbu_ref_stress=0.0,
+            janbu_const=4.0, janbu_m=15.0, consolidation_time=1000.0)
+
+
+def rectangle_segments(x0, y0, x1, y1):
+    ring = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]], dtype=float)
+    return np.hstack([ring[:-1], ring[1:]])
+
+
+class TestSuperposition(unittest.TestCase):
+    def setUp(self):
+        ratio, extent = short_term_curve_parameters(r"1 % av byggegropdybde")
+        self.pit = dict(type="Excavation", segments=rectangle_segments(20, -5, 30, 15), excavation_depth=10.0,
+                        ratio=ratio, extent=extent, porewp_red_m=10.0)
+        self.tunnel = dict(type="Tunnel", segments=rectangle_segments(-50, 30, 200, 40), tunnel_depth=15.0,
+                           tunnel_diameter=9.5, volume_loss=2.0, trough_width=0.5, porewp_red_m=5.0)
+        self.tunnel["corridors"] = [self.tunnel["segments"]]
+
+    def test_single_source(self):
+        """One excavation gives the results of evaluate_excavation()."""
+        site = square_buildings([(0, 0), (50, 0), (100, 0)])
+        site.dtb = np.linspace(5.0, 30.0, site.n_corners)
+        combined = evaluate_sources(site, [self.pit], **SOIL)
+        site.near_dist, site.near_angle = distance_to_polygons(site.corner_xy, self.pit["segments"])
+        parameters = {name: self.pit[name] for name in ("excavation_depth", "ratio", "extent", "porewp_red_m")}
+        single = evaluate_excavation(site, **parameters, **SOIL)
+        for name in ("sv_short", "sh_short", "porewp_red", "sv_long", "sv_tot", "slope_ang", "max_sv_tot", "sv_class"):
+            np.testing.assert_allclose(combined[name], single[name], err_msg=name)
+        np.testing.assert_allclose(combined["sv_sources"][0], single["sv_short"][0])
+
+    def test_contributions_add_up(self):
+        """Settlements and porewater pressure reductions add up, the long term settlement follows the total reduction."""
+        site = square_buildings([(0, 0), (50, 0), (100, 0)])
+        site.dtb = np.full(site.n_corners, 20.0)
+        both = source_contributions(site.corner_xy, [self.pit, self.tunnel])
+        pit = source_contributions(site.corner_xy, [self.pit])
+        tunnel = source_contributions(site.corner_xy, [self.tunnel])
+        np.testing.assert_allclose(both["sv_short"], pit["sv_short"] + tunnel["sv_short"])
+        np.testing.assert_allclose(both["porewp_red"], pit["porewp_red"] + tunnel["porewp_red"])
+        np.testing.assert_allclose(both["near_dist"], np.minimum(pit["near_dist"], tunnel["near_dist"]))
+        self.assertTrue(np.all(both["sh_short"] <= pit["sh_short"] + tunnel["sh_short"] + 1e-12))
+
+        results = evaluate_sources(site, [self.pit, self.tunnel], **SOIL)
+        np.testing.assert_allclose(results["sv_sources"].sum(axis=0), results["sv_short"][0])
+        np.testing.assert_allclose(results["sv_tot"], results["sv_short"] + results["sv_long"])
+        self.assertGreater(results["max_sv_tot"][0].max(), evaluate_sources(site, [self.pit], **SOIL)["max_sv_tot"][0].max())
+
+    def test_superposed_cells(self):
+        """The grid gets the same combined settlements as points at the cell centers."""
+        grid = Grid(np.full((30, 40), 20.0), (-40.0, 5.0, 0.0, 80.0, 0.0, -5.0), "")
+        grid.values[0, 0] = np.nan
+        bands = superposed_cells(grid, [self.pit, self.tunnel], fixed=SOIL, rows_per_chunk=7)
+        contributions = source_contributions(grid.cell_centers(), [self.pit, self.tunnel])
+        np.testing.assert_allclose(bands["sv_short"].ravel(), contributions["sv_short"])
+        np.testing.assert_allclose(bands["porewp_red"].ravel(), contributions["porewp_red"])
+        self.assertTrue(np.isnan(bands["sv_tot"][0, 0]))
+        self.assertTrue(np.all(bands["sv_long"][1:] >= 0))
+
+    def test_tunnel_axis_distance(self):
+        """The trough is measured from the tunnel axis, so it does not widen with the tunnel polygon."""
+        xy = np.array([[0.0, 35.0], [0.0, 37.0], [0.0, 20.0], [0.0, 60.0]])
+        near_dist, _ = distance_to_polygons(xy, self.tunnel["segments"])
+        axis_dist = tunnel_axis_distance(near_dist, self.tunnel["corridors"], xy)
+        np.testing.assert_allclose(axis_dist, [0.0, 2.0, 15.0, 25.0])
+
+        # A wider polygon around the same axis gives the same trough
+        wide = dict(self.tunnel, segments=rectangle_segments(-50, 15, 200, 55))
+        wide["corridors"] = [wide["segments"]]
+        trough = dict(tunnel_depth=15.0, tunnel_diameter=9.5, volume_loss=2.0, trough_width=0.5)
+        expected, _ = short_term_tunnel(np.abs(xy[:, 1] - 35.0), **trough)
+        for tunnel in (self.tunnel, wide):
+            contributions = source_contributions(xy, [tunnel], long_term=False)
+            np.testing.assert_allclose(contributions["sv_short"], expected, atol=1e-4)
+
+    def test_tunnel_axis_distance_opposite_corridors(self):
+        """Every tunnel polygon is a corridor of its own width, whatever the orientation of its ring."""
+        # A counter clockwise tunnel 10 m wide and a clockwise tunnel 20 m wide
+        north = rectangle_segments(-50, 30, 200, 40)
+        south = rectangle_segments(-50, -50, 200, -30)[::-1, [2, 3, 0, 1]]
+        self.assertAlmostEqual(corridor_half_width(north), 5.0)
+        self.assertAlmostEqual(corridor_half_width(south), 10.0)
+        xy = np.array([[0.0, 35.0], [0.0, -40.0], [0.0, -45.0], [0.0, -5.0], [0.0, 20.0]])
+        near_dist, _ = distance_to_polygons(xy, np.vstack([north, south]))
+        axis_dist = tunnel_axis_distance(near_dist, [north, south], xy)
+        np.testing.assert_allclose(axis_dist, [0.0, 0.0, 5.0, 35.0, 15.0])
+
+        # Two tunnels of the same width keep their width, also with opposite orientations
+        south = rectangle_segments(-50, -40, 200, -30)[::-1, [2, 3, 0, 1]]
+        near_dist, _ = distance_to_polygons(xy, np.vstack([north, south]))
+        axis_dist = tunnel_axis_distance(near_dist, [north, south], xy)
+        np.testing.assert_allclose(axis_dist, [0.0, 5.0, 10.0, 30.0, 15.0])
+
+    def test_leakage_porepressure_curves(self):
+        """The pore pressure curves from the tunnel leakage are left to the REMEDY core."""
+        site = square_buildings([(0, 0), (50, 0)])
+        site.dtb = np.full(site.n_corners, 20.0)
+        for curve in ("Upper", "Typical", "Lower"):
+            with self.assertRaises(ValueError):
+                evaluate_sources(site, [dict(self.tunnel, porepressure_curve=curve)], **SOIL)
+        manual = evaluate_sources(site, [dict(self.tunnel, porepressure_curve="Manual")], **SOIL)
+        np.testing.assert_allclose(manual["sv_tot"], evaluate_sources(site, [self.tunnel], **SOIL)["sv_tot"])
+        short = evaluate_sources(site, [dict(self.tunnel, porepressure_curve="Typical")], long_term=False, **SOIL)
+        self.assertGreater(short["sv_short"].max(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ GeovitaProcessingPlugin - Tests
+                              -------------------
+        begin                : 2024-02-09
+        copyright            : (C) 2024 by DPE
+        email                : dpe@geovita.no
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "DPE"
+__date__ = "2024.02.09"
+__copyright__ = "(C) 2024 by DPE"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import numpy as np
+from qgis.testing import unittest
+
+from geovita_processing_plugin.utilities.gridlib import long_term_percentile_cells
+from geovita_processing_plugin.utilities.settlementlib import long_term_settlement
+from geovita_processing_plugin.utilities.uncertainty import (
+    draw_samples,
+    exceedance_probability,
+    parse_distribution_table,
+    sample_percentiles,
+)
+
+PARAMETERS = ["OCR", "JANBU_COMP_MODULUS", "SOIL_DENSITY"]
+
+
+class TestUncertainty(unittest.TestCase):
+    def test_parse_and_draw(self):
+        """Samples follow the distribution table and are repeatable with a seed."""
+        table = [
+            "OCR", "normal", "1,2", "0.1", "",
+            "janbu_comp_modulus", "lognormal", 15, 3, "",
+            "SOIL_DENSITY", "triangular", 18, 18.5, 19,
+        ]
+        distributions = parse_distribution_table(table, PARAMETERS)
+        samples = draw_samples(distributions, 20000, seed=1)
+        self.assertAlmostEqual(samples["OCR"].mean(), 1.2, places=2)
+        self.assertAlmostEqual(samples["JANBU_COMP_MODULUS"].mean(), 15, delta=0.1)
+        self.assertAlmostEqual(samples["JANBU_COMP_MODULUS"].std(), 3, delta=0.1)
+        self.assertTrue(np.all((samples["SOIL_DENSITY"] >= 18) & (samples["SOIL_DENSITY"] <= 19)))
+        np.testing.assert_array_equal(samples["OCR"], draw_samples(distributions, 20000, seed=1)["OCR"])
+
+    def test_invalid_table(self):
+        """Unknown parameters and invalid distributions are rejected."""
+        with self.assertRaises(ValueError):
+            parse_distribution_table(["DEPTH", "fixed", 1, "", ""], PARAMETERS)
+        with self.assertRaises(ValueError):
+            parse_distribution_table(["OCR", "uniform", 2, 1, ""], PARAMETERS)
+        with self.assertRaises(ValueError):
+            parse_distribution_table(["OCR", "beta", 1, 1, ""], PARAMETERS)
+
+    def test_summaries(self):
+        """Exceedance probabilities and percentiles are taken along the samples, ignoring NaN."""
+        values = np.array([[0.0, np.nan], [0.02, np.nan], [0.06, np.nan], [0.08, np.nan]])
+        probabilities = exceedance_probability(values, (0.01, 0.05, 0.075))
+        np.testing.assert_allclose(probabilities[:, 0], [0.75, 0.5, 0.25])
+        self.assertTrue(np.all(np.isnan(probabilities[:, 1])))
+        percentiles = sample_percentiles(values, (50,))
+        self.assertAlmostEqual(percentiles[0, 0], 0.04)
+        self.assertTrue(np.isnan(percentiles[0, 1]))
+
+    def test_percentile_cells(self):
+        """Chunked percentile bands equal the percentiles of the full samples x cells evaluation."""
+        dtb = np.array([10.0, 20.0, np.nan, 30.0, 25.0])
+        near_dist = np.array([0.0, 50.0, 0.0, 100.0, 500.0])
+        sv_short = np.array([0.01, 0.0, 0.0, 0.0, 0.0])
+        samples = {"ocr": np.linspace(1.0, 1.5, 40), "janbu_m": np.linspace(10.0, 20.0, 40)}
+        fixed = {"dry_crust_thk": 3.0, "dep_groundwater": 3.0, "density_sat": 19.0, "janbu_ref_stress": 0.0,
+                 "janbu_const": 4.0, "consolidation_time": 1000.0}
+        bands = long_term_percentile_cells(dtb, near_dist, sv_short, 10.0, samples, fixed, (10, 50, 90))
+
+        porewp_red = 10.0 * np.clip(1.0 - near_dist / 380.0, 0.0, None)
+        full = sv_short + long_term_settlement(
+            dtb, porewp_red, fixed["dry_crust_thk"], fixed["dep_groundwater"], fixed["density_sat"],
+            samples["ocr"][:, None], fixed["janbu_ref_stress"], fixed["janbu_const"], samples["janbu_m"][:, None],
+            fixed["consolidation_time"],
+        )
+        expected = np.percentile(full, (10, 50, 90), axis=0)
+        valid = ~np.isnan(dtb)
+        np.testing.assert_allclose(bands[:, valid], expected[:, valid])
+        self.assertTrue(np.all(np.isnan(bands[:, ~valid])))
+        self.assertTrue(np.all(np.diff(bands[:, valid], axis=0) >= 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,389 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Evaluation of many excavation or tunnel sites in one run. The buildings are read and reprojected once,
+partitioned by site through a spatial index, and every site is evaluated by the REMEDY core of the
+Excavation or Tunnel algorithm in a pool of worker processes. The outputs of all sites are merged into
+one building, wall and corner layer with the schema of the Excavation and Tunnel outputs, vulnerability
+included, and every building once.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+import logging
+import math
+import multiprocessing
+import shutil
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from qgis.core import (QgsCoordinateTransformContext,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsField,
+                       QgsFields,
+                       QgsSpatialIndex,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
+
+from .incremental import ID_FIELDS, associate_outputs
+
+# Seconds between two checks for cancellation while the workers run
+POLL_INTERVAL = 0.2
+
+# REMEDY core of every type of site, and its argument with the excavation or tunnel polygons
+CORES = {"Excavation": "mainBegrensSkade_Excavation", "Tunnel": "mainBegrensSkade_Tunnel"}
+SITE_JSON_ARGUMENTS = {"Excavation": "excavationJson", "Tunnel": "tunnelJson"}
+
+# Building attribute deciding which site governs a building evaluated for several sites
+GOVERNING_FIELD = "max_sv_tot"
+
+# The building, wall and corner outputs of the core, in the order it returns them
+OUTPUT_NAMES = ["buildings", "walls", "corners"]
+
+_NUMERIC_TYPES = (QVariant.Int, QVariant.LongLong, QVariant.Double)
+
+
+def site_id_of(value):
+    """
+    The site id of a site field value.
+
+    Returns:
+        str or None: The value as text, or None for an empty value.
+    """
+    if value is None or str(value).strip() in ("", "NULL"):
+        return None
+    return str(value).strip()
+
+
+def partition_buildings(building_layer, site_geometries, search_distance):
+    """
+    Assigns the buildings to every excavation or tunnel site, through a spatial index of the building
+    bounding boxes. A building belongs to every site whose bounding box, grown by the search distance,
+    intersects its own. Buildings near several sites are evaluated for each of them, and merged by
+    write_site_outputs().
+
+    Args:
+        building_layer (QgsVectorLayer): All buildings, in the output CRS.
+        site_geometries (dict): Site id -> QgsGeometry of the excavation or tunnel.
+        search_distance (float): Distance from the sites [m], 0 for all buildings.
+
+    Returns:
+        dict: Site id -> feature ids of its buildings, in increasing order.
+    """
+    if search_distance <= 0:
+        fids = sorted(building_layer.allFeatureIds())
+        return {site_id: fids for site_id in site_geometries}
+    index = QgsSpatialIndex(building_layer.getFeatures(QgsFeatureRequest().setNoAttributes()))
+    partition = {}
+    for site_id, geometry in site_geometries.items():
+        extent = geometry.boundingBox()
+        extent.grow(search_distance)
+        partition[site_id] = sorted(index.intersects(extent))
+    return partition
+
+
+def site_jsons(source_json, site_field):
+    """
+    Splits the excavation or tunnel polygons into one core input per site.
+
+    Args:
+        source_json (dict): The polygons of all sites, see methodslib.get_shapefile_as_json_pyqgis().
+        site_field (str): The field with the site id.
+
+    Returns:
+        dict: Site id -> {"features": [...]} the polygons of the site. Polygons without a site id are left out.
+    """
+    sites = {}
+    for feature in source_json["features"]:
+        site_id = site_id_of(feature["attributes"].get(site_field))
+        if site_id is not None:
+            sites.setdefault(site_id, {"features": []})["features"].append(feature)
+    return sites
+
+
+def write_site_buildings(building_layer, fids, output_path):
+    """
+    Writes the buildings of a site to the shapefile the core reads.
+
+    Returns:
+        list: The feature ids of the written buildings, in the order of the shapefile.
+    """
+    writer = _create_writer(output_path, building_layer.fields(), building_layer.wkbType(), building_layer.crs())
+    written = []
+    for feature in building_layer.getFeatures(QgsFeatureRequest().setFilterFids(list(fids))):
+        writer.addFeature(feature)
+        written.append(feature.id())
+    del writer
+    return written
+
+
+def site_tasks(building_layer, site_inputs, partition, site_type, core_kwargs, work_folder):
+    """
+    Writes the buildings of every site with buildings, and returns the arguments of evaluate_site_task().
+
+    Args:
+        building_layer (QgsVectorLayer): All buildings, in the output CRS.
+        site_inputs (dict): Site id -> the excavation or tunnel polygons of the site, see site_jsons().
+        partition (dict): Site id -> feature ids of its buildings, see partition_buildings().
+        site_type (str): "Excavation" or "Tunnel".
+        core_kwargs (dict): Site id -> keyword arguments of the core, without the buildings, the polygons
+            and the output folder.
+        work_folder (Path): Folder for the inputs and outputs of the sites, one sub folder per site.
+
+    Returns:
+        list: (site_id, site_type, core_kwargs, fids) tuples of plain python values, 'fids' being the
+        feature ids of the buildings in the order of the shapefile of the site.
+    """
+    tasks = []
+    for number, (site_id, site_json) in enumerate(site_inputs.items(), start=1):
+        if not len(partition.get(site_id, [])):
+            continue
+        site_folder = Path(work_folder) / f"site-{number}"
+        site_folder.mkdir(parents=True, exist_ok=True)
+        buildings_path = site_folder / "buildings.shp"
+        fids = write_site_buildings(building_layer, partition[site_id], buildings_path)
+        kwargs = dict(core_kwargs[site_id])
+        kwargs.update(
+            buildingsFN=str(buildings_path),
+            output_ws=str(site_folder),
+            feature_name=f"site-{number}",
+        )
+        kwargs[SITE_JSON_ARGUMENTS[site_type]] = site_json
+        tasks.append((site_id, site_type, kwargs, fids))
+    return tasks
+
+
+def evaluate_site_task(site_id, site_type, core_kwargs, fids, logger=None):
+    """
+    Evaluates the buildings of one site with the REMEDY core. Runs in a worker process, see run_sites().
+
+    Args:
+        site_id (str): The id of the site.
+        site_type (str): "Excavation" or "Tunnel".
+        core_kwargs (dict): Keyword arguments of the core, see site_tasks().
+        fids (list): Feature ids of the buildings of the site, see site_tasks().
+        logger (logging.Logger, optional): Logger of the core, the one of this module by default.
+
+    Returns:
+        tuple: (site_id, (fids, buildings_path, output_paths)) with the building, wall and corner
+        shapefiles written by the core.
+    """
+    # The core is imported where the site is evaluated, worker processes import it once
+    from ..REMEDY_GIS_RiskTool import BegrensSkade
+
+    core = getattr(BegrensSkade, CORES[site_type])
+    output_paths = core(logger=logger or logging.getLogger(__name__), **core_kwargs)
+    return site_id, (fids, core_kwargs["buildingsFN"], [str(path) for path in output_paths])
+
+
+def python_executable():
+    """
+    The Python interpreter for worker processes. Inside QGIS sys.executable is the QGIS application, the
+    interpreter is looked up next to the Python installation QGIS runs on.
+
+    Returns:
+        str or None: The interpreter, or None if it is not found.
+    """
+    executable = Path(sys.executable)
+    if executable.stem.lower().startswith("python"):
+        return str(executable)
+    for folder in (Path(sys.exec_prefix), Path(sys.exec_prefix) / "bin"):
+        for name in ("python.exe", "python3", "python"):
+            if (folder / name).is_file():
+                return str(folder / name)
+    return shutil.which("python3") or shutil.which("python")
+
+
+def run_sites(tasks, n_workers=0, progress=None, logger=None):
+    """
+    Evaluates every site, in a pool of 'n_workers' processes or in this process if n_workers is 0 (or no
+    Python interpreter for the workers is found).
+
+    Args:
+        tasks (list): Arguments of evaluate_site_task() for every site.
+        n_workers (int): The number of worker processes.
+        progress (callable, optional): Called with the fraction of evaluated sites. An exception of the
+            callback (e.g. a canceled run) stops the evaluation, the sites not started are dropped.
+        logger (logging.Logger, optional): Logger for logging messages, and of the core in this process.
+
+    Returns:
+        dict: Site id -> (fids, buildings_path, output_paths), see evaluate_site_task().
+    """
+    results = {}
+    executable = python_executable() if n_workers > 0 else None
+    if n_workers > 0 and executable is None and logger:
+        logger.warning("@run_sites@ - No Python interpreter found for the worker processes, the sites are evaluated in QGIS")
+    if executable is None:
+        for task in tasks:
+            site_id, site_result = evaluate_site_task(*task, logger=logger)
+            results[site_id] = site_result
+            if progress is not None:
+                progress(len(results) / len(tasks))
+        return results
+
+    # Spawned workers only import the plugin modules they need, not the QGIS application
+    mp_context = multiprocessing.get_context("spawn")
+    mp_context.set_executable(executable)
+    if logger:
+        logger.info(f"@run_sites@ - Evaluating {len(tasks)} sites in {n_workers} worker processes ({executable})")
+    executor = ProcessPoolExecutor(max_workers=min(n_workers, len(tasks)) or 1, mp_context=mp_context)
+    try:
+        pending = {executor.submit(evaluate_site_task, *task) for task in tasks}
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                site_id, site_result = future.result()
+                results[site_id] = site_result
+            if progress is not None:
+                progress(len(results) / len(tasks))
+    finally:
+        # Sites that have not started are dropped, running sites are awaited so no worker outlives the run
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _create_writer(output_path, fields, wkb_type, crs):
+    """Creates an ESRI Shapefile writer, overwriting 'output_path'."""
+    QgsVectorFileWriter.deleteShapeFile(str(output_path))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(str(output_path), fields, wkb_type, crs, QgsCoordinateTransformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise IOError(f"Could not write {output_path}: {writer.errorMessage()}")
+    return writer
+
+
+def _sort_value(value):
+    """Orders missing and NaN values before all numbers."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return -math.inf
+    return value
+
+
+def merge_site_values(records, governing_field=GOVERNING_FIELD):
+    """
+    Merges the building results of buildings evaluated for several sites.
+
+    Args:
+        records (dict): Building -> list of (site_id, values), 'values' being a dict of the numeric
+            attributes of the building in the output of the site.
+        governing_field (str): The attribute deciding the governing site.
+
+    Returns:
+        dict: Building -> (site_id, values) The governing site, with the largest value of 'governing_field',
+        and the largest value of every attribute over all sites (missing values are skipped).
+    """
+    merged = {}
+    for building, site_values in records.items():
+        governing_site, governing_values = max(site_values, key=lambda item: _sort_value(item[1].get(governing_field)))
+        values = {}
+        for name, value in governing_values.items():
+            candidates = [other[name] for _, other in site_values if _sort_value(other.get(name)) != -math.inf]
+            values[name] = max(candidates) if candidates else value
+        merged[building] = (governing_site, values)
+    return merged
+
+
+def _merged_fields(layer):
+    """The fields of a core output, after the site id and the number of sites of the building."""
+    fields = QgsFields()
+    fields.append(QgsField("site", QVariant.String, "string", 80))
+    fields.append(QgsField("n_sites", QVariant.Int))
+    for field in layer.fields():
+        fields.append(field)
+    return fields
+
+
+def write_site_outputs(site_results, building_path, wall_path, corner_path):
+    """
+    Merges the outputs of all sites into one building, wall and corner shapefile, with the fields of the
+    Excavation and Tunnel outputs. Every building appears once: a building evaluated for several sites
+    gets the largest value of every numeric attribute over the sites, and the walls and corners of the
+    governing site (the largest total settlement). The field 'site' holds the governing site and 'n_sites'
+    the number of sites the building was evaluated for. The id fields (bid, wid, cid) are numbered anew.
+
+    Args:
+        site_results (dict): Site id -> (fids, buildings_path, output_paths), see run_sites().
+        building_path, wall_path, corner_path (str): The merged shapefiles.
+
+    Returns:
+        tuple: (building_path, wall_path, corner_path, summary) with summary a dict site id ->
+        {"n_buildings", "n_governing", "max_sv_tot"}.
+    """
+    # Output name -> building feature id -> site id -> output features of the building
+    features = {name: {} for name in OUTPUT_NAMES}
+    layers = {}
+    for site_id, (fids, buildings_path, output_paths) in site_results.items():
+        site_buildings = QgsVectorLayer(str(buildings_path), "buildings", "ogr")
+        for name, output_path in zip(OUTPUT_NAMES, output_paths):
+            # Output features are linked to the building of the site shapefile, numbered from 0
+            association = associate_outputs(site_buildings, output_path)
+            layer = QgsVectorLayer(str(output_path), name, "ogr")
+            layers.setdefault(name, layer)
+            for feature in layer.getFeatures():
+                building = association.get(str(feature.id()))
+                if building is not None:
+                    features[name].setdefault(fids[int(building)], {}).setdefault(site_id, []).append(feature)
+        del site_buildings
+
+    records = {}
+    for building, site_features in features["buildings"].items():
+        records[building] = [
+            (site_id, {field.name(): feature[field.name()] for field in feature.fields() if field.type() in _NUMERIC_TYPES
+                       and field.name() not in ID_FIELDS})
+            for site_id, site_list in site_features.items()
+            for feature in site_list[:1]
+        ]
+    merged = merge_site_values(records)
+
+    summary = {site_id: {"n_buildings": len(fids), "n_governing": 0, "max_sv_tot": None}
+               for site_id, (fids, _, _) in site_results.items()}
+    for site_values in records.values():
+        for site_id, values in site_values:
+            value = values.get(GOVERNING_FIELD)
+            if _sort_value(value) > _sort_value(summary[site_id]["max_sv_tot"]):
+                summary[site_id]["max_sv_tot"] = value
+    for governing_site, _ in merged.values():
+        summary[governing_site]["n_governing"] += 1
+
+    paths = {"buildings": building_path, "walls": wall_path, "corners": corner_path}
+    building_ids = {building: number for number, building in enumerate(sorted(merged), start=1)}
+    for name in OUTPUT_NAMES:
+        fields = _merged_fields(layers[name])
+        writer = _create_writer(paths[name], fields, layers[name].wkbType(), layers[name].crs())
+        running_ids = {id_field: 1 for id_field in ID_FIELDS if fields.indexOf(id_field) >= 0}
+        for building in sorted(merged):
+            governing_site, values = merged[building]
+            site_features = features[name].get(building, {})
+            for source in site_features.get(governing_site, []):
+                feature = QgsFeature(fields)
+                feature.setGeometry(source.geometry())
+                for field in source.fields():
+                    feature[field.name()] = source[field.name()]
+                if name == "buildings":
+                    for field_name, value in values.items():
+                        feature[field_name] = value
+                for id_field in running_ids:
+                    if id_field == "bid":
+                        feature[id_field] = building_ids[building]
+                    else:
+                        feature[id_field] = running_ids[id_field]
+                        running_ids[id_field] += 1
+                feature["site"] = str(governing_site)
+                feature["n_sites"] = len(features["buildings"][building])
+                writer.addFeature(feature)
+        del writer
+    return str(building_path), str(wall_path), str(corner_path), summary
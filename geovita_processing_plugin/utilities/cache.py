@@ -0,0 +1,411 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from osgeo import gdal
+
+from .methodslib import get_file_components
+
+# The cache lives next to the log directory in the users Downloads/REMEDY folder
+CACHE_ROOT = Path.home() / "Downloads" / "REMEDY" / "cache"
+RESULT_CACHE_DIR = CACHE_ROOT / "results"
+RESULT_CACHE_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+REPROJECTION_CACHE_DIR = CACHE_ROOT / "reprojections"
+REPROJECTION_CACHE_MAX_SIZE = 5 * 1024 ** 3  # 5 GB
+DISTANCE_CACHE_DIR = CACHE_ROOT / "distance"
+DISTANCE_CACHE_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+OVERVIEW_CACHE_DIR = CACHE_ROOT / "overviews"
+OVERVIEW_CACHE_MAX_SIZE = 5 * 1024 ** 3  # 5 GB
+SPATIAL_INDEX_CACHE_DIR = CACHE_ROOT / "spatial-index"
+SPATIAL_INDEX_CACHE_MAX_SIZE = 5 * 1024 ** 3  # 5 GB
+
+_INDEX_FILENAME = "index.json"
+_LOCK_FILENAME = "index.lock"
+
+
+def _stat_fingerprint(path):
+    """Returns (name, size, mtime_ns) for every existing component of a file based dataset."""
+    stats = []
+    for component in get_file_components(Path(path)):
+        if component.suffix.lower() == ".qix":
+            # A spatial index built later does not change the data
+            continue
+        stat = component.stat()
+        stats.append([component.name, stat.st_size, stat.st_mtime_ns])
+    return stats
+
+
+def _raster_stat_fingerprint(path):
+    """
+    Returns (path, size, mtime_ns) for every file GDAL reads for a raster: the file itself, its side car
+    files and, for a VRT mosaic, the source rasters of the tiles. Rasters GDAL can not open are
+    fingerprinted by their own components, see _stat_fingerprint().
+    """
+    dataset = gdal.Open(str(path))
+    file_list = dataset.GetFileList() if dataset is not None else None
+    dataset = None
+    if not file_list:
+        return _stat_fingerprint(path)
+    stats = []
+    for file_name in sorted(set(file_list)):
+        file_path = Path(file_name)
+        if file_path.is_file():
+            stat = file_path.stat()
+            stats.append([str(file_path), stat.st_size, stat.st_mtime_ns])
+    return stats
+
+
+def _layer_file_path(layer):
+    """Returns the file path of a layer, or None if the layer is not file based (e.g. memory layers)."""
+    path = Path(layer.source().split("|")[0])
+    return path if path.is_file() else None
+
+
+def fingerprint_vector_layer(layer):
+    """
+    Fingerprints a vector layer by source, feature count, extent, CRS and file modification time.
+
+    Layers that are not backed by a file (memory layers, database layers) are fingerprinted by
+    a content hash of all geometries and attributes instead of the modification time.
+
+    Args:
+        layer (QgsVectorLayer): The layer to fingerprint, or None.
+
+    Returns:
+        dict: A JSON serializable fingerprint.
+    """
+    if layer is None:
+        return None
+    extent = layer.extent()
+    fingerprint = {
+        "source": layer.source(),
+        "subset": layer.subsetString(),
+        "feature_count": layer.featureCount(),
+        "extent": [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+        "crs": layer.crs().authid() or layer.crs().toWkt(),
+    }
+    path = _layer_file_path(layer)
+    if path is not None:
+        fingerprint["files"] = _stat_fingerprint(path)
+    else:
+        content = hashlib.sha256()
+        for feature in layer.getFeatures():
+            content.update(bytes(feature.geometry().asWkb()))
+            content.update(repr(feature.attributes()).encode("utf-8"))
+        fingerprint["content"] = content.hexdigest()
+    return fingerprint
+
+
+def fingerprint_raster_layer(layer):
+    """
+    Fingerprints a raster layer by source, size, extent, CRS and the modification time of its files,
+    the source tiles of a VRT included.
+
+    Args:
+        layer (QgsRasterLayer): The layer to fingerprint, or None.
+
+    Returns:
+        dict: A JSON serializable fingerprint.
+    """
+    if layer is None:
+        return None
+    extent = layer.extent()
+    fingerprint = {
+        "source": layer.source(),
+        "size": [layer.width(), layer.height()],
+        "extent": [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+        "crs": layer.crs().authid() or layer.crs().toWkt(),
+    }
+    path = _layer_file_path(layer)
+    if path is not None:
+        fingerprint["files"] = _raster_stat_fingerprint(path)
+    return fingerprint
+
+
+def reprojection_cache_key(layer, output_crs):
+    """
+    Returns the key of a reprojected layer: source path, modification time, source CRS and target CRS.
+
+    Args:
+        layer (Union[QgsVectorLayer, QgsRasterLayer]): The layer to reproject.
+        output_crs (QgsCoordinateReferenceSystem): The target CRS.
+
+    Returns:
+        str or None: The key, or None if the layer is not file based and can not be cached.
+    """
+    path = _layer_file_path(layer)
+    if path is None:
+        return None
+    is_vector = hasattr(layer, "subsetString")
+    return fingerprint_parameters(
+        "reprojection",
+        layer.source(),
+        layer.subsetString() if is_vector else "",
+        _stat_fingerprint(path) if is_vector else _raster_stat_fingerprint(path),
+        layer.crs().toWkt(),
+        output_crs.toWkt(),
+    )
+
+
+def overview_cache_key(raster_path):
+    """
+    Returns the key of the overviews of a raster file: path and modification time of the raster and,
+    for a VRT mosaic, of its source tiles.
+
+    Returns:
+        str or None: The key, or None if the raster is not a file.
+    """
+    path = Path(raster_path)
+    if not path.is_file():
+        return None
+    return fingerprint_parameters("overviews", str(path.resolve()), _raster_stat_fingerprint(path))
+
+
+def spatial_index_cache_key(layer):
+    """
+    Returns the key of the indexed GeoPackage copy of a vector layer: source path, subset and modification time.
+
+    Returns:
+        str or None: The key, or None if the layer is not file based.
+    """
+    path = _layer_file_path(layer)
+    if path is None:
+        return None
+    return fingerprint_parameters("spatial-index", layer.source(), layer.subsetString(), _stat_fingerprint(path))
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    Holds an exclusive lock on 'path' (created if missing), between processes. Waits until the lock is free.
+    """
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    # Retries for 10 seconds before raising
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def fingerprint_parameters(*parts):
+    """Returns a sha256 hex digest of JSON serializable parts (dict keys are sorted)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    A content-addressed cache of files on disk with size bounded LRU eviction.
+
+    Each entry is a folder named by its key, holding copies of the cached files (with all
+    shapefile/TIFF components). An index.json in the cache root records size and last access
+    of every entry. When the total size exceeds 'max_size', the least recently used entries
+    are evicted. The index is read, updated and written under a lock on index.lock, so several
+    QGIS sessions or processes can share the cache, and is replaced atomically.
+
+    Attributes:
+        root (Path): The cache directory.
+        max_size (int): Maximum total size of the cache in bytes.
+        logger (logging.Logger): Optional logger.
+    """
+    # One lock per cache directory, shared between instances in the same QGIS session
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, root, max_size, logger=None):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.logger = logger
+        self.root.mkdir(parents=True, exist_ok=True)
+        with DiskCache._locks_guard:
+            self._lock = DiskCache._locks.setdefault(str(self.root.resolve()), threading.RLock())
+
+    @contextmanager
+    def _locked(self):
+        """Holds the lock of the cache in this session, then the lock of the index between processes."""
+        with self._lock, _file_lock(self.root / _LOCK_FILENAME):
+            yield
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(f"@DiskCache@ - {message}")
+
+    def _read_index(self):
+        index_path = self.root / _INDEX_FILENAME
+        if not index_path.is_file():
+            return {}
+        try:
+            return json.loads(index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            # A corrupt index makes the cached entries unusable, start over
+            self._log("Could not read cache index, the cache is reset")
+            return {}
+
+    def _write_index(self, index):
+        # Readers see the old or the new index, never a partly written one
+        handle, temp_path = tempfile.mkstemp(prefix=f"{_INDEX_FILENAME}.", suffix=".tmp", dir=str(self.root))
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as temp_file:
+                json.dump(index, temp_file, indent=1)
+            os.replace(temp_path, str(self.root / _INDEX_FILENAME))
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def get(self, key):
+        """
+        Looks up an entry and marks it as recently used.
+
+        Returns:
+            dict or None: Name -> Path of the cached files, or None if the key is not cached.
+        """
+        with self._locked():
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            files = {name: self.root / key / file_name for name, file_name in entry["files"].items()}
+            if not all(path.is_file() for path in files.values()):
+                self._log(f"Entry {key} is incomplete and is removed")
+                self._remove_entry(index, key)
+                self._write_index(index)
+                return None
+            entry["last_access"] = time.time()
+            self._write_index(index)
+            return files
+
+    def put(self, key, files):
+        """
+        Copies files (with all their components) into the cache under 'key' and evicts old entries.
+
+        Args:
+            key (str): The cache key.
+            files (dict): Name -> path of the files to cache.
+
+        Returns:
+            dict: Name -> Path of the cached copies.
+        """
+        with self._locked():
+            index = self._read_index()
+            self._remove_entry(index, key)
+            entry_dir = self.root / key
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            size = 0
+            entry_files = {}
+            for name, path in files.items():
+                path = Path(path)
+                for component in get_file_components(path):
+                    shutil.copy2(str(component), str(entry_dir / component.name))
+                    size += component.stat().st_size
+                entry_files[name] = path.name
+            index[key] = {"files": entry_files, "size": size, "created": time.time(), "last_access": time.time()}
+            self._evict(index, keep=key)
+            self._write_index(index)
+            self._log(f"Stored entry {key} ({size} bytes)")
+            return {name: entry_dir / file_name for name, file_name in entry_files.items()}
+
+    def _remove_entry(self, index, key):
+        index.pop(key, None)
+        shutil.rmtree(self.root / key, ignore_errors=True)
+
+    def _evict(self, index, keep=None):
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            total -= index[key]["size"]
+            self._remove_entry(index, key)
+            self._log(f"Evicted entry {key}")
+
+    def size(self):
+        """Returns the total size in bytes of all cached entries."""
+        with self._locked():
+            return sum(entry["size"] for entry in self._read_index().values())
+
+    def purge(self):
+        """
+        Removes all entries from the cache.
+
+        Returns:
+            tuple: (number of removed entries, number of freed bytes)
+        """
+        with self._locked():
+            index = self._read_index()
+            count, size = len(index), sum(entry["size"] for entry in index.values())
+            for key in list(index):
+                self._remove_entry(index, key)
+            # Remove leftovers from entries that never made it to the index
+            for path in self.root.iterdir():
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+            self._write_index(index)
+            self._log(f"Purged {count} entries ({size} bytes)")
+            return count, size
+
+
+def get_result_cache(logger=None):
+    """Returns the cache holding the outputs of the REMEDY algorithms."""
+    return DiskCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_SIZE, logger)
+
+
+def get_reprojection_cache(logger=None):
+    """Returns the cache holding reprojected building, excavation, tunnel and DTB layers."""
+    return DiskCache(REPROJECTION_CACHE_DIR, REPROJECTION_CACHE_MAX_SIZE, logger)
+
+
+def get_distance_cache(logger=None):
+    """Returns the cache holding the distance fields of impact map grids to their excavation."""
+    return DiskCache(DISTANCE_CACHE_DIR, DISTANCE_CACHE_MAX_SIZE, logger)
+
+
+def get_overview_cache(logger=None):
+    """Returns the cache holding VRTs with overviews of high resolution DTB rasters."""
+    return DiskCache(OVERVIEW_CACHE_DIR, OVERVIEW_CACHE_MAX_SIZE, logger)
+
+
+def get_spatial_index_cache(logger=None):
+    """Returns the cache holding GeoPackage copies, with R-tree index, of vector layers that can not be indexed in place."""
+    return DiskCache(SPATIAL_INDEX_CACHE_DIR, SPATIAL_INDEX_CACHE_MAX_SIZE, logger)
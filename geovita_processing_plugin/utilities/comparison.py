@@ -0,0 +1,688 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from qgis.core import (QgsCoordinateTransformContext,
+                       QgsFeature,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsProcessingContext,
+                       QgsProcessingFeedback,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
+from qgis import processing
+from osgeo import gdal, ogr, osr
+from pathlib import Path
+import math
+import random
+
+import numpy as np
+
+# Default tolerances used when comparing a candidate engine against the reference (REMEDY) engine.
+# Settlements are written in meters, so an absolute tolerance of 1e-5 equals 0.01 mm.
+DEFAULT_ABS_TOL = 1e-5
+DEFAULT_REL_TOL = 1e-3
+
+# Tolerances of the vectorized settlement engine (settlementlib/sitelib/gridlib) against REMEDY:
+# 0.1 mm or 1 % of the REMEDY value, a hundredth of the lowest settlement category limit (10 mm)
+ENGINE_ABS_TOL = 1e-4
+ENGINE_REL_TOL = 1e-2
+
+# Attributes of the REMEDY outputs that the vectorized engine reproduces (CombinedImpact outputs)
+ENGINE_FIELDS = {
+    "OUTPUT_BUILDING": ["max_sv_tot", "max_angle"],
+    "OUTPUT_WALL": ["slope_ang"],
+    "OUTPUT_CORNER": ["sv_short", "sh_short", "sv_long", "sv_tot"],
+}
+
+# Features are paired by their centroid rounded to this number of decimals [m] when matching by location
+LOCATION_DECIMALS = 3
+
+RASTER_SUFFIXES = ('.tif', '.tiff', '.vrt', '.img')
+
+# Allowed vulnerability values, see the specification table in the README
+SYNTHETIC_FOUNDATIONS = ['To bedrock', 'Raft', 'Strip', 'Wooden piles']
+SYNTHETIC_STRUCTURES = ['Steel', 'Reinforced concrete', 'Mixed', 'Masonry']
+SYNTHETIC_CONDITIONS = ['Excellent', 'Good', 'Medium', 'Bad']
+
+
+class Deviation:
+    """
+    The largest deviation found for one compared quantity (an attribute or a raster band).
+
+    Attributes:
+        name (str): Name of the compared attribute or band.
+        n_compared (int): Number of values compared.
+        n_failed (int): Number of values outside the tolerance.
+        max_abs (float): Largest absolute deviation.
+        max_rel (float): Largest relative deviation (relative to the reference value).
+        location: Feature key or (row, col) of the largest absolute deviation.
+        reference_value (float): Reference value at the location of the largest deviation.
+        candidate_value (float): Candidate value at the location of the largest deviation.
+    """
+    def __init__(self, name, n_compared=0, n_failed=0, max_abs=0.0, max_rel=0.0,
+                 location=None, reference_value=None, candidate_value=None):
+        self.name = name
+        self.n_compared = n_compared
+        self.n_failed = n_failed
+        self.max_abs = max_abs
+        self.max_rel = max_rel
+        self.location = location
+        self.reference_value = reference_value
+        self.candidate_value = candidate_value
+
+    @property
+    def passed(self):
+        return self.n_failed == 0
+
+    def __repr__(self):
+        return (f"Deviation({self.name}: max_abs={self.max_abs:.6g}, max_rel={self.max_rel:.6g}, "
+                f"failed={self.n_failed}/{self.n_compared}, at={self.location}, "
+                f"reference={self.reference_value}, candidate={self.candidate_value})")
+
+
+class ComparisonReport:
+    """
+    Collects the deviations between one reference output and one candidate output.
+
+    Structural problems (missing files, different feature counts, misaligned rasters)
+    are stored in 'errors' and make the comparison fail regardless of the tolerances.
+    """
+    def __init__(self, label, reference_path=None, candidate_path=None):
+        self.label = label
+        self.reference_path = reference_path
+        self.candidate_path = candidate_path
+        self.deviations = {}
+        self.errors = []
+
+    @property
+    def passed(self):
+        return not self.errors and all(dev.passed for dev in self.deviations.values())
+
+    def add_error(self, message):
+        self.errors.append(message)
+
+    def add_deviation(self, deviation):
+        self.deviations[deviation.name] = deviation
+
+    def largest_deviations(self, count=5):
+        """Returns the 'count' deviations with the largest absolute difference, largest first."""
+        return sorted(self.deviations.values(), key=lambda dev: dev.max_abs, reverse=True)[:count]
+
+    def summary(self):
+        status = "PASSED" if self.passed else "FAILED"
+        lines = [f"[{status}] {self.label}"]
+        lines.extend(f"  ERROR: {error}" for error in self.errors)
+        lines.extend(f"  {deviation}" for deviation in self.largest_deviations())
+        return "\n".join(lines)
+
+
+def compare_arrays(name, reference, candidate, abs_tol=DEFAULT_ABS_TOL, rel_tol=DEFAULT_REL_TOL, locations=None):
+    """
+    Compares two equally shaped arrays element wise and returns a Deviation.
+
+    NaN in both arrays counts as equal, NaN in only one of them counts as a failure.
+    A value passes if |candidate - reference| <= abs_tol + rel_tol * |reference|.
+
+    Args:
+        name (str): Name of the compared quantity.
+        reference (np.ndarray): Reference values.
+        candidate (np.ndarray): Candidate values.
+        abs_tol (float): Absolute tolerance.
+        rel_tol (float): Relative tolerance.
+        locations (sequence, optional): Key per element (flattened order) used to report where the
+            largest deviation occurs. If None, the array index is reported.
+
+    Returns:
+        Deviation: The summary of the comparison.
+    """
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    if reference.shape != candidate.shape:
+        raise ValueError(f"Shape mismatch for {name}: {reference.shape} != {candidate.shape}")
+
+    both_nan = np.isnan(reference) & np.isnan(candidate)
+    one_nan = np.isnan(reference) ^ np.isnan(candidate)
+    valid = ~(both_nan | one_nan)
+
+    abs_diff = np.zeros(reference.shape)
+    abs_diff[valid] = np.abs(candidate[valid] - reference[valid])
+    rel_diff = np.zeros(reference.shape)
+    nonzero = valid & (reference != 0)
+    rel_diff[nonzero] = abs_diff[nonzero] / np.abs(reference[nonzero])
+
+    failed = one_nan | (valid & (abs_diff > abs_tol + rel_tol * np.abs(np.nan_to_num(reference))))
+
+    deviation = Deviation(name, n_compared=int(reference.size), n_failed=int(failed.sum()))
+    if reference.size == 0:
+        return deviation
+
+    deviation.max_rel = float(rel_diff.max())
+    # Report a NaN mismatch before any numeric difference
+    if one_nan.any():
+        flat_index = int(np.flatnonzero(one_nan)[0])
+        deviation.max_abs = math.inf
+    else:
+        flat_index = int(np.argmax(abs_diff))
+        deviation.max_abs = float(abs_diff.flat[flat_index])
+    deviation.reference_value = float(reference.flat[flat_index])
+    deviation.candidate_value = float(candidate.flat[flat_index])
+    if locations is not None:
+        deviation.location = locations[flat_index]
+    else:
+        deviation.location = np.unravel_index(flat_index, reference.shape)
+    return deviation
+
+
+def _feature_values(layer, field_names, key_field=None):
+    """Reads numeric attribute values and centroids from a vector layer into arrays, keyed by 'key_field' or fid."""
+    keys = []
+    values = {name: [] for name in field_names}
+    centroids = []
+    for feature in layer.getFeatures():
+        keys.append(feature[key_field] if key_field else feature.id())
+        for name in field_names:
+            value = feature[name]
+            try:
+                values[name].append(float(value))
+            except (TypeError, ValueError):
+                values[name].append(math.nan)
+        geom = feature.geometry()
+        if geom is None or geom.isNull():
+            centroids.append((math.nan, math.nan))
+        else:
+            point = geom.centroid().asPoint()
+            centroids.append((point.x(), point.y()))
+    return keys, {name: np.array(vals, dtype=float) for name, vals in values.items()}, np.array(centroids, dtype=float).reshape(-1, 2)
+
+
+def compare_vector_outputs(reference_path, candidate_path, fields=None, key_field=None,
+                           abs_tol=DEFAULT_ABS_TOL, rel_tol=DEFAULT_REL_TOL, label=None, match_by_location=False):
+    """
+    Compares the numeric attributes of two vector outputs (e.g. OUTPUT_BUILDING/WALL/CORNER) feature by feature.
+
+    Features are paired by 'key_field' if given, by their centroid if 'match_by_location' is True (for
+    outputs of different engines, or merged incremental outputs, where the feature order and the
+    attributes differ), otherwise by their order in the files. The feature centroids are compared as
+    well and reported as the pseudo attribute '__centroid__'.
+
+    Args:
+        reference_path (str or Path): Path to the reference vector file.
+        candidate_path (str or Path): Path to the candidate vector file.
+        fields (list, optional): Attribute names to compare. Defaults to all numeric fields present in both files.
+        key_field (str, optional): Attribute used to pair the features.
+        abs_tol (float): Absolute tolerance.
+        rel_tol (float): Relative tolerance.
+        label (str, optional): Label used in the report. Defaults to the file name.
+        match_by_location (bool): Pair the features by their centroid, see LOCATION_DECIMALS.
+
+    Returns:
+        ComparisonReport: The report containing one Deviation per attribute.
+    """
+    report = ComparisonReport(label or Path(str(reference_path)).name, reference_path, candidate_path)
+    reference_layer = QgsVectorLayer(str(reference_path), "reference", "ogr")
+    candidate_layer = QgsVectorLayer(str(candidate_path), "candidate", "ogr")
+    if not reference_layer.isValid():
+        report.add_error(f"Could not load reference layer: {reference_path}")
+    if not candidate_layer.isValid():
+        report.add_error(f"Could not load candidate layer: {candidate_path}")
+    if report.errors:
+        return report
+
+    if fields is None:
+        candidate_names = set(candidate_layer.fields().names())
+        fields = [field.name() for field in reference_layer.fields()
+                  if field.isNumeric() and field.name() in candidate_names and field.name() != key_field]
+    else:
+        missing = [name for name in fields
+                   if reference_layer.fields().indexOf(name) < 0 or candidate_layer.fields().indexOf(name) < 0]
+        if missing:
+            report.add_error(f"Fields missing in one of the outputs: {missing}")
+            fields = [name for name in fields if name not in missing]
+
+    ref_keys, ref_values, ref_centroids = _feature_values(reference_layer, fields, key_field)
+    cand_keys, cand_values, cand_centroids = _feature_values(candidate_layer, fields, key_field)
+    if match_by_location:
+        ref_keys = [tuple(np.round(xy, LOCATION_DECIMALS)) for xy in ref_centroids]
+        cand_keys = [tuple(np.round(xy, LOCATION_DECIMALS)) for xy in cand_centroids]
+
+    if key_field or match_by_location:
+        cand_index = {key: i for i, key in enumerate(cand_keys)}
+        missing_keys = [key for key in ref_keys if key not in cand_index]
+        extra_keys = set(cand_keys) - set(ref_keys)
+        if missing_keys:
+            report.add_error(f"{len(missing_keys)} features missing in candidate, e.g. {missing_keys[:5]}")
+        if extra_keys:
+            report.add_error(f"{len(extra_keys)} extra features in candidate, e.g. {sorted(extra_keys, key=str)[:5]}")
+        ref_rows = [i for i, key in enumerate(ref_keys) if key in cand_index]
+        cand_rows = [cand_index[ref_keys[i]] for i in ref_rows]
+    else:
+        if len(ref_keys) != len(cand_keys):
+            report.add_error(f"Feature count differs: reference {len(ref_keys)}, candidate {len(cand_keys)}")
+        count = min(len(ref_keys), len(cand_keys))
+        ref_rows = list(range(count))
+        cand_rows = list(range(count))
+
+    locations = [ref_keys[i] for i in ref_rows]
+    for name in fields:
+        report.add_deviation(compare_arrays(name, ref_values[name][ref_rows], cand_values[name][cand_rows],
+                                            abs_tol, rel_tol, locations))
+
+    centroid_distance = np.hypot(*(ref_centroids[ref_rows] - cand_centroids[cand_rows]).T) if ref_rows else np.zeros(0)
+    report.add_deviation(compare_arrays("__centroid__", np.zeros(len(ref_rows)), centroid_distance,
+                                        abs_tol, 0.0, locations))
+    return report
+
+
+def compare_raster_outputs(reference_path, candidate_path, bands=None,
+                           abs_tol=DEFAULT_ABS_TOL, rel_tol=DEFAULT_REL_TOL, label=None, candidate_zone=None):
+    """
+    Compares two rasters (e.g. OUTPUT_RASTER) cell by cell.
+
+    The rasters must share size and geotransform. Nodata cells are compared as NaN, so a cell
+    that is nodata in only one of the rasters counts as a failure. When 'candidate_zone' is set, the
+    candidate may be nodata outside of the zone, but must cover every valid reference cell inside it.
+
+    Args:
+        reference_path (str or Path): Path to the reference raster.
+        candidate_path (str or Path): Path to the candidate raster.
+        bands (list, optional): 1-based band numbers to compare. Defaults to all bands.
+        abs_tol (float): Absolute tolerance.
+        rel_tol (float): Relative tolerance.
+        label (str, optional): Label used in the report. Defaults to the file name.
+        candidate_zone (QgsGeometry, optional): The zone of the grid computed by the candidate (e.g. the
+            influence zone of an impact map), in the CRS of the rasters. Cells whose center is outside
+            of the zone and nodata in the candidate are left out of the comparison.
+
+    Returns:
+        ComparisonReport: The report containing one Deviation per band, located by (row, col).
+    """
+    report = ComparisonReport(label or Path(str(reference_path)).name, reference_path, candidate_path)
+    reference_ds = gdal.Open(str(reference_path))
+    candidate_ds = gdal.Open(str(candidate_path))
+    if reference_ds is None:
+        report.add_error(f"Could not open reference raster: {reference_path}")
+    if candidate_ds is None:
+        report.add_error(f"Could not open candidate raster: {candidate_path}")
+    if report.errors:
+        return report
+
+    ref_shape = (reference_ds.RasterCount, reference_ds.RasterYSize, reference_ds.RasterXSize)
+    cand_shape = (candidate_ds.RasterCount, candidate_ds.RasterYSize, candidate_ds.RasterXSize)
+    if ref_shape[1:] != cand_shape[1:]:
+        report.add_error(f"Raster size differs: reference {ref_shape[1:]}, candidate {cand_shape[1:]}")
+        return report
+    if not np.allclose(reference_ds.GetGeoTransform(), candidate_ds.GetGeoTransform()):
+        report.add_error(f"Geotransform differs: reference {reference_ds.GetGeoTransform()}, "
+                         f"candidate {candidate_ds.GetGeoTransform()}")
+        return report
+    if ref_shape[0] != cand_shape[0]:
+        report.add_error(f"Band count differs: reference {ref_shape[0]}, candidate {cand_shape[0]}")
+
+    outside_zone = None
+    if candidate_zone is not None:
+        outside_zone = ~zone_mask(candidate_zone, reference_ds)
+        if outside_zone.all():
+            report.add_error("The candidate zone covers no cell of the rasters")
+            return report
+
+    for band_number in bands or range(1, min(ref_shape[0], cand_shape[0]) + 1):
+        reference = read_band_as_array(reference_ds, band_number)
+        candidate = read_band_as_array(candidate_ds, band_number)
+        if outside_zone is not None:
+            reference = np.where(outside_zone & np.isnan(candidate), np.nan, reference)
+            missing = ~outside_zone & np.isnan(candidate) & ~np.isnan(reference)
+            if missing.any():
+                rows, cols = np.nonzero(missing)
+                report.add_error(f"band_{band_number}: {int(missing.sum())} cells of the candidate zone are "
+                                 f"nodata in the candidate, first at (row, col) ({rows[0]}, {cols[0]})")
+        report.add_deviation(compare_arrays(f"band_{band_number}", reference, candidate, abs_tol, rel_tol))
+    return report
+
+
+def zone_mask(geometry, dataset):
+    """
+    The cells of a raster whose center lies inside a polygon.
+
+    Args:
+        geometry (QgsGeometry): The polygon, in the CRS of the raster.
+        dataset (gdal.Dataset): The raster.
+
+    Returns:
+        np.ndarray: Boolean mask (rows, cols).
+    """
+    mask = gdal.GetDriverByName("MEM").Create("", dataset.RasterXSize, dataset.RasterYSize, 1, gdal.GDT_Byte)
+    mask.SetGeoTransform(dataset.GetGeoTransform())
+    mask.SetProjection(dataset.GetProjection())
+    source = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = source.CreateLayer("zone", None, ogr.wkbUnknown)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geometry.asWkb())))
+    layer.CreateFeature(feature)
+    gdal.RasterizeLayer(mask, [1], layer, burn_values=[1])
+    return mask.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def read_band_as_array(dataset, band_number=1):
+    """Reads a raster band into a float array where nodata cells are NaN."""
+    band = dataset.GetRasterBand(band_number)
+    array = band.ReadAsArray().astype(float)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        array[array == nodata] = np.nan
+    return array
+
+
+class DifferentialHarness:
+    """
+    Runs a reference and a candidate implementation on the same inputs and compares all outputs.
+
+    Both implementations are callables taking a parameter dictionary and returning a result
+    dictionary such as the one returned by processing.run(). Every output present in both results
+    is compared: rasters cell by cell, vector files attribute by attribute.
+
+    Example:
+        >>> harness = DifferentialHarness(
+        ...     processing_runner("geovita:begrensskadeexcavation", output_folder=ref_dir),
+        ...     my_accelerated_runner,
+        ... )
+        >>> reports = harness.run({"fixture": params})
+        >>> print(harness.summary(reports))
+    """
+    def __init__(self, reference, candidate, abs_tol=DEFAULT_ABS_TOL, rel_tol=DEFAULT_REL_TOL,
+                 key_fields=None, fields=None, logger=None, match_by_location=False, candidate_zone=None):
+        """
+        Args:
+            reference (callable): Reference implementation, parameters -> results.
+            candidate (callable): Candidate implementation, parameters -> results.
+            abs_tol (float): Absolute tolerance.
+            rel_tol (float): Relative tolerance.
+            key_fields (dict, optional): Output name -> attribute used to pair features, e.g. {"OUTPUT_CORNER": "cid"}.
+            fields (dict, optional): Output name -> list of attributes to compare. Defaults to all shared numeric fields.
+            logger (logging.Logger, optional): Logger for the summary of each case.
+            match_by_location (bool): Pair the features of vector outputs by their centroid, see compare_vector_outputs().
+            candidate_zone (callable, optional): Parameters -> zone (QgsGeometry) computed by the candidate,
+                see compare_raster_outputs().
+        """
+        self.reference = reference
+        self.candidate = candidate
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+        self.key_fields = key_fields or {}
+        self.fields = fields or {}
+        self.logger = logger
+        self.match_by_location = match_by_location
+        self.candidate_zone = candidate_zone
+
+    def compare_results(self, case_name, reference_results, candidate_results, candidate_zone=None):
+        """
+        Compares two result dictionaries and returns one ComparisonReport per output. 'candidate_zone'
+        (QgsGeometry) is passed on to compare_raster_outputs().
+        """
+        reports = []
+        for output_name, reference_path in reference_results.items():
+            label = f"{case_name}/{output_name}"
+            if output_name not in candidate_results:
+                report = ComparisonReport(label, reference_path, None)
+                report.add_error(f"Output {output_name} missing in candidate results")
+                reports.append(report)
+                continue
+            candidate_path = candidate_results[output_name]
+            if str(reference_path).lower().endswith(RASTER_SUFFIXES):
+                report = compare_raster_outputs(reference_path, candidate_path,
+                                                abs_tol=self.abs_tol, rel_tol=self.rel_tol, label=label,
+                                                candidate_zone=candidate_zone)
+            else:
+                report = compare_vector_outputs(reference_path, candidate_path,
+                                                fields=self.fields.get(output_name),
+                                                key_field=self.key_fields.get(output_name),
+                                                abs_tol=self.abs_tol, rel_tol=self.rel_tol, label=label,
+                                                match_by_location=self.match_by_location)
+            reports.append(report)
+        return reports
+
+    def run_case(self, case_name, parameters):
+        """Runs both implementations on one parameter set and compares the outputs."""
+        reference_results = self.reference(dict(parameters))
+        candidate_results = self.candidate(dict(parameters))
+        candidate_zone = self.candidate_zone(parameters) if self.candidate_zone else None
+        reports = self.compare_results(case_name, reference_results, candidate_results, candidate_zone)
+        if self.logger:
+            for report in reports:
+                self.logger.info(report.summary())
+        return reports
+
+    def run(self, cases):
+        """
+        Runs all cases.
+
+        Args:
+            cases (dict): Case name -> parameter dictionary.
+
+        Returns:
+            dict: Case name -> list of ComparisonReport.
+        """
+        return {case_name: self.run_case(case_name, parameters) for case_name, parameters in cases.items()}
+
+    @staticmethod
+    def summary(results):
+        """Formats the reports from run() and lists the largest deviations of each output."""
+        return "\n".join(report.summary() for reports in results.values() for report in reports)
+
+    @staticmethod
+    def all_passed(results):
+        return all(report.passed for reports in results.values() for report in reports)
+
+
+def processing_runner(algorithm_id, output_folder, overrides=None, parameter_names=None, output_names=None):
+    """
+    Returns a callable running a processing algorithm, for use as reference or candidate in DifferentialHarness.
+
+    Each runner needs its own output folder, otherwise the candidate overwrites the reference outputs.
+    The result cache is disabled unless the overrides enable it, so that both sides really compute.
+
+    Args:
+        algorithm_id (str): E.g. "geovita:begrensskadeexcavation".
+        output_folder (str or Path): Folder passed as OUTPUT_FOLDER.
+        overrides (dict, optional): Parameters overriding the case parameters, e.g. to select an engine.
+        parameter_names (dict, optional): Case parameter -> parameter name of the algorithm, for an
+            algorithm that names the same input differently (e.g. CombinedImpact as candidate of Excavation).
+        output_names (dict, optional): Output of the algorithm -> output name of the reference. Only
+            these outputs are returned.
+    """
+    def run(parameters):
+        parameters = {(parameter_names or {}).get(name, name): value for name, value in parameters.items()}
+        parameters["USE_CACHE"] = False
+        parameters.update(overrides or {})
+        parameters["OUTPUT_FOLDER"] = str(output_folder)
+        results = processing.run(algorithm_id, parameters,
+                                 context=QgsProcessingContext(), feedback=QgsProcessingFeedback())
+        if output_names:
+            results = {new: results[old] for old, new in output_names.items() if old in results}
+        return results
+    return run
+
+
+def cached_runner(algorithm_id, output_folder, overrides=None):
+    """
+    Returns a callable running an algorithm twice with the result cache, see processing_runner().
+    The second run restores the outputs of the first one from the cache, and its results are returned.
+    """
+    runner = processing_runner(algorithm_id, output_folder, dict(overrides or {}, USE_CACHE=True))
+
+    def run(parameters):
+        runner(parameters)
+        return runner(parameters)
+    return run
+
+
+def incremental_runner(algorithm_id, output_folder, previous_buildings, overrides=None):
+    """
+    Returns a callable running an algorithm in incremental mode on 'previous_buildings' first, and then on
+    the buildings of the case, see processing_runner(). The results of the second (incremental) run,
+    which only recomputes the buildings that differ, are returned.
+
+    Args:
+        previous_buildings (QgsVectorLayer): The building layer of the previous run.
+    """
+    runner = processing_runner(algorithm_id, output_folder, dict(overrides or {}, INCREMENTAL=True))
+
+    def run(parameters):
+        runner(dict(parameters, INPUT_BUILDING_POLY=previous_buildings))
+        return runner(parameters)
+    return run
+
+
+def move_buildings(buildings_path, output_path, building_numbers, offset=(2.0, 0.0)):
+    """
+    Writes a copy of a (synthetic) building layer where some buildings are moved, e.g. as the edited
+    layer of an incremental run.
+
+    Args:
+        buildings_path (str or Path): The building shapefile, with a 'bygningsnr' field.
+        output_path (str or Path): The copy.
+        building_numbers (list): 'bygningsnr' of the buildings to move.
+        offset (tuple): The translation (dx, dy) [m].
+
+    Returns:
+        Path: The output path.
+    """
+    layer = QgsVectorLayer(str(buildings_path), "buildings", "ogr")
+    features = []
+    for feature in layer.getFeatures():
+        geometry = QgsGeometry(feature.geometry())
+        if feature["bygningsnr"] in building_numbers:
+            geometry.translate(*offset)
+        features.append((feature.attributes(), geometry))
+    _write_polygons(output_path, layer.fields(), features, layer.crs())
+    return Path(output_path)
+
+
+def create_synthetic_site(output_folder, crs, n_buildings=40, seed=0, origin=(100000.0, 100000.0),
+                          excavation_size=(60.0, 30.0), max_distance=200.0, dtb_resolution=1.0):
+    """
+    Writes a generated excavation, building layer and depth to bedrock raster for differential testing.
+
+    The excavation is a rectangle centred on 'origin'. Buildings are randomly rotated rectangles placed
+    between 5 m and 'max_distance' from the excavation, with random vulnerability attributes.
+    The depth to bedrock varies smoothly between about 5 and 35 m, so that both shallow and deep
+    soil columns are exercised.
+
+    Args:
+        output_folder (str or Path): Folder for the generated files.
+        crs (QgsCoordinateReferenceSystem): CRS of the generated data.
+        n_buildings (int): Number of buildings.
+        seed (int): Seed for the random generator, the output is deterministic for a given seed.
+        origin (tuple): Centre of the excavation.
+        excavation_size (tuple): Width and height of the excavation [m].
+        max_distance (float): Largest distance from the excavation to a building [m].
+        dtb_resolution (float): Cell size of the generated raster [m].
+
+    Returns:
+        dict: {"excavation": Path, "buildings": Path, "dtb": Path}
+    """
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    x0, y0 = origin
+    half_w, half_h = excavation_size[0] / 2, excavation_size[1] / 2
+
+    excavation_geom = QgsGeometry.fromPolygonXY([[
+        QgsPointXY(x0 - half_w, y0 - half_h), QgsPointXY(x0 + half_w, y0 - half_h),
+        QgsPointXY(x0 + half_w, y0 + half_h), QgsPointXY(x0 - half_w, y0 + half_h),
+        QgsPointXY(x0 - half_w, y0 - half_h)]])
+    excavation_fields = QgsFields()
+    excavation_fields.append(QgsField("id", QVariant.Int))
+    excavation_path = output_folder / "synthetic_excavation.shp"
+    _write_polygons(excavation_path, excavation_fields, [([1], excavation_geom)], crs)
+
+    building_fields = QgsFields()
+    building_fields.append(QgsField("bygningsnr", QVariant.Int))
+    building_fields.append(QgsField("Foundation", QVariant.String, len=80))
+    building_fields.append(QgsField("Structure", QVariant.String, len=80))
+    building_fields.append(QgsField("Condition", QVariant.String, len=80))
+    buildings = []
+    while len(buildings) < n_buildings:
+        angle = rng.uniform(0, 2 * math.pi)
+        distance = rng.uniform(5.0, max_distance)
+        cx = x0 + (half_w + distance) * math.cos(angle)
+        cy = y0 + (half_h + distance) * math.sin(angle)
+        width, depth = rng.uniform(8, 30), rng.uniform(8, 20)
+        rotation = rng.uniform(0, math.pi)
+        corners = []
+        for dx, dy in ((-1, -1), (1, -1), (1, 1), (-1, 1), (-1, -1)):
+            px, py = dx * width / 2, dy * depth / 2
+            corners.append(QgsPointXY(cx + px * math.cos(rotation) - py * math.sin(rotation),
+                                      cy + px * math.sin(rotation) + py * math.cos(rotation)))
+        geom = QgsGeometry.fromPolygonXY([corners])
+        # Keep buildings outside the excavation and apart from each other
+        if geom.intersects(excavation_geom) or any(geom.intersects(other) for _, other in buildings):
+            continue
+        attributes = [len(buildings) + 1,
+                      rng.choice(SYNTHETIC_FOUNDATIONS),
+                      rng.choice(SYNTHETIC_STRUCTURES),
+                      rng.choice(SYNTHETIC_CONDITIONS)]
+        buildings.append((attributes, geom))
+    buildings_path = output_folder / "synthetic_buildings.shp"
+    _write_polygons(buildings_path, building_fields, buildings, crs)
+
+    # Depth to bedrock raster covering the whole site with a margin
+    extent = half_w + max_distance + 60.0, half_h + max_distance + 60.0
+    n_cols = int(math.ceil(2 * extent[0] / dtb_resolution))
+    n_rows = int(math.ceil(2 * extent[1] / dtb_resolution))
+    xs = x0 - extent[0] + (np.arange(n_cols) + 0.5) * dtb_resolution
+    ys = y0 + extent[1] - (np.arange(n_rows) + 0.5) * dtb_resolution
+    grid_x, grid_y = np.meshgrid(xs - x0, ys - y0)
+    phase = rng.uniform(0, 2 * math.pi)
+    dtb = 20.0 + 10.0 * np.sin(grid_x / 70.0 + phase) * np.cos(grid_y / 55.0) + 5.0 * np.tanh(grid_x / 150.0)
+
+    dtb_path = output_folder / "synthetic_dtb.tif"
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(str(dtb_path), n_cols, n_rows, 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((x0 - extent[0], dtb_resolution, 0.0, y0 + extent[1], 0.0, -dtb_resolution))
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(crs.toWkt())
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(-9999.0)
+    band.WriteArray(dtb.astype(np.float32))
+    band.FlushCache()
+    dataset = None
+
+    return {"excavation": excavation_path, "buildings": buildings_path, "dtb": dtb_path}
+
+
+def _write_polygons(path, fields, features, crs):
+    """Writes (attributes, geometry) tuples to an ESRI Shapefile."""
+    layer = QgsVectorLayer(f"Polygon?crs={crs.authid()}", Path(path).stem, "memory")
+    provider = layer.dataProvider()
+    provider.addAttributes(fields.toList())
+    layer.updateFields()
+    qgs_features = []
+    for attributes, geom in features:
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes(attributes)
+        feature.setGeometry(geom)
+        qgs_features.append(feature)
+    provider.addFeatures(qgs_features)
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    error = QgsVectorFileWriter.writeAsVectorFormatV3(layer, str(path), QgsCoordinateTransformContext(), options)
+    if error[0] != QgsVectorFileWriter.NoError:
+        raise IOError(f"Could not write {path}: {error}")
@@ -0,0 +1,581 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Raster grids for the vectorized impact map: reading the depth to bedrock grid, the distance
+field from every cell to the excavation (exact, or as a cached distance transform), the cells of
+the influence zone, adaptive refinement of cell values, and writing multi-band results.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from osgeo import gdal, ogr
+from pathlib import Path
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .cache import fingerprint_parameters, get_distance_cache
+from .settlementlib import (
+    LOOKUP_TOLERANCE,
+    N_SUBLAYERS,
+    chunks,
+    consolidation_degree,
+    long_term_lookup_table,
+    long_term_settlement,
+    long_term_settlement_times,
+    porewater_reduction_excavation,
+)
+from .sitelib import DISTANCE_CHUNK_SIZE, LONG_TERM_CHUNK_ELEMENTS, distance_to_polygons, source_contributions
+
+# Nodata value of the written grids
+GRID_NODATA = -9999.0
+
+# Cells closer to the excavation than this number of cells get the exact distance in a distance
+# transform, where the short term settlement curves are steep
+EXACT_DISTANCE_CELLS = 10
+
+# Size of the coarsest blocks of the adaptive refinement [cells], a power of two
+ADAPTIVE_COARSE_STEP = 16
+
+# Size of the tiles the influence zone is split in for the REMEDY core [cells]
+ZONE_TILE_SIZE = 256
+
+
+class Grid:
+    """
+    A single band raster read into memory.
+
+    Attributes:
+        values (np.ndarray): The cell values (rows, cols), NaN at nodata cells.
+        geotransform (tuple): The GDAL geotransform, north up.
+        projection (str): The WKT of the CRS.
+    """
+    def __init__(self, values, geotransform, projection):
+        self.values = values
+        self.geotransform = tuple(geotransform)
+        self.projection = projection
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def cell_centers(self, rows=None):
+        """
+        Returns the coordinates (n, 2) of the cell centers, row by row.
+
+        Args:
+            rows (slice, optional): The rows to return, all rows by default.
+        """
+        x0, dx, _, y0, _, dy = self.geotransform
+        rows = rows or slice(0, self.shape[0])
+        row_index = np.arange(self.shape[0])[rows]
+        x = x0 + (np.arange(self.shape[1]) + 0.5) * dx
+        y = y0 + (row_index + 0.5) * dy
+        xx, yy = np.meshgrid(x, y)
+        return np.column_stack([xx.ravel(), yy.ravel()])
+
+
+    def cell_centers_at(self, index):
+        """
+        Returns the coordinates (n, 2) of the cell centers of some cells.
+
+        Args:
+            index (np.ndarray): Flat indices of the cells.
+        """
+        x0, dx, _, y0, _, dy = self.geotransform
+        rows, cols = np.divmod(np.asarray(index, dtype=np.int64), self.shape[1])
+        return np.column_stack([x0 + (cols + 0.5) * dx, y0 + (rows + 0.5) * dy])
+
+
+def read_grid(raster_path, band=1):
+    """
+    Reads one band of a raster as a Grid.
+
+    Raises:
+        IOError: If the raster can not be opened.
+        ValueError: If the raster is rotated.
+    """
+    dataset = gdal.Open(str(raster_path))
+    if dataset is None:
+        raise IOError(f"Could not open raster: {raster_path}")
+    geotransform = dataset.GetGeoTransform()
+    if geotransform[2] != 0 or geotransform[4] != 0:
+        raise ValueError(f"Rotated rasters are not supported: {raster_path}")
+    raster_band = dataset.GetRasterBand(band)
+    values = raster_band.ReadAsArray().astype(float)
+    nodata = raster_band.GetNoDataValue()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    return Grid(values, geotransform, dataset.GetProjection())
+
+
+def distance_field(grid, segments, rows_per_chunk=None, progress=None):
+    """
+    Distance from every cell center of a grid to polygons given by their ring segments.
+
+    Args:
+        grid (Grid): The grid.
+        segments (np.ndarray): Ring segments (m, 4), see sitelib.polygon_segments().
+        progress (callable, optional): Called with the fraction of computed rows after every chunk.
+
+    Returns:
+        np.ndarray: Distances (rows, cols), zero inside the polygons.
+    """
+    n_rows, n_cols = grid.shape
+    distance = np.empty(grid.shape)
+    rows_per_chunk = rows_per_chunk or max(1, DISTANCE_CHUNK_SIZE // n_cols)
+    for rows in chunks(n_rows, rows_per_chunk):
+        near_dist, _ = distance_to_polygons(grid.cell_centers(rows), segments)
+        distance[rows] = near_dist.reshape(-1, n_cols)
+        if progress is not None:
+            progress(rows.stop / n_rows)
+    return distance
+
+
+def superposed_cells(grid, sources, short_term=True, long_term=True, fixed=None, rows_per_chunk=None, progress=None):
+    """
+    Combined settlement of several excavations and tunnels at every cell center of a grid, see
+    sitelib.source_contributions(). The sources are evaluated together per chunk of rows, and the
+    long term settlement follows from the total porewater pressure reduction of the cells.
+
+    Args:
+        grid (Grid): The depth to bedrock of the cells (NaN at nodata cells), only used for long term.
+        sources (list): The excavations and tunnels, see sitelib.source_contributions().
+        short_term (bool): Include short term settlements.
+        long_term (bool): Include long term settlements.
+        fixed (dict): The arguments of settlementlib.long_term_settlement() except dtb and porewp_red.
+        progress (callable, optional): Called with the fraction of computed rows after every chunk.
+
+    Returns:
+        dict: 'sv_short', 'sv_long', 'sv_tot' and 'porewp_red' (rows, cols). The long term and total
+        settlements are NaN at cells without depth to bedrock.
+    """
+    n_rows, n_cols = grid.shape
+    bands = {name: np.zeros(grid.shape) for name in ("sv_short", "sv_long", "sv_tot", "porewp_red")}
+    rows_per_chunk = rows_per_chunk or max(1, min(DISTANCE_CHUNK_SIZE, LONG_TERM_CHUNK_ELEMENTS // N_SUBLAYERS) // n_cols)
+    for rows in chunks(n_rows, rows_per_chunk):
+        contributions = source_contributions(grid.cell_centers(rows), sources, short_term, long_term)
+        sv_long = np.zeros(len(contributions["sv_short"]))
+        if long_term:
+            dtb = grid.values[rows].ravel()
+            sv_long[np.isnan(dtb)] = np.nan
+            active = np.flatnonzero(~np.isnan(dtb) & (contributions["porewp_red"] > 0))
+            sv_long[active] = long_term_settlement(dtb[active], contributions["porewp_red"][active], **fixed)
+        bands["sv_short"][rows] = contributions["sv_short"].reshape(-1, n_cols)
+        bands["porewp_red"][rows] = contributions["porewp_red"].reshape(-1, n_cols)
+        bands["sv_long"][rows] = sv_long.reshape(-1, n_cols)
+        if progress is not None:
+            progress(rows.stop / n_rows)
+    bands["sv_tot"] = bands["sv_short"] + bands["sv_long"]
+    return bands
+
+
+def _gdal_callback(progress, errors):
+    """Wraps a progress callback for GDAL. An exception of the callback (e.g. a canceled run) aborts GDAL and is kept in 'errors'."""
+    def callback(complete, message, data):
+        try:
+            progress(complete)
+        except Exception as e:
+            errors.append(e)
+            return 0
+        return 1
+    return callback
+
+
+def distance_transform(grid, geometries_wkb, segments, progress=None):
+    """
+    Distance from every cell center of a grid to polygons, as a Euclidean distance transform of the
+    rasterized polygons (gdal.ComputeProximity). Cells within EXACT_DISTANCE_CELLS of the polygons
+    get the exact distance to the polygon outlines, farther cells are within half a cell diagonal.
+
+    Args:
+        grid (Grid): The grid.
+        geometries_wkb (list): The polygons as WKB.
+        segments (np.ndarray): Ring segments (m, 4) of the polygons, see sitelib.polygon_segments().
+        progress (callable, optional): Called with the computed fraction while the distance transform runs.
+
+    Returns:
+        np.ndarray: Distances (rows, cols), zero inside the polygons.
+    """
+    n_rows, n_cols = grid.shape
+    driver = gdal.GetDriverByName("MEM")
+    mask = driver.Create("", n_cols, n_rows, 1, gdal.GDT_Byte)
+    mask.SetGeoTransform(grid.geotransform)
+    mask.SetProjection(grid.projection)
+    source = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = source.CreateLayer("polygons", None, ogr.wkbUnknown)
+    for wkb in geometries_wkb:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+        layer.CreateFeature(feature)
+    # All touched cells, so that polygons narrower than a cell are not lost
+    gdal.RasterizeLayer(mask, [1], layer, burn_values=[1], options=["ALL_TOUCHED=TRUE"])
+    if not mask.GetRasterBand(1).ReadAsArray().any():
+        # The polygons are outside of the grid
+        return distance_field(grid, segments, progress=progress)
+
+    proximity = driver.Create("", n_cols, n_rows, 1, gdal.GDT_Float32)
+    proximity.SetGeoTransform(grid.geotransform)
+    proximity.SetProjection(grid.projection)
+    errors = []
+    gdal.ComputeProximity(
+        mask.GetRasterBand(1),
+        proximity.GetRasterBand(1),
+        ["VALUES=1", "DISTUNITS=GEO"],
+        callback=_gdal_callback(progress, errors) if progress is not None else None,
+    )
+    if errors:
+        raise errors[0]
+    distance = proximity.GetRasterBand(1).ReadAsArray().astype(float)
+
+    x0, dx, _, y0, _, dy = grid.geotransform
+    rows, cols = np.nonzero(distance <= EXACT_DISTANCE_CELLS * max(abs(dx), abs(dy)))
+    xy = np.column_stack([x0 + (cols + 0.5) * dx, y0 + (rows + 0.5) * dy])
+    distance[rows, cols], _ = distance_to_polygons(xy, segments)
+    return distance
+
+
+def cached_distance_field(grid, geometries_wkb, segments, clipping_range, logger=None, progress=None):
+    """
+    The distance transform of a grid to polygons (see distance_transform()), computed once and
+    stored in the distance cache. Later calls with the same polygons, grid and clipping range load
+    it memory-mapped. The progress callback is passed on to distance_transform().
+
+    Returns:
+        tuple: (distances (rows, cols) as a read-only float32 memory map, True if it was cached)
+    """
+    geometry_hash = hashlib.sha256()
+    for wkb in geometries_wkb:
+        geometry_hash.update(bytes(wkb))
+    key = fingerprint_parameters(
+        "distance", geometry_hash.hexdigest(), grid.geotransform, grid.shape, grid.projection, clipping_range
+    )
+    cache = get_distance_cache(logger)
+    cached_files = cache.get(key)
+    if cached_files is not None:
+        return np.load(str(cached_files["distance"]), mmap_mode="r"), True
+
+    distance = distance_transform(grid, geometries_wkb, segments, progress).astype(np.float32)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir) / "distance.npy"
+        np.save(str(temp_path), distance)
+        cached_files = cache.put(key, {"distance": temp_path})
+    return np.load(str(cached_files["distance"]), mmap_mode="r"), False
+
+
+def influence_zone(distance, clipping_range):
+    """
+    The cells of a grid within clipping_range of the excavation, i.e. inside the buffered excavation.
+
+    Args:
+        distance (np.ndarray): Distance from every cell to the excavation (rows, cols).
+        clipping_range (float): The buffer distance [m].
+
+    Returns:
+        np.ndarray: Flat indices of the cells, row by row (int32 for grids below 2**31 cells).
+    """
+    index = np.flatnonzero(np.asarray(distance).ravel() <= clipping_range)
+    return index.astype(np.int32) if np.size(distance) < 2 ** 31 else index
+
+
+def zone_windows(index, shape, tile_size=ZONE_TILE_SIZE):
+    """
+    Windows of a grid that cover the cells of an influence zone, for a computation that only takes
+    rectangles. The grid is split in tiles of tile_size x tile_size cells, tiles without cells of the
+    zone are left out, and every other tile is shrunk to the bounding box of its cells in the zone.
+
+    Args:
+        index (np.ndarray): Flat indices of the cells of the zone, see influence_zone().
+        shape (tuple): The grid shape (rows, cols).
+        tile_size (int): The tile size [cells].
+
+    Returns:
+        list: (row_offset, col_offset, n_rows, n_cols) of every window, row by row.
+    """
+    rows, cols = np.divmod(np.asarray(index, dtype=np.int64), shape[1])
+    tiles = (rows // tile_size) * ((shape[1] + tile_size - 1) // tile_size) + cols // tile_size
+    order = np.argsort(tiles, kind="stable")
+    tiles, rows, cols = tiles[order], rows[order], cols[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(tiles) != 0]) if len(tiles) else np.array([], dtype=int)
+    windows = []
+    for start, stop in zip(starts, np.r_[starts[1:], len(tiles)].astype(int)):
+        r0, c0 = rows[start:stop].min(), cols[start:stop].min()
+        windows.append((int(r0), int(c0), int(rows[start:stop].max() - r0 + 1), int(cols[start:stop].max() - c0 + 1)))
+    return windows
+
+
+def expand_cells(values, index, shape):
+    """
+    Spreads values of some cells of a grid to the full grid, NaN at the other cells.
+
+    Args:
+        values (np.ndarray): Values (..., n_cells) of the cells.
+        index (np.ndarray or None): Flat indices (n_cells) of the cells, None if values holds every cell.
+        shape (tuple): The grid shape (rows, cols).
+
+    Returns:
+        np.ndarray: (..., rows, cols)
+    """
+    values = np.asarray(values)
+    if index is None:
+        return values.reshape(values.shape[:-1] + tuple(shape))
+    result = np.full(values.shape[:-1] + (shape[0] * shape[1],), np.nan)
+    result[..., index] = values
+    return result.reshape(values.shape[:-1] + tuple(shape))
+
+
+def _interpolate_blocks(values, r0, c0, h, w, n_cols):
+    """
+    Bilinear interpolation of blocks of (h + 1) x (w + 1) cells from their corner values.
+
+    Returns:
+        tuple: (flat cell indices (n_blocks * cells), values (n_bands, n_blocks * cells))
+    """
+    fr = np.arange(h + 1) / h if h else np.zeros(1)
+    fc = np.arange(w + 1) / w if w else np.zeros(1)
+    fr, fc = [f.ravel() for f in np.meshgrid(fr, fc, indexing="ij")]
+    cells = (r0[:, None] + np.rint(fr * h).astype(int)) * n_cols + c0[:, None] + np.rint(fc * w).astype(int)
+    v00, v01, v10, v11 = [
+        values[:, (r0 + dr) * n_cols + c0 + dc][:, :, None] for dr, dc in ((0, 0), (0, w), (h, 0), (h, w))
+    ]
+    interpolated = (
+        (1 - fr) * (1 - fc) * v00 + (1 - fr) * fc * v01 + fr * (1 - fc) * v10 + fr * fc * v11
+    )
+    return cells.ravel(), interpolated.reshape(values.shape[0], -1)
+
+
+def adaptive_cells(evaluate, shape, tolerance, valid=None, coarse_step=ADAPTIVE_COARSE_STEP):
+    """
+    Values of every cell of a grid, evaluated on a quadtree of blocks instead of at every cell.
+
+    The grid is split into blocks of coarse_step cells. The corners and the center of every block
+    are evaluated, and a block is split in four while its corner values differ by more than the
+    tolerance, its center differs from the bilinear interpolation of the corners by more than the
+    tolerance, or any of them is NaN. The cells of the remaining blocks are interpolated from the
+    corners. Steep gradients (near the excavation) are refined down to single cells, flat areas
+    keep the coarse blocks.
+
+    Args:
+        evaluate (callable): Called with flat cell indices (n), returns values (n_bands, n) or (n).
+        shape (tuple): The grid shape (rows, cols).
+        tolerance (float): The allowed difference, in the unit of the values.
+        valid (np.ndarray, optional): Flat mask of the cells with data. Other cells are set to NaN,
+            also where they are inside interpolated blocks.
+        coarse_step (int): The size of the coarsest blocks [cells], a power of two.
+
+    Returns:
+        tuple: (values (n_bands, rows * cols), the number of evaluated cells)
+    """
+    n_rows, n_cols = shape
+    known = np.zeros(n_rows * n_cols, dtype=bool)
+    store = {}
+
+    def ensure(cells):
+        cells = np.unique(cells)
+        cells = cells[~known[cells]]
+        if len(cells):
+            values = np.atleast_2d(evaluate(cells))
+            if "values" not in store:
+                store["values"] = np.full((values.shape[0], n_rows * n_cols), np.nan)
+                store["result"] = np.full((values.shape[0], n_rows * n_cols), np.nan)
+            store["values"][:, cells] = values
+            known[cells] = True
+
+    step = coarse_step
+    r0, c0 = [origin.ravel() for origin in np.meshgrid(
+        np.arange(0, max(n_rows - 1, 1), step), np.arange(0, max(n_cols - 1, 1), step), indexing="ij"
+    )]
+    while len(r0):
+        r1 = np.minimum(r0 + step, n_rows - 1)
+        c1 = np.minimum(c0 + step, n_cols - 1)
+        corners = np.stack([r0 * n_cols + c0, r0 * n_cols + c1, r1 * n_cols + c0, r1 * n_cols + c1])
+        if step == 1:
+            # Every cell of the blocks is a corner
+            ensure(corners.ravel())
+            break
+        rm, cm = (r0 + r1) // 2, (c0 + c1) // 2
+        ensure(np.concatenate([corners.ravel(), rm * n_cols + cm]))
+        values = store["values"]
+        corner_values = values[:, corners]
+        with np.errstate(invalid="ignore"):
+            spread = (corner_values.max(axis=1) - corner_values.min(axis=1)).max(axis=0)
+            fr = np.where(r1 > r0, (rm - r0) / np.maximum(r1 - r0, 1), 0.0)
+            fc = np.where(c1 > c0, (cm - c0) / np.maximum(c1 - c0, 1), 0.0)
+            weights = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc])
+            center_error = np.abs(values[:, rm * n_cols + cm] - (corner_values * weights).sum(axis=1)).max(axis=0)
+            refine = ~(spread <= tolerance) | ~(center_error <= tolerance)
+
+        # Interpolate the blocks that are fine enough, grouped by block size (smaller at the edges)
+        filled = ~refine
+        for h, w in set(zip(r1[filled] - r0[filled], c1[filled] - c0[filled])):
+            group = filled & (r1 - r0 == h) & (c1 - c0 == w)
+            cells, interpolated = _interpolate_blocks(values, r0[group], c0[group], h, w, n_cols)
+            store["result"][:, cells] = interpolated
+
+        # Split the other blocks in four
+        half = step // 2
+        r0, c0, r1, c1 = r0[refine], c0[refine], r1[refine], c1[refine]
+        children_r = [r0, r0, r0 + half, r0 + half]
+        children_c = [c0, c0 + half, c0, c0 + half]
+        keep = [
+            ((cr < r1) | (cr == r0)) & ((cc < c1) | (cc == c0)) for cr, cc in zip(children_r, children_c)
+        ]
+        r0 = np.concatenate([cr[k] for cr, k in zip(children_r, keep)])
+        c0 = np.concatenate([cc[k] for cc, k in zip(children_c, keep)])
+        step = half
+
+    result = store["result"]
+    result[:, known] = store["values"][:, known]
+    if valid is not None:
+        result[:, ~valid] = np.nan
+    return result, int(known.sum())
+
+
+def write_grid(output_path, bands, geotransform, projection, descriptions=None, sparse=False):
+    """
+    Writes one or more bands to a Float32 GeoTIFF. NaN values are written as GRID_NODATA.
+
+    Args:
+        output_path (str): The output file, overwritten if it exists.
+        bands (list): Arrays (rows, cols), one per band.
+        geotransform (tuple): The GDAL geotransform.
+        projection (str): The WKT of the CRS.
+        descriptions (list, optional): Band descriptions.
+        sparse (bool): Leave tiles with only nodata out of the file (SPARSE_OK), for grids where
+            only the influence zone is computed.
+
+    Returns:
+        str: The output path.
+    """
+    n_rows, n_cols = bands[0].shape
+    driver = gdal.GetDriverByName("GTiff")
+    options = ["COMPRESS=DEFLATE", "TILED=YES"] + (["SPARSE_OK=TRUE"] if sparse else [])
+    dataset = driver.Create(str(output_path), n_cols, n_rows, len(bands), gdal.GDT_Float32, options=options)
+    if dataset is None:
+        raise IOError(f"Could not create raster: {output_path}")
+    dataset.SetGeoTransform(geotransform)
+    dataset.SetProjection(projection)
+    for index, values in enumerate(bands, start=1):
+        band = dataset.GetRasterBand(index)
+        band.SetNoDataValue(GRID_NODATA)
+        band.WriteArray(np.where(np.isnan(values), GRID_NODATA, values).astype(np.float32))
+        if descriptions:
+            band.SetDescription(descriptions[index - 1])
+    dataset.FlushCache()
+    dataset = None
+    return str(Path(output_path))
+
+
+def long_term_table_cells(dtb, near_dist, porewp_red_m, soil, tolerance=LOOKUP_TOLERANCE):
+    """
+    Builds a long term lookup table for the cells of a grid, see settlementlib.long_term_lookup_table().
+
+    Args:
+        dtb (np.ndarray): Depth to bedrock of the cells (n_cells), NaN at nodata cells.
+        near_dist (np.ndarray): Distance from the cells to the excavation (n_cells).
+        porewp_red_m (float): Porewater pressure reduction at the excavation [m].
+        soil (dict): The arguments of settlementlib.final_long_term_settlement() except dtb and
+            porewp_red, scalars or arrays (n_samples).
+        tolerance (float): The error bound [m].
+
+    Returns:
+        tuple: (LongTermTable, max_error), (None, None) if the cells are evaluated faster exactly.
+    """
+    porewp_red = porewater_reduction_excavation(near_dist, porewp_red_m)
+    active = np.flatnonzero(~np.isnan(dtb) & (porewp_red > 0))
+    return long_term_lookup_table(dtb[active], porewp_red[active], soil, tolerance)
+
+
+def long_term_percentile_cells(dtb, near_dist, sv_short, porewp_red_m, samples, fixed, percentiles, progress=None,
+                               table=None):
+    """
+    Percentiles of the total settlement of every cell over sampled soil parameters.
+
+    The cells are evaluated in chunks of (samples x cells) and every chunk is reduced to its
+    percentiles right away, so the samples of all cells are never held in memory at once.
+
+    Args:
+        dtb (np.ndarray): Depth to bedrock of the cells (n_cells), NaN at nodata cells.
+        near_dist (np.ndarray): Distance from the cells to the excavation (n_cells).
+        sv_short (np.ndarray): Short term settlement of the cells (n_cells), the same for every sample.
+        porewp_red_m (float): Porewater pressure reduction at the excavation [m].
+        samples (dict): Argument of settlementlib.long_term_settlement() -> array (n_samples).
+        fixed (dict): The other arguments of long_term_settlement(), except dtb and porewp_red.
+        percentiles (sequence): The percentiles to compute.
+        progress (callable, optional): Called with the fraction of evaluated cells after every chunk.
+        table (LongTermTable, optional): A lookup table of the samples, see long_term_table_cells(),
+            to interpolate the long term settlements instead of integrating them.
+
+    Returns:
+        np.ndarray: (len(percentiles), n_cells), NaN at nodata cells.
+    """
+    n_samples = max([len(values) for values in samples.values()] + [1])
+    arguments = dict(fixed)
+    arguments.update({name: np.asarray(values, dtype=float)[:, None] for name, values in samples.items()})
+    porewp_red = porewater_reduction_excavation(near_dist, porewp_red_m)
+
+    result = np.full((len(percentiles), len(dtb)), np.nan)
+    # Cells without porewater pressure reduction have no long term settlement
+    result[:, ~np.isnan(dtb)] = sv_short[~np.isnan(dtb)]
+    active = np.flatnonzero(~np.isnan(dtb) & (porewp_red > 0))
+    chunk_size = max(LONG_TERM_CHUNK_ELEMENTS // (n_samples * (1 if table else N_SUBLAYERS)), 1)
+    for part in chunks(len(active), chunk_size):
+        cells = active[part]
+        if table is None:
+            sv_long = long_term_settlement(dtb[cells], porewp_red[cells], **arguments)
+        else:
+            sv_long = table(dtb[cells], porewp_red[cells], arguments["consolidation_time"])
+        sv_tot = np.broadcast_to(sv_short[cells] + sv_long, (n_samples, len(cells)))
+        result[:, cells] = np.percentile(sv_tot, percentiles, axis=0)
+        if progress is not None:
+            progress(part.stop / len(active))
+    return result
+
+
+def long_term_time_cells(dtb, near_dist, sv_short, porewp_red_m, fixed, consolidation_times, progress=None,
+                         table=None):
+    """
+    Total settlement of every cell at several consolidation times, in one evaluation per chunk of
+    cells: the final long term settlement is shared by the times, only the degree of consolidation
+    is evaluated along the time axis.
+
+    Args:
+        dtb (np.ndarray): Depth to bedrock of the cells (n_cells), NaN at nodata cells.
+        near_dist (np.ndarray): Distance from the cells to the excavation (n_cells).
+        sv_short (np.ndarray): Short term settlement of the cells (n_cells).
+        porewp_red_m (float): Porewater pressure reduction at the excavation [m].
+        fixed (dict): The arguments of settlementlib.final_long_term_settlement(), except dtb and porewp_red.
+        consolidation_times (sequence): Consolidation times [years].
+        progress (callable, optional): Called with the fraction of evaluated cells after every chunk.
+        table (LongTermTable, optional): A lookup table of the soil parameters, see long_term_table_cells().
+
+    Returns:
+        np.ndarray: (len(consolidation_times), n_cells), NaN at nodata cells.
+    """
+    porewp_red = porewater_reduction_excavation(near_dist, porewp_red_m)
+    result = np.full((len(consolidation_times), len(dtb)), np.nan)
+    result[:, ~np.isnan(dtb)] = sv_short[~np.isnan(dtb)]
+    active = np.flatnonzero(~np.isnan(dtb) & (porewp_red > 0))
+    times = np.asarray(consolidation_times, dtype=float)
+    chunk_size = max(LONG_TERM_CHUNK_ELEMENTS // (len(times) if table else N_SUBLAYERS), 1)
+    for part in chunks(len(active), chunk_size):
+        cells = active[part]
+        if table is None:
+            sv_long = long_term_settlement_times(dtb[cells], porewp_red[cells], consolidation_times=times, **fixed)
+        else:
+            sv_long = table.final(dtb[cells], porewp_red[cells])[:, None] * \
+                consolidation_degree(times, table.thickness(dtb[cells])[:, None])
+        result[:, cells] = sv_short[cells] + sv_long.T
+        if progress is not None:
+            progress(part.stop / len(active))
+    return result
@@ -0,0 +1,318 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from qgis.core import (QgsCoordinateTransformContext,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsGeometry,
+                       QgsSpatialIndex,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer)
+from pathlib import Path
+import hashlib
+import json
+import tempfile
+
+from .cache import CACHE_ROOT, DiskCache
+
+INCREMENTAL_CACHE_DIR = CACHE_ROOT / "incremental"
+INCREMENTAL_CACHE_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+
+# Corners and walls are written on the building outline. Output features are linked to the
+# nearest building, buildings closer than twice this distance are treated as touching.
+ASSOCIATION_TOLERANCE = 0.05  # meters
+
+# Fields holding the running id of each output, renumbered when new results are appended
+ID_FIELDS = ['bid', 'wid', 'cid']
+
+_MANIFEST_NAME = "manifest"
+
+
+def get_incremental_cache(logger=None):
+    """Returns the cache holding the per-building results of previous runs (incremental mode)."""
+    return DiskCache(INCREMENTAL_CACHE_DIR, INCREMENTAL_CACHE_MAX_SIZE, logger)
+
+
+def building_fingerprints(layer):
+    """
+    Hashes the geometry and attributes of every building.
+    Attributes are included since the vulnerability analysis reads them.
+
+    Args:
+        layer (QgsVectorLayer): The building layer, in the output CRS.
+
+    Returns:
+        dict: str(feature id) -> {"hash": sha256 hex digest, "wkb": geometry as WKB hex}
+    """
+    fingerprints = {}
+    for feature in layer.getFeatures():
+        wkb = bytes(feature.geometry().asWkb())
+        content = hashlib.sha256(wkb)
+        content.update(repr(feature.attributes()).encode("utf-8"))
+        fingerprints[str(feature.id())] = {"hash": content.hexdigest(), "wkb": wkb.hex()}
+    return fingerprints
+
+
+class IncrementalPlan:
+    """
+    The buildings to recompute, and the previous results to drop, in an incremental run.
+
+    Attributes:
+        changed, added, deleted (list): Feature ids compared with the previous run.
+        recompute (list): Current feature ids to send to the calculation.
+        dropped (set): Previous feature ids whose results are replaced or removed.
+    """
+    def __init__(self, changed, added, deleted, recompute, dropped):
+        self.changed = changed
+        self.added = added
+        self.deleted = deleted
+        self.recompute = recompute
+        self.dropped = dropped
+
+    @property
+    def is_unchanged(self):
+        return not (self.changed or self.added or self.deleted)
+
+    def __repr__(self):
+        return (f"IncrementalPlan(changed={len(self.changed)}, added={len(self.added)}, "
+                f"deleted={len(self.deleted)}, recompute={len(self.recompute)}, dropped={len(self.dropped)})")
+
+
+def plan_incremental(previous, current, tolerance=ASSOCIATION_TOLERANCE):
+    """
+    Compares the building fingerprints of the previous and the current run.
+
+    Touching buildings share corners and walls in the outputs, so a changed building is
+    recomputed together with every building it touches (directly or through neighbours),
+    in both the previous and the current geometry.
+
+    Args:
+        previous (dict): Fingerprints of the previous run, from building_fingerprints().
+        current (dict): Fingerprints of the current run.
+        tolerance (float): The association tolerance in meters.
+
+    Returns:
+        IncrementalPlan
+    """
+    changed = [fid for fid in current if fid in previous and previous[fid]["hash"] != current[fid]["hash"]]
+    added = [fid for fid in current if fid not in previous]
+    deleted = [fid for fid in previous if fid not in current]
+
+    # Nodes are the previous and the current version of every building
+    nodes = [("previous", fid) for fid in previous] + [("current", fid) for fid in current]
+    geometries = []
+    for version, fid in nodes:
+        geometry = QgsGeometry()
+        fingerprints = previous if version == "previous" else current
+        geometry.fromWkb(bytes.fromhex(fingerprints[fid]["wkb"]))
+        geometries.append(geometry)
+
+    index = QgsSpatialIndex()
+    for i, geometry in enumerate(geometries):
+        feature = QgsFeature(i)
+        feature.setGeometry(geometry)
+        index.addFeature(feature)
+
+    parents = list(range(len(nodes)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, geometry in enumerate(geometries):
+        search_box = geometry.boundingBox().buffered(2 * tolerance)
+        for j in index.intersects(search_box):
+            if j > i and geometry.distance(geometries[j]) <= 2 * tolerance:
+                parents[find(j)] = find(i)
+
+    dirty = set(changed) | set(added) | set(deleted)
+    dirty_roots = {find(i) for i, (_, fid) in enumerate(nodes) if fid in dirty}
+    recompute = [fid for i, (version, fid) in enumerate(nodes) if version == "current" and find(i) in dirty_roots]
+    dropped = {fid for i, (version, fid) in enumerate(nodes) if version == "previous" and find(i) in dirty_roots}
+    return IncrementalPlan(changed, added, deleted, recompute, dropped)
+
+
+def associate_outputs(building_layer, output_path, tolerance=ASSOCIATION_TOLERANCE):
+    """
+    Links every feature of an output (buildings, walls or corners) to its nearest input building.
+
+    Args:
+        building_layer (QgsVectorLayer): The building layer sent to the calculation.
+        output_path (str): Path to the output shapefile.
+
+    Returns:
+        dict: str(output feature id) -> str(building feature id)
+    """
+    buildings = {feature.id(): feature.geometry() for feature in building_layer.getFeatures()}
+    index = QgsSpatialIndex(building_layer.getFeatures())
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    association = {}
+    request = QgsFeatureRequest().setNoAttributes()
+    for feature in output_layer.getFeatures(request):
+        geometry = feature.geometry()
+        candidates = index.intersects(geometry.boundingBox().buffered(tolerance))
+        if not candidates:
+            candidates = index.nearestNeighbor(geometry.centroid().asPoint(), 3)
+        if not candidates:
+            continue
+        nearest = min(candidates, key=lambda fid: buildings[fid].distance(geometry))
+        association[str(feature.id())] = str(nearest)
+    return association
+
+
+def write_building_subset(building_layer, fids, output_path):
+    """
+    Writes the buildings with the given feature ids to a shapefile.
+
+    Returns:
+        str: The path to the written shapefile.
+    """
+    request = QgsFeatureRequest().setFilterFids([int(fid) for fid in fids])
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(
+        str(output_path),
+        building_layer.fields(),
+        building_layer.wkbType(),
+        building_layer.crs(),
+        QgsCoordinateTransformContext(),
+        options,
+    )
+    for feature in building_layer.getFeatures(request):
+        writer.addFeature(feature)
+    del writer
+    return str(output_path)
+
+
+def merge_outputs(previous_path, kept_fids, new_path, output_path):
+    """
+    Writes the kept features of a previous output followed by the features of a new output.
+    The id fields (bid, wid, cid) of new features continue after the largest kept id.
+
+    Args:
+        previous_path (str): The cached output of the previous run.
+        kept_fids (set): Feature ids of the previous output to keep.
+        new_path (str or None): The output of the recomputed buildings, or None if nothing was recomputed.
+        output_path (str): The merged output, overwritten if it exists.
+    """
+    previous_layer = QgsVectorLayer(str(previous_path), "previous", "ogr")
+    fields = previous_layer.fields()
+    wkb_type = previous_layer.wkbType()
+    crs = previous_layer.crs()
+    kept = [feature for feature in previous_layer.getFeatures() if str(feature.id()) in kept_fids]
+    del previous_layer
+
+    new_features = []
+    if new_path is not None:
+        new_layer = QgsVectorLayer(str(new_path), "new", "ogr")
+        new_features = list(new_layer.getFeatures())
+        del new_layer
+
+    id_fields = [name for name in ID_FIELDS if fields.indexOf(name) >= 0]
+    next_ids = {name: max([feature[name] for feature in kept if feature[name] is not None] or [0]) + 1
+                for name in id_fields}
+
+    QgsVectorFileWriter.deleteShapeFile(str(output_path))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(str(output_path), fields, wkb_type, crs,
+                                        QgsCoordinateTransformContext(), options)
+    for feature in kept:
+        writer.addFeature(feature)
+    for new_feature in new_features:
+        feature = QgsFeature(fields)
+        feature.setGeometry(new_feature.geometry())
+        for field in fields:
+            if new_feature.fields().indexOf(field.name()) >= 0:
+                feature[field.name()] = new_feature[field.name()]
+        for name in id_fields:
+            feature[name] = next_ids[name]
+            next_ids[name] += 1
+        writer.addFeature(feature)
+    del writer
+
+
+class IncrementalState:
+    """
+    The per-building results of the previous run with the same parameters (except the building layer).
+
+    The state is stored in the incremental cache: a copy of every output, the building
+    fingerprints, and the link from every output feature to its building.
+
+    Attributes:
+        key (str): Hash of the parameters, see GvBaseProcessingAlgorithms.getCacheKey().
+        output_names (list): Names of the outputs, e.g. ['OUTPUT_BUILDING', 'OUTPUT_WALL', 'OUTPUT_CORNER'].
+    """
+    def __init__(self, key, output_names, logger=None):
+        self.key = key
+        self.output_names = output_names
+        self.logger = logger
+        self.cache = get_incremental_cache(logger)
+        self.files = None
+        self.manifest = None
+        # Fingerprints of the buildings of the current run
+        self.current = None
+
+    def load(self):
+        """Loads the previous state. Returns False if there is no previous run with these parameters."""
+        files = self.cache.get(self.key)
+        if files is None:
+            return False
+        try:
+            self.manifest = json.loads(Path(files[_MANIFEST_NAME]).read_text(encoding="utf-8"))
+        except (OSError, ValueError, KeyError):
+            return False
+        self.files = files
+        return True
+
+    @property
+    def fingerprints(self):
+        return self.manifest["buildings"]
+
+    def previous_output(self, name):
+        return self.files[name]
+
+    def kept_fids(self, name, dropped):
+        """Returns the feature ids of a previous output that do not belong to a dropped building."""
+        association = self.manifest["associations"][name]
+        return {output_fid for output_fid, building_fid in association.items() if building_fid not in dropped}
+
+    def save(self, building_layer, fingerprints, outputs):
+        """
+        Stores the outputs of a (full or merged) run as the new state.
+
+        Args:
+            building_layer (QgsVectorLayer): The complete building layer of the run.
+            fingerprints (dict): Fingerprints of building_layer, from building_fingerprints().
+            outputs (dict): Output name -> path to the output shapefile.
+        """
+        manifest = {
+            "buildings": fingerprints,
+            "associations": {name: associate_outputs(building_layer, path) for name, path in outputs.items()},
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            manifest_path = Path(temp_dir) / f"{_MANIFEST_NAME}.json"
+            manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+            files = dict(outputs)
+            files[_MANIFEST_NAME] = manifest_path
+            try:
+                self.cache.put(self.key, files)
+            except OSError as e:
+                if self.logger:
+                    self.logger.warning(f"@IncrementalState@ - Could not store the incremental state: {e}")
@@ -13,9 +13,16 @@ __author__ = 'DPE'
 __date__ = '2024-01-17'
 __copyright__ = '(C) 2024 by DPE'
 
+import itertools
 import logging.handlers
+import threading
 from pathlib import Path
 
+# Guards the handler setup, algorithm instances are created from several threads in batch mode
+_setup_lock = threading.Lock()
+# Numbers of the runs logged in this session
+_run_ids = itertools.count(1)
+
 class CustomLogger:
     """
     A custom logging class that sets up a rotating file logger.
@@ -62,7 +69,9 @@ class CustomLogger:
         log_file = self.log_dir_path / self.log_filename
 
         self.logger = logging.getLogger(self.logger_name)
-        if not self.logger.handlers:
+        with _setup_lock:
+            if self.logger.handlers:
+                return
             hdlr = logging.handlers.RotatingFileHandler(str(log_file), "a", self.max_file_size, 20)
             formatter = logging.Formatter("%(asctime)s %(levelname)s Thread %(thread)d %(message)s ")
             hdlr.setFormatter(formatter)
@@ -78,4 +87,22 @@ class CustomLogger:
         Returns:
             logging.Logger: The configured logger instance.
         """
-        return self.logger
\ No newline at end of file
+        return self.logger
+
+
+class RunLogger(logging.LoggerAdapter):
+    """
+    The logger of one algorithm run. Every message is prefixed with the number of the run, so the
+    lines of runs in parallel (batch processing, models) can be told apart in the shared log file.
+    """
+
+    def __init__(self, logger, run_id=None):
+        """
+        Parameters:
+            logger (logging.Logger): The logger of the algorithm.
+            run_id (int, optional): Number of the run, the next number of the session by default.
+        """
+        super().__init__(logger, {"run": next(_run_ids) if run_id is None else run_id})
+
+    def process(self, msg, kwargs):
+        return f"[run {self.extra['run']}] {msg}", kwargs
@@ -22,13 +22,41 @@ from qgis.core import (Qgis,
                        QgsProcessingContext,
                        QgsProcessingFeedback,
                        QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
+                       QgsCoordinateTransformContext,
+                       QgsFeatureRequest,
+                       QgsFeatureSource,
+                       QgsVectorDataProvider,
+                       QgsProject,
+                       QgsVectorFileWriter,
                        QgsRectangle,
                        QgsProcessingException)
 
 from qgis import processing
+from qgis.PyQt import sip
+from osgeo import gdal
 from pathlib import Path
 from typing import Union
+import math
 import shutil
+import tempfile
+import threading
+
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj', '.cpg', '.qpj']
+TIFF_EXTENSIONS = ['.tif', '.tiff', '.tfw', '.tif.aux.xml', '.tiff.aux.xml']
+
+# The DTB is read from overviews when the output grid size is at least this factor times its pixel size
+OVERVIEW_MIN_FACTOR = 2
+# Overview levels are built down to this size [pixels]
+OVERVIEW_MIN_SIZE = 256
+# Margin around the buildings of the DTB window that is reprojected [output CRS units]
+RASTER_WINDOW_MARGIN = 10.0
+# Overviews are not built for larger rasters (e.g. national VRT mosaics), they are read by window instead
+OVERVIEW_MAX_PIXELS = 1024 ** 3
+
+# Temporary folders of the runs in progress by processing context, see create_run_temp_folder()
+_RUN_TEMP_FOLDERS = {}
+_RUN_TEMP_FOLDERS_LOCK = threading.Lock()
 
 def get_shapefile_as_json_pyqgis(layer, logger=None):
         if logger is not None:
@@ -74,7 +102,7 @@ def get_shapefile_as_json_pyqgis(layer, logger=None):
 
         return {"features": features}
     
-def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipping_range, output_resolution, output_folder, output_crs, context=None, logger=None):
+def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipping_range, output_resolution, output_folder, output_crs, context=None, logger=None, file_prefix="", read_overviews=True):
     """
     Processes raster data for excavation polygons by clipping, resampling, 
     and converting it to TIFF format, and then returns the path to the processed file.
@@ -88,6 +116,9 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
     - output_crs (QgsCoordinateReferenceSystem): The desired output CRS
     - context (QgsProcessingContext): Processing context for managing temporary files. Defaults to None.
     - logger: Logger object for logging messages. Defaults to None.
+    - file_prefix (str): Prefix of the temporary and output file names, to prepare several grids in one run. Defaults to "".
+    - read_overviews (bool): Read coarse grids from overviews of the raster. Defaults to True. A window already cut
+      from the source (see prepare_dtb_window()) is small and temporary, it is averaged directly instead.
 
     Returns:
     - Path: Path object of the processed raster in TIFF format.
@@ -109,10 +140,38 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
         
         # Adjust the polygon extent using the intersected extent
         adjusted_polygon_extent = get_intersected_extent(polygon_extent, raster_extent, clipping_range)
+        source_pixel_size = max(dtb_raster_layer.rasterUnitsPerPixelX(), dtb_raster_layer.rasterUnitsPerPixelY())
+        if output_resolution >= OVERVIEW_MIN_FACTOR * source_pixel_size:
+    ### READ FROM OVERVIEWS ####
+            # The output grid is coarser than the DTB: warp the window in one step from the overview
+            # level closest to the output grid size, averaging the overview pixels of every cell
+            dtb_raster_resample_path = temp_folder / f"{file_prefix}resampl_temp-raster.tif"
+            overview_raster_path = dtb_raster_layer.source().split("|")[0]
+            if read_overviews:
+                overview_raster_path = get_overview_raster(overview_raster_path, logger, feedback)
+            logger.info(f"@process_raster_for_impactmap@ - Reading {overview_raster_path} with overviews, "
+                        f"pixel size {source_pixel_size}, output grid size {output_resolution}")
+            feedback.pushInfo("@process_raster_for_impactmap@ --> Start resampling from overviews")
+            processing.run("gdal:warpreproject", {
+                'INPUT': str(overview_raster_path),
+                'SOURCE_CRS': dtb_raster_layer.crs().authid(),
+                'TARGET_CRS': output_crs.authid(),
+                'RESAMPLING': 5,  # 5 for Average
+                'TARGET_RESOLUTION': output_resolution,
+                'TARGET_EXTENT': f"{adjusted_polygon_extent.xMinimum()}, {adjusted_polygon_extent.xMaximum()}, {adjusted_polygon_extent.yMinimum()}, {adjusted_polygon_extent.yMaximum()}",
+                'TARGET_EXTENT_CRS': output_crs.authid(),
+                'EXTRA': '-ovr AUTO',
+                'OUTPUT': str(dtb_raster_resample_path)
+            }, is_child_algorithm=True, context=context, feedback=feedback)
+            check_canceled(feedback, [dtb_raster_resample_path], logger)
+            dtb_raster_layer = QgsRasterLayer(str(dtb_raster_resample_path), "resampl_temp-raster")
+            logger.info(f"@process_raster_for_impactmap@ - After resampling: {dtb_raster_layer.width()} cols, {dtb_raster_layer.height()} rows")
+            feedback.pushInfo("@process_raster_for_impactmap@ --> Done resampling from overviews")
+            continue
     ### START RASTER CLIP ####
         logger.debug("@process_raster_for_impactmap@ - START raster clipping")
         feedback.pushInfo("@process_raster_for_impactmap@ --> Start clipping")
-        dtb_clip_raster_path = temp_folder / "clip_temp-raster.tif"
+        dtb_clip_raster_path = temp_folder / f"{file_prefix}clip_temp-raster.tif"
         # Clipping the raster to the modified extent
         processing.run("gdal:cliprasterbyextent", {
             'INPUT': dtb_raster_layer.source(),
@@ -122,6 +181,7 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
             'DATA_TYPE': 0,  # Use 5 for Float32
             'OUTPUT': str(dtb_clip_raster_path)
         }, is_child_algorithm=True, context=context, feedback=feedback)
+        check_canceled(feedback, [dtb_clip_raster_path], logger)
         dtb_raster_layer = QgsRasterLayer(str(dtb_clip_raster_path), "clip_temp-raster")
         if dtb_raster_layer.crs().isValid():
             logger.debug(f"@process_raster_for_impactmap@ - CRS Description: {dtb_raster_layer.crs().description()}")
@@ -134,7 +194,7 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
         
     ### START RASTER RESAMPLE ####        
         # Resampling the raster to the desired output resolution
-        dtb_raster_resample_path = temp_folder / "resampl_temp-raster.tif"
+        dtb_raster_resample_path = temp_folder / f"{file_prefix}resampl_temp-raster.tif"
         logger.debug("@process_raster_for_impactmap@ - START raster resampling")
         feedback.pushInfo("@process_raster_for_impactmap@ --> Start resampling")
         
@@ -152,6 +212,7 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
             'TARGET_RESOLUTION': output_resolution,
             'OUTPUT': str(dtb_raster_resample_path)
         }, is_child_algorithm=True, context=context, feedback=feedback)
+        check_canceled(feedback, [dtb_clip_raster_path, dtb_raster_resample_path], logger)
         dtb_raster_layer = QgsRasterLayer(str(dtb_raster_resample_path), "resampl_temp-raster")
         if dtb_raster_layer.crs().isValid():
             logger.debug(f"@process_raster_for_impactmap@ - CRS Description: {dtb_raster_layer.crs().description()}")
@@ -162,7 +223,7 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
         feedback.pushInfo("@process_raster_for_impactmap@ --> Done resampling")
     
         # Convert to TIFF if needed
-        dtb_raster_tiff = output_folder / "dtb_raster.tif"
+        dtb_raster_tiff = output_folder / f"{file_prefix}dtb_raster.tif"
         if not dtb_raster_layer.source().endswith(('.tif', '.tiff')): #checks a tuple
             logger.info("START raster to TIFF conversion")
             QgsRasterFileWriter.writeRasterLayer(dtb_raster_layer, str(dtb_raster_tiff), "GTiff")
@@ -173,6 +234,375 @@ def process_raster_for_impactmap(source_excavation_poly, dtb_raster_layer, clipp
         # Return the Path object of the final processed raster file
         return dtb_raster_tiff
 
+def remove_temp_files(paths, logger=None):
+    """
+    Removes temporary files of a run with all their components (e.g. .shx, .dbf or .tif.aux.xml).
+    Folders, e.g. the temporary folder of the run, are removed with their content.
+
+    Args:
+    - paths (list): Paths of the files and folders. Missing files are skipped.
+    - logger: Logger object for logging messages. Defaults to None.
+    """
+    for path in paths:
+        if Path(path).is_dir():
+            try:
+                shutil.rmtree(str(path))
+            except OSError as e:
+                if logger:
+                    logger.warning(f"@remove_temp_files@ - Could not remove {path}: {e}")
+            continue
+        for component in get_file_components(Path(path)):
+            try:
+                component.unlink()
+            except OSError as e:
+                if logger:
+                    logger.warning(f"@remove_temp_files@ - Could not remove {component}: {e}")
+
+def check_canceled(feedback, temp_files=(), logger=None):
+    """
+    Cancellation checkpoint, between the stages of a run and inside its loops.
+
+    Args:
+    - feedback (QgsProcessingFeedback): The feedback of the run, or None.
+    - temp_files (list, optional): Temporary files written by the run so far, removed when the run is canceled.
+    - logger: Logger object for logging messages. Defaults to None.
+
+    Raises:
+    - QgsProcessingException: If the run was canceled.
+    """
+    if feedback is None or not feedback.isCanceled():
+        return
+    remove_temp_files(temp_files, logger)
+    if logger:
+        logger.info("@check_canceled@ - The run was canceled")
+    raise QgsProcessingException("The run was canceled")
+
+def gdal_progress(feedback):
+    """
+    Returns a progress callback for GDAL functions that aborts the GDAL operation when the run is canceled.
+
+    Args:
+    - feedback (QgsProcessingFeedback): The feedback of the run, or None.
+
+    Returns:
+    - callable: The callback, or None without feedback.
+    """
+    if feedback is None:
+        return None
+    return lambda complete, message, data: 0 if feedback.isCanceled() else 1
+
+def get_overview_raster(raster_path, logger=None, feedback=None):
+    """
+    Returns a raster with overviews for a file based raster, to read coarse grids from it.
+
+    Rasters that have overviews are returned as they are. For other rasters, a VRT of the raster
+    with external average overviews (.vrt.ovr) is built once and kept in the overview cache, keyed by
+    the path and modification time of the raster. Overviews are never written next to the source.
+
+    Args:
+    - raster_path (str): Path to the raster file.
+    - logger: Logger object for logging messages. Defaults to None.
+    - feedback (QgsProcessingFeedback, optional): Building the overviews stops when the run is canceled.
+
+    Returns:
+    - Path: The raster to read, the source itself if no overviews could be provided.
+    """
+    # Imported here, the cache module depends on this module
+    from .cache import get_overview_cache, overview_cache_key
+
+    raster_path = Path(raster_path)
+    dataset = gdal.Open(str(raster_path))
+    if dataset is None or dataset.GetRasterBand(1).GetOverviewCount() > 0:
+        return raster_path
+    if dataset.RasterXSize * dataset.RasterYSize > OVERVIEW_MAX_PIXELS:
+        # Building overviews would read the whole raster, more than the window of one analysis
+        return raster_path
+    cache_key = overview_cache_key(raster_path)
+    if cache_key is None:
+        return raster_path
+    cache = get_overview_cache(logger)
+    cached_files = cache.get(cache_key)
+    if cached_files is not None:
+        return cached_files["raster"]
+
+    levels = []
+    factor = 2
+    while min(dataset.RasterXSize, dataset.RasterYSize) // factor >= OVERVIEW_MIN_SIZE:
+        levels.append(factor)
+        factor *= 2
+    if not levels:
+        return raster_path
+    if logger:
+        logger.info(f"@get_overview_raster@ - Building overviews {levels} of {raster_path}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The VRT refers to the absolute path of the source, so it stays valid in the cache
+        vrt_path = Path(temp_dir) / f"{raster_path.stem}.vrt"
+        vrt = gdal.BuildVRT(str(vrt_path), [str(raster_path.resolve())])
+        vrt.BuildOverviews("AVERAGE", levels, callback=gdal_progress(feedback))
+        vrt = None
+        # Incomplete overviews of a canceled run are not cached
+        check_canceled(feedback, logger=logger)
+        try:
+            cached_files = cache.put(cache_key, {"raster": vrt_path, "overviews": Path(f"{vrt_path}.ovr")})
+        except OSError as e:
+            if logger:
+                logger.warning(f"@get_overview_raster@ - Could not store overviews in the cache: {e}")
+            return raster_path
+    return cached_files["raster"]
+
+def is_gdal_raster(raster_source):
+    """
+    Checks if a raster source (GeoTIFF, VRT, GeoPackage raster or any other GDAL format) can be read by GDAL.
+
+    Args:
+    - raster_source (str): The file path or GDAL connection string of the raster.
+
+    Returns:
+    - bool: True if GDAL can open the raster.
+    """
+    return gdal.Open(str(raster_source)) is not None
+
+def extract_raster_window(raster_source, extent, output_path, logger=None, feedback=None):
+    """
+    Copies the pixels of a raster that cover an extent to a GeoTIFF.
+
+    Only the window is read (GDAL windowed read), so a large mosaic (e.g. a VRT over many tiles)
+    costs only the tiles under the extent. The window is widened to whole pixels plus one pixel on
+    every side, and keeps the pixel grid of the source, so sampled values are unchanged.
+
+    Args:
+    - raster_source (str): The file path or GDAL connection string of the raster.
+    - extent (QgsRectangle): The extent to read, in the CRS of the raster.
+    - output_path (Path): The GeoTIFF to write.
+    - logger: Logger object for logging messages. Defaults to None.
+    - feedback (QgsProcessingFeedback, optional): The copy stops when the run is canceled.
+
+    Returns:
+    - Path: The written GeoTIFF, or None if the extent does not overlap the raster.
+
+    Raises:
+    - IOError: If the raster can not be opened.
+    - ValueError: If the raster is rotated.
+    """
+    dataset = gdal.Open(str(raster_source))
+    if dataset is None:
+        raise IOError(f"Could not open raster: {raster_source}")
+    x0, dx, rx, y0, ry, dy = dataset.GetGeoTransform()
+    if rx != 0 or ry != 0:
+        raise ValueError(f"Rotated rasters are not supported: {raster_source}")
+    cols = sorted(((extent.xMinimum() - x0) / dx, (extent.xMaximum() - x0) / dx))
+    rows = sorted(((extent.yMinimum() - y0) / dy, (extent.yMaximum() - y0) / dy))
+    col_min = max(math.floor(cols[0]) - 1, 0)
+    col_max = min(math.ceil(cols[1]) + 1, dataset.RasterXSize)
+    row_min = max(math.floor(rows[0]) - 1, 0)
+    row_max = min(math.ceil(rows[1]) + 1, dataset.RasterYSize)
+    if col_max <= col_min or row_max <= row_min:
+        return None
+    if logger:
+        logger.info(f"@extract_raster_window@ - Reading {col_max - col_min} x {row_max - row_min} pixels "
+                    f"of {dataset.RasterXSize} x {dataset.RasterYSize} from {raster_source}")
+    window = gdal.Translate(
+        str(output_path),
+        dataset,
+        format="GTiff",
+        srcWin=[col_min, row_min, col_max - col_min, row_max - row_min],
+        creationOptions=["COMPRESS=DEFLATE", "TILED=YES"],
+        callback=gdal_progress(feedback),
+    )
+    check_canceled(feedback, [output_path], logger)
+    if window is None:
+        raise IOError(f"Could not write raster window: {output_path}")
+    window = None
+    return Path(output_path)
+
+def warp_raster_to_grid(raster_source, extent, resolution, output_path, logger=None, feedback=None):
+    """
+    Resamples the pixels of a raster that cover an extent to a grid of square cells, averaging the
+    source pixels of every cell. The extent is widened to whole cells.
+
+    Args:
+    - raster_source (str): The file path or GDAL connection string of the raster.
+    - extent (QgsRectangle): The extent of the grid, in the CRS of the raster.
+    - resolution (float): The cell size of the grid, in the units of the raster CRS.
+    - output_path (Path): The GeoTIFF to write.
+    - logger: Logger object for logging messages. Defaults to None.
+    - feedback (QgsProcessingFeedback, optional): The warp stops when the run is canceled.
+
+    Returns:
+    - Path: The written GeoTIFF.
+
+    Raises:
+    - IOError: If the raster can not be read or the grid can not be written.
+    """
+    bounds = [
+        math.floor(extent.xMinimum() / resolution) * resolution,
+        math.floor(extent.yMinimum() / resolution) * resolution,
+        math.ceil(extent.xMaximum() / resolution) * resolution,
+        math.ceil(extent.yMaximum() / resolution) * resolution,
+    ]
+    if logger:
+        logger.info(f"@warp_raster_to_grid@ - Resampling {raster_source} to {resolution} m cells over {bounds}")
+    grid = gdal.Warp(
+        str(output_path),
+        str(raster_source),
+        format="GTiff",
+        outputBounds=bounds,
+        xRes=resolution,
+        yRes=resolution,
+        resampleAlg="average",
+        outputType=gdal.GDT_Float32,
+        dstNodata=-9999.0,
+        creationOptions=["COMPRESS=DEFLATE", "TILED=YES"],
+        callback=gdal_progress(feedback),
+    )
+    check_canceled(feedback, [output_path], logger)
+    if grid is None:
+        raise IOError(f"Could not resample {raster_source} to {output_path}")
+    grid = None
+    return Path(output_path)
+
+def clip_raster_to_extent(raster_layer, extent, extent_crs, output_path, margin=RASTER_WINDOW_MARGIN, context=None, logger=None):
+    """
+    Clips a raster to an extent given in another CRS, e.g. the buildings in the output CRS, so that
+    only the window is reprojected afterwards instead of the whole raster.
+
+    Args:
+    - raster_layer (QgsRasterLayer): The raster to clip.
+    - extent (QgsRectangle): The extent, in extent_crs.
+    - extent_crs (QgsCoordinateReferenceSystem): The CRS of the extent.
+    - output_path (Path): The GeoTIFF to write.
+    - margin (float): The extent is grown by this distance, in extent_crs units.
+    - context (QgsProcessingContext, optional): For the coordinate transform context.
+    - logger: Logger object for logging messages. Defaults to None.
+
+    Returns:
+    - QgsRasterLayer: The clipped raster in the CRS of the source, or None if the extent does not overlap it.
+    """
+    extent = QgsRectangle(extent)
+    extent.grow(margin)
+    transform_context = context.transformContext() if context is not None else QgsProject.instance().transformContext()
+    transform = QgsCoordinateTransform(extent_crs, raster_layer.crs(), transform_context)
+    raster_extent = transform.transformBoundingBox(extent)
+    clipped_path = extract_raster_window(
+        raster_layer.source().split("|")[0], raster_extent, output_path, logger, context.feedback() if context is not None else None
+    )
+    if clipped_path is None:
+        return None
+    return QgsRasterLayer(str(clipped_path), clipped_path.stem)
+
+def read_features_in_extent(layer, extent, extent_crs, output_path, context=None, logger=None, feedback=None):
+    """
+    Writes the features of a layer whose bounding box intersects an extent to a shapefile.
+
+    The features are requested with QgsFeatureRequest.setFilterRect, so providers with a spatial
+    index (GeoPackage R-tree, shapefile .qix, FlatGeobuf) only read the features near the extent,
+    and the cost follows the size of the extent instead of the size of the dataset.
+
+    Args:
+    - layer (QgsVectorLayer): The layer to read, e.g. a national building dataset.
+    - extent (QgsRectangle): The extent, in extent_crs.
+    - extent_crs (QgsCoordinateReferenceSystem): The CRS of the extent.
+    - output_path (Path): The shapefile to write, overwritten if it exists.
+    - context (QgsProcessingContext, optional): For the coordinate transform context.
+    - logger: Logger object for logging messages. Defaults to None.
+    - feedback (QgsProcessingFeedback, optional): The read stops when the run is canceled.
+
+    Returns:
+    - QgsVectorLayer: The written features, in the CRS of the layer.
+    """
+    transform_context = context.transformContext() if context is not None else QgsProject.instance().transformContext()
+    transform = QgsCoordinateTransform(extent_crs, layer.crs(), transform_context)
+    request = QgsFeatureRequest().setFilterRect(transform.transformBoundingBox(extent))
+
+    QgsVectorFileWriter.deleteShapeFile(str(output_path))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(
+        str(output_path), layer.fields(), layer.wkbType(), layer.crs(), QgsCoordinateTransformContext(), options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise QgsProcessingException(f"@read_features_in_extent@ - Could not create {output_path}: {writer.errorMessage()}")
+    count = 0
+    for feature in layer.getFeatures(request):
+        if feedback is not None and feedback.isCanceled():
+            break
+        writer.addFeature(feature)
+        count += 1
+    del writer
+    check_canceled(feedback, [output_path], logger)
+    if logger:
+        logger.info(f"@read_features_in_extent@ - Read {count} of {layer.featureCount()} features of {layer.source()}")
+    return QgsVectorLayer(str(output_path), Path(output_path).stem, "ogr")
+
+def ensure_spatial_index(layer, convert=True, logger=None):
+    """
+    Makes sure a vector layer has a spatial index, so extent requests only read the features near the extent.
+
+    Shapefiles get a .qix index next to the source. File based layers whose provider can not build an index
+    in place (e.g. GeoJSON, CSV or a read only shapefile folder) are converted once to a GeoPackage, which
+    always holds an R-tree index. The GeoPackage is kept in the spatial index cache, keyed by source path and
+    modification time, so later runs over the same dataset read the indexed copy directly.
+
+    Args:
+    - layer (QgsVectorLayer): The layer to index.
+    - convert (bool, optional): Convert layers that can not be indexed in place. Default is True.
+    - logger: Logger object for logging messages. Defaults to None.
+
+    Returns:
+    - Tuple: (layer, status) The layer to read: a new layer of the source if the index was created, the indexed
+      copy if the layer was converted. The status is
+      'present', 'created', 'converted' or 'unsupported'.
+    """
+    # Imported here, the cache module depends on this module
+    from .cache import get_spatial_index_cache, spatial_index_cache_key
+
+    provider = layer.dataProvider()
+    if provider.hasSpatialIndex() == QgsFeatureSource.SpatialIndexPresent:
+        return layer, "present"
+    if provider.capabilities() & QgsVectorDataProvider.CreateSpatialIndex:
+        # The index is built through a layer of the calling thread, 'layer' may belong to the project
+        # on the main thread. The new layer opens the source with the index.
+        own_layer = QgsVectorLayer(layer.source(), layer.name(), layer.providerType())
+        if own_layer.isValid() and own_layer.dataProvider().createSpatialIndex():
+            if logger:
+                logger.info(f"@ensure_spatial_index@ - Created spatial index of {layer.source()}")
+            return own_layer, "created"
+    cache_key = spatial_index_cache_key(layer) if convert else None
+    if cache_key is None:
+        if logger:
+            logger.info(f"@ensure_spatial_index@ - No spatial index for {layer.source()}, the layer can not be indexed")
+        return layer, "unsupported"
+
+    cache = get_spatial_index_cache(logger)
+    cached_files = cache.get(cache_key)
+    if cached_files is None:
+        temp_path = Path(tempfile.mkdtemp()) / f"{layer.name() or 'layer'}.gpkg"
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.layerOptions = ["SPATIAL_INDEX=YES"]
+        writer = QgsVectorFileWriter.create(
+            str(temp_path), layer.fields(), layer.wkbType(), layer.crs(), QgsCoordinateTransformContext(), options
+        )
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise QgsProcessingException(f"@ensure_spatial_index@ - Could not create {temp_path}: {writer.errorMessage()}")
+        for feature in layer.getFeatures():
+            writer.addFeature(feature)
+        # The R-tree is completed when the writer is closed
+        del writer
+        try:
+            cached_files = cache.put(cache_key, {"layer": temp_path})
+            shutil.rmtree(temp_path.parent, ignore_errors=True)
+        except OSError as e:
+            # The indexed copy is still usable for this run
+            if logger:
+                logger.warning(f"@ensure_spatial_index@ - Could not store the indexed copy in the cache: {e}")
+            cached_files = {"layer": temp_path}
+        if logger:
+            logger.info(f"@ensure_spatial_index@ - Converted {layer.source()} to the indexed GeoPackage {cached_files['layer']}")
+    indexed_layer = QgsVectorLayer(str(cached_files["layer"]), layer.name(), "ogr")
+    return indexed_layer, "converted"
+
 def get_intersected_extent(polygon_extent, raster_extent, clipping_range):
     """
     Expands a given polygon extent by a specified clipping range and then intersects it with a raster extent.
@@ -240,20 +670,64 @@ def reproject_is_needed(layer: Union[QgsVectorLayer, QgsRasterLayer],
     else:
         return False
     
+def _restore_reprojection(layer, output_crs: QgsCoordinateReferenceSystem, destination_path: Path, logger=None):
+    """
+    Copies a previously reprojected version of 'layer' from the reprojection cache to 'destination_path'.
+
+    Returns:
+    - Tuple: (cache_key, restored) The cache key is None if the layer can not be cached (not file based).
+    """
+    # Imported here, the cache module depends on this module
+    from .cache import get_reprojection_cache, reprojection_cache_key
+
+    cache_key = reprojection_cache_key(layer, output_crs)
+    if cache_key is None:
+        return None, False
+    cached_files = get_reprojection_cache(logger).get(cache_key)
+    if cached_files is None:
+        return cache_key, False
+    try:
+        copy_file_components(cached_files["layer"], destination_path)
+    except OSError as e:
+        # The entry may have been evicted by a concurrent run, fall back to reprojecting
+        if logger:
+            logger.warning(f"@reproject_layers@ - Could not restore cached reprojection: {e}")
+        return cache_key, False
+    if logger:
+        logger.info(f"@reproject_layers@ - Reusing cached reprojection {cache_key} for {layer.source()}")
+    return cache_key, True
+
+def _store_reprojection(cache_key, reprojected_path: Path, logger=None):
+    """Stores a reprojected layer in the reprojection cache. A failure to cache never fails the reprojection."""
+    from .cache import get_reprojection_cache
+
+    if cache_key is None:
+        return
+    try:
+        get_reprojection_cache(logger).put(cache_key, {"layer": reprojected_path})
+    except OSError as e:
+        if logger:
+            logger.warning(f"@reproject_layers@ - Could not store reprojection in the cache: {e}")
+
 def reproject_layers(output_crs: QgsCoordinateReferenceSystem, 
                      vector_layer: QgsVectorLayer = None,
                      raster_layer: QgsRasterLayer = None, 
                      context: QgsProcessingContext = None, 
-                     logger = None):
+                     logger = None,
+                     use_cache: bool = True):
     """
     Reprojects vector and optionally raster layers to a specified CRS.
 
+    File based layers are cached on disk, keyed by source path, modification time, source CRS and target CRS.
+    Repeated reprojections of an unchanged layer are copied from the cache instead of recomputed.
+
     Args:
     - output_crs (QgsCoordinateReferenceSystem): The desired output CRS.
     - vector_layer (QgsVectorLayer, optional): The vector layer to be reprojected, or None if not applicable.
     - raster_layer (QgsRasterLayer, optional): The raster layer to be reprojected, or None if not applicable.
     - context (QgsProcessingContext, optional): The context for processing. Default is None.
     - logger (logging.Logger, optional): Logger for logging messages. Default is None.
+    - use_cache (bool, optional): Reuse and store reprojections in the reprojection cache. Default is True.
 
     Returns:
     - Tuple: (reprojected_vector_layer, reprojected_raster_layer) Paths to the reprojected layers.
@@ -279,14 +753,21 @@ def reproject_layers(output_crs: QgsCoordinateReferenceSystem,
         if logger:
             logger.info(f"Attempting to reproject to: {reprojected_vector_path}")  # Log the output path
 
-        try:
-            processing.run("native:reprojectlayer", {
-                'INPUT': vector_layer,
-                'TARGET_CRS': output_crs.authid(),
-                'OUTPUT': str(reprojected_vector_path)
-            }, is_child_algorithm=True, context=context, feedback=feedback)
-        except Exception as e:
-            raise QgsProcessingException(f"@reproject_layers@ - Error during vector reprojection: {str(e)}")
+        cache_key, restored = _restore_reprojection(vector_layer, output_crs, reprojected_vector_path, logger) if use_cache else (None, False)
+        if restored:
+            feedback.pushInfo("@reproject_layers@ - Reusing cached reprojection of the vector layer")
+        else:
+            try:
+                processing.run("native:reprojectlayer", {
+                    'INPUT': vector_layer,
+                    'TARGET_CRS': output_crs.authid(),
+                    'OUTPUT': str(reprojected_vector_path)
+                }, is_child_algorithm=True, context=context, feedback=feedback)
+            except Exception as e:
+                raise QgsProcessingException(f"@reproject_layers@ - Error during vector reprojection: {str(e)}")
+            # A canceled reprojection is incomplete, it is removed instead of cached
+            check_canceled(feedback, [reprojected_vector_path], logger)
+            _store_reprojection(cache_key, reprojected_vector_path, logger)
         
         reprojected_vector_layer = QgsVectorLayer(str(reprojected_vector_path), f"reprojected_{vector_layer.name()}.shp", 'ogr')
         if not reprojected_vector_layer.isValid():
@@ -300,15 +781,21 @@ def reproject_layers(output_crs: QgsCoordinateReferenceSystem,
         reprojected_raster_path = temp_folder / f"reprojected_{raster_layer.name()}.tif"
         if logger:
             logger.info(f"Attempting to reproject to: {reprojected_raster_path}")  # Log the output path
-        try:
-            processing.run("gdal:warpreproject", {
-                'INPUT': raster_layer.source(),
-                'SOURCE_CRS': raster_layer.crs().authid(),
-                'TARGET_CRS': output_crs.authid(),
-                'OUTPUT': str(reprojected_raster_path)
-            }, is_child_algorithm=True, context=context, feedback=feedback)
-        except Exception as e:
-            raise QgsProcessingException(f"@reproject_layers@ - Error during raster reprojection: {str(e)}")
+        cache_key, restored = _restore_reprojection(raster_layer, output_crs, reprojected_raster_path, logger) if use_cache else (None, False)
+        if restored:
+            feedback.pushInfo("@reproject_layers@ - Reusing cached reprojection of the raster layer")
+        else:
+            try:
+                processing.run("gdal:warpreproject", {
+                    'INPUT': raster_layer.source(),
+                    'SOURCE_CRS': raster_layer.crs().authid(),
+                    'TARGET_CRS': output_crs.authid(),
+                    'OUTPUT': str(reprojected_raster_path)
+                }, is_child_algorithm=True, context=context, feedback=feedback)
+            except Exception as e:
+                raise QgsProcessingException(f"@reproject_layers@ - Error during raster reprojection: {str(e)}")
+            check_canceled(feedback, [reprojected_raster_path], logger)
+            _store_reprojection(cache_key, reprojected_raster_path, logger)
         
         reprojected_raster_layer = QgsRasterLayer(str(reprojected_raster_path), f"reprojected_{raster_layer.name()}.tif")
         if not reprojected_raster_layer.isValid():
@@ -318,6 +805,87 @@ def reproject_layers(output_crs: QgsCoordinateReferenceSystem,
 
     return reprojected_vector_layer, reprojected_raster_layer
 
+def prepare_vector_layer(layer: QgsVectorLayer, output_crs: QgsCoordinateReferenceSystem, context: QgsProcessingContext = None, logger=None):
+    """
+    Returns a vector layer in the output CRS, reprojected (through the reprojection cache) if needed.
+
+    Args:
+    - layer (QgsVectorLayer): The building, excavation or tunnel layer.
+    - output_crs (QgsCoordinateReferenceSystem): The output CRS.
+    - context (QgsProcessingContext, optional): The context for processing. Default is None.
+    - logger (logging.Logger, optional): Logger for logging messages. Default is None.
+
+    Returns:
+    - QgsVectorLayer: The layer itself, or the reprojected layer.
+    """
+    if not reproject_is_needed(layer, output_crs):
+        return layer
+    if context is not None and context.feedback() is not None:
+        context.feedback().pushInfo(
+            f"PROCESS - Reprojection needed for layer: {layer.name()}, ORIGINAL CRS: {layer.crs().postgisSrid()}"
+        )
+    try:
+        reprojected_layer, _ = reproject_layers(output_crs, vector_layer=layer, raster_layer=None, context=context, logger=logger)
+    except Exception as e:
+        raise QgsProcessingException(f"Error during reprojection of {layer.name()}: {e}")
+    return reprojected_layer
+
+def prepare_dtb_window(raster_layer: QgsRasterLayer, extent: QgsRectangle, extent_crs: QgsCoordinateReferenceSystem,
+                       output_crs: QgsCoordinateReferenceSystem, context: QgsProcessingContext = None, logger=None) -> Path:
+    """
+    Writes the window of a depth to bedrock raster under an extent, in the output CRS.
+
+    A raster in another CRS is clipped to the extent before it is reprojected, so only the window is warped.
+    The window is then read with extract_raster_window, so any GDAL raster (GeoTIFF, VRT mosaic, GeoPackage)
+    is accepted.
+
+    Args:
+    - raster_layer (QgsRasterLayer): The depth to bedrock raster.
+    - extent (QgsRectangle): The extent to cover, e.g. the extent of the buildings, in extent_crs.
+    - extent_crs (QgsCoordinateReferenceSystem): The CRS of the extent.
+    - output_crs (QgsCoordinateReferenceSystem): The output CRS.
+    - context (QgsProcessingContext, optional): The context for processing. Default is None.
+    - logger (logging.Logger, optional): Logger for logging messages. Default is None.
+
+    Returns:
+    - Path: The window, a GeoTIFF in the output CRS.
+
+    Raises:
+    - QgsProcessingException: If the raster can not be read or does not cover the extent.
+    """
+    temp_folder = create_temp_folder_for_version(Qgis.QGIS_VERSION_INT, context)
+    feedback = context.feedback() if context is not None else None
+    transform_context = context.transformContext() if context is not None else QgsProject.instance().transformContext()
+    output_extent = QgsCoordinateTransform(extent_crs, output_crs, transform_context).transformBoundingBox(extent)
+    if reproject_is_needed(raster_layer, output_crs):
+        if feedback is not None:
+            feedback.pushInfo(
+                f"PROCESS - Reprojection needed for layer: {raster_layer.name()}, ORIGINAL CRS: {raster_layer.crs().postgisSrid()}"
+            )
+        # Only the window around the extent is reprojected, not the whole raster
+        clipped_raster = clip_raster_to_extent(
+            raster_layer, output_extent, output_crs, temp_folder / "dtb_clip_temp-raster.tif", context=context, logger=logger
+        )
+        if clipped_raster is None:
+            raise QgsProcessingException("The raster layer does not cover the buildings")
+        try:
+            # The clipped window is a new file every run, so it is not put in the reprojection cache
+            _, raster_layer = reproject_layers(
+                output_crs, vector_layer=None, raster_layer=clipped_raster, context=context, logger=logger, use_cache=False
+            )
+        except Exception as e:
+            raise QgsProcessingException(f"Error during reprojection of RASTER LAYER: {e}")
+        check_canceled(feedback, [temp_folder / "dtb_clip_temp-raster.tif"], logger)
+    try:
+        window_path = extract_raster_window(
+            raster_layer.source().split("|")[0], output_extent, temp_folder / "dtb_window_temp-raster.tif", logger, feedback
+        )
+    except (IOError, ValueError) as e:
+        raise QgsProcessingException(f"The raster layer can not be read: {e}")
+    if window_path is None:
+        raise QgsProcessingException("The raster layer does not cover the buildings")
+    return window_path
+
 def move_file_components(original_file_path: Path, destination_file_path: Path):
     """
     Moves all components of a Shapefile or a TIFF file to a specified destination folder.
@@ -330,12 +898,12 @@ def move_file_components(original_file_path: Path, destination_file_path: Path):
     destination_folder = destination_file_path.parent
     destination_base_name = destination_file_path.stem
 
-    if file_extension in ['.shp', '.shx', '.dbf', '.prj', '.cpg', '.qpj']:
+    if file_extension in SHAPEFILE_EXTENSIONS:
         # Handle Shapefile components
-        extensions = ['.shp', '.shx', '.dbf', '.prj', '.cpg', '.qpj']
-    elif file_extension in ['.tif', '.tiff']:
+        extensions = SHAPEFILE_EXTENSIONS
+    elif file_extension in TIFF_EXTENSIONS:
         # Handle TIFF and associated files (including .aux.xml and .tfw)
-        extensions = ['.tif', '.tiff', '.tfw', '.tif.aux.xml', '.tiff.aux.xml']
+        extensions = TIFF_EXTENSIONS
     else:
         raise ValueError("Unsupported file format")
 
@@ -346,26 +914,123 @@ def move_file_components(original_file_path: Path, destination_file_path: Path):
         if src_file.exists():
             shutil.move(str(src_file), str(dest_file))
             
-def create_temp_folder_for_version(qgis_version_int : int, context: QgsProcessingContext = None) -> Path:
+def get_file_components(file_path: Path) -> list:
+    """
+    Returns all existing files belonging to a Shapefile or a TIFF file (e.g. .shx, .dbf, .prj or .tif.aux.xml).
+    For other formats only the file itself is returned.
+
+    Args:
+    - file_path (pathlib.Path): The full path to the main file.
+
+    Returns:
+    - list: Paths of the existing components.
+    """
+    file_extension = file_path.suffix.lower()
+    if file_extension in SHAPEFILE_EXTENSIONS:
+        extensions = SHAPEFILE_EXTENSIONS + ['.qix']
+    elif file_extension in TIFF_EXTENSIONS:
+        candidates = [file_path, file_path.with_suffix('.tfw'), Path(f"{file_path}.aux.xml")]
+        return [path for path in candidates if path.exists()]
+    else:
+        return [file_path] if file_path.exists() else []
+    return [file_path.with_suffix(ext) for ext in extensions if file_path.with_suffix(ext).exists()]
+
+def copy_file_components(original_file_path: Path, destination_file_path: Path):
+    """
+    Copies all components of a Shapefile or a TIFF file to a new file path, renaming them to its base name.
+
+    Args:
+    - original_file_path (pathlib.Path): The full path to the main file.
+    - destination_file_path (pathlib.Path): The full destination file path.
+    """
+    original_file_path = Path(original_file_path)
+    destination_file_path = Path(destination_file_path)
+    for component in get_file_components(original_file_path):
+        # Keep the (possibly double) extension, e.g. '.tif.aux.xml'
+        extension = component.name[len(original_file_path.stem):]
+        shutil.copy2(str(component), str(destination_file_path.parent / (destination_file_path.stem + extension)))
+
+def get_processing_temp_folder(qgis_version_int : int, context: QgsProcessingContext = None) -> Path:
     """
-    Creates a temporary folder based on the QGIS version.
+    Returns the Processing temporary folder, the folder of the context for QGIS 3.32 and above.
 
     Args:
         qgis_version_int  (int): The integer representation of the QGIS version.
         context (QgsProcessingContext, optional): The context for processing. Default is None.
 
     Returns:
-        Path: The path to the temporary folder.
+        Path: The path to the folder.
     """
     # Check if the running version of QGIS is lower than the requirement
-    if qgis_version_int >= 33200 and context is not None:
-        # For QGIS versions 3.32.0 and above
-        temp_folder = Path(context.temporaryFolder())
-        temp_folder.mkdir(parents=True, exist_ok=True)
+    if qgis_version_int >= 33200 and context is not None and context.temporaryFolder():
+        # For QGIS versions 3.32.0 and above, unless the context has no temporary folder of its own
+        base_folder = Path(context.temporaryFolder())
     else:
         # For older versions, or if no context is provided, use the global Processing temporary folder
-        temp_folder = QgsProcessingUtils.tempFolder()
-        temp_folder = Path(temp_folder)
-        temp_folder.mkdir(parents=True, exist_ok=True)
-        
+        base_folder = Path(QgsProcessingUtils.tempFolder())
+    base_folder.mkdir(parents=True, exist_ok=True)
+    return base_folder
+
+def _context_key(context: QgsProcessingContext) -> int:
+    # The Python wrappers of one context may differ, the C++ object identifies it
+    return sip.unwrapinstance(context)
+
+def create_run_temp_folder(qgis_version_int : int, context: QgsProcessingContext) -> Path:
+    """
+    Creates the temporary folder of a run, returned by create_temp_folder_for_version() for the context
+    of the run until remove_run_temp_folder() is called.
+
+    Runs in parallel (batch processing, background threads) have their own context, so they never write
+    temporary files with the same name. A child algorithm run with the context of its parent gets a
+    folder of its own, and the folder of the parent is returned again when the child has finished.
+
+    Args:
+        qgis_version_int  (int): The integer representation of the QGIS version.
+        context (QgsProcessingContext): The context of the run.
+
+    Returns:
+        Path: The path to the temporary folder.
+    """
+    temp_folder = Path(tempfile.mkdtemp(prefix="remedy_", dir=get_processing_temp_folder(qgis_version_int, context)))
+    with _RUN_TEMP_FOLDERS_LOCK:
+        _RUN_TEMP_FOLDERS.setdefault(_context_key(context), []).append(temp_folder)
     return temp_folder
+
+def remove_run_temp_folder(temp_folder: Path, context: QgsProcessingContext, logger=None):
+    """
+    Removes the temporary folder of a run with its content, see create_run_temp_folder().
+
+    Args:
+        temp_folder (Path): The folder of the run.
+        context (QgsProcessingContext): The context of the run.
+        logger: Logger object for logging messages. Defaults to None.
+    """
+    with _RUN_TEMP_FOLDERS_LOCK:
+        folders = _RUN_TEMP_FOLDERS.get(_context_key(context), [])
+        if temp_folder in folders:
+            folders.remove(temp_folder)
+        if not folders:
+            _RUN_TEMP_FOLDERS.pop(_context_key(context), None)
+    remove_temp_files([temp_folder], logger)
+
+def create_temp_folder_for_version(qgis_version_int : int, context: QgsProcessingContext = None) -> Path:
+    """
+    Returns the temporary folder of the run of the context, see create_run_temp_folder().
+
+    Outside of a run (e.g. the utilities called from a script), a new folder inside the Processing
+    temporary folder is created for every call.
+
+    Args:
+        qgis_version_int  (int): The integer representation of the QGIS version.
+        context (QgsProcessingContext, optional): The context for processing. Default is None.
+
+    Returns:
+        Path: The path to the temporary folder.
+    """
+    if context is not None:
+        with _RUN_TEMP_FOLDERS_LOCK:
+            # The folder of a canceled run is removed without ending the run, it is skipped
+            folders = [folder for folder in _RUN_TEMP_FOLDERS.get(_context_key(context), []) if folder.is_dir()]
+        if folders:
+            return folders[-1]
+    return Path(tempfile.mkdtemp(prefix="remedy_", dir=get_processing_temp_folder(qgis_version_int, context)))
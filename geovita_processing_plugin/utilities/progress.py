@@ -0,0 +1,276 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Progress of the long running computations of the REMEDY algorithms. The computations call a
+progress callback with the computed fraction after every batch of buildings, corners or cells.
+The ProgressReporter maps the fraction into the progress bar of the run, checks for cancellation
+and reports the throughput and the estimated time left.
+
+A REMEDY core that does not report its progress is run under a CoreHeartbeat instead, which moves
+the progress bar with the time elapsed and the throughput the same core had in previous runs.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+import inspect
+import json
+import threading
+import time
+from datetime import timedelta
+
+from .cache import CACHE_ROOT
+from .methodslib import check_canceled
+
+# Seconds between two throughput/ETA messages of one computation
+REPORT_INTERVAL = 10.0
+
+# Seconds between two updates of the progress bar while a REMEDY core runs without reporting its progress
+HEARTBEAT_INTERVAL = 1.0
+
+# The estimated progress of a heartbeat stops here until the core returns
+HEARTBEAT_MAX_FRACTION = 0.99
+
+# Throughput of the REMEDY cores in previous runs, items per second by core function
+RATE_HISTORY_PATH = CACHE_ROOT / "core-rates.json"
+
+# Weight of the last run in the recorded throughput (exponential moving average)
+RATE_HISTORY_WEIGHT = 0.5
+
+
+def format_duration(seconds):
+    """Formats a duration in seconds as H:MM:SS."""
+    return str(timedelta(seconds=round(max(seconds, 0.0))))
+
+
+def accepts_progress(function):
+    """True if 'function' takes a 'progress' keyword argument (e.g. a REMEDY core function that reports its progress)."""
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+    return "progress" in parameters or any(
+        parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()
+    )
+
+
+class ProgressReporter:
+    """
+    Progress callback of a computation, called with the computed fraction (0..1) after every batch.
+
+    The fraction is mapped to start..start + span percent of the run (span 0 leaves the progress bar
+    as it is). Every call is a cancellation checkpoint, see methodslib.check_canceled(). When the
+    number of items of the computation is known, the throughput (items per second) and the estimated
+    time left are shown as progress text, and pushed to the log every REPORT_INTERVAL seconds.
+    """
+
+    def __init__(self, feedback, start, span, total=None, unit="items", temp_files=(), logger=None,
+                 report_interval=REPORT_INTERVAL, clock=time.monotonic):
+        """
+        Args:
+            feedback (QgsProcessingFeedback): The feedback of the run.
+            start (float): Progress at the start of the computation [%].
+            span (float): Progress of the whole computation [%].
+            total (int, optional): Number of items (buildings, corners, cells, ...) of the computation.
+            unit (str): Name of the items, e.g. "buildings".
+            temp_files (list): Temporary files of the run, removed when it is canceled.
+            logger (logging.Logger, optional): Logger for logging messages.
+        """
+        self.feedback = feedback
+        self.start = start
+        self.span = span
+        self.total = total
+        self.unit = unit
+        self.temp_files = temp_files
+        self.logger = logger
+        self.report_interval = report_interval
+        self.clock = clock
+        self.started = clock()
+        self.last_report = self.started
+        self.fraction = 0.0
+
+    def rate(self):
+        """Items per second so far, or None without a number of items or before any progress."""
+        elapsed = self.clock() - self.started
+        if not self.total or self.fraction <= 0.0 or elapsed <= 0.0:
+            return None
+        return self.fraction * self.total / elapsed
+
+    def eta(self):
+        """Estimated seconds left, or None before any progress."""
+        elapsed = self.clock() - self.started
+        if self.fraction <= 0.0:
+            return None
+        return elapsed * (1.0 - self.fraction) / self.fraction
+
+    def message(self):
+        """Progress text with the computed items, the throughput and the estimated time left."""
+        if self.total:
+            text = f"{round(self.fraction * self.total)} of {self.total} {self.unit}"
+        else:
+            text = f"{100 * self.fraction:.0f} %"
+        rate = self.rate()
+        if rate is not None:
+            text += f", {rate:,.0f} {self.unit}/s"
+        eta = self.eta()
+        if eta is not None and self.fraction < 1.0:
+            text += f", ETA {format_duration(eta)}"
+        return text
+
+    def __call__(self, fraction):
+        check_canceled(self.feedback, self.temp_files, self.logger)
+        self.fraction = min(max(fraction, 0.0), 1.0)
+        if self.span:
+            self.feedback.setProgress(self.start + self.span * self.fraction)
+        if self.total is None:
+            return
+        text = self.message()
+        self.feedback.setProgressText(text)
+        now = self.clock()
+        if now - self.last_report >= self.report_interval or self.fraction >= 1.0:
+            self.last_report = now
+            self.feedback.pushInfo(f"PROCESS - {text}")
+            if self.logger:
+                self.logger.info(f"@ProgressReporter@ - {text}")
+
+
+class RateHistory:
+    """
+    Throughput (items per second) of every REMEDY core in previous runs, kept in a JSON file so the
+    estimates carry over between QGIS sessions. Runs in parallel share the file through a lock.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, path=RATE_HISTORY_PATH, logger=None):
+        self.path = path
+        self.logger = logger
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def rate(self, name):
+        """The recorded throughput of a core [items/s], or None if it never ran."""
+        with self._lock:
+            rate = self._load().get(name)
+        return rate if isinstance(rate, (int, float)) and rate > 0 else None
+
+    def record(self, name, items, seconds):
+        """Adds the throughput of a run to the history. A failure to write never fails the run."""
+        if items <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            rates = self._load()
+            previous = rates.get(name)
+            rate = items / seconds
+            if isinstance(previous, (int, float)) and previous > 0:
+                rate = RATE_HISTORY_WEIGHT * rate + (1.0 - RATE_HISTORY_WEIGHT) * previous
+            rates[name] = rate
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = self.path.with_suffix(".tmp")
+                temp_path.write_text(json.dumps(rates, indent=1), encoding="utf-8")
+                temp_path.replace(self.path)
+            except OSError as e:
+                if self.logger:
+                    self.logger.warning(f"@RateHistory@ - Could not store the throughput of {name}: {e}")
+
+
+class CoreHeartbeat:
+    """
+    Progress of a REMEDY core that does not report its progress, as a context manager around the call.
+
+    A background thread updates the progress bar every HEARTBEAT_INTERVAL seconds. The expected
+    duration is the number of items divided by the throughput of the core in previous runs (see
+    RateHistory), and the progress moves with the elapsed time up to HEARTBEAT_MAX_FRACTION, with
+    the estimated items done and time left as progress text. Without a previous run only the
+    elapsed time is shown. When the core returns, the progress is set to the end of the span and
+    the throughput of the run is recorded.
+
+    The core can not be interrupted, a canceled run is reported as waiting for the core to return.
+    """
+
+    def __init__(self, feedback, start, span, total, unit, name, history=None, logger=None,
+                 interval=HEARTBEAT_INTERVAL, clock=time.monotonic):
+        """
+        Args:
+            feedback (QgsProcessingFeedback): The feedback of the run.
+            start (float): Progress at the start of the core [%].
+            span (float): Progress of the whole core call [%].
+            total (int, optional): Number of items (buildings, cells) of the call, None if unknown.
+            unit (str): Name of the items, e.g. "buildings".
+            name (str): Name of the core function, the key of its throughput in the history.
+            history (RateHistory, optional): Defaults to the history in the cache folder.
+        """
+        self.feedback = feedback
+        self.start = start
+        self.span = span
+        self.total = total
+        self.unit = unit
+        self.name = name
+        self.history = history if history is not None else RateHistory(logger=logger)
+        self.logger = logger
+        self.interval = interval
+        self.clock = clock
+        rate = self.history.rate(name) if total else None
+        self.expected = total / rate if rate else None
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def message(self, elapsed):
+        """Progress text after 'elapsed' seconds."""
+        if self.feedback.isCanceled():
+            return f"Canceled, waiting for {self.name} to return ({format_duration(elapsed)} elapsed)"
+        if self.expected is None:
+            return f"Running {self.name}, {format_duration(elapsed)} elapsed"
+        fraction = min(elapsed / self.expected, HEARTBEAT_MAX_FRACTION)
+        text = f"About {round(fraction * self.total)} of {self.total} {self.unit} (estimated from previous runs)"
+        if elapsed < self.expected:
+            text += f", ETA {format_duration(self.expected - elapsed)}"
+        return text
+
+    def tick(self):
+        """Updates the progress bar and the progress text."""
+        elapsed = self.clock() - self.started
+        if self.expected is not None and self.span:
+            fraction = min(elapsed / max(self.expected, 1e-9), HEARTBEAT_MAX_FRACTION)
+            self.feedback.setProgress(self.start + self.span * fraction)
+        self.feedback.setProgressText(self.message(elapsed))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def __enter__(self):
+        self.started = self.clock()
+        if self.expected is None:
+            self.feedback.pushInfo(f"PROCESS - {self.name} does not report its progress, no previous run to estimate it")
+        else:
+            self.feedback.pushInfo(
+                f"PROCESS - {self.name} does not report its progress, estimated {format_duration(self.expected)} "
+                f"for {self.total} {self.unit} from previous runs"
+            )
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        if exc_type is None:
+            if self.span:
+                self.feedback.setProgress(self.start + self.span)
+            if self.total:
+                self.history.record(self.name, self.total, self.clock() - self.started)
+        return False
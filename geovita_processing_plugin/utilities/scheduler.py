@@ -0,0 +1,105 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Concurrent preparation of the inputs of the REMEDY algorithms. The building, excavation/tunnel
+and DTB inputs are prepared independently (reprojection, JSON conversion, raster windows), and
+the work is I/O or GDAL code that releases the GIL, so the branches run on a thread pool.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from qgis.core import QgsProcessingContext, QgsProcessingException
+from qgis.PyQt.QtCore import QObject, QThread
+
+# Seconds between two checks for cancellation while the branches run
+POLL_INTERVAL = 0.1
+
+
+def thread_context(context):
+    """
+    Returns a processing context for another thread, with the thread safe settings of 'context'.
+
+    A QgsProcessingContext must not be shared between threads, each branch gets its own.
+    """
+    branch_context = QgsProcessingContext()
+    if context is not None:
+        branch_context.copyThreadSafeSettings(context)
+        branch_context.setFeedback(context.feedback())
+    return branch_context
+
+
+def _move_to_thread(result, thread):
+    """Moves layers (and other QObjects) in a branch result to 'thread', so the caller owns them."""
+    if isinstance(result, QObject):
+        result.moveToThread(thread)
+    elif isinstance(result, (tuple, list)):
+        for value in result:
+            _move_to_thread(value, thread)
+
+
+def run_branches(branches, context=None, feedback=None, logger=None):
+    """
+    Runs independent preparation branches concurrently on a thread pool and joins them.
+
+    Each branch is called with its own processing context as keyword argument 'context'. When a
+    branch fails or the run is canceled, the branches that have not started are dropped and the
+    running ones are awaited before returning, so no branch outlives the call.
+
+    Args:
+        branches (dict): Name -> callable(context=...) of each branch.
+        context (QgsProcessingContext, optional): The context of the algorithm.
+        feedback (QgsProcessingFeedback, optional): Checked for cancellation.
+        logger (logging.Logger, optional): Logger for logging messages.
+
+    Returns:
+        dict: Name -> return value of each branch.
+
+    Raises:
+        QgsProcessingException: If the run was canceled, or with the name and error of the first failed branch.
+    """
+    caller_thread = QThread.currentThread()
+
+    def run(name, branch, branch_context):
+        result = branch(context=branch_context)
+        _move_to_thread(result, caller_thread)
+        if logger:
+            logger.info(f"@run_branches@ - Finished preparation of {name}")
+        return result
+
+    if not branches:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(branches), thread_name_prefix="remedy-prepare") as executor:
+        futures = {
+            executor.submit(run, name, branch, thread_context(context)): name
+            for name, branch in branches.items()
+        }
+        pending = set(futures)
+        canceled = False
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_EXCEPTION)
+            canceled = feedback is not None and feedback.isCanceled()
+            if canceled or any(future.exception() is not None for future in done):
+                for future in pending:
+                    future.cancel()
+                break
+        # Leaving the executor waits for the branches that are still running
+
+    if canceled:
+        raise QgsProcessingException("The preparation of the inputs was canceled")
+    for future, name in futures.items():
+        if not future.cancelled() and future.done() and future.exception() is not None:
+            if logger:
+                logger.error(f"@run_branches@ - Preparation of {name} failed: {future.exception()}")
+            raise QgsProcessingException(f"{name}: {future.exception()}") from future.exception()
+    return {name: future.result() for future, name in futures.items()}
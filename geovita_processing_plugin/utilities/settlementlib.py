@@ -0,0 +1,519 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Vectorized settlement calculations following the method of the REMEDY GIS RiskTool (GIBV).
+
+Every function works on numpy arrays and broadcasts its arguments, so the same code evaluates
+one scenario over all corners, many scenarios at once (scenarios x corners) or sampled soil
+parameters (samples x corners). Nothing in this module depends on QGIS.
+
+Distances and settlements are in meters, stresses in kPa and unit weights in kN/m3.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+import numpy as np
+
+# Unit weight of water [kN/m3]
+GAMMA_WATER = 10.0
+
+# Distance from the excavation where the porewater pressure reduction has faded out [m].
+# This is the (hardcoded) calculation range of the REMEDY GIS RiskTool.
+POREWATER_INFLUENCE_DISTANCE = 380.0
+
+# Coefficient of consolidation used to compute the degree of consolidation [m2/year]
+CONSOLIDATION_COEFFICIENT = 2.0
+
+# Number of sublayers used to integrate the long term strain over the soil column
+N_SUBLAYERS = 40
+
+# Long term lookup tables: default error bound [m] (a tenth of the lowest settlement limit),
+# initial nodes along the depth to bedrock and the porewater pressure reduction, the largest number
+# of nodes along an axis when refining, and the number of points checked against the exact evaluation
+LOOKUP_TOLERANCE = 0.001
+LOOKUP_NODES = (65, 17)
+LOOKUP_MAX_NODES = 4097
+LOOKUP_CHECK_POINTS = 10000
+
+# Smallest number of points for which a lookup table is built, fewer points are evaluated faster exactly
+LOOKUP_MIN_POINTS = 250_000
+
+# Number of sublayer evaluations (parameter sets x points x sublayers) held in memory at once
+# when building and checking lookup tables
+LOOKUP_CHUNK_ELEMENTS = 4_000_000
+
+# Ratio of horizontal displacement to settlement behind an excavation wall
+HORIZONTAL_DISPLACEMENT_RATIO = 1.0
+
+# Short term settlement curves (Peck 1969): settlement at the wall as a ratio of the
+# excavation depth H, decreasing linearly to zero at 'extent' x H from the wall.
+SHORT_TERM_CURVES = {
+    r"0,5 % av byggegropdybde": (0.005, 2.0),
+    r"1 % av byggegropdybde": (0.01, 2.0),
+    r"2 % av byggegropdybde": (0.02, 3.0),
+    r"3 % av byggegropdybde": (0.03, 4.0),
+}
+
+# Limits of the settlement [m] and angular distortion categories, see the styles of the outputs
+SETTLEMENT_LIMITS = (0.010, 0.050, 0.075)
+ANGLE_LIMITS = (1 / 500, 1 / 200, 1 / 50)
+
+
+def short_term_curve_parameters(curve_names):
+    """
+    Returns the (ratio, extent) arrays of one or more short term settlement curves.
+
+    Args:
+        curve_names (str or sequence of str): Curve names, see SHORT_TERM_CURVES.
+
+    Returns:
+        tuple: (ratio, extent) as numpy arrays with the shape of curve_names.
+    """
+    names = np.asarray(curve_names)
+    ratio = np.vectorize(lambda name: SHORT_TERM_CURVES[name][0], otypes=[float])(names)
+    extent = np.vectorize(lambda name: SHORT_TERM_CURVES[name][1], otypes=[float])(names)
+    return ratio, extent
+
+
+def short_term_excavation(near_dist, excavation_depth, ratio, extent):
+    """
+    Short term settlement and horizontal displacement behind an excavation wall.
+
+    Args:
+        near_dist (array): Distance from the excavation [m].
+        excavation_depth (array): Depth of the excavation H [m].
+        ratio (array): Settlement at the wall as a ratio of H.
+        extent (array): Distance where the settlement is zero, as a multiple of H.
+
+    Returns:
+        tuple: (sv_short, sh_short) [m]
+    """
+    near_dist = np.asarray(near_dist, dtype=float)
+    depth = np.asarray(excavation_depth, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shape = np.clip(1.0 - near_dist / (extent * depth), 0.0, None)
+    sv = np.where(depth > 0, ratio * depth * shape, 0.0)
+    return sv, sv * HORIZONTAL_DISPLACEMENT_RATIO
+
+
+def short_term_tunnel(near_dist, tunnel_depth, tunnel_diameter, volume_loss, trough_width):
+    """
+    Short term settlement trough above a tunnel (Peck 1969, O'Reilly & New 1982).
+
+    The trough is a Gaussian curve with the inflection point i = K * z0, where K is the trough
+    width parameter and z0 the depth of the tunnel axis. The volume of the trough equals the
+    volume loss in percent of the excavated tunnel area.
+
+    Args:
+        near_dist (array): Horizontal distance from the tunnel axis [m].
+        tunnel_depth (array): Depth of the tunnel axis z0 [m].
+        tunnel_diameter (array): Tunnel diameter D [m].
+        volume_loss (array): Volume loss [%].
+        trough_width (array): Trough width parameter K [-].
+
+    Returns:
+        tuple: (sv_short, sh_short) [m]
+    """
+    x = np.asarray(near_dist, dtype=float)
+    z0 = np.asarray(tunnel_depth, dtype=float)
+    i = np.asarray(trough_width, dtype=float) * z0
+    volume = np.asarray(volume_loss, dtype=float) / 100.0 * np.pi * np.asarray(tunnel_diameter, dtype=float) ** 2 / 4.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sv_max = volume / (np.sqrt(2.0 * np.pi) * i)
+        sv = np.where(i > 0, sv_max * np.exp(-x ** 2 / (2.0 * i ** 2)), 0.0)
+        sh = np.where(z0 > 0, sv * x / z0, 0.0)
+    return sv, sh
+
+
+def porewater_reduction_excavation(near_dist, porewp_red_m, influence_distance=POREWATER_INFLUENCE_DISTANCE):
+    """
+    Porewater pressure reduction [m] at a distance from the excavation, decreasing linearly
+    from 'porewp_red_m' at the wall to zero at 'influence_distance'.
+    """
+    near_dist = np.asarray(near_dist, dtype=float)
+    return np.asarray(porewp_red_m, dtype=float) * np.clip(1.0 - near_dist / influence_distance, 0.0, None)
+
+
+def consolidation_degree(consolidation_time, drainage_length, cv=CONSOLIDATION_COEFFICIENT):
+    """
+    Average degree of consolidation U(t) (Terzaghi), using the approximation
+    U = (Tv^3 / (Tv^3 + 0.5))^(1/6) with the time factor Tv = cv * t / Hdr^2.
+
+    Args:
+        consolidation_time (array): Time since the drawdown started [years].
+        drainage_length (array): Drainage length Hdr [m], the soil is drained at the bedrock.
+        cv (float): Coefficient of consolidation [m2/year].
+
+    Returns:
+        array: U between 0 and 1.
+    """
+    time = np.asarray(consolidation_time, dtype=float)
+    length = np.asarray(drainage_length, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tv = cv * time / length ** 2
+        degree = (tv ** 3 / (tv ** 3 + 0.5)) ** (1.0 / 6.0)
+    return np.where(length > 0, np.nan_to_num(degree, nan=1.0), 1.0)
+
+
+def final_long_term_settlement(dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr,
+                               janbu_ref_stress, janbu_const, janbu_m, n_sublayers=N_SUBLAYERS):
+    """
+    Long term consolidation settlement due to porewater pressure reduction (Janbu), when the
+    consolidation is complete.
+
+    The soil between the dry crust and the bedrock is divided in sublayers. The porewater
+    pressure reduction increases linearly from zero below the dry crust to 'porewp_red' at the
+    bedrock (drainage towards the bedrock). In every sublayer the strain is
+        (min(s1, pc) - s0) / M0                      overconsolidated part, M0 = janbu_const * m * pc
+        + ln((s1 - pr) / (pc - pr)) / m   if s1 > pc  normally consolidated part
+    where s0 is the initial effective stress, s1 = s0 + GAMMA_WATER * du and pc = OCR * s0.
+
+    All arguments broadcast against each other, the result has their broadcast shape.
+
+    Args:
+        dtb (array): Depth to bedrock [m].
+        porewp_red (array): Porewater pressure reduction at the bedrock [m water column].
+        dry_crust_thk (array): Thickness of the overburden not affected by the drawdown [m].
+        dep_groundwater (array): Depth to the groundwater table [m].
+        density_sat (array): Saturated unit weight of the soil [kN/m3].
+        ocr (array): Overconsolidation ratio.
+        janbu_ref_stress (array): Janbu reference stress pr [kPa].
+        janbu_const (array): Janbu constant M0 / (m * pc).
+        janbu_m (array): Janbu modulus number m.
+        n_sublayers (int): Number of sublayers in the integration.
+
+    Returns:
+        tuple: (settlement [m], thickness of the consolidating soil [m])
+    """
+    dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m = \
+        np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in (
+            dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr, janbu_ref_stress, janbu_const,
+            janbu_m)])
+
+    thickness = np.clip(dtb - dry_crust_thk, 0.0, None)
+    fractions = (np.arange(n_sublayers) + 0.5) / n_sublayers
+
+    z = dry_crust_thk[..., None] + thickness[..., None] * fractions
+    s0 = density_sat[..., None] * z - GAMMA_WATER * np.clip(z - dep_groundwater[..., None], 0.0, None)
+    s0 = np.clip(s0, 1e-6, None)
+    s1 = s0 + (GAMMA_WATER * np.clip(porewp_red, 0.0, None))[..., None] * fractions
+    pc = ocr[..., None] * s0
+    pr = janbu_ref_stress[..., None]
+    # A zero modulus gives no strain (division by infinity)
+    m = np.where(janbu_m > 0, janbu_m, np.inf)[..., None]
+    m0 = janbu_const[..., None] * m * pc
+    m0 = np.where(m0 > 0, m0, np.inf)
+
+    # The normally consolidated strain is negative (clipped to zero) unless s1 > pc
+    strain = np.clip((np.minimum(s1, pc) - s0) / m0, 0.0, None)
+    strain += np.clip(np.log(np.clip(s1 - pr, 1e-6, None) / np.clip(pc - pr, 1e-6, None)) / m, 0.0, None)
+    settlement = strain.sum(axis=-1) * thickness / n_sublayers
+    return np.where(np.isnan(dtb), np.nan, settlement), thickness
+
+
+def long_term_settlement(dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr,
+                         janbu_ref_stress, janbu_const, janbu_m, consolidation_time,
+                         n_sublayers=N_SUBLAYERS):
+    """
+    Long term consolidation settlement after 'consolidation_time', the final settlement (see
+    final_long_term_settlement()) scaled with the degree of consolidation.
+
+    All arguments broadcast against each other, the result has their broadcast shape.
+    A NaN depth to bedrock gives a NaN settlement.
+
+    Args:
+        consolidation_time (array): Consolidation time [years].
+        Other arguments: See final_long_term_settlement().
+
+    Returns:
+        array: Long term settlement [m].
+    """
+    settlement, thickness = final_long_term_settlement(
+        dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m,
+        n_sublayers,
+    )
+    return settlement * consolidation_degree(consolidation_time, thickness)
+
+
+def long_term_settlement_times(dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr,
+                               janbu_ref_stress, janbu_const, janbu_m, consolidation_times,
+                               n_sublayers=N_SUBLAYERS):
+    """
+    Long term settlement at several consolidation times. The final settlement is computed once,
+    only the degree of consolidation is evaluated for every time.
+
+    Args:
+        consolidation_times (sequence): Consolidation times [years].
+        Other arguments: See final_long_term_settlement().
+
+    Returns:
+        array: Long term settlements with a trailing time axis (..., n_times) [m].
+    """
+    settlement, thickness = final_long_term_settlement(
+        dtb, porewp_red, dry_crust_thk, dep_groundwater, density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m,
+        n_sublayers,
+    )
+    times = np.asarray(consolidation_times, dtype=float)
+    return settlement[..., None] * consolidation_degree(times, thickness[..., None])
+
+
+def _parameter_columns(soil, n_dims):
+    """Appends n_dims axes to the soil parameters with one value per parameter set."""
+    return {name: np.reshape(value, np.shape(value) + (1,) * n_dims) for name, value in soil.items()}
+
+
+class LongTermTable:
+    """
+    The final long term settlement (see final_long_term_settlement()) tabulated on a regular grid
+    of depth to bedrock and porewater pressure reduction, and evaluated by bilinear interpolation.
+
+    The soil parameters are scalars, or arrays (n_params) for several parameter sets (scenarios
+    or samples) tabulated at once. The points are then given as (n) or (n_params, n) arrays.
+    The tables are built with long_term_lookup_table(), which checks the interpolation error.
+
+    Attributes:
+        dtb_nodes (np.ndarray): Depth to bedrock of the table nodes [m].
+        porewp_nodes (np.ndarray): Porewater pressure reduction of the table nodes [m].
+        values (np.ndarray): The settlements (..., n_dtb, n_porewp) [m].
+    """
+    def __init__(self, dtb_max, porewp_red_max, soil, n_dtb, n_porewp, n_sublayers=N_SUBLAYERS):
+        self.soil = {name: np.asarray(value, dtype=float) for name, value in soil.items()}
+        self.n_params = np.broadcast_shapes(*[value.shape for value in self.soil.values()])
+        if len(self.n_params) > 1:
+            raise ValueError("The soil parameters of a lookup table must be scalars or one dimensional")
+        self.dtb_nodes = np.linspace(0.0, max(float(dtb_max), 1e-6), n_dtb)
+        self.porewp_nodes = np.linspace(0.0, max(float(porewp_red_max), 1e-6), n_porewp)
+        self.values = np.empty(self.n_params + (n_dtb, n_porewp))
+        columns = _parameter_columns(self.soil, 2)
+        n_per_row = max(int(np.prod(self.n_params)), 1) * n_porewp * n_sublayers
+        for rows in chunks(n_dtb, max(LOOKUP_CHUNK_ELEMENTS // n_per_row, 1)):
+            self.values[..., rows, :], _ = final_long_term_settlement(
+                self.dtb_nodes[rows, None], self.porewp_nodes[None, :], n_sublayers=n_sublayers, **columns
+            )
+
+    @property
+    def shape(self):
+        return self.values.shape[-2:]
+
+    @staticmethod
+    def _locate(values, nodes):
+        """Index of the table cell of every value and the weight of its upper node."""
+        position = np.clip(np.nan_to_num(values, nan=0.0) / (nodes[1] - nodes[0]), 0.0, len(nodes) - 1)
+        index = np.minimum(position.astype(int), len(nodes) - 2)
+        return index, position - index
+
+    def final(self, dtb, porewp_red):
+        """
+        Interpolated final long term settlement [m], NaN where the depth to bedrock is NaN.
+
+        Points outside of the table get the value at its edge, tables built with
+        long_term_lookup_table() cover all points they were built for.
+        """
+        dtb = np.asarray(dtb, dtype=float)
+        porewp_red = np.asarray(porewp_red, dtype=float)
+        i, wi = self._locate(dtb, self.dtb_nodes)
+        j, wj = self._locate(porewp_red, self.porewp_nodes)
+        if self.n_params:
+            index = (np.arange(self.n_params[0])[:, None],)
+        else:
+            index = ()
+        values = self.values
+        settlement = (
+            values[index + (i, j)] * (1 - wi) * (1 - wj)
+            + values[index + (i + 1, j)] * wi * (1 - wj)
+            + values[index + (i, j + 1)] * (1 - wi) * wj
+            + values[index + (i + 1, j + 1)] * wi * wj
+        )
+        return np.where(np.isnan(dtb), np.nan, settlement)
+
+    def thickness(self, dtb):
+        """Thickness of the consolidating soil, the drainage length of consolidation_degree()."""
+        dry_crust_thk = self.soil["dry_crust_thk"]
+        if self.n_params:
+            dry_crust_thk = np.broadcast_to(dry_crust_thk, self.n_params)[:, None]
+        return np.clip(np.asarray(dtb, dtype=float) - dry_crust_thk, 0.0, None)
+
+    def __call__(self, dtb, porewp_red, consolidation_time):
+        """
+        Interpolated long term settlement after 'consolidation_time' (a scalar, or one value per
+        parameter set), see long_term_settlement().
+        """
+        consolidation_time = np.asarray(consolidation_time, dtype=float)
+        if consolidation_time.ndim == 1:
+            consolidation_time = consolidation_time[:, None]
+        return self.final(dtb, porewp_red) * consolidation_degree(consolidation_time, self.thickness(dtb))
+
+    def max_error(self, dtb, porewp_red, n_sublayers=N_SUBLAYERS):
+        """
+        Largest absolute difference between the table and the exact final settlement at the points [m].
+
+        Args:
+            dtb (array): Depth to bedrock of the points (n).
+            porewp_red (array): Porewater pressure reduction of the points (n) or (n_params, n).
+        """
+        dtb = np.asarray(dtb, dtype=float)
+        porewp_red = np.asarray(porewp_red, dtype=float)
+        columns = _parameter_columns(self.soil, 1)
+        max_error = 0.0
+        n_per_point = max(int(np.prod(self.n_params)), 1) * n_sublayers
+        for part in chunks(len(dtb), max(LOOKUP_CHUNK_ELEMENTS // n_per_point, 1)):
+            exact, _ = final_long_term_settlement(dtb[part], porewp_red[..., part], n_sublayers=n_sublayers, **columns)
+            error = np.abs(self.final(dtb[part], porewp_red[..., part]) - exact)
+            if np.any(~np.isnan(error)):
+                max_error = max(max_error, float(np.nanmax(error)))
+        return max_error
+
+
+def long_term_lookup_table(dtb, porewp_red, soil, tolerance=LOOKUP_TOLERANCE, n_sublayers=N_SUBLAYERS, seed=0):
+    """
+    Builds a LongTermTable covering the given points, refined until its interpolation error is
+    within the tolerance.
+
+    The error is checked against the exact evaluation at LOOKUP_CHECK_POINTS random places halfway
+    between the table nodes along each axis and at cell centers, where bilinear interpolation is
+    least accurate, and at up to LOOKUP_CHECK_POINTS of the points themselves. While the errors
+    along the two axes add up to more than the tolerance, the node count of the axis with the larger
+    error (or of both, if both are above half the tolerance) is doubled. The settlement has kinks
+    along the depth to bedrock, where sublayers become normally consolidated, so that axis usually
+    needs the most nodes.
+
+    Args:
+        dtb (array): Depth to bedrock of the points (n) [m], NaN where unknown.
+        porewp_red (array): Porewater pressure reduction of the points (n) or (n_params, n) [m].
+        soil (dict): The other arguments of final_long_term_settlement(), scalars or arrays (n_params).
+        tolerance (float): The error bound [m].
+        seed (int): Seed for picking the checked places.
+
+    Returns:
+        tuple: (LongTermTable, max_error), or (None, None) when a table would not be cheaper than
+        evaluating the points exactly, or the tolerance is not reached within LOOKUP_MAX_NODES.
+    """
+    dtb = np.asarray(dtb, dtype=float)
+    porewp_red = np.asarray(porewp_red, dtype=float)
+    valid = np.flatnonzero(~np.isnan(dtb))
+    if len(valid) < LOOKUP_MIN_POINTS:
+        return None, None
+    rng = np.random.default_rng(seed)
+    checked = rng.choice(valid, min(len(valid), LOOKUP_CHECK_POINTS), replace=False)
+
+    def between(nodes, halfway):
+        """Random places along an axis, halfway between two nodes or at the nodes."""
+        index = rng.integers(0, len(nodes) - 1, LOOKUP_CHECK_POINTS)
+        return nodes[index] + (nodes[index + 1] - nodes[index]) * (0.5 if halfway else 0.0)
+
+    n_dtb, n_porewp = LOOKUP_NODES
+    # Exact evaluations spent on building and checking tables, in points
+    spent = 0
+    while n_dtb <= LOOKUP_MAX_NODES and n_porewp <= LOOKUP_MAX_NODES:
+        if spent + n_dtb * n_porewp >= len(valid):
+            return None, None
+        table = LongTermTable(np.nanmax(dtb), np.max(porewp_red), soil, n_dtb, n_porewp, n_sublayers)
+        spent += n_dtb * n_porewp + 4 * LOOKUP_CHECK_POINTS
+        nodes = (table.dtb_nodes, table.porewp_nodes)
+        dtb_error = table.max_error(between(nodes[0], True), between(nodes[1], False), n_sublayers)
+        porewp_error = table.max_error(between(nodes[0], False), between(nodes[1], True), n_sublayers)
+        if dtb_error + porewp_error <= tolerance:
+            max_error = max(
+                dtb_error,
+                porewp_error,
+                table.max_error(between(nodes[0], True), between(nodes[1], True), n_sublayers),
+                table.max_error(dtb[checked], porewp_red[..., checked], n_sublayers),
+            )
+            if max_error <= tolerance:
+                return table, max_error
+            dtb_error = porewp_error = tolerance
+        if dtb_error >= porewp_error or dtb_error > tolerance / 2:
+            n_dtb = 2 * n_dtb - 1
+        if porewp_error >= dtb_error or porewp_error > tolerance / 2:
+            n_porewp = 2 * n_porewp - 1
+    return None, None
+
+
+def parse_consolidation_times(text):
+    """
+    Reads a list of consolidation times, separated by commas, semicolons or spaces.
+
+    Returns:
+        list: The distinct times in increasing order, empty for an empty text.
+
+    Raises:
+        ValueError: If a time is not a non negative number.
+    """
+    times = set()
+    for item in str(text or "").replace(";", " ").replace(",", " ").split():
+        time = float(item)
+        if not np.isfinite(time) or time < 0:
+            raise ValueError(f"Invalid consolidation time: {item}")
+        times.add(time)
+    return sorted(times)
+
+
+def time_label(time):
+    """Short label of a consolidation time for field names, e.g. 10 -> '10', 0.5 -> '0_5'."""
+    time = float(time)
+    return str(int(time)) if time.is_integer() else str(time).replace(".", "_")
+
+
+def classify(values, limits):
+    """
+    Returns the category (1 to len(limits) + 1) of every value. NaN values get category 0.
+    """
+    values = np.asarray(values, dtype=float)
+    categories = np.digitize(np.nan_to_num(values, nan=0.0), limits) + 1
+    return np.where(np.isnan(values), 0, categories)
+
+
+def classify_settlement(sv_tot):
+    """Settlement category 1-4 (< 10 mm, 10 - 50 mm, 50 - 75 mm, > 75 mm)."""
+    return classify(sv_tot, SETTLEMENT_LIMITS)
+
+
+def classify_angle(angle):
+    """Angular distortion category 1-4 (< 1/500, 1/500 - 1/200, 1/200 - 1/50, > 1/50)."""
+    return classify(angle, ANGLE_LIMITS)
+
+
+def wall_slopes(sv_corners, wall_start, wall_end, wall_length):
+    """
+    Angular distortion (differential settlement over length) of every wall.
+
+    Args:
+        sv_corners (array): Settlements (..., n_corners).
+        wall_start, wall_end (array): Corner index of the wall ends (n_walls).
+        wall_length (array): Wall lengths (n_walls).
+
+    Returns:
+        array: Slopes (..., n_walls).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.abs(sv_corners[..., wall_start] - sv_corners[..., wall_end]) / wall_length
+    return np.where(wall_length > 0, slopes, 0.0)
+
+
+def building_maximum(values, offsets):
+    """
+    Maximum per building of values ordered by building.
+
+    Args:
+        values (array): Values (..., n) where the values of each building are contiguous.
+        offsets (array): Index of the first value of every building (n_buildings).
+
+    Returns:
+        array: (..., n_buildings)
+    """
+    return np.maximum.reduceat(values, offsets, axis=-1)
+
+
+def chunks(n, chunk_size):
+    """Yields slices covering range(n) in chunks of at most chunk_size."""
+    for start in range(0, n, max(int(chunk_size), 1)):
+        yield slice(start, min(start + chunk_size, n))
@@ -0,0 +1,777 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Preparation of buildings, excavations and depth to bedrock rasters for the vectorized engine
+in settlementlib. A site is prepared once (corners, walls, distances and DTB samples as numpy
+arrays) and can then be evaluated for any number of scenarios or samples.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+from qgis.core import (QgsCoordinateTransformContext,
+                       QgsFeature,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsVectorFileWriter,
+                       QgsWkbTypes)
+from qgis.PyQt.QtCore import QVariant
+from osgeo import gdal
+from pathlib import Path
+
+import numpy as np
+
+from .settlementlib import (
+    N_SUBLAYERS,
+    building_maximum,
+    chunks,
+    classify_angle,
+    classify_settlement,
+    long_term_lookup_table,
+    long_term_settlement,
+    porewater_reduction_excavation,
+    short_term_excavation,
+    short_term_tunnel,
+    wall_slopes,
+)
+
+# Number of corners handled at once when measuring distances to the excavation
+DISTANCE_CHUNK_SIZE = 20000
+
+# Largest difference between the half widths of tunnel corridors [m] taken as the same width
+CORRIDOR_WIDTH_TOLERANCE = 1e-6
+
+# Upper bound of array elements in the long term integration (cases x corners x sublayers)
+LONG_TERM_CHUNK_ELEMENTS = 4_000_000
+
+# Upper bound of array elements (samples x corners) evaluated at once in a Monte Carlo simulation
+MONTE_CARLO_CHUNK_ELEMENTS = 2_000_000
+
+# Pore pressure reduction curves of the Tunnel algorithm. Only the Manual curve, a given reduction at
+# the tunnel, is evaluated by the vectorized engine. The other curves derive the reduction from the
+# leakage into the tunnel inside the REMEDY core.
+POREPRESSURE_CURVES = ["Upper", "Typical", "Lower", "Manual"]
+MANUAL_POREPRESSURE_CURVE = "Manual"
+
+
+class PreparedSite:
+    """
+    Buildings broken down in corners and walls, with the distance from every corner to the
+    excavation and the depth to bedrock below it.
+
+    Corners and walls are ordered by building, so 'corner_offsets' and 'wall_offsets' hold
+    the index of the first corner and wall of every building.
+
+    Attributes:
+        building_ids (np.ndarray): Feature id of every building in the input layer.
+        building_geometries (list): QgsGeometry of every building.
+        corner_xy (np.ndarray): Corner coordinates (n_corners, 2).
+        corner_building (np.ndarray): Building index of every corner.
+        corner_offsets (np.ndarray): Index of the first corner of every building.
+        wall_start, wall_end (np.ndarray): Corner indices of the wall ends.
+        wall_length (np.ndarray): Length of every wall [m].
+        wall_offsets (np.ndarray): Index of the first wall of every building.
+        near_dist (np.ndarray): Distance from every corner to the excavation [m].
+        near_angle (np.ndarray): Direction from the nearest excavation point to the corner [degrees].
+        axis_dist (np.ndarray or None): Distance from every corner to the tunnel axis [m], for tunnels,
+            see tunnel_axis_distance().
+        dtb (np.ndarray or None): Depth to bedrock at every corner [m], NaN outside the raster.
+        crs (QgsCoordinateReferenceSystem): CRS of the coordinates.
+    """
+    def __init__(self):
+        self.building_ids = None
+        self.building_geometries = []
+        self.corner_xy = None
+        self.corner_building = None
+        self.corner_offsets = None
+        self.wall_start = None
+        self.wall_end = None
+        self.wall_length = None
+        self.wall_offsets = None
+        self.near_dist = None
+        self.near_angle = None
+        self.axis_dist = None
+        self.dtb = None
+        self.crs = None
+
+    @property
+    def n_buildings(self):
+        return len(self.building_ids)
+
+    @property
+    def n_corners(self):
+        return len(self.corner_xy)
+
+
+def _exterior_rings(geometry):
+    """Returns the exterior ring of every part of a (multi)polygon as (n, 2) arrays without the closing vertex."""
+    rings = []
+    polygons = geometry.asMultiPolygon() if geometry.isMultipart() else [geometry.asPolygon()]
+    for polygon in polygons:
+        if not polygon:
+            continue
+        ring = np.array([[point.x(), point.y()] for point in polygon[0]], dtype=float)
+        if len(ring) > 1 and np.allclose(ring[0], ring[-1]):
+            ring = ring[:-1]
+        if len(ring) >= 3:
+            rings.append(ring)
+    return rings
+
+
+def polygon_segments(layer):
+    """
+    Returns all ring segments (exterior and interior) of a polygon layer.
+
+    Returns:
+        np.ndarray: (n_segments, 4) with x1, y1, x2, y2.
+    """
+    return geometry_segments(feature.geometry() for feature in layer.getFeatures())
+
+
+def geometry_segments(geometries):
+    """
+    Returns all ring segments (exterior and interior) of polygon geometries, see polygon_segments().
+
+    Args:
+        geometries (iterable): QgsGeometry polygons or multipolygons.
+    """
+    segments = []
+    for geometry in geometries:
+        polygons = geometry.asMultiPolygon() if geometry.isMultipart() else [geometry.asPolygon()]
+        for polygon in polygons:
+            for ring in polygon:
+                points = np.array([[point.x(), point.y()] for point in ring], dtype=float)
+                if len(points) > 1:
+                    segments.append(np.hstack([points[:-1], points[1:]]))
+    if not segments:
+        return np.empty((0, 4))
+    return np.vstack(segments)
+
+
+def distance_to_polygons(xy, segments):
+    """
+    Distance from points to polygons given by their ring segments, zero inside the polygons.
+
+    Args:
+        xy (np.ndarray): Points (n, 2).
+        segments (np.ndarray): Ring segments (m, 4) from polygon_segments().
+
+    Returns:
+        tuple: (distance, angle) The angle is the direction from the nearest polygon point to the
+        point in degrees, counter clockwise from east.
+    """
+    distance, angle, inside = _boundary_distance(xy, segments)
+    return np.where(inside, 0.0, distance), angle
+
+
+def _boundary_distance(xy, segments):
+    """
+    Distance from points to the rings of polygons, also inside the polygons, see distance_to_polygons().
+
+    Returns:
+        tuple: (distance, angle, inside) with 'inside' True for points inside the polygons (even-odd rule).
+    """
+    distance = np.empty(len(xy))
+    angle = np.zeros(len(xy))
+    inside = np.zeros(len(xy), dtype=bool)
+    x1, y1, x2, y2 = segments.T
+    dx, dy = x2 - x1, y2 - y1
+    length2 = np.where(dx ** 2 + dy ** 2 > 0, dx ** 2 + dy ** 2, 1.0)
+    for part in chunks(len(xy), DISTANCE_CHUNK_SIZE):
+        px = xy[part, 0][:, None]
+        py = xy[part, 1][:, None]
+        t = np.clip(((px - x1) * dx + (py - y1) * dy) / length2, 0.0, 1.0)
+        nx = x1 + t * dx
+        ny = y1 + t * dy
+        d2 = (px - nx) ** 2 + (py - ny) ** 2
+        nearest = np.argmin(d2, axis=1)
+        rows = np.arange(len(nearest))
+        distance[part] = np.sqrt(d2[rows, nearest])
+        angle[part] = np.degrees(np.arctan2(py[:, 0] - ny[rows, nearest], px[:, 0] - nx[rows, nearest]))
+
+        # Even-odd rule
+        crosses = ((y1 <= py) != (y2 <= py)) & (px < x1 + (py - y1) * dx / np.where(dy != 0, dy, 1.0))
+        inside[part] = np.count_nonzero(crosses, axis=1) % 2 == 1
+    return distance, angle, inside
+
+
+def check_porepressure_curve(curve):
+    """
+    Checks that the pore pressure reduction of a tunnel can be evaluated by the vectorized engine.
+
+    Args:
+        curve (str): One of POREPRESSURE_CURVES.
+
+    Raises:
+        ValueError: If the curve is not the Manual curve.
+    """
+    if curve != MANUAL_POREPRESSURE_CURVE:
+        raise ValueError(
+            f"The '{curve}' pore pressure curve is computed from the tunnel leakage by the REMEDY core only. "
+            f"Use the Tunnel algorithm, or the '{MANUAL_POREPRESSURE_CURVE}' curve with the porewater pressure "
+            f"reduction at the tunnel"
+        )
+
+
+def tunnel_corridors(geometries):
+    """
+    Returns the corridors of tunnel polygons, see tunnel_axis_distance(). Every part of every polygon
+    is one corridor around its own axis, given by the segments of its exterior ring.
+
+    Args:
+        geometries (iterable): QgsGeometry polygons or multipolygons.
+
+    Returns:
+        list: Ring segments (m, 4) of every corridor.
+    """
+    corridors = []
+    for geometry in geometries:
+        for ring in _exterior_rings(geometry):
+            corridors.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+    return corridors
+
+
+def corridor_half_width(segments):
+    """
+    Half width of a tunnel polygon, taken as a corridor of constant width around the tunnel axis.
+
+    The width W follows from the area A and the perimeter P of a rectangle, P = 2 (L + W) and
+    A = L * W, so a long tunnel of length L gets W = A / L.
+
+    Args:
+        segments (np.ndarray): Segments (m, 4) of the exterior ring of one corridor, see tunnel_corridors().
+
+    Returns:
+        float: W / 2 [m]
+    """
+    x1, y1, x2, y2 = segments.T
+    # The ring is either clockwise or counter clockwise
+    area = abs(np.sum(x1 * y2 - x2 * y1)) / 2.0
+    perimeter = np.sum(np.hypot(x2 - x1, y2 - y1))
+    width = (perimeter - np.sqrt(max(perimeter ** 2 - 16.0 * area, 0.0))) / 4.0
+    return width / 2.0
+
+
+def tunnel_axis_distance(near_dist, corridors, xy):
+    """
+    Horizontal distance from points to the axis of tunnel polygons, the distance the settlement trough
+    above a tunnel is measured from (see settlementlib.short_term_tunnel()).
+
+    Every corridor has a constant width around its axis (see corridor_half_width()): outside it the
+    distance to the axis is the distance to the corridor plus its half width, inside it is the half
+    width minus the distance to its ring. Every point takes the nearest axis. When all corridors have
+    the same width, the nearest axis of a point outside the polygons is the one of the nearest
+    polygon, so only the points inside the polygons are measured again.
+
+    Args:
+        near_dist (np.ndarray): Distance from the points to the tunnel polygons, zero inside them,
+            see distance_to_polygons().
+        corridors (list): Ring segments (m, 4) of every corridor, see tunnel_corridors().
+        xy (np.ndarray): Coordinates (n, 2) of the points, in the order of near_dist.
+
+    Returns:
+        np.ndarray: The distance to the axis [m].
+    """
+    near_dist = np.asarray(near_dist, dtype=float)
+    if not corridors:
+        return near_dist.copy()
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    half_widths = np.array([corridor_half_width(segments) for segments in corridors])
+    if np.ptp(half_widths) <= CORRIDOR_WIDTH_TOLERANCE:
+        axis_dist = near_dist + half_widths.max()
+        points = np.flatnonzero(near_dist <= 0)
+    else:
+        axis_dist = np.full(near_dist.shape, np.inf)
+        points = np.arange(len(near_dist))
+    if len(points):
+        for segments, half_width in zip(corridors, half_widths):
+            distance, _, inside = _boundary_distance(xy[points], segments)
+            corridor_dist = np.where(inside, np.maximum(half_width - distance, 0.0), distance + half_width)
+            axis_dist[points] = np.minimum(axis_dist[points], corridor_dist)
+    return axis_dist
+
+
+def sample_raster(raster_path, xy, band=1):
+    """
+    Samples a raster at points (nearest cell). Only the window covering the points is read.
+
+    Args:
+        raster_path (str or gdal.Dataset): Path to any GDAL raster, or an open dataset that is reused
+            for many calls.
+        xy (np.ndarray): Points (n, 2) in the CRS of the raster.
+
+    Returns:
+        np.ndarray: The values, NaN outside the raster and at nodata cells.
+    """
+    values = np.full(len(xy), np.nan)
+    dataset = raster_path if isinstance(raster_path, gdal.Dataset) else gdal.Open(str(raster_path))
+    if dataset is None or len(xy) == 0:
+        return values
+    x0, dx, rx, y0, ry, dy = dataset.GetGeoTransform()
+    if rx != 0 or ry != 0:
+        raise ValueError(f"Rotated rasters are not supported: {raster_path}")
+    cols = np.floor((xy[:, 0] - x0) / dx).astype(int)
+    rows = np.floor((xy[:, 1] - y0) / dy).astype(int)
+    valid = (cols >= 0) & (cols < dataset.RasterXSize) & (rows >= 0) & (rows < dataset.RasterYSize)
+    if not valid.any():
+        return values
+    col_min, col_max = cols[valid].min(), cols[valid].max()
+    row_min, row_max = rows[valid].min(), rows[valid].max()
+    raster_band = dataset.GetRasterBand(band)
+    window = raster_band.ReadAsArray(int(col_min), int(row_min), int(col_max - col_min + 1), int(row_max - row_min + 1))
+    window = window.astype(float)
+    nodata = raster_band.GetNoDataValue()
+    if nodata is not None:
+        window[window == nodata] = np.nan
+    values[valid] = window[rows[valid] - row_min, cols[valid] - col_min]
+    return values
+
+
+def prepare_site(building_layer, excavation_layer=None, dtb_path=None, tunnel=False):
+    """
+    Breaks down the buildings in corners and walls, and measures the distance to the excavation
+    and the depth to bedrock at every corner. All layers must be in the same (projected) CRS.
+
+    Args:
+        building_layer (QgsVectorLayer): Building polygons.
+        excavation_layer (QgsVectorLayer, optional): Excavation polygons.
+        dtb_path (str, optional): Path to the depth to bedrock raster.
+        tunnel (bool): The excavation layer holds tunnel polygons, the distance to the tunnel axis is
+            measured as well.
+
+    Returns:
+        PreparedSite
+    """
+    site = PreparedSite()
+    site.crs = building_layer.crs()
+    building_ids = []
+    corners = []
+    corner_building = []
+    corner_offsets = []
+    wall_start = []
+    wall_end = []
+    wall_offsets = []
+    n_corners = 0
+    for feature in building_layer.getFeatures():
+        geometry = feature.geometry()
+        if geometry.isEmpty() or QgsWkbTypes.geometryType(geometry.wkbType()) != QgsWkbTypes.PolygonGeometry:
+            continue
+        rings = _exterior_rings(geometry)
+        if not rings:
+            continue
+        building_index = len(building_ids)
+        building_ids.append(feature.id())
+        site.building_geometries.append(geometry)
+        corner_offsets.append(n_corners)
+        wall_offsets.append(len(wall_start))
+        for ring in rings:
+            n = len(ring)
+            corners.append(ring)
+            corner_building.extend([building_index] * n)
+            indices = np.arange(n_corners, n_corners + n)
+            wall_start.extend(indices)
+            wall_end.extend(np.roll(indices, -1))
+            n_corners += n
+
+    site.building_ids = np.array(building_ids, dtype=np.int64)
+    site.corner_xy = np.vstack(corners) if corners else np.empty((0, 2))
+    site.corner_building = np.array(corner_building, dtype=np.int64)
+    site.corner_offsets = np.array(corner_offsets, dtype=np.int64)
+    site.wall_start = np.array(wall_start, dtype=np.int64)
+    site.wall_end = np.array(wall_end, dtype=np.int64)
+    site.wall_offsets = np.array(wall_offsets, dtype=np.int64)
+    site.wall_length = np.linalg.norm(site.corner_xy[site.wall_end] - site.corner_xy[site.wall_start], axis=1) \
+        if len(site.wall_start) else np.empty(0)
+
+    if excavation_layer is not None:
+        segments = polygon_segments(excavation_layer)
+        site.near_dist, site.near_angle = distance_to_polygons(site.corner_xy, segments)
+        if tunnel:
+            corridors = tunnel_corridors(feature.geometry() for feature in excavation_layer.getFeatures())
+            site.axis_dist = tunnel_axis_distance(site.near_dist, corridors, site.corner_xy)
+    if dtb_path is not None:
+        site.dtb = sample_raster(dtb_path, site.corner_xy)
+    return site
+
+
+def _write_results(output_path, wkb_type, crs, geometries, building_numbers, columns):
+    """
+    Writes features with a building number 'bid' and result columns to an ESRI Shapefile.
+
+    Args:
+        output_path (str): The output shapefile, overwritten if it exists.
+        wkb_type (QgsWkbTypes.Type): The geometry type of the features.
+        crs (QgsCoordinateReferenceSystem): The CRS of the geometries.
+        geometries (iterable): QgsGeometry of every feature.
+        building_numbers (np.ndarray): Building number of every feature.
+        columns (list): (field name, QVariant type, array with one value per feature) tuples.
+            Field names are limited to 10 characters in shapefiles.
+
+    Returns:
+        str: The output path.
+    """
+    fields = QgsFields()
+    fields.append(QgsField("bid", QVariant.Int))
+    for name, field_type, _ in columns:
+        if field_type == QVariant.Double:
+            fields.append(QgsField(name, field_type, "double", 20, 6))
+        else:
+            fields.append(QgsField(name, field_type))
+
+    QgsVectorFileWriter.deleteShapeFile(str(output_path))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(str(output_path), fields, wkb_type, crs,
+                                        QgsCoordinateTransformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise IOError(f"Could not write {output_path}: {writer.errorMessage()}")
+    for index, geometry in enumerate(geometries):
+        feature = QgsFeature(fields)
+        feature.setGeometry(geometry)
+        attributes = [int(building_numbers[index])]
+        for _, field_type, values in columns:
+            value = values[index]
+            if field_type == QVariant.Int:
+                attributes.append(int(value))
+            else:
+                attributes.append(None if np.isnan(value) else float(value))
+        feature.setAttributes(attributes)
+        writer.addFeature(feature)
+    del writer
+    return str(Path(output_path))
+
+
+def write_building_results(site, output_path, columns):
+    """
+    Writes the buildings of a prepared site with result columns to an ESRI Shapefile.
+
+    Args:
+        site (PreparedSite): The prepared site.
+        output_path (str): The output shapefile, overwritten if it exists.
+        columns (list): (field name, QVariant type, array with one value per building) tuples.
+            Field names are limited to 10 characters in shapefiles.
+
+    Returns:
+        str: The output path.
+    """
+    def multi_polygons():
+        for geometry in site.building_geometries:
+            geometry = type(geometry)(geometry)
+            geometry.convertToMultiType()
+            yield geometry
+
+    return _write_results(output_path, QgsWkbTypes.MultiPolygon, site.crs, multi_polygons(),
+                          np.arange(site.n_buildings) + 1, columns)
+
+
+def write_wall_results(site, output_path, columns):
+    """
+    Writes the walls of a prepared site as lines with result columns to an ESRI Shapefile, see
+    write_building_results(). 'bid' is the number of the building of every wall.
+    """
+    wall_building = np.repeat(np.arange(site.n_buildings), np.diff(np.append(site.wall_offsets, len(site.wall_start))))
+    lines = (
+        QgsGeometry.fromPolylineXY([QgsPointXY(*site.corner_xy[start]), QgsPointXY(*site.corner_xy[end])])
+        for start, end in zip(site.wall_start, site.wall_end)
+    )
+    return _write_results(output_path, QgsWkbTypes.LineString, site.crs, lines, wall_building + 1, columns)
+
+
+def write_corner_results(site, output_path, columns):
+    """
+    Writes the corners of a prepared site as points with result columns to an ESRI Shapefile, see
+    write_building_results(). 'bid' is the number of the building of every corner.
+    """
+    points = (QgsGeometry.fromPointXY(QgsPointXY(x, y)) for x, y in site.corner_xy)
+    return _write_results(output_path, QgsWkbTypes.Point, site.crs, points, site.corner_building + 1, columns)
+
+
+def _as_cases(value):
+    """Returns a scalar as is, and a sequence of one value per case as a (n_cases, 1) column."""
+    value = np.asarray(value, dtype=float)
+    return value.reshape(-1, 1) if value.ndim == 1 else value
+
+
+def evaluate_site(site, sv_short, sh_short, porewp_red, long_term=True, dry_crust_thk=None, dep_groundwater=None,
+                  density_sat=None, ocr=None, janbu_ref_stress=None, janbu_const=None, janbu_m=None,
+                  consolidation_time=None, lookup_tolerance=None, progress=None):
+    """
+    Adds the long term settlements to the short term settlements of a prepared site, and derives
+    the wall slopes, the building maxima and the categories.
+
+    Args:
+        site (PreparedSite): The prepared site, with DTB samples if long_term is True.
+        sv_short, sh_short (array): Short term settlements and horizontal displacements (n_cases, n_corners).
+        porewp_red (array): Porewater pressure reduction at the corners (n_cases, n_corners) [m].
+        long_term (bool): Include long term settlements.
+        lookup_tolerance (float, optional): Interpolate the long term settlements in a lookup table with
+            this error bound [m] (see settlementlib.long_term_lookup_table()), when that is faster.
+        progress (callable, optional): Called with the fraction of evaluated corners after every chunk.
+        Other arguments: A scalar or a sequence with one value per case, see settlementlib.long_term_settlement().
+
+    Returns:
+        dict: See evaluate_excavation().
+    """
+    shape = np.broadcast_shapes(np.shape(sv_short), np.shape(porewp_red))
+    sv_long = np.zeros(shape)
+    if long_term:
+        if site.dtb is None:
+            raise ValueError("Long term settlements need the depth to bedrock at the corners")
+        case_parameters = [_as_cases(value) for value in (dry_crust_thk, dep_groundwater, density_sat, ocr,
+                                                           janbu_ref_stress, janbu_const, janbu_m, consolidation_time)]
+        # Only corners with a porewater pressure reduction settle, corners without DTB are NaN
+        sv_long[:, np.isnan(site.dtb)] = np.nan
+        active = np.flatnonzero(~np.isnan(site.dtb) & np.any(porewp_red > 0, axis=0))
+        table = None
+        if lookup_tolerance:
+            soil = {
+                "dry_crust_thk": dry_crust_thk,
+                "dep_groundwater": dep_groundwater,
+                "density_sat": density_sat,
+                "ocr": ocr,
+                "janbu_ref_stress": janbu_ref_stress,
+                "janbu_const": janbu_const,
+                "janbu_m": janbu_m,
+            }
+            table, _ = long_term_lookup_table(site.dtb[active], porewp_red[:, active], soil, lookup_tolerance)
+        if table is not None:
+            sv_long[:, active] = table(site.dtb[active], porewp_red[:, active], consolidation_time)
+        else:
+            chunk_size = max(LONG_TERM_CHUNK_ELEMENTS // (shape[0] * N_SUBLAYERS), 1)
+            for part in chunks(len(active), chunk_size):
+                corners = active[part]
+                sv_long[:, corners] = long_term_settlement(site.dtb[corners], porewp_red[:, corners], *case_parameters)
+                if progress is not None:
+                    progress(part.stop / len(active))
+
+    sv_tot = sv_short + sv_long
+    slope_ang = wall_slopes(sv_tot, site.wall_start, site.wall_end, site.wall_length)
+    max_sv_tot = building_maximum(sv_tot, site.corner_offsets)
+    max_angle = building_maximum(slope_ang, site.wall_offsets)
+    return {
+        "sv_short": sv_short,
+        "sh_short": sh_short,
+        "porewp_red": porewp_red,
+        "sv_long": sv_long,
+        "sv_tot": sv_tot,
+        "slope_ang": slope_ang,
+        "max_sv_tot": max_sv_tot,
+        "max_angle": max_angle,
+        "sv_class": classify_settlement(max_sv_tot),
+        "angle_class": classify_angle(max_angle),
+    }
+
+
+def _n_cases(*parameters):
+    """Returns the number of cases given by scalar or sequence parameters."""
+    return max([np.size(value) for value in parameters if value is not None] + [1])
+
+
+def evaluate_excavation(site, short_term=True, long_term=True, excavation_depth=None, ratio=None, extent=None,
+                        porewp_red_m=None, dry_crust_thk=None, dep_groundwater=None, density_sat=None, ocr=None,
+                        janbu_ref_stress=None, janbu_const=None, janbu_m=None, consolidation_time=None,
+                        lookup_tolerance=None, progress=None):
+    """
+    Evaluates settlements and categories of a prepared site for one or more cases (scenarios or samples).
+
+    Every parameter is a scalar, or a sequence with one value per case. The results have the shape
+    (n_cases, n) if any parameter is a sequence, and (1, n) otherwise.
+
+    Args:
+        site (PreparedSite): The prepared site, with DTB samples if long_term is True.
+        short_term (bool): Include short term settlements.
+        long_term (bool): Include long term settlements.
+        ratio, extent: Short term curve parameters, see settlementlib.short_term_curve_parameters().
+        lookup_tolerance (float, optional): Error bound of a long term lookup table [m], see evaluate_site().
+        progress (callable, optional): Called with the fraction of evaluated corners, see evaluate_site().
+        Other arguments: See settlementlib.long_term_settlement().
+
+    Returns:
+        dict: Corner results 'sv_short', 'sh_short', 'porewp_red', 'sv_long', 'sv_tot', wall results
+        'slope_ang', and building results 'max_sv_tot', 'max_angle', 'sv_class' and 'angle_class'.
+    """
+    n_cases = _n_cases(excavation_depth, ratio, extent, porewp_red_m, dry_crust_thk, dep_groundwater, density_sat,
+                       ocr, janbu_ref_stress, janbu_const, janbu_m, consolidation_time)
+    shape = (n_cases, site.n_corners)
+
+    sv_short = np.zeros(shape)
+    sh_short = np.zeros(shape)
+    if short_term:
+        sv_short, sh_short = short_term_excavation(
+            site.near_dist, _as_cases(excavation_depth), _as_cases(ratio), _as_cases(extent)
+        )
+        sv_short = np.broadcast_to(sv_short, shape)
+        sh_short = np.broadcast_to(sh_short, shape)
+
+    porewp_red = np.zeros(shape)
+    if long_term:
+        porewp_red = np.broadcast_to(porewater_reduction_excavation(site.near_dist, _as_cases(porewp_red_m)), shape)
+    return evaluate_site(site, sv_short, sh_short, porewp_red, long_term, dry_crust_thk, dep_groundwater,
+                         density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m, consolidation_time,
+                         lookup_tolerance, progress)
+
+
+def evaluate_tunnel(site, short_term=True, long_term=True, tunnel_depth=None, tunnel_diameter=None,
+                    volume_loss=None, trough_width=None, porewp_red_m=None, dry_crust_thk=None,
+                    dep_groundwater=None, density_sat=None, ocr=None, janbu_ref_stress=None, janbu_const=None,
+                    janbu_m=None, consolidation_time=None, lookup_tolerance=None, progress=None,
+                    porepressure_curve=MANUAL_POREPRESSURE_CURVE):
+    """
+    Evaluates settlements and categories of a prepared site above a tunnel, see evaluate_excavation().
+
+    The site must be prepared with the tunnel polygons as excavation and tunnel=True, see prepare_site().
+    The settlement trough is centered on the tunnel axis (axis_dist), and the porewater pressure
+    reduction 'porewp_red_m' at the tunnel decreases linearly with the distance from the tunnel (near_dist).
+    This is the Manual curve of the Tunnel algorithm, other curves raise a ValueError, see
+    check_porepressure_curve().
+    """
+    if long_term:
+        check_porepressure_curve(porepressure_curve)
+    if short_term and site.axis_dist is None:
+        raise ValueError("Short term settlements above a tunnel need the distance to the tunnel axis")
+    n_cases = _n_cases(tunnel_depth, tunnel_diameter, volume_loss, trough_width, porewp_red_m, dry_crust_thk,
+                       dep_groundwater, density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m, consolidation_time)
+    shape = (n_cases, site.n_corners)
+
+    sv_short = np.zeros(shape)
+    sh_short = np.zeros(shape)
+    if short_term:
+        sv_short, sh_short = short_term_tunnel(
+            site.axis_dist, _as_cases(tunnel_depth), _as_cases(tunnel_diameter), _as_cases(volume_loss),
+            _as_cases(trough_width)
+        )
+        sv_short = np.broadcast_to(sv_short, shape)
+        sh_short = np.broadcast_to(sh_short, shape)
+
+    porewp_red = np.zeros(shape)
+    if long_term:
+        porewp_red = np.broadcast_to(porewater_reduction_excavation(site.near_dist, _as_cases(porewp_red_m)), shape)
+    return evaluate_site(site, sv_short, sh_short, porewp_red, long_term, dry_crust_thk, dep_groundwater,
+                         density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m, consolidation_time,
+                         lookup_tolerance, progress)
+
+
+def source_contributions(xy, sources, short_term=True, long_term=True):
+    """
+    Short term settlements, horizontal displacements and porewater pressure reductions at points from
+    several excavations and tunnels at once (superposition).
+
+    Every source is a dict with 'type' ("Excavation" or "Tunnel"), 'segments' (its ring segments, see
+    geometry_segments()), the arguments of its short term curve ('excavation_depth', 'ratio', 'extent'
+    or 'tunnel_depth', 'tunnel_diameter', 'volume_loss', 'trough_width') and 'porewp_red_m'. A tunnel
+    also has 'corridors', see tunnel_corridors(), and optionally a 'porepressure_curve', see
+    check_porepressure_curve().
+
+    The settlements and the porewater pressure reductions of the sources are added up. The horizontal
+    displacements point towards their source and are added as vectors. The long term settlement is
+    not linear in the porewater pressure reduction, and is computed afterwards from the total reduction.
+
+    Args:
+        xy (np.ndarray): Points (n, 2).
+        sources (list): The excavations and tunnels.
+        short_term (bool): Include short term settlements.
+        long_term (bool): Include porewater pressure reductions.
+
+    Returns:
+        dict: 'sv_short', 'sh_short', 'porewp_red' and 'near_dist' (distance to the nearest source) (n),
+        and 'sv_sources' with the short term settlement of every source (n_sources, n).
+    """
+    n = len(xy)
+    near_dist = np.full(n, np.inf)
+    sv_sources = np.zeros((len(sources), n))
+    sh_x = np.zeros(n)
+    sh_y = np.zeros(n)
+    porewp_red = np.zeros(n)
+    for index, source in enumerate(sources):
+        distance, angle = distance_to_polygons(xy, source["segments"])
+        near_dist = np.minimum(near_dist, distance)
+        if short_term:
+            if source["type"] == "Excavation":
+                sv, sh = short_term_excavation(distance, source["excavation_depth"], source["ratio"], source["extent"])
+            else:
+                # The trough is centered on the tunnel axis, the displacements point away from it
+                axis_dist = tunnel_axis_distance(distance, source["corridors"], xy)
+                sv, sh = short_term_tunnel(axis_dist, source["tunnel_depth"], source["tunnel_diameter"],
+                                           source["volume_loss"], source["trough_width"])
+                angle = np.where(distance > 0, angle, angle + 180.0)
+            sv_sources[index] = sv
+            sh_x -= sh * np.cos(np.radians(angle))
+            sh_y -= sh * np.sin(np.radians(angle))
+        if long_term:
+            if source["type"] == "Tunnel":
+                check_porepressure_curve(source.get("porepressure_curve", MANUAL_POREPRESSURE_CURVE))
+            porewp_red += porewater_reduction_excavation(distance, source["porewp_red_m"])
+    return {
+        "sv_short": sv_sources.sum(axis=0),
+        "sh_short": np.hypot(sh_x, sh_y),
+        "porewp_red": porewp_red,
+        "near_dist": near_dist,
+        "sv_sources": sv_sources,
+    }
+
+
+def evaluate_sources(site, sources, short_term=True, long_term=True, dry_crust_thk=None, dep_groundwater=None,
+                     density_sat=None, ocr=None, janbu_ref_stress=None, janbu_const=None, janbu_m=None,
+                     consolidation_time=None, lookup_tolerance=None, progress=None):
+    """
+    Evaluates the combined settlements of several excavations and tunnels on a prepared site, in one
+    pass over its corners, see source_contributions(). The distance to the nearest source is stored as
+    the near_dist of the site.
+
+    Args:
+        site (PreparedSite): The prepared site, with DTB samples if long_term is True.
+        sources (list): The excavations and tunnels, see source_contributions().
+        Other arguments: Scalars, see evaluate_excavation().
+
+    Returns:
+        dict: The results of evaluate_excavation() for a single case, with the short term settlement of
+        every source as 'sv_sources' (n_sources, n_corners).
+    """
+    contributions = source_contributions(site.corner_xy, sources, short_term, long_term)
+    site.near_dist = contributions["near_dist"]
+    results = evaluate_site(site, contributions["sv_short"][None], contributions["sh_short"][None],
+                            contributions["porewp_red"][None], long_term, dry_crust_thk, dep_groundwater,
+                            density_sat, ocr, janbu_ref_stress, janbu_const, janbu_m, consolidation_time,
+                            lookup_tolerance, progress)
+    results["sv_sources"] = contributions["sv_sources"]
+    return results
+
+
+def monte_carlo_buildings(site, evaluate, samples, fixed, n_samples, progress=None):
+    """
+    Evaluates a prepared site for sampled parameters, in chunks of samples so that the corner arrays
+    (samples x corners) stay small. Only the building maxima of every sample are kept.
+
+    Args:
+        site (PreparedSite): The prepared site.
+        evaluate (callable): evaluate_excavation or evaluate_tunnel.
+        samples (dict): Keyword argument of evaluate -> array of n_samples values.
+        fixed (dict): Keyword arguments of evaluate that are the same for all samples.
+        n_samples (int): The number of samples.
+        progress (callable, optional): Called with the fraction of evaluated samples after every chunk.
+
+    Returns:
+        tuple: (max_sv_tot, max_angle) arrays (n_samples, n_buildings) in single precision.
+    """
+    max_sv_tot = np.empty((n_samples, site.n_buildings), dtype=np.float32)
+    max_angle = np.empty((n_samples, site.n_buildings), dtype=np.float32)
+    chunk_size = max(MONTE_CARLO_CHUNK_ELEMENTS // max(site.n_corners, 1), 1)
+    for part in chunks(n_samples, chunk_size):
+        results = evaluate(site, **fixed, **{name: values[part] for name, values in samples.items()})
+        # Parameters without samples give one case, broadcast it to the samples of the chunk
+        max_sv_tot[part] = results["max_sv_tot"]
+        max_angle[part] = results["max_angle"]
+        if progress is not None:
+            progress(part.stop / n_samples)
+    return max_sv_tot, max_angle
@@ -0,0 +1,187 @@
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Distributions of uncertain soil parameters, and summaries (percentiles and exceedance
+probabilities) of results sampled along the first axis. Nothing in this module depends on QGIS.
+"""
+
+__author__ = 'DPE'
+__date__ = '2024-01-17'
+__copyright__ = '(C) 2024 by DPE'
+
+import numpy as np
+
+# Supported distributions and the meaning of their parameters (P1, P2, P3)
+DISTRIBUTIONS = {
+    "fixed": "P1 = value",
+    "normal": "P1 = mean, P2 = standard deviation",
+    "lognormal": "P1 = mean, P2 = standard deviation",
+    "uniform": "P1 = min, P2 = max",
+    "triangular": "P1 = min, P2 = mode, P3 = max",
+}
+
+# Columns of a distribution table (QgsProcessingParameterMatrix)
+DISTRIBUTION_TABLE_HEADERS = ["Parameter", "Distribution", "P1", "P2", "P3"]
+
+# Percentiles written for every building or cell
+PERCENTILES = (10, 50, 90)
+
+# Uncertain soil parameters and the matching argument of settlementlib.long_term_settlement()
+UNCERTAIN_PARAMETERS = {
+    "OCR": "ocr",
+    "JANBU_COMP_MODULUS": "janbu_m",
+    "JANBU_CONSTANT": "janbu_const",
+    "DRY_CRUST_THICKNESS": "dry_crust_thk",
+    "SOIL_DENSITY": "density_sat",
+}
+
+# Default distribution table, around the default values of the algorithms
+DEFAULT_DISTRIBUTION_TABLE = [
+    "OCR", "normal", 1.2, 0.1, "",
+    "JANBU_COMP_MODULUS", "lognormal", 15, 3, "",
+    "JANBU_CONSTANT", "uniform", 3, 5, "",
+    "DRY_CRUST_THICKNESS", "triangular", 4, 5, 6,
+    "SOIL_DENSITY", "normal", 18.5, 0.5, "",
+]
+
+
+class Distribution:
+    """
+    The distribution of one parameter.
+
+    Normal samples are truncated at zero, since all soil parameters are positive.
+    Lognormal distributions are given by the mean and standard deviation of the parameter itself.
+    """
+    def __init__(self, kind, p1, p2=None, p3=None):
+        kind = str(kind).strip().lower()
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution '{kind}', use one of {list(DISTRIBUTIONS)}")
+        required = DISTRIBUTIONS[kind].count("=")
+        values = [p1, p2, p3][:required]
+        if any(value is None for value in values):
+            raise ValueError(f"The {kind} distribution needs {DISTRIBUTIONS[kind]}")
+        self.kind = kind
+        self.p1, self.p2, self.p3 = [None if value is None else float(value) for value in (p1, p2, p3)]
+        if kind in ("uniform", "triangular") and self.p1 > (self.p3 if kind == "triangular" else self.p2):
+            raise ValueError(f"The minimum of the {kind} distribution is larger than the maximum")
+        if kind == "triangular" and not self.p1 <= self.p2 <= self.p3:
+            raise ValueError("The mode of the triangular distribution must be between min and max")
+        if kind in ("normal", "lognormal") and self.p2 < 0:
+            raise ValueError(f"The standard deviation of the {kind} distribution is negative")
+        if kind == "lognormal" and self.p1 <= 0:
+            raise ValueError("The mean of the lognormal distribution must be positive")
+
+    def sample(self, n, rng):
+        """Draws n samples with the numpy Generator rng."""
+        if self.kind == "fixed":
+            return np.full(n, self.p1)
+        if self.kind == "normal":
+            return np.clip(rng.normal(self.p1, self.p2, n), 0.0, None)
+        if self.kind == "lognormal":
+            sigma2 = np.log(1.0 + (self.p2 / self.p1) ** 2)
+            return rng.lognormal(np.log(self.p1) - sigma2 / 2.0, np.sqrt(sigma2), n)
+        if self.kind == "uniform":
+            return rng.uniform(self.p1, self.p2, n)
+        if self.p1 == self.p3:
+            return np.full(n, self.p1)
+        return rng.triangular(self.p1, self.p2, self.p3, n)
+
+    def __repr__(self):
+        values = ", ".join(str(value) for value in (self.p1, self.p2, self.p3) if value is not None)
+        return f"{self.kind}({values})"
+
+
+def _number(value):
+    """Converts a table cell to a float, None for empty cells. Accepts decimal commas."""
+    if value is None or str(value).strip() in ("", "NULL"):
+        return None
+    return float(str(value).replace(",", "."))
+
+
+def parse_distribution_table(matrix, parameter_names):
+    """
+    Reads a distribution table given as a flat list of cells, row by row, with the columns
+    DISTRIBUTION_TABLE_HEADERS (as returned by QgsProcessingAlgorithm.parameterAsMatrix()).
+
+    Args:
+        matrix (list): The table cells.
+        parameter_names (list): The parameters that may be given a distribution.
+
+    Returns:
+        dict: Parameter name -> Distribution.
+
+    Raises:
+        ValueError: For unknown parameters or distributions and invalid distribution parameters.
+    """
+    n_columns = len(DISTRIBUTION_TABLE_HEADERS)
+    if len(matrix) % n_columns:
+        raise ValueError(f"The distribution table must have {n_columns} columns: {DISTRIBUTION_TABLE_HEADERS}")
+    distributions = {}
+    for start in range(0, len(matrix), n_columns):
+        name, kind, p1, p2, p3 = matrix[start:start + n_columns]
+        name = str(name).strip().upper()
+        if not name:
+            continue
+        if name not in parameter_names:
+            raise ValueError(f"Unknown parameter '{name}' in the distribution table, use one of {parameter_names}")
+        try:
+            distributions[name] = Distribution(kind, _number(p1), _number(p2), _number(p3))
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}")
+    return distributions
+
+
+def draw_samples(distributions, n_samples, seed=None):
+    """
+    Draws n_samples values of every parameter, independently.
+
+    Args:
+        distributions (dict): Parameter name -> Distribution.
+        n_samples (int): The number of samples.
+        seed (int, optional): Seed of the random generator, for repeatable results.
+
+    Returns:
+        dict: Parameter name -> array (n_samples).
+    """
+    rng = np.random.default_rng(seed)
+    return {name: distribution.sample(n_samples, rng) for name, distribution in sorted(distributions.items())}
+
+
+def exceedance_probability(values, limits):
+    """
+    Probability that sampled values exceed every limit, ignoring NaN samples.
+
+    Args:
+        values (array): Samples along the first axis (n_samples, ...).
+        limits (sequence): The limits.
+
+    Returns:
+        np.ndarray: (len(limits), ...) NaN where all samples are NaN.
+    """
+    values = np.asarray(values)
+    valid = np.count_nonzero(~np.isnan(values), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probabilities = [np.count_nonzero(values > limit, axis=0) / valid for limit in limits]
+    return np.where(valid > 0, probabilities, np.nan)
+
+
+def sample_percentiles(values, percentiles=PERCENTILES):
+    """
+    Percentiles of sampled values along the first axis, ignoring NaN samples.
+
+    Returns:
+        np.ndarray: (len(percentiles), ...)
+    """
+    values = np.asarray(values)
+    result = np.full((len(percentiles),) + values.shape[1:], np.nan)
+    valid = ~np.all(np.isnan(values), axis=0)
+    if valid.any():
+        result[:, valid] = np.nanpercentile(values[:, valid], percentiles, axis=0)
+    return result